@@ -1,6 +1,7 @@
 from typing import Callable, Coroutine
 
 import pytest
+from aiohttp import web
 
 from main import settings
 from project.db.models import Database, SessionUserModel
@@ -28,3 +29,15 @@ def drop_test(async_engine) -> Callable[[], Coroutine]:
             await conn.commit()
 
     return catch
+
+
+async def start_stand_in(routes) -> tuple[web.AppRunner, str]:
+    """Local aiohttp stand-in of the backend. Returns the runner and the base url."""
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
@@ -0,0 +1,111 @@
+"""
+__tests__/test_async_httpclient_batch.py
+
+The batch API of the AsyncHttpClient: 'request_many' and 'stream_many'.
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient, HttpCall, HttpRequest
+
+
+@pytest.mark.asyncio
+async def test_request_many_keeps_order_and_bounds_concurrency():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def item(request: web.Request) -> web.Response:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        number = int(request.match_info["number"])
+        # The first items answer the latest
+        await asyncio.sleep(0.001 * (20 - number))
+        in_flight -= 1
+        return web.json_response({"number": number})
+
+    runner, base_url = await start_stand_in([web.get("/item/{number}/", item)])
+    try:
+        async with AsyncHttpClient() as client:
+            calls = [
+                HttpCall(HttpRequest.GET.value, f"{base_url}/item/{number}/")
+                for number in range(20)
+            ]
+            results = await client.request_many(calls, concurrency=4)
+        assert [result.data["number"] for result in results] == list(range(20))
+        assert all(result.ok for result in results)
+        assert max_in_flight <= 4
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stream_many_reports_failures_per_item():
+    async def fast(request: web.Request) -> web.Response:
+        return web.json_response({"data": "fast"})
+
+    async def slow(request: web.Request) -> web.Response:
+        await asyncio.sleep(1)
+        return web.json_response({"data": "slow"})
+
+    async def not_json(request: web.Request) -> web.Response:
+        return web.Response(text="<html></html>", content_type="text/html")
+
+    runner, base_url = await start_stand_in(
+        [web.get("/fast/", fast), web.get("/slow/", slow), web.get("/html/", not_json)]
+    )
+    try:
+        async with AsyncHttpClient() as client:
+            calls = [
+                HttpCall(HttpRequest.GET.value, f"{base_url}/slow/", timeout=0.05),
+                HttpCall(HttpRequest.GET.value, f"{base_url}/html/"),
+                HttpCall(HttpRequest.GET.value, f"{base_url}/fast/"),
+            ]
+            results = [result async for result in client.stream_many(calls, timeout=5)]
+        by_index = {result.index: result for result in results}
+        assert len(results) == 3
+        # The timed out item does not cancel the batch
+        assert isinstance(by_index[0].error, asyncio.TimeoutError)
+        assert by_index[1].error is not None and not by_index[1].ok
+        assert by_index[2].ok and by_index[2].data == {"data": "fast"}
+        # Finished in order of completion: the slow one is the last
+        assert results[-1].index == 0
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_stream_many_stopped_early_awaits_the_cancelled_calls():
+    async def slow(request: web.Request) -> web.Response:
+        await asyncio.sleep(1)
+        return web.json_response({"data": "slow"})
+
+    async def fast(request: web.Request) -> web.Response:
+        return web.json_response({"data": "fast"})
+
+    runner, base_url = await start_stand_in(
+        [web.get("/fast/", fast), web.get("/slow/", slow)]
+    )
+    try:
+        async with AsyncHttpClient() as client:
+            calls = [HttpCall(HttpRequest.GET.value, f"{base_url}/fast/")] + [
+                HttpCall(HttpRequest.GET.value, f"{base_url}/slow/") for _ in range(3)
+            ]
+            stream = client.stream_many(calls, timeout=5)
+            first = await anext(stream)
+            await stream.aclose()
+            # Right after 'aclose()' - the calls are finished, not only asked to cancel
+            pending = [
+                task
+                for task in asyncio.all_tasks()
+                if task.get_coro().__qualname__.endswith("_call_one")
+                and not task.done()
+            ]
+        assert first.index == 0 and first.ok
+        assert pending == []
+    finally:
+        await runner.cleanup()
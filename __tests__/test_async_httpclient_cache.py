@@ -0,0 +1,87 @@
+"""
+__tests__/test_async_httpclient_cache.py
+
+The response cache of the AsyncHttpClient: Cache-Control, ETag revalidation and single-flight.
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient, HttpRequest
+from project.http_cache import ResponseCache, parse_cache_control
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('public, max-age="60", no-cache') == {
+        "public": None,
+        "max-age": "60",
+        "no-cache": None,
+    }
+    assert parse_cache_control(None) == {}
+
+
+@pytest.mark.asyncio
+async def test_cache_hit_and_etag_revalidation():
+    hits = {"full": 0, "not_modified": 0, "no_store": 0}
+
+    async def profile(request: web.Request) -> web.Response:
+        if request.headers.get("If-None-Match") == '"v1"':
+            hits["not_modified"] += 1
+            return web.Response(status=304, headers={"Cache-Control": "max-age=60"})
+        hits["full"] += 1
+        return web.json_response(
+            {"data": "profile"}, headers={"ETag": '"v1"', "Cache-Control": "no-cache"}
+        )
+
+    async def no_store(request: web.Request) -> web.Response:
+        hits["no_store"] += 1
+        return web.json_response({"data": "x"}, headers={"Cache-Control": "no-store"})
+
+    runner, base_url = await start_stand_in(
+        [web.get("/profile/", profile), web.get("/no_store/", no_store)]
+    )
+    try:
+        cache = ResponseCache()
+        async with AsyncHttpClient(cache=cache) as client:
+            for _ in range(3):
+                responses = await client.request(
+                    HttpRequest.GET.value, f"{base_url}/profile/"
+                )
+                assert responses == {"data": "profile"}
+                await client.request(HttpRequest.GET.value, f"{base_url}/no_store/")
+        # 1) full body with 'no-cache'; 2) revalidated => 'max-age=60'; 3) hit
+        assert hits == {"full": 1, "not_modified": 1, "no_store": 3}
+        assert cache.info()["revalidated"] == 1
+        assert cache.info()["hits"] == 1
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_misses():
+    hits = 0
+
+    async def group(request: web.Request) -> web.Response:
+        nonlocal hits
+        hits += 1
+        await asyncio.sleep(0.05)
+        return web.json_response({"data": "group"})
+
+    runner, base_url = await start_stand_in([web.get("/group/", group)])
+    try:
+        cache = ResponseCache()
+        async with AsyncHttpClient(cache=cache) as client:
+            responses = await asyncio.gather(
+                *(
+                    client.request(HttpRequest.GET.value, f"{base_url}/group/")
+                    for _ in range(10)
+                )
+            )
+        assert all(response == {"data": "group"} for response in responses)
+        assert hits == 1
+        assert cache.info()["coalesced"] == 9
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,37 @@
+"""
+__tests__/test_async_httpclient_pool.py
+
+The shared (pooled) session of the AsyncHttpClient. Here is a local aiohttp stand-in of the backend.
+"""
+
+import pytest
+from aiohttp import web
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient, HttpRequest
+
+
+@pytest.mark.asyncio
+async def test_async_http_client_reuses_session():
+    peers = set()
+
+    async def echo(request: web.Request) -> web.Response:
+        peers.add(request.transport.get_extra_info("peername"))
+        return web.json_response({"data": request.headers.get("X-Test")})
+
+    runner, base_url = await start_stand_in([web.get("/echo/", echo)])
+    try:
+        client = AsyncHttpClient(limit_per_host=1)
+        session = client.session
+        for _ in range(3):
+            responses = await client.request(
+                HttpRequest.GET.value, url=f"{base_url}/echo/", headers={"X-Test": "1"}
+            )
+            assert responses == {"data": "1"}
+        # The same session and the one keep-alive connection for all calls
+        assert client.session is session
+        assert len(peers) == 1
+        await client.close()
+        assert client.closed
+    finally:
+        await runner.cleanup()
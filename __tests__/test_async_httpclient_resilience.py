@@ -0,0 +1,91 @@
+"""
+__tests__/test_async_httpclient_resilience.py
+
+Retries, circuit breaker and hedged requests of the AsyncHttpClient.
+"""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient, HttpRequest
+from project.http_resilience import BreakerState, RetryPolicy
+
+
+@pytest.mark.asyncio
+async def test_retries_idempotent_methods_only():
+    hits = {"GET": 0, "POST": 0}
+
+    async def flaky(request: web.Request) -> web.Response:
+        hits[request.method] += 1
+        if hits[request.method] < 3:
+            return web.json_response({"data": "busy"}, status=503)
+        return web.json_response({"data": "ok"})
+
+    runner, base_url = await start_stand_in(
+        [web.get("/flaky/", flaky), web.post("/flaky/", flaky)]
+    )
+    try:
+        policy = RetryPolicy(attempts=3, backoff_base=0.001, backoff_max=0.01)
+        async with AsyncHttpClient(retry_policy=policy) as client:
+            assert await client.request(
+                HttpRequest.GET.value, f"{base_url}/flaky/"
+            ) == {"data": "ok"}
+            assert await client.request(
+                HttpRequest.POST.value, f"{base_url}/flaky/"
+            ) == {"data": "busy"}
+            stats = client.stats()
+        assert hits == {"GET": 3, "POST": 1}
+        assert stats["retries"] == 2
+        assert stats["retries_exhausted"] == 0
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast():
+    hits = 0
+
+    async def down(request: web.Request) -> web.Response:
+        nonlocal hits
+        hits += 1
+        return web.json_response({"data": "down"}, status=502)
+
+    runner, base_url = await start_stand_in([web.get("/down/", down)])
+    try:
+        async with AsyncHttpClient(
+            breaker_threshold=2, breaker_reset_timeout=60
+        ) as client:
+            for _ in range(5):
+                await client.request(HttpRequest.GET.value, f"{base_url}/down/")
+            stats = client.stats()
+        assert hits == 2
+        assert stats["short_circuited"] == 3
+        assert stats["breakers"]["127.0.0.1"]["state"] == BreakerState.OPEN.value
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_hedged_get_wins_over_slow_first():
+    hits = 0
+
+    async def tail(request: web.Request) -> web.Response:
+        nonlocal hits
+        hits += 1
+        if hits == 1:
+            await asyncio.sleep(1)
+        return web.json_response({"data": hits})
+
+    runner, base_url = await start_stand_in([web.get("/tail/", tail)])
+    try:
+        async with AsyncHttpClient(hedge_after=0.02) as client:
+            responses = await client.request(HttpRequest.GET.value, f"{base_url}/tail/")
+            stats = client.stats()
+        assert responses == {"data": 2}
+        assert stats["hedges_started"] == 1
+        assert stats["hedges_won"] == 1
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,34 @@
+"""
+__tests__/test_cache.py
+"""
+
+from project.cache import LRUCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_cache_eviction_expiry_and_weight():
+    clock = FakeClock()
+    cache = LRUCache(maxsize=2, max_weight=10, clock=clock)
+    cache.set("a", 1, expires_at=5)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.info()["evictions"] == 1
+    clock.now = 5
+    assert cache.get("a") is None
+    assert cache.info()["expirations"] == 1
+    # The weight bound
+    cache.set("big", 4, weight=9)
+    cache.set("small", 5, weight=2)
+    assert "big" not in cache and cache.weight == 2
+    cache.pop("small")
+    assert len(cache) == 0 and cache.weight == 0
@@ -0,0 +1,131 @@
+"""
+__tests__/test_clusters.py
+"""
+
+import json
+import random
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from project.clusters import ClusterIndex
+from project.db.spatial import SpatialGridIndex
+from project.jwt_auth import JWTUser
+from project.routers.internal.clusters import router as clusters_router
+
+
+def random_spatial(count: int, seed: int = 1) -> SpatialGridIndex:
+    generator = random.Random(seed)
+    spatial = SpatialGridIndex(cell_size=0.5)
+    for driver_id in range(1, count + 1):
+        spatial.upsert(
+            driver_id, generator.uniform(43.0, 68.0), generator.uniform(28.0, 60.0)
+        )
+    return spatial
+
+
+def levels_of(index: ClusterIndex):
+    return [
+        (
+            level.keys.tolist(),
+            level.count.tolist(),
+            level.ids.tolist(),
+            level.lat.copy(),
+        )
+        for level in index.levels
+    ]
+
+
+def test_levels_are_nested_and_clusters_cover_all_trucks():
+    spatial = random_spatial(3000)
+    index = ClusterIndex(spatial, cell_px=64, max_zoom=12)
+    for level in index.levels:
+        assert level.count.sum() == 3000
+        assert (np.diff(level.keys) > 0).all()
+    # The world at zoom 0 is one tile
+    tile = index.tile(0, 0, 0)
+    assert tile.trucks == 3000
+    clusters = json.loads("[%s]" % tile.clusters)
+    assert sum(cluster["count"] for cluster in clusters) == 3000
+    assert len(clusters) == tile.count <= 16
+    # The cluster of one truck is the truck
+    lat, lon, _ = spatial.position(1)
+    (tile_12,) = index.viewport(lat, lon, lat, lon, zoom=12)
+    single = {c.get("driver_id"): c for c in json.loads("[%s]" % tile_12.clusters)}[1]
+    assert (single["lat"], single["lon"], single["count"]) == (
+        round(lat, 6),
+        round(lon, 6),
+        1,
+    )
+    assert index.tile(0, 0, 0) is tile
+
+
+def test_apply_moves_trucks_like_rebuild():
+    spatial = random_spatial(2000)
+    index = ClusterIndex(spatial, cell_px=64, max_zoom=10)
+    before = index.tile(3, 4, 2)
+    generator = random.Random(2)
+    for driver_id in generator.sample(range(1, 2001), 150):
+        spatial.upsert(
+            driver_id, generator.uniform(43.0, 68.0), generator.uniform(28.0, 60.0)
+        )
+    spatial.upsert(5000, 55.75, 37.61)
+    spatial.remove(7)
+    assert index.apply() == 152
+    assert index.apply() == 0
+    assert len(index) == 2000
+    incremental = levels_of(index)
+    assert index.tile(3, 4, 2) is not before
+    index.rebuild()
+    for (keys, count, ids, lat), level in zip(incremental, index.levels):
+        assert keys == level.keys.tolist()
+        assert count == level.count.tolist()
+        assert ids == level.ids.tolist()
+        assert np.allclose(lat, level.lat)
+
+
+def test_viewport_tiles():
+    spatial = SpatialGridIndex(cell_size=1.0)
+    spatial.upsert(1, 65.0, 179.9)
+    spatial.upsert(2, 65.0, -179.9)
+    spatial.upsert(3, 65.0, 170.0)
+    index = ClusterIndex(spatial, max_zoom=8, max_tiles=64)
+    tiles = index.viewport(60.0, 175.0, 70.0, -175.0, zoom=6)
+    assert sum(tile.trucks for tile in tiles) == 2
+    # Above 'max_zoom' - the trucks one by one
+    tiles = index.viewport(64.9, 179.8, 65.1, -179.8, zoom=12)
+    found = [json.loads("[%s]" % tile.clusters) for tile in tiles]
+    assert sorted(c["driver_id"] for clusters in found for c in clusters) == [1, 2]
+    with pytest.raises(ValueError):
+        index.viewport(-80.0, -180.0, 80.0, 180.0, zoom=6)
+
+
+def test_clusters_endpoints():
+    app = FastAPI()
+    app.include_router(clusters_router)
+    app.state.clusters = ClusterIndex(random_spatial(500), max_zoom=12)
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        params = {"min_lat": 40, "min_lon": 20, "max_lat": 70, "max_lon": 70, "zoom": 4}
+        response = client.get("/clusters", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert body["zoom"] == 4 and sum(c["count"] for c in body["clusters"]) == 500
+        assert response.headers["cache-control"] == "private, max-age=1"
+        response = client.get(
+            "/clusters",
+            params=params,
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+        assert client.get("/clusters", params=dict(params, zoom=12)).status_code == 400
+        tile = client.get("/clusters/0/0/0").json()
+        assert (tile["x"], tile["y"]) == (0, 0) and len(tile["clusters"]) <= 16
+        assert client.get("/clusters/2/4/0").status_code == 404
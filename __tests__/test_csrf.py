@@ -0,0 +1,49 @@
+"""
+__tests__/test_csrf.py
+"""
+
+from project.csrf import CsrfTokenSigner
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_csrf_token_signature_and_age():
+    clock = FakeClock()
+    signer = CsrfTokenSigner(["key-1"], max_age=60, clock=clock)
+    token = signer.new_token()
+    assert "key-1" not in token
+    assert signer.verify(token)
+    # Other worker with the same key ring
+    assert CsrfTokenSigner(["key-1"], clock=clock).verify(token)
+    kid, nonce, timestamp, signature = token.split(".")
+    for bad in (
+        "",
+        "garbage",
+        "%s.%s.%s.%s" % (kid, nonce + "x", timestamp, signature),
+        "%s.%s.%s.%s" % (kid, nonce, int(timestamp) + 1, signature),
+        token[:-1] + ("A" if token[-1] != "A" else "B"),
+        "%s.%s.%s.%s" % (kid, nonce, "١٢٣", signature),
+        token + "é",
+    ):
+        assert not signer.verify(bad)
+    assert not CsrfTokenSigner(["key-2"], clock=clock).verify(token)
+    clock.now += 61
+    assert not signer.verify(token)
+
+
+def test_csrf_key_rotation():
+    clock = FakeClock()
+    old_token = CsrfTokenSigner(["old"], clock=clock).new_token()
+    rotated = CsrfTokenSigner(["new", "old"], clock=clock)
+    assert rotated.verify(old_token)
+    new_token = rotated.new_token()
+    assert rotated.verify(new_token)
+    # The old key is removed - its tokens are invalid
+    assert not CsrfTokenSigner(["new"], clock=clock).verify(old_token)
+    assert CsrfTokenSigner(["new"], clock=clock).verify(new_token)
@@ -0,0 +1,55 @@
+"""
+__tests__/test_lifespan.py
+"""
+
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+
+import main
+
+
+@pytest.mark.asyncio
+async def test_lifespan_stops_started_resources_when_startup_fails(monkeypatch):
+    class BrokenSync:
+        def __init__(self, db, interval) -> None:
+            pass
+
+        async def start(self) -> None:
+            raise RuntimeError("sync failed")
+
+    monkeypatch.setattr(main, "SpatialIndexSync", BrokenSync)
+    app = FastAPI()
+    with pytest.raises(RuntimeError):
+        async with main.lifespan(app):
+            pass
+    # The resources started before the failed step are stopped
+    assert app.state.http_client.closed
+    assert app.state.position_buffer._task is None
+    assert not [
+        task for task in asyncio.all_tasks() if task.get_name() == "SessionReaper"
+    ]
+    await main.db.engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_http_client_without_retries_and_breaker_by_default(monkeypatch):
+    class BrokenSync:
+        def __init__(self, db, interval) -> None:
+            pass
+
+        async def start(self) -> None:
+            raise RuntimeError("sync failed")
+
+    monkeypatch.setattr(main, "SpatialIndexSync", BrokenSync)
+    app = FastAPI()
+    with pytest.raises(RuntimeError):
+        async with main.lifespan(app):
+            pass
+    # The retries and the circuit breaker are opt-in (HTTP_CLIENT_RETRIES, ..._BREAKER_THRESHOLD)
+    client = app.state.http_client
+    assert client.retry_policy.attempts == 1
+    assert client.retry_policy.attempt_timeout is None
+    assert client.breaker_threshold == 0
+    await main.db.engine.dispose()
@@ -0,0 +1,132 @@
+"""
+__tests__/test_live.py
+"""
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import pytest
+from fastapi import FastAPI, WebSocketDisconnect
+from fastapi.testclient import TestClient
+
+from project.db.spatial import SpatialGridIndex
+from project.jwt_auth import JWTUser
+from project.live import LiveSubscriber, PositionHub
+from project.routers.internal.live import router as live_router
+
+
+def trucks_of(frame: bytes):
+    return {truck["driver_id"]: truck for truck in json.loads(frame)["trucks"]}
+
+
+@pytest.mark.asyncio
+async def test_hub_coalesces_and_shares_frames():
+    spatial = SpatialGridIndex(cell_size=1.0)
+    spatial.upsert(1, 55.5, 37.5, 1.0)
+    spatial.upsert(2, 59.9, 30.3, 1.0)
+    hub = PositionHub(spatial, bbox_step=0.5)
+    first, second, drivers = LiveSubscriber(), LiveSubscriber(), LiveSubscriber()
+    # The near viewports are one group
+    assert hub.subscribe(first, bbox=(55.1, 37.1, 55.9, 37.9)) is hub.subscribe(
+        second, bbox=(55.2, 37.3, 55.8, 37.8)
+    )
+    hub.subscribe(drivers, drivers={2})
+    assert hub.info()["groups"] == 2
+    assert trucks_of(hub.snapshot(first.group)).keys() == {1}
+
+    # Three reports of the truck in one tick - one update
+    for recorded_at in (2.0, 3.0, 4.0):
+        spatial.upsert(1, 55.6, 37.6, recorded_at)
+    spatial.upsert(3, 10.0, 10.0, 4.0)
+    assert hub.publish() == 2
+    assert len(first.queue) == len(second.queue) == 1
+    assert first.queue[0] is second.queue[0]
+    assert trucks_of(first.queue[0]) == {
+        1: {"driver_id": 1, "lat": 55.6, "lon": 37.6, "recorded_at": 4.0}
+    }
+    assert not drivers.queue
+    # The truck which left the viewport is sent - the client removes its marker
+    spatial.upsert(1, 45.0, 45.0, 5.0)
+    spatial.upsert(2, 60.0, 30.4, 5.0)
+    spatial.remove(3)
+    hub.publish()
+    assert trucks_of(first.queue[-1])[1]["lat"] == 45.0
+    assert trucks_of(drivers.queue[-1]).keys() == {2}
+
+    sent = []
+
+    async def send(frame: bytes) -> None:
+        sent.append(json.loads(frame))
+
+    task = asyncio.create_task(hub.sender(first, send))
+    await asyncio.sleep(0)
+    assert [frame["type"] for frame in sent] == ["snapshot", "update", "update"]
+    task.cancel()
+    hub.unsubscribe(first)
+    hub.unsubscribe(second)
+    assert hub.info() == {"groups": 1, "subscribers": 1, "ticks": 2, "frames": 3}
+
+
+def test_slow_subscriber_gets_snapshot_instead_of_frames():
+    spatial = SpatialGridIndex(cell_size=1.0)
+    hub = PositionHub(spatial, max_pending=2)
+    slow = LiveSubscriber(max_pending=2)
+    hub.subscribe(slow, drivers={1})
+    slow.resync = False
+    for tick in range(5):
+        spatial.upsert(1, 55.0 + tick, 37.0, float(tick))
+        hub.publish()
+    assert slow.dropped == 2 and slow.resync
+    assert len(slow.queue) == 2
+    # The snapshot has the latest position
+    assert trucks_of(hub.snapshot(slow.group))[1]["lat"] == 59.0
+    with pytest.raises(ValueError):
+        hub.subscribe_message(slow, '{"bbox": [56, 37, 55, 38]}')
+    with pytest.raises(ValueError):
+        hub.subscribe_message(slow, '{"drivers": []}')
+
+
+def test_live_endpoint():
+    spatial = SpatialGridIndex(cell_size=1.0)
+    spatial.upsert(7, 55.75, 37.61, 1.0)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        app.state.position_hub = PositionHub(spatial, interval=0.01)
+        app.state.position_hub.start()
+        yield
+        await app.state.position_hub.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(live_router)
+    users = iter([JWTUser(id=1), JWTUser(id=2, is_active=False)])
+
+    class SetUser:
+        def __init__(self, app):
+            self.app = app
+
+        async def __call__(self, scope, receive, send):
+            if scope["type"] == "websocket":
+                scope["user"] = next(users)
+            await self.app(scope, receive, send)
+
+    app.add_middleware(SetUser)
+    with TestClient(app) as client:
+        with client.websocket_connect("/live") as websocket:
+            websocket.send_text('{"bbox": [55, 37, 56, 38]}')
+            snapshot = json.loads(websocket.receive_bytes())
+            assert (
+                snapshot["type"] == "snapshot"
+                and snapshot["trucks"][0]["driver_id"] == 7
+            )
+            client.portal.call(lambda: spatial.upsert(7, 55.8, 37.7, 2.0))
+            update = json.loads(websocket.receive_bytes())
+            assert update["type"] == "update" and update["trucks"][0]["lat"] == 55.8
+            websocket.send_text("{}")
+            assert json.loads(websocket.receive_bytes())["type"] == "error"
+        # Not active
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect("/live"):
+                pass
+        assert error.value.code == 1008
@@ -0,0 +1,74 @@
+"""
+__tests__/test_logs.py
+"""
+
+import gzip
+import io
+import json
+import logging
+import sys
+import threading
+
+import pytest
+
+from logs import JsonFormatter, configure_logging, make_file_handler, shutdown_logging
+
+
+@pytest.fixture
+def own_logging(tmp_path):
+    shutdown_logging()
+    yield tmp_path
+    shutdown_logging()
+    # The default pipeline of the other tests
+    configure_logging(logging.INFO)
+
+
+def test_configure_logging_once(own_logging):
+    stream = io.StringIO()
+    log_file = own_logging / "app.log"
+    listener = configure_logging(logging.INFO, log_file=str(log_file), stream=stream)
+    threads = threading.active_count()
+    for _ in range(5):
+        assert configure_logging(logging.INFO) is listener
+    assert threading.active_count() == threads
+    queue_handlers = [
+        handler
+        for handler in logging.getLogger().handlers
+        if isinstance(handler, logging.handlers.QueueHandler)
+    ]
+    assert len(queue_handlers) == 1
+    logging.getLogger("test").info("driver %s is on the map", 7)
+    shutdown_logging()
+    assert "driver 7 is on the map" in log_file.read_text(encoding="utf-8")
+    assert "driver 7 is on the map" in stream.getvalue()
+
+
+def test_rotation_keeps_compressed_archives(tmp_path):
+    log_file = tmp_path / "app.log"
+    handler = make_file_handler(str(log_file), max_bytes=200, backup_count=2)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger = logging.Logger("rotation")
+    logger.addHandler(handler)
+    for number in range(30):
+        logger.info("line %02d %s", number, "x" * 20)
+    handler.close()
+    archives = sorted(path.name for path in tmp_path.iterdir())
+    assert archives == ["app.log", "app.log.1.gz", "app.log.2.gz"]
+    with gzip.open(tmp_path / "app.log.1.gz", "rt", encoding="utf-8") as file:
+        assert "line" in file.read()
+    assert "line 29" in log_file.read_text(encoding="utf-8")
+
+
+def test_json_formatter():
+    try:
+        raise ValueError("oops")
+    except ValueError:
+        exc_info = sys.exc_info()
+    record = logging.LogRecord(
+        "project.test", logging.ERROR, "x.py", 10, "bad %s", ("id",), exc_info
+    )
+    line = json.loads(JsonFormatter().format(record))
+    assert line["level"] == "ERROR"
+    assert line["logger"] == "project.test"
+    assert line["message"] == "bad id"
+    assert "ValueError: oops" in line["exc_info"]
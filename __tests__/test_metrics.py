@@ -0,0 +1,90 @@
+"""
+__tests__/test_metrics.py
+"""
+
+import pytest
+from aiohttp import web
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.middleware import Middleware
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient, HttpRequest
+from project.metrics import (
+    REGISTRY,
+    Histogram,
+    MetricsMiddleware,
+    MetricsRegistry,
+    observe_upstream,
+    register_engine_pool,
+)
+from project.routers.internal.metrics import router as metrics_router
+
+
+def test_histogram_render():
+    registry = MetricsRegistry()
+    histogram = registry.register(
+        Histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    )
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(('/a"b',), value)
+    text = registry.render()
+    assert "# TYPE latency_seconds histogram" in text
+    assert 'latency_seconds_bucket{route="/a\\"b",le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{route="/a\\"b",le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{route="/a\\"b",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/a\\"b"} 4' in text
+    assert 'latency_seconds_sum{route="/a\\"b"} 3.65' in text
+
+
+def test_metrics_middleware_and_endpoint(tmp_path):
+    app = FastAPI(middleware=[Middleware(MetricsMiddleware)])
+    app.include_router(metrics_router)
+
+    @app.get("/drivers/{driver_id}")
+    async def driver(driver_id: int):
+        return {"data": driver_id}
+
+    engine = create_async_engine("sqlite+aiosqlite:///%s" % (tmp_path / "pool.sqlite3"))
+    register_engine_pool(engine, REGISTRY)
+    with TestClient(app) as client:
+        for driver_id in range(3):
+            assert client.get("/drivers/%d" % driver_id).status_code == 200
+        assert client.get("/nowhere").status_code == 404
+        response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    # The template of route, not the URL
+    assert (
+        'http_requests_total{method="GET",route="/drivers/{driver_id}",status="200"} 3'
+        in text
+    )
+    assert (
+        'http_requests_total{method="GET",route="<unmatched>",status="404"} 1' in text
+    )
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/drivers/{driver_id}"} 3'
+        in text
+    )
+    assert 'http_requests_in_flight{method="GET"} 1' in text  # the scrape itself
+    assert "db_pool_size 5" in text
+    assert "db_pool_checked_out 0" in text
+
+
+@pytest.mark.asyncio
+async def test_upstream_observer():
+    async def handler(request):
+        return web.json_response({"data": "ok"})
+
+    runner, base_url = await start_stand_in([web.get("/ok", handler)])
+    try:
+        async with AsyncHttpClient(observer=observe_upstream) as client:
+            await client.request(HttpRequest.GET.value, base_url + "/ok")
+    finally:
+        await runner.cleanup()
+    text = REGISTRY.render()
+    assert 'upstream_requests_total{method="GET",host="127.0.0.1",status="200"}' in text
+    assert (
+        'upstream_request_duration_seconds_count{method="GET",host="127.0.0.1"}' in text
+    )
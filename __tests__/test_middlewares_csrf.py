@@ -0,0 +1,128 @@
+"""
+__tests__/test_middlewares_csrf.py
+"""
+
+import pytest
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+from starlette.middleware import Middleware
+
+from project.csrf import CsrfTokenSigner
+from project.db.corn import Settings
+from project.middlewares import CustomHeaderMiddleware
+
+SECRET_KEYS = ["0199-secret-key"]
+
+
+def make_client() -> TestClient:
+    app = FastAPI(
+        middleware=[Middleware(CustomHeaderMiddleware, secret_keys=SECRET_KEYS)]
+    )
+
+    @app.get("/")
+    async def index():
+        return {"data": "ok"}
+
+    @app.post("/")
+    async def create():
+        return {"data": "created"}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for chunk in (b"a", b"b", b"c"):
+                yield chunk
+
+        return StreamingResponse(chunks())
+
+    return TestClient(app)
+
+
+def test_csrf_cookie_is_set_once_for_safe_methods():
+    with make_client() as client:
+        response = client.get("/")
+        assert response.status_code == 200
+        token = response.cookies.get("csrf_token")
+        assert token and "secret" not in token
+        assert "Max-Age=" in response.headers["set-cookie"]
+        # The cookie is 'Secure' - the client over http doesn't send it, so by hand
+        response = client.get(
+            "/", headers={"Cookie": "theme=dark; csrf_token=%s" % token}
+        )
+        assert "set-cookie" not in response.headers
+        # The streaming response is passed as is
+        response = client.get("/stream")
+        assert response.content == b"abc"
+
+
+def test_csrf_unsafe_methods_need_the_valid_header():
+    with make_client() as client:
+        token = client.get("/").cookies.get("csrf_token")
+        response = client.post("/", headers={"X-CSRF-Token": token})
+        assert response.status_code == 200
+        assert response.json() == {"data": "created"}
+        # The other worker (or the app after restart) with the same keys
+        with make_client() as other_client:
+            response = other_client.post("/", headers={"X-CSRF-Token": token})
+            assert response.status_code == 200
+        for headers in (
+            {},
+            {"X-CSRF-Token": ""},
+            {"X-CSRF-Token": "0199secretkeyBearerxyz"},
+        ):
+            response = client.post("/", headers=headers)
+            # Not 500 when the header is missing
+            assert response.status_code == 403
+            assert response.json() == {"detail": "Invalid CSRF Token"}
+
+
+def test_csrf_invalid_cookie_is_replaced():
+    expired = CsrfTokenSigner(SECRET_KEYS, clock=lambda: 0).new_token()
+    retired = CsrfTokenSigner(["0198-retired-key"]).new_token()
+    with make_client() as client:
+        for token in (expired, retired):
+            response = client.get("/", headers={"Cookie": "csrf_token=%s" % token})
+            new_token = response.cookies.get("csrf_token")
+            assert new_token and new_token != token
+            response = client.post("/", headers={"X-CSRF-Token": new_token})
+            assert response.status_code == 200
+
+
+def test_csrf_keys_shared_only_from_env(monkeypatch):
+    monkeypatch.delenv("SECRET_KEY", raising=False)
+    monkeypatch.delenv("CSRF_SECRET_KEYS", raising=False)
+    # The default 'SECRET_KEY' is new in every process
+    assert not Settings().CSRF_KEYS_SHARED
+    assert Settings(SECRET_KEY="0199-secret-key").CSRF_KEYS_SHARED
+    monkeypatch.setenv("CSRF_SECRET_KEYS", '["0199-secret-key"]')
+    assert Settings().CSRF_KEYS_SHARED
+
+
+def test_csrf_websocket_origin():
+    app = FastAPI(
+        middleware=[
+            Middleware(
+                CustomHeaderMiddleware,
+                secret_keys=SECRET_KEYS,
+                allowed_origins=["http://127.0.0.1:8000"],
+            )
+        ]
+    )
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_text("ok")
+        await websocket.close()
+
+    with TestClient(app) as client:
+        for headers in ({"Origin": "http://127.0.0.1:8000"}, {}):
+            with client.websocket_connect("/ws", headers=headers) as websocket:
+                assert websocket.receive_text() == "ok"
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect(
+                "/ws", headers={"Origin": "http://evil.example"}
+            ):
+                pass
+        assert error.value.code == 1008
@@ -0,0 +1,242 @@
+"""
+__tests__/test_middlewares_jwt.py
+"""
+
+import asyncio
+import time
+
+import jwt
+import pytest
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.testclient import TestClient
+from starlette.middleware import Middleware
+
+from __tests__.fixtures import start_stand_in
+from project.asynchttp_client import AsyncHttpClient
+from project.jwt_auth import JWTKeyProvider, JWTVerifier
+from project.middlewares import CustomJWTMiddleware
+from project.permissions import IsActive
+
+SECRET_KEY = "django-signing-key-of-the-person-backend"
+
+
+def make_token(key=SECRET_KEY, algorithm="HS256", **claims) -> str:
+    payload = {
+        "token_type": "access",
+        "user_id": 7,
+        "username": "driver",
+        "groups": ["DRIVER"],
+        "exp": int(time.time()) + 300,
+    }
+    payload.update(claims)
+    return jwt.encode(payload, key, algorithm=algorithm)
+
+
+def make_client(verifier: JWTVerifier) -> TestClient:
+    app = FastAPI(middleware=[Middleware(CustomJWTMiddleware, verifier=verifier)])
+
+    @app.get("/me")
+    async def me(request: Request):
+        user = request.user
+        return {
+            "id": user.id,
+            "authenticated": user.is_authenticated,
+            "driver": user.groups.filter(name__in=["DRIVER"]).exists(),
+            "active": bool(IsActive().has_permission(request)),
+        }
+
+    return TestClient(app)
+
+
+def test_jwt_middleware_user_of_token():
+    verifier = JWTVerifier(JWTKeyProvider("HS256", secret_key=SECRET_KEY))
+    with make_client(verifier) as client:
+        response = client.get("/me")
+        assert response.json() == {
+            "id": None,
+            "authenticated": False,
+            "driver": False,
+            "active": False,
+        }
+        token = make_token()
+        for headers in ({"token_access": token}, {"token_access": "Bearer %s" % token}):
+            response = client.get("/me", headers=headers)
+            assert response.json() == {
+                "id": 7,
+                "authenticated": True,
+                "driver": True,
+                "active": True,
+            }
+        # The second request with the token is the hit of cache
+        assert verifier.cache.info()["hits"] >= 1
+        # The refresh token
+        refresh = make_token(token_type="refresh")
+        assert client.get("/me", headers={"token_refresh": refresh}).json()["id"] == 7
+        # The refresh token in the access header
+        assert client.get("/me", headers={"token_access": refresh}).status_code == 401
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        "garbage",
+        make_token(key="other-signing-key-of-the-person-backend"),
+        make_token(exp=int(time.time()) - 10),
+        make_token(exp=None),
+    ],
+    ids=["garbage", "other key", "expired", "no exp"],
+)
+def test_jwt_middleware_invalid_token(token):
+    verifier = JWTVerifier(JWTKeyProvider("HS256", secret_key=SECRET_KEY))
+    with make_client(verifier) as client:
+        response = client.get("/me", headers={"token_access": token})
+        assert response.status_code == 401
+        assert response.json() == {"detail": "Invalid token"}
+        assert response.headers["www-authenticate"] == "Bearer"
+
+
+@pytest.mark.asyncio
+async def test_jwt_public_key_is_loaded_once(tmp_path):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path / "public.pem"
+    path.write_bytes(
+        private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+    )
+    keys = JWTKeyProvider("RS256", public_key_path=str(path))
+    verifier = JWTVerifier(keys, cache_size=0)
+    token = make_token(key=private_key, algorithm="RS256")
+    assert (await verifier.verify(token)).username == "driver"
+    key = keys._key
+    path.unlink()
+    # The file is not read again
+    assert (await verifier.verify(token, "access")).id == 7
+    assert keys._key is key
+
+
+@pytest.mark.asyncio
+async def test_jwt_public_key_of_url_as_text_or_json():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = (
+        private_key.public_key()
+        .public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        )
+        .decode("ascii")
+    )
+    routes = web.RouteTableDef()
+
+    @routes.get("/text")
+    async def text_key(request):
+        return web.Response(text=pem, content_type="application/x-pem-file")
+
+    @routes.get("/json")
+    async def json_key(request):
+        return web.json_response({"public_key": pem})
+
+    runner, base_url = await start_stand_in(routes)
+    token = make_token(key=private_key, algorithm="RS256")
+    try:
+        async with AsyncHttpClient() as http_client:
+            for path in ("/text", "/json"):
+                keys = JWTKeyProvider("RS256", public_key_url=base_url + path)
+                verifier = JWTVerifier(keys, cache_size=0, http_client=http_client)
+                assert (await verifier.verify(token)).id == 7
+            keys = JWTKeyProvider("RS256", public_key_url=base_url + "/missing")
+            with pytest.raises(ValueError):
+                await keys.get_key(http_client)
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_jwt_failed_public_key_is_not_fetched_again_during_backoff():
+    hits = 0
+    now = 100.0
+    routes = web.RouteTableDef()
+
+    @routes.get("/down")
+    async def down(request):
+        nonlocal hits
+        hits += 1
+        return web.Response(status=502)
+
+    runner, base_url = await start_stand_in(routes)
+    token = make_token(
+        key=rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        algorithm="RS256",
+    )
+    try:
+        async with AsyncHttpClient() as http_client:
+            keys = JWTKeyProvider(
+                "RS256",
+                public_key_url=base_url + "/down",
+                retry_after=5.0,
+                clock=lambda: now,
+            )
+            verifier = JWTVerifier(keys, cache_size=0, http_client=http_client)
+            results = await asyncio.gather(
+                *(verifier.verify(token) for _ in range(10)), return_exceptions=True
+            )
+            assert all(isinstance(result, ValueError) for result in results)
+            # The waiters of the lock and the next requests don't fetch again
+            assert hits == 1
+            now += 4.9
+            with pytest.raises(ValueError):
+                await verifier.verify(token)
+            assert hits == 1
+            now += 0.2
+            with pytest.raises(ValueError):
+                await verifier.verify(token)
+            assert hits == 2
+    finally:
+        await runner.cleanup()
+
+
+def test_jwt_middleware_malformed_public_key_is_503():
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    keys = JWTKeyProvider("RS256", public_key="-----BEGIN PUBLIC KEY-----\nnot a key\n")
+    with make_client(JWTVerifier(keys)) as client:
+        token = make_token(key=private_key, algorithm="RS256")
+        response = client.get("/me", headers={"token_access": token})
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+
+
+def test_jwt_middleware_websocket_token_of_query():
+    app = FastAPI(
+        middleware=[
+            Middleware(
+                CustomJWTMiddleware,
+                verifier=JWTVerifier(JWTKeyProvider("HS256", secret_key=SECRET_KEY)),
+            )
+        ]
+    )
+
+    @app.websocket("/ws")
+    async def ws(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_json({"id": websocket.user.id})
+        await websocket.close()
+
+    with TestClient(app) as client:
+        with client.websocket_connect(
+            "/ws?token_access=%s" % make_token()
+        ) as websocket:
+            assert websocket.receive_json() == {"id": 7}
+        with client.websocket_connect(
+            "/ws", headers={"token_access": make_token()}
+        ) as websocket:
+            assert websocket.receive_json() == {"id": 7}
+        with client.websocket_connect("/ws") as websocket:
+            assert websocket.receive_json() == {"id": None}
+        with pytest.raises(WebSocketDisconnect) as error:
+            with client.websocket_connect("/ws?token_access=garbage"):
+                pass
+        assert error.value.code == 1008
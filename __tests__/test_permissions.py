@@ -0,0 +1,103 @@
+"""
+__tests__/test_permissions.py
+"""
+
+import pytest
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+
+from project.jwt_auth import ANONYMOUS_USER, GroupSet, JWTUser
+from project.permissions import (
+    IsActive,
+    IsAll,
+    IsManipulate,
+    IsOwnerRaport,
+    IsReader,
+    PermissionEngine,
+    require,
+    user_mask,
+)
+
+
+def make_user(groups=(), **flags) -> JWTUser:
+    return JWTUser(id=flags.pop("id", 1), groups=GroupSet(groups), **flags)
+
+
+def test_permissions_are_the_bit_tests():
+    driver = user_mask(make_user(["Truck driver"]))
+    manager = user_mask(make_user(["MANAGER"]))
+    admin = user_mask(make_user(["ADMIN"], is_staff=True))
+    reader = user_mask(make_user(["Employee"]))
+    root = user_mask(make_user(is_staff=True, is_superuser=True))
+    inactive = user_mask(make_user(["DRIVER"], is_active=False))
+    anonymous = user_mask(ANONYMOUS_USER)
+
+    assert IsOwnerRaport().check(driver) and not IsOwnerRaport().check(manager)
+    assert not IsOwnerRaport().check(inactive)
+    assert IsManipulate().check(manager)
+    assert IsAll().check(admin) and IsAll().check(root) and not IsAll().check(manager)
+    assert IsReader().check(reader) and IsReader().check(admin)
+    assert not IsReader().check(root)
+    assert not IsActive().check(anonymous)
+    # Composition
+    either = IsOwnerRaport() | IsManipulate()
+    assert either.check(driver) and either.check(manager) and not either.check(reader)
+    assert not (IsReader() & IsAll()).check(root)
+    assert (IsReader() & IsAll()).check(admin)
+    assert (IsActive() & ~IsManipulate()).check(driver)
+    assert not (either & IsReader()).check(driver)
+
+
+@pytest.mark.asyncio
+async def test_permission_engine_loads_the_groups_once_per_request():
+    calls = []
+
+    async def load_groups(user):
+        calls.append(user.id)
+        return ["MANAGER"]
+
+    engine = PermissionEngine(load_groups=load_groups)
+    app = FastAPI()
+
+    @app.middleware("http")
+    async def set_user(request: Request, call_next):
+        user_id = request.headers.get("user-id")
+        request.scope["user"] = (
+            make_user(id=int(user_id)) if user_id else ANONYMOUS_USER
+        )
+        return await call_next(request)
+
+    @app.get(
+        "/",
+        dependencies=[
+            Depends(require(IsManipulate(), engine)),
+            Depends(require(IsActive() & IsManipulate(), engine)),
+        ],
+    )
+    async def index():
+        return {"data": "ok"}
+
+    @app.get("/admin", dependencies=[Depends(require(IsAll(), engine))])
+    async def admin():
+        return {"data": "ok"}
+
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.get("/", headers={"user-id": "5"}).status_code == 200
+        assert client.get("/admin", headers={"user-id": "5"}).status_code == 403
+        assert client.get("/").status_code == 401
+    # One load per request - not per check; the anonymous user is not loaded
+    assert calls == [5, 5, 5, 5]
+
+
+@pytest.mark.asyncio
+async def test_sync_check_does_not_hide_the_loaded_groups():
+    async def load_groups(user):
+        return ["MANAGER"]
+
+    engine = PermissionEngine(load_groups=load_groups)
+    request = Request({"type": "http", "user": make_user(id=5)})
+    # The sync check by the token first - the user has no groups in it
+    assert not IsManipulate().check(engine.request_mask(request))
+    assert IsManipulate().check(await engine.mask_for(request))
+    assert IsManipulate().check(engine.request_mask(request))
@@ -0,0 +1,431 @@
+"""
+__tests__/test_positions.py
+"""
+
+import asyncio
+import json
+import time
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.exc import DataError
+
+from project.db.models import FLEET_WIRE_DTYPE, Database, PositionModel
+from project.jwt_auth import JWTUser
+from project.positions import (
+    POSITION_DTYPE,
+    POSITION_WIRE_DTYPE,
+    MAX_DRIVER_ID,
+    BinaryPositionParser,
+    BufferFullError,
+    MAX_LINE_SIZE,
+    NdjsonPositionParser,
+    PositionBuffer,
+    validate_positions,
+)
+from project.routers.internal.positions import router as positions_router
+
+NOW = time.time()
+
+
+def ndjson_line(driver_id=7, **fields) -> bytes:
+    item = {
+        "driver_id": driver_id,
+        "timestamp": NOW,
+        "lat": 55.75,
+        "lon": 37.61,
+        "speed": 62.5,
+        "heading": 180,
+    }
+    item.update(fields)
+    return json.dumps(item).encode() + b"\n"
+
+
+def wire_records(count: int) -> bytes:
+    wire = np.zeros(count, dtype=POSITION_WIRE_DTYPE)
+    wire["driver_id"] = np.arange(1, count + 1)
+    wire["recorded_at"] = NOW
+    wire["lat"] = 55.7
+    wire["lon"] = 37.6
+    wire["speed"] = 80.0
+    wire["heading"] = 90.0
+    return wire.tobytes()
+
+
+class FakeDatabase:
+    def __init__(self, fail: bool = False) -> None:
+        self.rows = []
+        self.fail = fail
+
+    async def bulk_insert_positions(self, rows) -> int:
+        if self.fail:
+            raise ConnectionError("database is down")
+        self.rows.extend(rows)
+        return len(rows)
+
+
+class Int4Database(FakeDatabase):
+    """'driver_id' is int4 - as 'Integer' of PostgreSQL."""
+
+    async def bulk_insert_positions(self, rows) -> int:
+        if any(row[0] > MAX_DRIVER_ID for row in rows):
+            raise DataError("INSERT", None, ValueError("value out of int32 range"))
+        return await super().bulk_insert_positions(rows)
+
+
+def test_validate_positions_in_bulk():
+    rows = np.zeros(6, dtype=POSITION_DTYPE)
+    rows["driver_id"] = 1
+    rows["recorded_at"] = NOW
+    rows["lat"] = [10, 91, 10, 10, np.nan, 10]
+    rows["speed"] = [50, 50, -1, 50, 50, 50]
+    rows["heading"] = [0, 0, 0, 400, 0, 360]
+    valid, rejected = validate_positions(rows, now=NOW)
+    assert rejected == 3 + 1
+    assert valid["heading"].tolist() == [0.0, 360.0]
+
+    rows["lat"] = 10
+    rows["speed"] = 50
+    rows["heading"] = 0
+    rows["recorded_at"][0] = NOW + 3600
+    rows["recorded_at"][1] = NOW - 30 * 24 * 3600
+    rows["driver_id"][2] = 0
+    assert validate_positions(rows, now=NOW)[1] == 3
+
+    rows["recorded_at"] = NOW
+    rows["driver_id"] = [1, MAX_DRIVER_ID, MAX_DRIVER_ID + 1, 2**32, -1, 2]
+    valid, rejected = validate_positions(rows, now=NOW)
+    assert rejected == 3
+    assert valid["driver_id"].tolist() == [1, MAX_DRIVER_ID, 2]
+
+
+def test_ndjson_parser_stream_and_broken_lines():
+    parser = NdjsonPositionParser()
+    body = ndjson_line(1) + b"{broken\n" + ndjson_line(2, lat=None) + ndjson_line(3)
+    # The line is split between chunks
+    rows = [
+        parser.feed(body[:30]),
+        parser.feed(body[30:]),
+        parser.feed(ndjson_line(4)[:-1]),
+    ]
+    rows.append(parser.close())
+    rows = np.concatenate(rows)
+    assert rows["driver_id"].tolist() == [1, 3, 4]
+    assert rows["lat"].tolist() == [55.75] * 3
+    assert parser.rejected == 2
+
+
+def test_ndjson_parser_integer_driver_id_and_long_line():
+    parser = NdjsonPositionParser()
+    body = b"".join(
+        [ndjson_line(7.9), ndjson_line("7"), ndjson_line(True), ndjson_line(2**70)]
+    )
+    assert parser.feed(body).size == 0
+    assert parser.rejected == 4
+    # The long line is rejected once - its rest is skipped, not the second broken line
+    parser = NdjsonPositionParser()
+    long_line = ndjson_line(1, note="x" * (2 * MAX_LINE_SIZE))
+    rows = []
+    for start in range(0, len(long_line), 1000):
+        rows.append(parser.feed(long_line[start : start + 1000]))
+    rows.append(parser.feed(ndjson_line(2) + ndjson_line(7.0) + ndjson_line(3)))
+    rows.append(parser.close())
+    assert np.concatenate(rows)["driver_id"].tolist() == [2, 3]
+    assert parser.rejected == 2
+
+
+def test_binary_parser_keeps_split_record():
+    parser = BinaryPositionParser()
+    data = wire_records(3) + b"\x01\x02"
+    rows = np.concatenate(
+        [parser.feed(data[:40]), parser.feed(data[40:]), parser.close()]
+    )
+    assert rows["driver_id"].tolist() == [1, 2, 3]
+    assert rows["lat"].tolist() == [55.7] * 3
+    assert parser.rejected == 1
+
+
+@pytest.mark.asyncio
+async def test_buffer_flushes_and_applies_backpressure():
+    db = FakeDatabase()
+    buffer = PositionBuffer(
+        db, max_rows=10, batch_size=5, flush_interval=60, put_timeout=0.05
+    )
+    rows = np.zeros(6, dtype=POSITION_DTYPE)
+    seen = []
+    buffer.listeners.append(lambda batch: seen.append(len(batch)))
+
+    await buffer.put(rows)
+    # The buffer is full and nothing flushes it - the producer waits, then gets the error
+    with pytest.raises(BufferFullError):
+        await buffer.put(rows)
+
+    buffer.start()
+    await buffer.put(rows)
+    await asyncio.sleep(0.05)
+    await buffer.stop()
+    assert len(db.rows) == 12
+    assert buffer.size == 0
+    assert sum(seen) == 12
+
+
+@pytest.mark.asyncio
+async def test_buffer_keeps_rows_when_database_fails():
+    db = FakeDatabase(fail=True)
+    buffer = PositionBuffer(db, max_rows=100)
+    await buffer.put(np.zeros(5, dtype=POSITION_DTYPE))
+    with pytest.raises(ConnectionError):
+        await buffer.flush()
+    assert buffer.size == 5
+    db.fail = False
+    assert await buffer.flush() == 5
+    assert buffer.size == 0
+
+
+@pytest.mark.asyncio
+async def test_buffer_drops_the_rows_of_data_error():
+    db = Int4Database()
+    buffer = PositionBuffer(db, max_rows=100)
+    bad = np.zeros(5, dtype=POSITION_DTYPE)
+    bad["driver_id"] = [1, 2, MAX_DRIVER_ID + 1, 4, 5]
+    good = np.zeros(3, dtype=POSITION_DTYPE)
+    good["driver_id"] = [6, 7, 8]
+    await buffer.put(bad)
+    await buffer.put(good)
+    # The batch is bisected - only the bad row is dropped, it is not retried forever
+    assert await buffer.flush() == 7
+    assert sorted(row[0] for row in db.rows) == [1, 2, 4, 5, 6, 7, 8]
+    assert buffer.size == 0 and buffer.dropped == 1 and not buffer.pending
+    await buffer.put(good)
+    assert await buffer.flush() == 3
+
+
+@pytest.mark.asyncio
+async def test_cancelled_flush_keeps_rows():
+    class SlowDatabase(FakeDatabase):
+        async def bulk_insert_positions(self, rows) -> int:
+            await asyncio.sleep(10)
+
+    buffer = PositionBuffer(SlowDatabase())
+    await buffer.put(np.zeros(5, dtype=POSITION_DTYPE))
+    task = asyncio.create_task(buffer.flush())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert buffer.size == 5
+    assert sum(len(rows) for rows in buffer.pending) == 5
+
+
+@pytest.mark.asyncio
+async def test_bulk_insert_positions_multi_row(tmp_path):
+    db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "positions.sqlite3"))
+    await db.bootstrap_schema()
+    rows = np.zeros(2500, dtype=POSITION_DTYPE)
+    rows["driver_id"] = np.arange(2500) % 7 + 1
+    rows["recorded_at"] = NOW
+    rows["lat"] = 55.75
+    assert await db.bulk_insert_positions(rows.tolist()) == 2500
+    async with db.session_factory() as session:
+        count = await session.scalar(select(func.count()).select_from(PositionModel))
+        lat = await session.scalar(select(PositionModel.lat).limit(1))
+    await db.engine.dispose()
+    assert count == 2500
+    assert lat == 55.75
+
+
+def test_post_positions_endpoint():
+    db = FakeDatabase()
+    app = FastAPI()
+    app.include_router(positions_router)
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        response = client.post(
+            "/positions",
+            content=ndjson_line(1),
+            headers={"Content-Type": "application/x-ndjson"},
+        )
+        assert response.status_code == 503
+
+        app.state.position_buffer = PositionBuffer(db)
+        body = ndjson_line(1) + ndjson_line(2, speed=-5) + ndjson_line(3)
+        response = client.post(
+            "/positions", content=body, headers={"Content-Type": "application/x-ndjson"}
+        )
+        assert response.status_code == 202
+        assert response.json() == {"accepted": 2, "rejected": 1}
+
+        response = client.post(
+            "/positions",
+            content=iter([wire_records(5)[:50], wire_records(5)[50:]]),
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        assert response.json() == {"accepted": 5, "rejected": 0}
+
+        response = client.post(
+            "/positions", content=b"[]", headers={"Content-Type": "application/json"}
+        )
+        assert response.status_code == 415
+    assert app.state.position_buffer.size == 7
+
+
+def test_post_positions_full_buffer_reports_where_to_resume():
+    db = FakeDatabase()
+    buffer = PositionBuffer(
+        db, max_rows=12, batch_size=4, flush_interval=60, put_timeout=0.01
+    )
+    app = FastAPI()
+    app.include_router(positions_router)
+    app.state.position_buffer = buffer
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    body = wire_records(25)
+    responses = []
+    with TestClient(app) as client:
+        while True:
+            response = client.post(
+                "/positions",
+                content=body,
+                headers={"Content-Type": "application/octet-stream"},
+            )
+            responses.append(response.json())
+            if response.status_code != 503:
+                break
+            # Only the rows before 'resume_at' are in the buffer
+            report = response.json()
+            assert buffer.size == report["accepted"] == report["resume_at"] // 28
+            client.portal.call(buffer.flush)
+            body = body[report["resume_at"] :]
+        client.portal.call(buffer.flush)
+    assert response.status_code == 202 and len(responses) > 1
+    assert sum(report["accepted"] for report in responses) == 25
+    # Every row once - the retry doesn't write the accepted rows twice
+    assert [row[0] for row in db.rows] == list(range(1, 26))
+
+
+def test_post_positions_oversized_driver_id():
+    db = Int4Database()
+    app = FastAPI()
+    app.include_router(positions_router)
+    app.state.position_buffer = PositionBuffer(db)
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        for body, accepted in (
+            (ndjson_line(MAX_DRIVER_ID + 1) + ndjson_line(2**32 + 7), 0),
+            (ndjson_line(1) + ndjson_line(2), 2),
+        ):
+            response = client.post(
+                "/positions",
+                content=body,
+                headers={"Content-Type": "application/x-ndjson"},
+            )
+            assert response.status_code == 202
+            assert response.json() == {"accepted": accepted, "rejected": 2 - accepted}
+    # The oversized ids did not reach the database - the valid batch is written
+    assert asyncio.run(app.state.position_buffer.flush()) == 2
+    assert [row[0] for row in db.rows] == [1, 2]
+
+
+def test_nearest_and_bbox_endpoints():
+    db = Database("sqlite+aiosqlite:///:memory:")
+    db.spatial.update_many(
+        [
+            (1, NOW, 55.75, 37.61, 0.0, 0.0),
+            (2, NOW, 55.76, 37.62, 0.0, 0.0),
+            (3, NOW, 59.9, 30.3, 0.0, 0.0),
+        ]
+    )
+    app = FastAPI()
+    app.include_router(positions_router)
+    app.state.db = db
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        response = client.get(
+            "/positions/nearest", params={"lat": 55.75, "lon": 37.6, "k": 2}
+        )
+        assert [truck["driver_id"] for truck in response.json()["trucks"]] == [1, 2]
+        response = client.get(
+            "/positions/bbox",
+            params={"min_lat": 59, "min_lon": 30, "max_lat": 60, "max_lon": 31},
+        )
+        assert response.json() == {
+            "trucks": [{"driver_id": 3, "lat": 59.9, "lon": 30.3, "recorded_at": NOW}]
+        }
+        assert (
+            client.get("/positions/nearest", params={"lat": 91, "lon": 0}).status_code
+            == 422
+        )
+
+
+def test_fleet_snapshot_endpoint():
+    db = Database("sqlite+aiosqlite:///:memory:")
+    db.fleet.update_many(
+        [
+            (1, NOW, 55.75, 37.61, 60.0, 90.0),
+            (2, NOW - 600, 55.76, 37.62, 0.0, 0.0),
+            (3, NOW - 600, 59.9, 30.3, 80.0, 180.0),
+        ]
+    )
+    app = FastAPI()
+    app.include_router(positions_router)
+    app.state.db = db
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        body = client.get("/positions/fleet").json()
+        assert body["count"] == 3 and body["driver_id"] == [1, 2, 3]
+        assert body["next_after"] is None
+        assert body["status"] == ["moving", "stopped", "moving"]
+        response = client.get("/positions/fleet", params={"limit": 2})
+        assert response.json()["driver_id"] == [1, 2]
+        assert (
+            response.json()["next_after"] == 2
+            and response.headers["x-next-after"] == "2"
+        )
+        body = client.get("/positions/fleet", params={"limit": 2, "after": 2}).json()
+        assert body["driver_id"] == [3] and body["next_after"] is None
+        params = {"stale_after": 300, "status": "moving"}
+        body = client.get("/positions/fleet", params=params).json()
+        assert (
+            body["driver_id"] == [3]
+            and body["lat"] == [59.9]
+            and body["speed"] == [80.0]
+        )
+        response = client.get(
+            "/positions/fleet",
+            params={"min_lat": 55, "min_lon": 37, "max_lat": 56, "max_lon": 38},
+            headers={"Accept": "application/octet-stream"},
+        )
+        records = np.frombuffer(response.content, dtype=FLEET_WIRE_DTYPE)
+        assert records["driver_id"].tolist() == [1, 2]
+        assert client.get("/positions/fleet", params={"min_lat": 55}).status_code == 400
+        assert (
+            client.get("/positions/fleet", params={"status": "parked"}).status_code
+            == 422
+        )
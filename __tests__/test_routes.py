@@ -0,0 +1,218 @@
+"""
+__tests__/test_routes.py
+"""
+
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from project.db.models import Database
+from project.jwt_auth import JWTUser
+from project.routers.internal.routes import router as routes_router
+from project.routes import (
+    RouteTiles,
+    decode_polyline,
+    douglas_peucker_importance,
+    encode_polyline,
+    simplify_route,
+)
+
+DAY = date(2026, 10, 17)
+DAY_START = datetime(2026, 10, 17, tzinfo=timezone.utc).timestamp()
+
+
+def reference_douglas_peucker(x, y, tolerance):
+    """The recursive algorithm of the book (the distance to the segment)."""
+    keep = {0, len(x) - 1}
+
+    def distance(i, a, b):
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        length2 = dx * dx + dy * dy
+        t = 0.0 if length2 == 0 else ((x[i] - x[a]) * dx + (y[i] - y[a]) * dy) / length2
+        t = min(max(t, 0.0), 1.0)
+        return np.hypot(x[i] - x[a] - t * dx, y[i] - y[a] - t * dy)
+
+    def split(a, b):
+        if b - a < 2:
+            return
+        distances = [distance(i, a, b) for i in range(a + 1, b)]
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance:
+            keep.add(a + 1 + farthest)
+            split(a, a + 1 + farthest)
+            split(a + 1 + farthest, b)
+
+    split(0, len(x) - 1)
+    return sorted(keep)
+
+
+def random_trace(count: int, seed: int = 1):
+    random = np.random.default_rng(seed)
+    heading = np.cumsum(random.normal(0, 0.3, count))
+    lat = 55.75 + np.cumsum(np.cos(heading)) * 0.0005
+    lon = 37.61 + np.cumsum(np.sin(heading)) * 0.0008
+    return lat, lon
+
+
+def test_encode_polyline_of_google_example():
+    polyline = encode_polyline(
+        np.array([38.5, 40.7, 43.252]), np.array([-120.2, -120.95, -126.453])
+    )
+    assert polyline == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+    lat, lon = random_trace(500)
+    decoded = np.array(decode_polyline(encode_polyline(lat, lon)))
+    assert np.abs(decoded[:, 0] - lat).max() < 1e-5
+    assert np.abs(decoded[:, 1] - lon).max() < 1e-5
+    assert encode_polyline(np.array([]), np.array([])) == ""
+
+
+def test_importance_matches_recursive_douglas_peucker():
+    random = np.random.default_rng(3)
+    x = np.cumsum(random.normal(0, 1, 400))
+    y = np.cumsum(random.normal(0, 1, 400))
+    importance = douglas_peucker_importance(x, y)
+    for tolerance in (0.5, 2.0, 8.0):
+        assert np.flatnonzero(
+            importance > tolerance
+        ).tolist() == reference_douglas_peucker(x, y, tolerance)
+    # The straight line - only the ends
+    line = np.arange(10.0)
+    assert np.isinf(douglas_peucker_importance(line, line * 2)).sum() == 2
+    assert (douglas_peucker_importance(line, line * 2)[1:-1] == 0).all()
+
+
+def test_simplify_route_zoom_levels_are_nested():
+    lat, lon = random_trace(5000)
+    tiles = simplify_route(lat, lon, range(19))
+    counts = [tiles[zoom].points for zoom in range(19)]
+    assert counts == sorted(counts)
+    assert counts[0] >= 2 and counts[-1] <= 5000
+    coarse = set(decode_polyline(tiles[8].polyline))
+    assert coarse <= set(decode_polyline(tiles[14].polyline))
+
+
+class FakeDatabase:
+    def __init__(self, rows) -> None:
+        self.rows = rows
+        self.calls = 0
+
+    async def select_route_positions(self, driver_id, start, end):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return (
+            [row for row in self.rows if start <= row[0] < end]
+            if driver_id == 7
+            else []
+        )
+
+
+@pytest.mark.asyncio
+async def test_route_tiles_cache_and_process_pool():
+    lat, lon = random_trace(2000)
+    rows = [(DAY_START + i, lat[i], lon[i]) for i in range(2000)]
+    db = FakeDatabase(rows)
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        routes = RouteTiles(db, executor=pool, max_zoom=16)
+        trips = await asyncio.gather(*(routes.trip(7, DAY) for _ in range(5)))
+    assert db.calls == 1
+    assert all(trip is trips[0] for trip in trips)
+    assert trips[0].total == 2000 and set(trips[0].tiles) == set(range(17))
+    assert await routes.trip(7, DAY) is trips[0]
+    assert await routes.trip(8, DAY) is None
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_does_not_cancel_the_other_waiters():
+    lat, lon = random_trace(500)
+    db = FakeDatabase([(DAY_START + i, lat[i], lon[i]) for i in range(500)])
+    routes = RouteTiles(db, max_zoom=12)
+    first = asyncio.ensure_future(routes.trip(7, DAY))
+    second = asyncio.ensure_future(routes.trip(7, DAY))
+    await asyncio.sleep(0)
+    # The client of the request which started the computation has gone
+    first.cancel()
+    trip = await second
+    assert first.cancelled() and trip.total == 500 and db.calls == 1
+    assert await routes.trip(7, DAY) is trip
+    # Nobody waits - the computation is cancelled
+    alone = asyncio.ensure_future(routes.trip(8, DAY))
+    await asyncio.sleep(0)
+    task = routes._pending[(8, DAY)]
+    alone.cancel()
+    await asyncio.sleep(0.02)
+    assert task.cancelled() and not routes._pending and not routes._waiters
+
+
+@pytest.mark.asyncio
+async def test_request_after_the_last_waiter_has_gone_gets_the_trip():
+    lat, lon = random_trace(500)
+    db = FakeDatabase([(DAY_START + i, lat[i], lon[i]) for i in range(500)])
+    routes = RouteTiles(db, max_zoom=12)
+    alone = asyncio.ensure_future(routes.trip(7, DAY))
+    await asyncio.sleep(0)
+    cancelled = routes._pending[(7, DAY)]
+    alone.cancel()
+    await asyncio.sleep(0)
+    # The same key at once - before the done callback of the cancelled computation
+    trip = await routes.trip(7, DAY)
+    assert alone.cancelled() and cancelled.cancelled()
+    assert trip.total == 500 and db.calls == 2
+    assert not routes._pending and not routes._waiters
+
+
+@pytest.mark.asyncio
+async def test_select_route_positions(tmp_path):
+    db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "routes.sqlite3"))
+    await db.bootstrap_schema()
+    await db.bulk_insert_positions(
+        [
+            (7, DAY_START + 10, 55.1, 37.1, 0.0, 0.0),
+            (7, DAY_START - 10, 55.0, 37.0, 0.0, 0.0),
+        ]
+        + [
+            (7, DAY_START + 5, 55.2, 37.2, 0.0, 0.0),
+            (8, DAY_START + 1, 1.0, 1.0, 0.0, 0.0),
+        ]
+    )
+    rows = await db.select_route_positions(7, DAY_START, DAY_START + 86400)
+    await db.engine.dispose()
+    assert rows == [(DAY_START + 5, 55.2, 37.2), (DAY_START + 10, 55.1, 37.1)]
+
+
+def test_route_endpoint():
+    lat, lon = random_trace(3000)
+    app = FastAPI()
+    app.include_router(routes_router)
+    app.state.route_tiles = RouteTiles(
+        FakeDatabase([(DAY_START + i, lat[i], lon[i]) for i in range(3000)]),
+        max_zoom=18,
+    )
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    with TestClient(app) as client:
+        response = client.get("/routes/7/2026-10-17", params={"zoom": 10})
+        assert response.status_code == 200
+        body = response.json()
+        assert body["total_points"] == 3000 and 2 <= body["points"] < 3000
+        assert len(decode_polyline(body["polyline"])) == body["points"]
+        assert response.headers["cache-control"] == "private, max-age=3600"
+        response = client.get(
+            "/routes/7/2026-10-17",
+            params={"zoom": 10},
+            headers={"If-None-Match": response.headers["etag"]},
+        )
+        assert response.status_code == 304
+        assert (
+            client.get("/routes/7/2026-10-17", params={"zoom": 22}).json()["zoom"] == 18
+        )
+        assert client.get("/routes/9/2026-10-17").status_code == 404
+        assert client.get("/routes/7/yesterday").status_code == 422
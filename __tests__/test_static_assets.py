@@ -0,0 +1,108 @@
+"""
+__tests__/test_static_assets.py
+"""
+
+import gzip
+import json
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from project import static_assets as module
+from project.static_assets import PrecompressedStaticFiles, StaticAssets
+
+BUNDLE = ("function map(){return 'truck';}\n" * 200).encode()
+
+
+def make_assets(tmp_path):
+    source = tmp_path / "static"
+    (source / "scripts").mkdir(parents=True)
+    (source / "scripts" / "bundle.js").write_bytes(BUNDLE)
+    (source / "favicon.ico").write_bytes(b"\x00" * 1000)
+    (source / "small.css").write_bytes(b"a{}")
+    return StaticAssets(str(source), str(tmp_path / "build"))
+
+
+def test_build_writes_hashed_and_compressed_files(tmp_path):
+    assets = make_assets(tmp_path)
+    manifest = assets.build()
+    hashed = manifest["scripts/bundle.js"]
+    assert hashed.startswith("scripts/bundle.") and hashed.endswith(".js")
+    assert assets.url("scripts/bundle.js") == "/static/" + hashed
+    assert assets.url("/missing.js") == "/static/missing.js"
+
+    target = os.path.join(assets.build_dir, hashed)
+    with open(target + ".gz", "rb") as file:
+        assert gzip.decompress(file.read()) == BUNDLE
+    # Already compressed format and the small file are not compressed
+    assert assets.assets[manifest["favicon.ico"]].variants == {}
+    assert assets.assets[manifest["small.css"]].variants == {}
+    with open(os.path.join(assets.build_dir, "manifest.json")) as file:
+        assert json.load(file) == manifest
+
+    # The same content - the same name, the changed - the new name
+    assert StaticAssets(assets.directory, assets.build_dir).build() == manifest
+    with open(os.path.join(assets.directory, "scripts", "bundle.js"), "ab") as file:
+        file.write(b"//")
+    assert assets.build()["scripts/bundle.js"] != hashed
+
+
+def test_accept_encoding_negotiation(tmp_path):
+    assets = make_assets(tmp_path)
+    hashed = assets.build()["scripts/bundle.js"]
+    asset = assets.assets[hashed]
+    asset.variants["br"] = ("bundle.js.br", asset.stat_result)
+    assert assets.choose(asset, "gzip, deflate, br")[2] == "br"
+    assert assets.choose(asset, "gzip, br;q=0.5")[2] == "gzip"
+    assert assets.choose(asset, "br;q=0, gzip;q=0")[2] == "identity"
+    assert assets.choose(asset, "*")[2] == "br"
+    assert assets.choose(asset, "")[2] == "identity"
+    assert assets.choose(asset, "deflate")[2] == "identity"
+
+
+def test_static_files_serve_precompressed_immutable(tmp_path):
+    assets = make_assets(tmp_path)
+    manifest = assets.build()
+    app = FastAPI()
+    app.mount("/static", PrecompressedStaticFiles(assets, max_age=3600), name="static")
+    url = assets.url("scripts/bundle.js")
+    target = os.path.join(assets.build_dir, manifest["scripts/bundle.js"])
+    gz_size = os.path.getsize(target + ".gz")
+
+    with TestClient(app) as client:
+        response = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["content-length"] == str(gz_size)
+        assert response.headers["content-type"].startswith("text/javascript")
+        assert response.headers["cache-control"] == "public, max-age=3600, immutable"
+        assert response.headers["vary"] == "Accept-Encoding"
+        # httpx decompresses the body
+        assert response.content == BUNDLE
+
+        plain = client.get(url, headers={"Accept-Encoding": "identity"})
+        assert "content-encoding" not in plain.headers
+        assert plain.headers["content-length"] == str(len(BUNDLE))
+
+        cached = client.get(
+            url,
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["etag"],
+            },
+        )
+        assert cached.status_code == 304
+
+        # The path without hash - as 'StaticFiles', without 'immutable'
+        source = client.get("/static/scripts/bundle.js")
+        assert source.status_code == 200
+        assert "immutable" not in source.headers.get("cache-control", "")
+        assert client.get("/static/missing.js").status_code == 404
+
+
+def test_build_without_brotli(tmp_path, monkeypatch):
+    monkeypatch.setattr(module, "brotli", None)
+    assets = make_assets(tmp_path)
+    hashed = assets.build()["scripts/bundle.js"]
+    assert set(assets.assets[hashed].variants) == {"gzip"}
@@ -0,0 +1,98 @@
+"""
+__tests__/test_templating.py
+"""
+
+import os
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+from project.templating import CachedTemplates, etag_matches
+
+
+def make_app(directory, bytecode_cache_dir=""):
+    templates = CachedTemplates(
+        directory=str(directory),
+        bytecode_cache_dir=bytecode_cache_dir,
+        check_interval=0,
+    )
+    app = FastAPI()
+
+    @app.get("/")
+    async def page(request: Request):
+        return templates.cached_response(request, "page.html", {"title": "First"})
+
+    @app.get("/users/{name}")
+    async def user(request: Request, name: str):
+        return templates.cached_response(
+            request, "page.html", {"title": name}, key=name
+        )
+
+    return app, templates
+
+
+def write_templates(directory, footer="v1"):
+    (directory / "layout.html").write_text(
+        "<title>{{ title }}</title>{% block body %}{% endblock %}" + footer
+    )
+    (directory / "page.html").write_text(
+        '{% extends "layout.html" %}{% block body %}Hallo{% endblock %}'
+    )
+
+
+def test_etag_matches():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches('"a"', '"b"')
+    assert not etag_matches("", '"b"')
+
+
+def test_page_is_cached_and_revalidated(tmp_path):
+    write_templates(tmp_path)
+    app, templates = make_app(tmp_path)
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.status_code == 200
+        assert response.text == "<title>First</title>Hallov1"
+        etag = response.headers["etag"]
+        assert etag.startswith('"') and not etag.startswith("W/")
+        assert response.headers["cache-control"] == "no-cache"
+
+        not_modified = client.get("/", headers={"If-None-Match": etag})
+        assert not_modified.status_code == 304
+        assert not_modified.content == b""
+        assert not_modified.headers["etag"] == etag
+
+        # The keyed context - the page per key
+        assert client.get("/users/ann").text == "<title>ann</title>Hallov1"
+        assert client.get("/users/bob").headers["etag"] != etag
+        assert templates.pages.stats.hits >= 1
+        assert len(templates.pages) == 3
+
+
+def test_changed_parent_template_drops_cache(tmp_path):
+    write_templates(tmp_path)
+    app, _ = make_app(tmp_path)
+    with TestClient(app) as client:
+        etag = client.get("/").headers["etag"]
+        layout = tmp_path / "layout.html"
+        write_templates(tmp_path, footer="v2")
+        stat = layout.stat()
+        # The mtime is changed even on the file systems with the coarse time
+        os.utime(layout, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        response = client.get("/", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.text == "<title>First</title>Hallov2"
+        assert response.headers["etag"] != etag
+
+
+def test_precompile_writes_bytecode_cache(tmp_path):
+    directory = tmp_path / "templates"
+    directory.mkdir()
+    write_templates(directory)
+    cache_dir = tmp_path / "bytecode"
+    _, templates = make_app(directory, str(cache_dir))
+    assert templates.precompile() == 2
+    assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import text
+
+from project.db.models import Database
+from project.db.profiles import EngineProfile, sqlite_performance_profile
+
+
+class TestEngineProfile:
+
+    @pytest.mark.asyncio
+    async def test_performance_profile_applies_pragmas(self, tmp_path) -> None:
+        db = Database(
+            "sqlite+aiosqlite:///%s" % (tmp_path / "profile.sqlite3"),
+            profile=sqlite_performance_profile(busy_timeout=7000),
+        )
+        db.init_engine()
+        assert db.engine.echo is False
+        async with db.engine.connect() as conn:
+            journal_mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+            synchronous = (await conn.execute(text("PRAGMA synchronous"))).scalar()
+            busy_timeout = (await conn.execute(text("PRAGMA busy_timeout"))).scalar()
+            temp_store = (await conn.execute(text("PRAGMA temp_store"))).scalar()
+        assert journal_mode == "wal"
+        # NORMAL
+        assert synchronous == 1
+        assert busy_timeout == 7000
+        # MEMORY
+        assert temp_store == 2
+        await db.engine.dispose()
+
+    def test_default_profile_keeps_old_engine_options(self) -> None:
+        # Without SQL echo - the statements are measured by 'QueryProfiler'
+        assert EngineProfile().engine_kwargs() == {
+            "echo": False,
+            "pool_size": 5,
+            "max_overflow": 10,
+            "pool_timeout": 30.0,
+        }
@@ -0,0 +1,112 @@
+"""
+__tests__/tests_models/test_fleet_state.py
+"""
+
+import time
+
+import numpy as np
+import pytest
+
+from project.db.models import (
+    FLEET_STATUS_MOVING,
+    FLEET_STATUS_STOPPED,
+    FLEET_WIRE_DTYPE,
+    Database,
+    FleetState,
+)
+
+NOW = time.time()
+
+
+def random_rows(count: int, seed: int = 1):
+    generator = np.random.default_rng(seed)
+    return [
+        (
+            driver_id,
+            NOW - float(generator.uniform(0, 900)),
+            float(generator.uniform(40.0, 70.0)),
+            float(generator.uniform(-180.0, 180.0)),
+            float(generator.choice([0.0, 1.0, 45.0, 90.0])),
+            float(generator.uniform(0, 360)),
+        )
+        for driver_id in range(1, count + 1)
+    ]
+
+
+class TestFleetState:
+
+    def test_update_keeps_newest_and_reuses_slots(self) -> None:
+        fleet = FleetState(capacity=2)
+        rows = [
+            (7, 100.0, 55.0, 37.0, 50.0, 90.0),
+            (8, 100.0, 10.0, 10.0, 0.0, 0.0),
+            # The same truck in the batch - the newest row
+            (7, 90.0, 1.0, 1.0, 1.0, 1.0),
+            (9, 50.0, 0.0, 179.5, 5.0, 5.0),
+        ]
+        assert fleet.update_many(rows) == 3
+        assert len(fleet) == 3 and fleet.capacity >= 3
+        assert fleet.get(7) == (7, 100.0, 55.0, 37.0, 50.0, 90.0)
+        # The older report doesn't replace the newer
+        assert fleet.update_many([(7, 80.0, 2.0, 2.0, 0.0, 0.0)]) == 0
+        assert fleet.get(7)[2:4] == (55.0, 37.0)
+        slot = int(fleet.slots_of([8])[0])
+        assert fleet.remove_many([8, 100]) == 1
+        assert fleet.get(8) is None and len(fleet) == 2
+        # The new truck gets the free slot, the arrays are not grown
+        size = fleet.size
+        fleet.update_many([(11, 1.0, 1.0, 1.0, 1.0, 1.0)])
+        assert int(fleet.slots_of([11])[0]) == slot and fleet.size == size
+        assert fleet.slots_of([7, 8, 9, 11]).tolist()[1] == -1
+        assert sorted(fleet.ids().tolist()) == [7, 9, 11]
+
+    def test_bulk_queries_match_full_scan(self) -> None:
+        rows = random_rows(5000)
+        fleet = FleetState()
+        fleet.update_many(rows)
+        fleet.remove_many(range(1, 5001, 7))
+        rows = [row for row in rows if (row[0] - 1) % 7]
+        stale = fleet.ids(fleet.stale(300.0, now=NOW))
+        assert set(stale.tolist()) == {row[0] for row in rows if row[1] < NOW - 300.0}
+        # Over the antimeridian
+        region = fleet.ids(fleet.in_region(50.0, 170.0, 60.0, -170.0))
+        assert set(region.tolist()) == {
+            row[0] for row in rows if 50.0 <= row[2] <= 60.0 and abs(row[3]) >= 170.0
+        }
+        stopped = fleet.with_status(FLEET_STATUS_STOPPED)
+        assert set(fleet.ids(stopped).tolist()) == {
+            row[0] for row in rows if row[4] < 3.0
+        }
+        assert (fleet.with_status(FLEET_STATUS_MOVING) | stopped).sum() == len(rows)
+        mask = fleet.stale(300.0, now=NOW) & stopped
+        records = np.frombuffer(fleet.to_records(mask), dtype=FLEET_WIRE_DTYPE)
+        assert records["driver_id"].tolist() == sorted(fleet.ids(mask).tolist())
+        # The pages in the order of ids
+        pages = [fleet.columns(mask, limit=100)]
+        while len(pages[-1]["driver_id"]) == 100:
+            pages.append(
+                fleet.columns(mask, limit=100, after=int(pages[-1]["driver_id"][-1]))
+            )
+        paged = np.concatenate([page["driver_id"] for page in pages])
+        assert paged.tolist() == records["driver_id"].tolist()
+        assert (records["speed"] < 3.0).all() and (
+            records["recorded_at"] < NOW - 300.0
+        ).all()
+
+    @pytest.mark.asyncio
+    async def test_hydrated_from_latest_positions(self, tmp_path) -> None:
+        url = "sqlite+aiosqlite:///%s" % (tmp_path / "fleet.sqlite3")
+        db = Database(url)
+        await db.bootstrap_schema()
+        rows = random_rows(300)
+        await db.bulk_insert_positions(rows)
+        assert len(db.fleet) == 300
+        # The other worker at the startup
+        other = Database(url, fleet_capacity=16)
+        assert await other.sync_spatial_index() == 300
+        for row in rows[::37]:
+            expected = other.fleet.get(row[0])
+            assert expected[:4] == row[:4]
+            assert expected[4:] == pytest.approx(row[4:], abs=1e-4)
+        await db.engine.dispose()
+        await other.engine.dispose()
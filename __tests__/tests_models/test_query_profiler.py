@@ -0,0 +1,136 @@
+"""
+__tests__/tests_models/test_query_profiler.py
+"""
+
+import logging
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from project.db.models import Database
+from project.db.profiler import QueryProfiler, QueryProfilerMiddleware, fingerprint
+from project.jwt_auth import JWTUser
+from project.routers.internal.admin import router as admin_router
+
+
+def test_fingerprint_drops_literals_and_in_lists():
+    assert (
+        fingerprint(
+            "SELECT *  FROM session\n WHERE id IN (?, ?, ?) AND name = 'o''k' AND n > 10.5"
+        )
+        == "SELECT * FROM session WHERE id IN (?+) AND name = ? AND n > ?"
+    )
+    assert fingerprint("SELECT * FROM t WHERE id IN ($1, $2)") == fingerprint(
+        "SELECT * FROM t WHERE id IN ($1, $2, $3, $4)"
+    )
+    assert fingerprint("SELECT * FROM t WHERE id IN (__[POSTCOMPILE_id_1])") == (
+        "SELECT * FROM t WHERE id IN (?+)"
+    )
+    # The names of tables and columns are kept
+    assert fingerprint("SELECT col1 FROM t2") == "SELECT col1 FROM t2"
+
+
+def test_aggregates_and_slow_log(caplog):
+    profiler = QueryProfiler(slow_threshold=0.05)
+    for elapsed in (0.001, 0.002, 0.003, 0.1):
+        profiler.record("SELECT * FROM session WHERE id = 1", elapsed)
+    profiler.record("SELECT 1", 0.0001)
+    with caplog.at_level(logging.WARNING, logger="project.db.profiler"):
+        profiler.record("SELECT * FROM session WHERE id = 2", 0.06)
+
+    rows = profiler.report()
+    assert [row["fingerprint"] for row in rows] == [
+        "SELECT * FROM session WHERE id = ?",
+        "SELECT ?",
+    ]
+    row = rows[0]
+    assert row["count"] == 5
+    assert row["slow"] == 2
+    assert row["max_ms"] == 100.0
+    assert row["p50_ms"] == 3.0
+    assert row["p95_ms"] == 100.0
+    assert "slow query 60.0 ms: SELECT * FROM session WHERE id = ?" in caplog.text
+
+    assert profiler.report(limit=1, order_by="count")[0]["count"] == 5
+    profiler.reset()
+    assert profiler.report() == []
+
+
+def test_n_plus_one_is_flagged_per_request():
+    profiler = QueryProfiler(n_plus_one_threshold=3)
+    token = profiler.start_request()
+    for user_id in range(3):
+        profiler.record("SELECT * FROM session WHERE id = %d" % user_id, 0.001)
+    profiler.record("SELECT 1", 0.001)
+    flagged = profiler.finish_request(token, "GET /drivers")
+    assert flagged == {"SELECT * FROM session WHERE id = ?": 3}
+    assert profiler.report(order_by="n_plus_one")[0]["n_plus_one"] == 1
+
+    # Outside of request the statements are not counted
+    profiler.record("SELECT * FROM session WHERE id = 5", 0.001)
+    token = profiler.start_request()
+    assert profiler.finish_request(token) == {}
+
+
+@pytest.mark.asyncio
+async def test_profiler_measures_engine_statements(tmp_path):
+    profiler = QueryProfiler(n_plus_one_threshold=5)
+    db = Database(
+        "sqlite+aiosqlite:///%s" % (tmp_path / "profiler.sqlite3"), profiler=profiler
+    )
+    db.init_engine()
+    assert db.engine.echo is False
+    token = profiler.start_request()
+    async with db.engine.connect() as conn:
+        for value in range(5):
+            await conn.execute(text("SELECT :value"), {"value": value})
+        with pytest.raises(Exception):
+            await conn.execute(text("SELECT * FROM missing_table"))
+        await conn.execute(text("SELECT 1"))
+    flagged = profiler.finish_request(token, "test")
+    await db.engine.dispose()
+
+    # ':value' is '?' of the sqlite dialect and 'SELECT 1' has the literal - the same fingerprint
+    assert flagged == {"SELECT ?": 6}
+    rows = {row["fingerprint"]: row for row in profiler.report()}
+    assert rows["SELECT ?"]["count"] == 6
+    assert "SELECT * FROM missing_table" not in rows
+
+
+def _app(profiler, user=None):
+    app = FastAPI()
+    app.include_router(admin_router)
+    app.state.query_profiler = profiler
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = user
+        return await call_next(request)
+
+    if profiler is not None:
+        app.add_middleware(QueryProfilerMiddleware, profiler=profiler)
+    return app
+
+
+def test_admin_queries_endpoint():
+    profiler = QueryProfiler()
+    profiler.record("SELECT * FROM session WHERE id = 1", 0.002)
+    admin = JWTUser(id=1, is_staff=True, is_superuser=True)
+
+    with TestClient(_app(profiler)) as client:
+        assert client.get("/admin/queries").status_code == 401
+    with TestClient(_app(profiler, JWTUser(id=2))) as client:
+        assert client.get("/admin/queries").status_code == 403
+    with TestClient(_app(profiler, admin)) as client:
+        response = client.get("/admin/queries", params={"order_by": "max_ms"})
+        assert response.status_code == 200
+        assert response.json()["queries"][0]["fingerprint"] == (
+            "SELECT * FROM session WHERE id = ?"
+        )
+        assert client.get("/admin/queries", params={"order_by": "x"}).status_code == 422
+        assert client.delete("/admin/queries").status_code == 204
+        assert client.get("/admin/queries").json() == {"queries": []}
+    with TestClient(_app(None, admin)) as client:
+        assert client.get("/admin/queries").status_code == 404
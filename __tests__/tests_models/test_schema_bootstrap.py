@@ -0,0 +1,136 @@
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+from project.db.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION_TABLE,
+    current_version,
+    latest_version,
+)
+from project.db.models import Base, Database
+from project.db.profiles import sqlite_performance_profile
+
+# The tables and indexes of models; the R*Tree of SQLite is not in the models
+SCHEMA_SQL = (
+    "SELECT type, name, sql FROM sqlite_master WHERE type IN ('table', 'index') "
+    "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'latest_positions_rtree%' "
+    "AND name != 'schema_version' ORDER BY name"
+)
+
+
+class TestSchemaBootstrap:
+
+    @pytest.mark.asyncio
+    async def test_bootstrap_is_idempotent(self, tmp_path) -> None:
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "schema.sqlite3"))
+        db.init_engine()
+        assert await db.bootstrap_schema() == latest_version()
+        # The schema is current - no DDL
+        assert await db.bootstrap_schema() == 0
+        async with db.engine.connect() as conn:
+            assert await current_version(conn) == latest_version()
+        await db.engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_bootstrap_adopts_database_without_version(self, tmp_path) -> None:
+        """The database created by 'create_all' before the versioning."""
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "old.sqlite3"))
+        db.init_engine()
+        await db.table_exists_create()
+        assert await db.bootstrap_schema() == latest_version()
+        async with db.engine.connect() as conn:
+            rows = (
+                await conn.execute(text("SELECT * FROM %s" % SCHEMA_VERSION_TABLE))
+            ).fetchall()
+        assert rows == [(1, latest_version())]
+        await db.engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_bootstrap_of_workers_started_at_once(self, tmp_path) -> None:
+        url = "sqlite+aiosqlite:///%s" % (tmp_path / "workers.sqlite3")
+        workers = [
+            Database(url, profile=sqlite_performance_profile()) for _ in range(4)
+        ]
+        for db in workers:
+            db.init_engine()
+        applied = await asyncio.gather(*(db.bootstrap_schema() for db in workers))
+        assert sum(applied) == latest_version()
+        async with workers[0].engine.connect() as conn:
+            tables = (
+                (
+                    await conn.execute(
+                        text("SELECT name FROM sqlite_master WHERE type='table'")
+                    )
+                )
+                .scalars()
+                .all()
+            )
+        assert set(Base.metadata.tables) <= set(tables)
+        for db in workers:
+            await db.engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_every_migration_creates_only_its_objects(self, tmp_path) -> None:
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "steps.sqlite3"))
+        db.init_engine()
+        created = []
+        async with db.engine.begin() as conn:
+            for migration in MIGRATIONS:
+                before = set((await conn.execute(text(SCHEMA_SQL))).scalars(1).all())
+                await conn.run_sync(migration.upgrade)
+                after = set((await conn.execute(text(SCHEMA_SQL))).scalars(1).all())
+                created.append(after - before)
+        await db.engine.dispose()
+        assert created[0] == {"session"}
+        assert created[1] == {"ix_session_expires_at"}
+        assert created[2] == {"positions", "ix_positions_driver_id_recorded_at"}
+        assert created[3] == {"latest_positions", "ix_latest_positions_updated_at"}
+
+    @pytest.mark.asyncio
+    async def test_frozen_migrations_match_models(self, tmp_path) -> None:
+        """The schema of all migrations is the schema of 'create_all' of the current models."""
+        migrated = Database("sqlite+aiosqlite:///%s" % (tmp_path / "migrated.sqlite3"))
+        await migrated.bootstrap_schema()
+        created = Database("sqlite+aiosqlite:///%s" % (tmp_path / "created.sqlite3"))
+        created.init_engine()
+        async with created.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        schemas = []
+        for db in (migrated, created):
+            async with db.engine.connect() as conn:
+                schemas.append((await conn.execute(text(SCHEMA_SQL))).all())
+            await db.engine.dispose()
+        assert schemas[0] == schemas[1]
+
+    @pytest.mark.asyncio
+    async def test_auto_vacuum_is_checked_at_every_bootstrap(self, tmp_path) -> None:
+        """The failed or skipped VACUUM does not stop the startup; the next start sets it."""
+        path = tmp_path / "vacuum.sqlite3"
+        db = Database(
+            "sqlite+aiosqlite:///%s" % path,
+            profile=sqlite_performance_profile(busy_timeout=50),
+        )
+
+        async def auto_vacuum() -> int:
+            async with db.engine.connect() as conn:
+                return (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+
+        # The file above the limit is not VACUUMed at startup
+        assert await db.bootstrap_schema(vacuum_max_bytes=0) == latest_version()
+        assert await auto_vacuum() == 0
+        # The other worker holds the lock - VACUUM fails, the startup does not
+        other = sqlite3.connect(path, timeout=0)
+        other.execute("BEGIN IMMEDIATE")
+        try:
+            assert await db.bootstrap_schema() == 0
+        finally:
+            other.rollback()
+            other.close()
+        assert await auto_vacuum() == 0
+        # The schema is current, the mode is set anyway
+        assert await db.bootstrap_schema() == 0
+        assert await auto_vacuum() == 2
+        await db.engine.dispose()
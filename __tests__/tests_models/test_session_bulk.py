@@ -0,0 +1,60 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+from uuid_extensions import uuid7
+
+from project.db.models import (
+    BaseSession,
+    Database,
+    SessionUserModel,
+    validate_session_ids,
+)
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+class TestSessionBulk:
+
+    def test_validate_session_ids_batched(self) -> None:
+        valid = [str(uuid7()) for _ in range(3)]
+        assert validate_session_ids(valid) == valid
+        with pytest.raises(ValueError):
+            validate_session_ids(valid + ["061cb8fe-0f0b-7c39-8003 d44a7ee0bdf6"])
+        with pytest.raises(ValueError):
+            validate_session_ids(["061cb8fe-0f0b"])
+
+    @pytest.mark.asyncio
+    async def test_bulk_create_touch_upsert(self, tmp_path) -> None:
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "bulk.sqlite3"))
+        db.init_engine()
+        await db.table_exists_create()
+        session_ids = [str(uuid7()) for _ in range(1200)]
+
+        assert await db.bulk_create_sessions(session_ids) == 1200
+        # The hot session is in the cache
+        assert await db.is_session_valid(session_ids[0])
+
+        assert await db.bulk_touch(session_ids, lifetime=timedelta(hours=3)) == 1200
+        cached = db.sessions.get(session_ids[0])
+        assert cached.expires_at > datetime.now() + timedelta(hours=2)
+
+        new_id = str(uuid7())
+        expired = datetime.now() - timedelta(seconds=1)
+        await db.bulk_upsert(
+            [
+                BaseSession(session_id=session_ids[1], expires_at=expired),
+                {"session_id": new_id},
+            ]
+        )
+        async with db.engine.connect() as conn:
+            count = (
+                await conn.execute(select(func.count()).select_from(SessionUserModel))
+            ).scalar()
+        assert count == 1201
+        assert not await db.is_session_valid(session_ids[1])
+        assert await db.is_session_valid(new_id)
+        await db.engine.dispose()
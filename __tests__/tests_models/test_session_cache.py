@@ -0,0 +1,61 @@
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from uuid_extensions import uuid7
+
+from project.db.models import BaseSession, Database, SessionCache
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+class TestSessionCache:
+
+    def test_session_cache_expires_at_expires_at(self) -> None:
+        cache = SessionCache(maxsize=2)
+        session_id = str(uuid7())
+        cache.put(
+            BaseSession(
+                session_id=session_id,
+                created_at=datetime.now(),
+                expires_at=datetime.now() - timedelta(seconds=1),
+            )
+        )
+        # Expired session is not cached
+        assert cache.get(session_id) is None
+        for _ in range(3):
+            cache.put(
+                BaseSession(
+                    session_id=str(uuid7()),
+                    expires_at=datetime.now() + timedelta(hours=1),
+                )
+            )
+        assert cache.info()["size"] == 2
+        assert cache.info()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_database_read_through_and_invalidation(self, tmp_path) -> None:
+        """
+        1) create_session - write-through, the check costs no DB round-trip;
+        2) invalidation - the next check reads the table;
+        3) delete_session - the session is not valid anymore.
+        """
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "session.sqlite3"))
+        db.init_engine()
+        await db.table_exists_create()
+        session_id = str(uuid7())
+
+        await db.create_session(session_id)
+        assert await db.is_session_valid(session_id)
+        assert db.sessions.info()["hits"] == 1
+        assert db.sessions.info()["misses"] == 0
+
+        db.invalidate_session(session_id)
+        assert await db.is_session_valid(session_id)
+        assert db.sessions.info()["misses"] == 1
+
+        await db.delete_session(session_id)
+        assert not await db.is_session_valid(session_id)
+        await db.engine.dispose()
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select, text
+from uuid_extensions import uuid7
+
+from project.db.models import Database, SessionUserModel
+from project.db.reaper import SessionReaper
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+class TestSessionReaper:
+
+    @pytest.mark.asyncio
+    async def test_reaper_deletes_expired_by_batches(self, tmp_path) -> None:
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "reaper.sqlite3"))
+        db.init_engine()
+        await db.table_exists_create()
+        await db.ensure_indexes()
+        past = datetime.now() - timedelta(minutes=1)
+        for _ in range(7):
+            await db.create_session(str(uuid7()), expires_at=past)
+        alive = await db.create_session(str(uuid7()))
+
+        reaper = SessionReaper(db, batch_size=3, vacuum_every=1)
+        assert await reaper.run_once() == 7
+        assert await reaper.run_once() == 0
+        async with db.engine.connect() as conn:
+            count = (
+                await conn.execute(select(func.count()).select_from(SessionUserModel))
+            ).scalar()
+            indexes = (
+                await conn.execute(text("PRAGMA index_list('session')"))
+            ).fetchall()
+        assert count == 1
+        assert await db.is_session_valid(alive.session_id)
+        assert "ix_session_expires_at" in [index[1] for index in indexes]
+        await db.engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_vacuum_is_incremental_after_migration(self, tmp_path) -> None:
+        db = Database("sqlite+aiosqlite:///%s" % (tmp_path / "vacuum.sqlite3"))
+        await db.bootstrap_schema()
+        await db.bulk_create_sessions(
+            [str(uuid7()) for _ in range(3000)], lifetime=timedelta(minutes=-1)
+        )
+        reaper = SessionReaper(db, batch_size=1000, vacuum_pages=5)
+        assert await reaper.run_once() == 3000
+
+        async def pragma(name: str) -> int:
+            async with db.engine.connect() as conn:
+                return (await conn.execute(text("PRAGMA %s" % name))).scalar()
+
+        assert await pragma("auto_vacuum") == 2
+        free = await pragma("freelist_count")
+        assert free > 10
+        # Only 'vacuum_pages' pages by the one trim - not the full VACUUM
+        await reaper.vacuum()
+        assert await pragma("freelist_count") == free - 5
+        await db.engine.dispose()
+
+    @pytest.mark.asyncio
+    async def test_run_survives_any_error(self) -> None:
+        class BrokenReaper(SessionReaper):
+            async def run_once(self) -> int:
+                self.passes += 1
+                raise RuntimeError("not a database error")
+
+        reaper = BrokenReaper(Database("sqlite+aiosqlite:///:memory:"), interval=0.01)
+        reaper.start()
+        await asyncio.sleep(0.1)
+        assert reaper.passes > 1 and not reaper._task.done()
+        await reaper.stop()
@@ -0,0 +1,120 @@
+"""
+__tests__/tests_models/test_spatial_index.py
+"""
+
+import random
+import time
+
+import pytest
+from sqlalchemy import text
+
+from project.db.models import Database
+from project.db.spatial import SpatialGridIndex, haversine_km
+
+NOW = time.time()
+
+
+def random_points(count: int, seed: int = 1):
+    generator = random.Random(seed)
+    return [
+        (driver_id, generator.uniform(40.0, 70.0), generator.uniform(20.0, 60.0))
+        for driver_id in range(1, count + 1)
+    ]
+
+
+def brute_nearest(points, lat, lon, k):
+    distances = sorted(
+        (haversine_km(lat, lon, p_lat, p_lon), i) for i, p_lat, p_lon in points
+    )
+    return [driver_id for _, driver_id in distances[:k]]
+
+
+class TestSpatialGridIndex:
+
+    def test_nearest_and_bbox_match_full_scan(self) -> None:
+        points = random_points(5000)
+        index = SpatialGridIndex(cell_size=0.5)
+        for driver_id, lat, lon in points:
+            index.upsert(driver_id, lat, lon, NOW)
+        for lat, lon in ((55.75, 37.61), (40.0, 20.0), (69.9, 59.9), (10.0, 0.0)):
+            found = [driver_id for driver_id, _ in index.nearest(lat, lon, k=10)]
+            assert found == brute_nearest(points, lat, lon, 10)
+        expected = {
+            driver_id
+            for driver_id, lat, lon in points
+            if 50.0 <= lat <= 52.5 and 30.0 <= lon <= 33.3
+        }
+        assert set(index.bbox(50.0, 30.0, 52.5, 33.3)) == expected
+        # The viewport larger than the occupied area
+        assert len(index.bbox(-90.0, -180.0, 90.0, 180.0)) == 5000
+        assert len(index.bbox(-90.0, -180.0, 90.0, 180.0, limit=7)) == 7
+        assert index.nearest(55.0, 37.0, k=5, max_km=0.001) == []
+
+    def test_antimeridian(self) -> None:
+        index = SpatialGridIndex(cell_size=1.0)
+        index.upsert(1, 65.0, 179.9)
+        index.upsert(2, 65.0, -179.9)
+        index.upsert(3, 65.0, 170.0)
+        assert sorted(index.bbox(60.0, 179.0, 70.0, -179.0)) == [1, 2]
+        assert [driver_id for driver_id, _ in index.nearest(65.0, -179.95, k=2)] == [
+            2,
+            1,
+        ]
+
+    def test_upsert_moves_and_ignores_older(self) -> None:
+        index = SpatialGridIndex(cell_size=0.25)
+        assert index.upsert(7, 55.0, 37.0, recorded_at=100.0)
+        assert index.upsert(7, 59.9, 30.3, recorded_at=200.0)
+        assert not index.upsert(7, 10.0, 10.0, recorded_at=150.0)
+        assert index.position(7) == (59.9, 30.3, 200.0)
+        assert index.bbox(54.0, 36.0, 56.0, 38.0) == []
+        assert len(index.cells) == 1
+        index.remove(7)
+        assert len(index) == 0 and not index.cells
+
+
+class TestDatabaseSpatial:
+
+    @pytest.mark.asyncio
+    async def test_latest_positions_and_rtree(self, tmp_path) -> None:
+        url = "sqlite+aiosqlite:///%s" % (tmp_path / "spatial.sqlite3")
+        db = Database(url)
+        await db.bootstrap_schema()
+        points = random_points(600)
+        rows = [(i, NOW - 60, lat, lon, 50.0, 90.0) for i, lat, lon in points]
+        # The older report in the later batch doesn't move the truck back
+        rows += [
+            (1, NOW, 55.75, 37.61, 10.0, 0.0),
+            (1, NOW - 120, 45.0, 45.0, 10.0, 0.0),
+        ]
+        await db.bulk_insert_positions(rows)
+        points[0] = (1, 55.75, 37.61)
+
+        assert db.spatial.position(1) == (55.75, 37.61, NOW)
+        found = await db.select_trucks_in_bbox(50.0, 30.0, 60.0, 40.0)
+        assert {row[0] for row in found} == set(
+            db.trucks_in_bbox(50.0, 30.0, 60.0, 40.0)
+        )
+        assert {row[0] for row in found} == {
+            i for i, lat, lon in points if 50.0 <= lat <= 60.0 and 30.0 <= lon <= 40.0
+        }
+        nearest = await db.select_nearest_trucks(55.0, 37.0, k=5)
+        assert [row[0] for row, _ in nearest] == brute_nearest(points, 55.0, 37.0, 5)
+        assert [i for i, _ in db.nearest_trucks(55.0, 37.0, k=5)] == [
+            row[0] for row, _ in nearest
+        ]
+
+        # The other worker: all rows at the first sync, then the changed rows
+        other = Database(url)
+        assert await other.sync_spatial_index() == 600
+        assert len(other.spatial) == 600
+        await db.bulk_insert_positions([(2, NOW + 1, 56.0, 38.0, 0.0, 0.0)])
+        assert await other.sync_spatial_index() >= 1
+        assert other.spatial.position(2) == (56.0, 38.0, NOW + 1)
+        async with db.engine.connect() as conn:
+            in_rtree = (
+                await conn.execute(text("SELECT count(*) FROM latest_positions_rtree"))
+            ).scalar()
+        assert in_rtree == 600
+        await db.engine.dispose()
+        await other.engine.dispose()
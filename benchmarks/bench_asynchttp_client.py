@@ -0,0 +1,88 @@
+"""
+benchmarks/bench_asynchttp_client.py
+
+Requests/s of the 'AsyncHttpClient' against a local aiohttp stand-in of the Django backend.
+- "session per call" - the old behavior: new 'aiohttp.ClientSession' (connector, TCP handshake, DNS) \
+on every call;
+- "shared session" - one pooled client per worker.
+Run: `python -m benchmarks.bench_asynchttp_client`
+"""
+
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+from project.asynchttp_client import AsyncHttpClient, HttpRequest, LocalApi
+
+TOTAL = 2000
+CONCURRENCY = 50
+
+
+async def _str_to_binary(request: web.Request) -> web.Response:
+    body = await request.json()
+    return web.json_response(
+        [
+            {"str_to_binary": " ".join(format(ord(c), "b") for c in s)}
+            for s in body["data"]
+        ]
+    )
+
+
+async def start_stand_in() -> tuple[web.AppRunner, str]:
+    app = web.Application()
+    app.router.add_post(LocalApi.STR_TO_BINARY.value, _str_to_binary)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}{LocalApi.STR_TO_BINARY.value}"
+
+
+async def session_per_call(url: str) -> None:
+    async with aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=30)
+    ) as session:
+        async with session.request(
+            HttpRequest.POST.value, url, json={"data": ["Hallo word"]}
+        ) as response:
+            await response.json()
+
+
+async def run(name: str, call) -> None:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            await call()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(TOTAL)))
+    elapsed = time.perf_counter() - start
+    print(
+        "%-20s %8.0f req/s  (%d requests, concurrency %d)"
+        % (name, TOTAL / elapsed, TOTAL, CONCURRENCY)
+    )
+
+
+async def main() -> None:
+    logging.getLogger("project").setLevel(logging.WARNING)
+    runner, url = await start_stand_in()
+    try:
+        await run("session per call", lambda: session_per_call(url))
+        async with AsyncHttpClient(limit_per_host=CONCURRENCY) as client:
+            await run(
+                "shared session",
+                lambda: client.request(
+                    HttpRequest.POST.value, url=url, jsom_data={"data": ["Hallo word"]}
+                ),
+            )
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
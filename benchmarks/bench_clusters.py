@@ -0,0 +1,200 @@
+"""
+benchmarks/bench_clusters.py
+
+TRUCKS latest positions of the whole country (lat 43..68, lon 28..180): most trucks are
+around the hubs, the rest are on the roads between them. The full-country viewport
+(zoom 3 and 4 - 1920x1080 of the screen) of the dispatcher:
+- per request: the grid clustering of all trucks in Python (no index) against 'ClusterIndex'
+  after the pass (the tiles are built again) and with the cached tiles;
+- the same by HTTP ('/clusters', the test client of FastAPI), p50/p99;
+- the pass of the moved trucks ('ClusterIndex.apply') by the share of the moved trucks;
+- the size of the response: one marker per truck against the clusters.
+Run: `python -m benchmarks.bench_clusters`
+"""
+
+import json
+import math
+import random
+import time
+
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from project.clusters import ClusterIndex
+from project.db.spatial import SpatialGridIndex
+from project.jwt_auth import JWTUser
+from project.routers.internal.clusters import router as clusters_router
+from project.routes import TILE_SIZE, mercator_pixels
+
+TRUCKS = 50_000
+HUBS = 40
+COUNTRY = (41.0, 19.0, 72.0, 180.0)
+REQUESTS = 50
+
+
+def random_position(generator: random.Random, hubs):
+    if generator.random() < 0.7:
+        lat, lon = generator.choice(hubs)
+        return lat + generator.gauss(0, 0.3), lon + generator.gauss(0, 0.5)
+    return generator.uniform(43.0, 68.0), generator.uniform(28.0, 180.0)
+
+
+def make_spatial(generator: random.Random, hubs) -> SpatialGridIndex:
+    spatial = SpatialGridIndex(cell_size=0.5)
+    for driver_id in range(1, TRUCKS + 1):
+        spatial.upsert(driver_id, *random_position(generator, hubs), recorded_at=1.0)
+    return spatial
+
+
+def naive_clusters(spatial: SpatialGridIndex, zoom: int, cell_px: int = 64) -> str:
+    """The grid clustering of all trucks per request in Python - without the index."""
+    scale = TILE_SIZE * 2**zoom / cell_px
+    cells = {}
+    for lat, lon, _, _ in spatial.points.values():
+        sin_lat = math.sin(math.radians(lat))
+        y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+        key = (int((lon + 180.0) / 360.0 * scale), int(y * scale))
+        cell = cells.get(key)
+        if cell is None:
+            cells[key] = [1, lat, lon]
+        else:
+            cell[0] += 1
+            cell[1] += lat
+            cell[2] += lon
+    return json.dumps(
+        [
+            {"lat": c[1] / c[0], "lon": c[2] / c[0], "count": c[0]}
+            for c in cells.values()
+        ]
+    )
+
+
+def numpy_clusters(
+    lat: np.ndarray, lon: np.ndarray, zoom: int, cell_px: int = 64
+) -> str:
+    """The same by NumPy over the arrays of all trucks."""
+    x, y = mercator_pixels(lat, lon)
+    scale = 2**zoom / cell_px
+    keys = (x * scale).astype(np.int64) << 32 | (y * scale).astype(np.int64)
+    _, inverse, count = np.unique(keys, return_inverse=True, return_counts=True)
+    lat = np.bincount(inverse, weights=lat) / count
+    lon = np.bincount(inverse, weights=lon) / count
+    return json.dumps(
+        [
+            {"lat": a, "lon": b, "count": c}
+            for a, b, c in zip(lat.tolist(), lon.tolist(), count.tolist())
+        ]
+    )
+
+
+def timed(function, repeat: int):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return (
+        times[len(times) // 2] * 1000,
+        times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+    )
+
+
+def main() -> None:
+    generator = random.Random(1)
+    hubs = [
+        (generator.uniform(44.0, 66.0), generator.uniform(30.0, 170.0))
+        for _ in range(HUBS)
+    ]
+    spatial = make_spatial(generator, hubs)
+    start = time.perf_counter()
+    index = ClusterIndex(spatial, cell_px=64, max_zoom=16, max_tiles=256)
+    print(
+        "%d trucks: 17 levels built in %.0f ms, %d cells"
+        % (
+            TRUCKS,
+            (time.perf_counter() - start) * 1000,
+            sum(len(level.keys) for level in index.levels),
+        )
+    )
+
+    def move(share: float) -> None:
+        for driver_id in generator.sample(range(1, TRUCKS + 1), int(TRUCKS * share)):
+            spatial.upsert(
+                driver_id, *random_position(generator, hubs), recorded_at=2.0
+            )
+
+    print("pass of the moved trucks ('apply'):")
+    for share in (0.001, 0.01, 0.05, 0.2):
+        move(share)
+        start = time.perf_counter()
+        moved = index.apply()
+        elapsed = (time.perf_counter() - start) * 1000
+        print("  %6d moved (%4.1f%%) %10.1f ms" % (moved, share * 100, elapsed))
+
+    lat = np.array([point[0] for point in spatial.points.values()])
+    lon = np.array([point[1] for point in spatial.points.values()])
+    for zoom in (3, 4):
+        tiles = index.viewport(*COUNTRY, zoom=zoom)
+        clusters = sum(tile.count for tile in tiles)
+        print(
+            "full-country viewport, zoom %d: %d tiles, %d clusters"
+            % (zoom, len(tiles), clusters)
+        )
+        naive = timed(lambda: naive_clusters(spatial, zoom), 3)[0]
+        print("  %-36s %9.2f ms" % ("per request, all trucks (Python)", naive))
+        vector = timed(lambda: numpy_clusters(lat, lon, zoom), 10)[0]
+        print("  %-36s %9.2f ms" % ("per request, all trucks (NumPy)", vector))
+
+        def after_pass():
+            index.passes += 1
+            index.viewport(*COUNTRY, zoom=zoom)
+
+        p50, p99 = timed(after_pass, REQUESTS)
+        print(
+            "  %-36s %9.2f ms p50 %9.2f ms p99"
+            % ("ClusterIndex, tiles built again", p50, p99)
+        )
+        p50, p99 = timed(lambda: index.viewport(*COUNTRY, zoom=zoom), REQUESTS * 10)
+        print(
+            "  %-36s %9.2f ms p50 %9.2f ms p99"
+            % ("ClusterIndex, cached tiles", p50, p99)
+        )
+
+    app = FastAPI()
+    app.include_router(clusters_router)
+    app.state.clusters = index
+
+    @app.middleware("http")
+    async def set_user(request, call_next):
+        request.scope["user"] = JWTUser(id=1)
+        return await call_next(request)
+
+    params = dict(zip(("min_lat", "min_lon", "max_lat", "max_lon"), COUNTRY), zoom=4)
+    with TestClient(app) as client:
+        body = client.get("/clusters", params=params).content
+        markers = json.dumps(
+            [
+                {"lat": round(p[0], 6), "lon": round(p[1], 6), "driver_id": driver_id}
+                for driver_id, p in spatial.points.items()
+            ]
+        )
+        print("HTTP /clusters, zoom 4 (the test client, in-process):")
+
+        def request_after_pass():
+            index.passes += 1
+            client.get("/clusters", params=params)
+
+        p50, p99 = timed(request_after_pass, REQUESTS)
+        print("  %-36s %9.2f ms p50 %9.2f ms p99" % ("tiles built again", p50, p99))
+        p50, p99 = timed(lambda: client.get("/clusters", params=params), REQUESTS * 4)
+        print("  %-36s %9.2f ms p50 %9.2f ms p99" % ("cached tiles", p50, p99))
+        print(
+            "  response: %d bytes of clusters against %d bytes of markers"
+            % (len(body), len(markers))
+        )
+
+
+if __name__ == "__main__":
+    main()
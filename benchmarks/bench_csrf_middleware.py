@@ -0,0 +1,140 @@
+"""
+benchmarks/bench_csrf_middleware.py
+
+Overhead of the CSRF middleware per request: the old 'BaseHTTPMiddleware' version (the copy
+below) against the pure ASGI 'project.middlewares.CustomHeaderMiddleware'.
+The requests are sent to the ASGI app directly - no server and no network.
+Run: `python -m benchmarks.bench_csrf_middleware`
+"""
+
+import asyncio
+import secrets
+import time
+
+from fastapi import HTTPException, Request, status
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from project.middlewares import CustomHeaderMiddleware, settings
+
+REQUESTS = 20000
+SECRET_KEY = "0199a1b2-c3d4-7e5f-8a9b-0c1d2e3f4a5b"
+
+
+class LegacyCustomHeaderMiddleware(BaseHTTPMiddleware):
+    """'CustomHeaderMiddleware' before the rewrite."""
+
+    def __init__(self, app, secret_key: str, cookie_name: str = "csrf_token") -> None:
+        super().__init__(app)
+        self.secret_key = secret_key
+        self.cookie_name = cookie_name
+
+    async def dispatch(self, request: Request, call_next):
+        if request.method in settings.ALLOWED_METHODS[:4]:
+            if not request.cookies.get(self.cookie_name):
+                response = await call_next(request)
+                csrf_token = "".join(
+                    [
+                        self.secret_key.replace("-", ""),
+                        "Bearer",
+                        secrets.token_urlsafe(32),
+                    ]
+                )
+                response.set_cookie(
+                    key=self.cookie_name,
+                    value=csrf_token,
+                    httponly=False,
+                    samesite=settings.CSRF_COOKIE_SAMESITE,
+                    secure=settings.CSRF_COOKIE_SECURE,
+                    max_age=settings.CSRF_COOKIE_MAX_AGE,
+                )
+                return response
+            return await call_next(request)
+        elif request.method in settings.ALLOWED_METHODS[4:]:
+            csrf_header = request.headers.get("X-CSRF-Token").split("Bearer")[0]
+            if not csrf_header or csrf_header != self.secret_key.replace("-", ""):
+                raise HTTPException(
+                    status_code=status.HTTP_403_FORBIDDEN, detail="Invalid CSRF Token"
+                )
+            return await call_next(request)
+        return await call_next(request)
+
+
+async def endpoint(scope, receive, send) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        }
+    )
+    await send({"type": "http.response.body", "body": b'{"data":"ok"}'})
+
+
+def make_scope(method: str, headers) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": "/",
+        "raw_path": b"/",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 5000),
+        "server": ("testserver", 80),
+    }
+
+
+async def receive() -> dict:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message) -> None:
+    pass
+
+
+async def run(app, scope) -> float:
+    # Warm up
+    for _ in range(200):
+        await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+async def main() -> None:
+    legacy_token = "%sBearer%s" % (
+        SECRET_KEY.replace("-", ""),
+        secrets.token_urlsafe(32),
+    )
+    middleware = CustomHeaderMiddleware(endpoint, secret_keys=[SECRET_KEY])
+    token = middleware.new_token()
+    legacy = LegacyCustomHeaderMiddleware(endpoint, secret_key=SECRET_KEY)
+    cases = [
+        ("GET + cookie", [(b"cookie", b"csrf_token=%s" % token.encode())], "GET"),
+        ("GET, new cookie", [], "GET"),
+        ("POST + header", None, "POST"),
+    ]
+    baseline = await run(endpoint, make_scope("GET", []))
+    print("%-16s %-20s %8.1f us/request" % ("no middleware", "", baseline))
+    for case_name, headers, method in cases:
+        for app_name, app, app_token in (
+            ("BaseHTTPMiddleware", legacy, legacy_token),
+            ("pure ASGI", middleware, token),
+        ):
+            if headers is None:
+                scope = make_scope(method, [(b"x-csrf-token", app_token.encode())])
+            else:
+                scope = make_scope(method, headers)
+            elapsed = await run(app, scope)
+            print(
+                "%-16s %-20s %8.1f us/request  (+%.1f us)"
+                % (case_name, app_name, elapsed, elapsed - baseline)
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,264 @@
+"""
+benchmarks/bench_fleet_state.py
+
+The latest state of TRUCKS trucks in memory:
+- 'FleetState' (the NumPy arrays + the sorted id -> slot map) against the dict of the plain
+  objects per truck (the class with '__dict__', the class with '__slots__') and the dict of
+  the ORM objects 'LatestPositionModel'. The memory is measured by 'tracemalloc' (the rows
+  of the input are allocated before);
+- the bulk queries 'stale > 5 min', 'in region' and both: the masks against the loop over
+  the objects;
+- the snapshot of the fleet: 'to_json' / 'to_records' against 'json.dumps' of the dicts;
+  the page of '/positions/fleet' (PAGE trucks): the copy of columns in the event loop and
+  its serialization (in the threads of the endpoint);
+- 'update_many' of the batch of the moved trucks.
+Run: `python -m benchmarks.bench_fleet_state [TRUCKS]`
+"""
+
+import gc
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from project.db.models import FleetState, LatestPositionModel, fleet_json, fleet_records
+
+TRUCKS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+MOVED = 5000
+PAGE = 5000
+STALE_AFTER = 300.0
+REGION = (50.0, 30.0, 60.0, 50.0)
+
+
+class PlainTruck:
+    def __init__(self, driver_id, recorded_at, lat, lon, speed, heading) -> None:
+        self.driver_id = driver_id
+        self.recorded_at = recorded_at
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.heading = heading
+        self.status = "stopped" if speed < 3.0 else "moving"
+
+
+class SlottedTruck:
+    __slots__ = ("driver_id", "recorded_at", "lat", "lon", "speed", "heading", "status")
+
+    def __init__(self, driver_id, recorded_at, lat, lon, speed, heading) -> None:
+        self.driver_id = driver_id
+        self.recorded_at = recorded_at
+        self.lat = lat
+        self.lon = lon
+        self.speed = speed
+        self.heading = heading
+        self.status = "stopped" if speed < 3.0 else "moving"
+
+
+def make_rows(now: float) -> np.ndarray:
+    """The rows in the order of 'POSITION_COLUMNS' as one array - the values of every state \
+    are made by its build (as by the parser of reports), not shared with the input."""
+    generator = np.random.default_rng(1)
+    return np.column_stack(
+        (
+            np.arange(1, TRUCKS + 1),
+            now - generator.uniform(0, 900, TRUCKS),
+            generator.uniform(41, 70, TRUCKS),
+            generator.uniform(20, 180, TRUCKS),
+            generator.choice([0.0, 35.5, 62.5, 88.0], TRUCKS),
+            generator.uniform(0, 360, TRUCKS),
+        )
+    )
+
+
+def build_fleet(data: np.ndarray) -> FleetState:
+    fleet = FleetState()
+    fleet.update_many(data)
+    return fleet
+
+
+def build_objects(kind):
+    def build(data: np.ndarray):
+        return {int(row[0]): kind(int(row[0]), *row[1:]) for row in data.tolist()}
+
+    return build
+
+
+def build_orm(data: np.ndarray):
+    return {
+        int(row[0]): LatestPositionModel(
+            driver_id=int(row[0]),
+            recorded_at=row[1],
+            lat=row[2],
+            lon=row[3],
+            speed=row[4],
+            heading=row[5],
+            updated_at=row[1],
+        )
+        for row in data.tolist()
+    }
+
+
+def allocated(build, data: np.ndarray):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = build(data)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return state, size, elapsed
+
+
+def measure(name: str, function, repeat: int) -> float:
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = (time.perf_counter() - start) / repeat
+    print("  %-40s %10.2f ms" % (name, elapsed * 1000))
+    return elapsed
+
+
+def main() -> None:
+    now = time.time()
+    data = make_rows(now)
+    print("memory of %d trucks (tracemalloc):" % TRUCKS)
+    states = {}
+    sizes = {}
+    for name, build in (
+        ("FleetState (arrays)", build_fleet),
+        ("dict of objects (__dict__)", build_objects(PlainTruck)),
+        ("dict of objects (__slots__)", build_objects(SlottedTruck)),
+        ("dict of ORM LatestPositionModel", build_orm),
+    ):
+        states[name], sizes[name], elapsed = allocated(build, data)
+        print(
+            "  %-32s %8.1f MB %6.0f B/truck   built in %6.0f ms"
+            % (name, sizes[name] / 2**20, sizes[name] / TRUCKS, elapsed * 1000)
+        )
+    fleet = states["FleetState (arrays)"]
+    fleet_size = sizes["FleetState (arrays)"]
+    print(
+        "  less memory: %s"
+        % ", ".join(
+            "%.1fx vs %s" % (size / fleet_size, name)
+            for name, size in sizes.items()
+            if size != fleet_size
+        )
+    )
+    del states["dict of ORM LatestPositionModel"], states["dict of objects (__slots__)"]
+    objects = states["dict of objects (__dict__)"]
+
+    print("queries:")
+    min_lat, min_lon, max_lat, max_lon = REGION
+    cases = (
+        (
+            "stale > 5 min",
+            lambda: fleet.ids(fleet.stale(STALE_AFTER, now=now)),
+            lambda: [
+                truck.driver_id
+                for truck in objects.values()
+                if truck.recorded_at < now - STALE_AFTER
+            ],
+        ),
+        (
+            "in region",
+            lambda: fleet.ids(fleet.in_region(*REGION)),
+            lambda: [
+                truck.driver_id
+                for truck in objects.values()
+                if min_lat <= truck.lat <= max_lat and min_lon <= truck.lon <= max_lon
+            ],
+        ),
+        (
+            "stale & in region",
+            lambda: fleet.ids(
+                fleet.stale(STALE_AFTER, now=now) & fleet.in_region(*REGION)
+            ),
+            lambda: [
+                truck.driver_id
+                for truck in objects.values()
+                if truck.recorded_at < now - STALE_AFTER
+                and min_lat <= truck.lat <= max_lat
+                and min_lon <= truck.lon <= max_lon
+            ],
+        ),
+    )
+    for name, vectorized, loop in cases:
+        assert sorted(vectorized().tolist()) == sorted(loop())
+        print("%s (%d trucks):" % (name, len(vectorized())))
+        fast = measure("FleetState masks", vectorized, 50)
+        slow = measure("loop over objects", loop, 5)
+        print("  speedup: %.0fx" % (slow / fast))
+
+    print("snapshot of the fleet:")
+
+    def objects_json():
+        return json.dumps(
+            [
+                {
+                    "driver_id": truck.driver_id,
+                    "recorded_at": truck.recorded_at,
+                    "lat": truck.lat,
+                    "lon": truck.lon,
+                    "speed": truck.speed,
+                    "heading": truck.heading,
+                    "status": truck.status,
+                }
+                for truck in objects.values()
+            ]
+        ).encode("utf-8")
+
+    slow = measure("json.dumps of dicts per truck", objects_json, 3)
+    fast = measure("FleetState.to_json (columns)", fleet.to_json, 5)
+    binary = measure("FleetState.to_records (binary)", fleet.to_records, 20)
+    print(
+        "  speedup: %.1fx (JSON), %.0fx (binary); bytes: %.1f MB dicts, %.1f MB columns, "
+        "%.1f MB binary"
+        % (
+            slow / fast,
+            slow / binary,
+            len(objects_json()) / 2**20,
+            len(fleet.to_json()) / 2**20,
+            len(fleet.to_records()) / 2**20,
+        )
+    )
+
+    print("page of %d trucks (after the middle id):" % PAGE)
+    middle = TRUCKS // 2
+    measure(
+        "columns (in the loop)", lambda: fleet.columns(limit=PAGE, after=middle), 50
+    )
+    page = fleet.columns(limit=PAGE, after=middle)
+    measure("fleet_json (in the threads)", lambda: fleet_json(page, middle + PAGE), 20)
+    measure("fleet_records (in the threads)", lambda: fleet_records(page), 50)
+
+    print("update of %d moved trucks:" % MOVED)
+    moved = [
+        (int(row[0]), row[1] + 10, row[2] + 0.01, row[3] + 0.01, row[4], row[5])
+        for row in data[:MOVED].tolist()
+    ]
+    later = iter(range(1, 10**6))
+
+    def update_fleet():
+        shift = next(later) * 10
+        fleet.update_many([(row[0], row[1] + shift) + row[2:] for row in moved])
+
+    def update_objects():
+        shift = next(later) * 10
+        for row in moved:
+            truck = objects[row[0]]
+            if row[1] + shift >= truck.recorded_at:
+                truck.recorded_at = row[1] + shift
+                truck.lat, truck.lon, truck.speed, truck.heading = row[2:]
+                truck.status = "stopped" if row[4] < 3.0 else "moving"
+
+    measure("FleetState.update_many", update_fleet, 20)
+    measure("setattr of objects", update_objects, 20)
+
+
+if __name__ == "__main__":
+    main()
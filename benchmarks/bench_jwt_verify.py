@@ -0,0 +1,70 @@
+"""
+benchmarks/bench_jwt_verify.py
+
+Verification of the same JWT-token again and again (the driver's app polls the map):
+'project.jwt_auth.JWTVerifier' without the cache (signature check every time) and with the
+LRU of the verified tokens. HS256 ('SIGNING_KEY' of the Django backend) and RS256.
+Run: `python -m benchmarks.bench_jwt_verify`
+"""
+
+import asyncio
+import logging
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from project.jwt_auth import JWTKeyProvider, JWTVerifier
+
+VERIFICATIONS = 20000
+TOKENS = 100  # of different users
+SECRET_KEY = "django-signing-key-of-the-person-backend"
+
+
+def make_tokens(key, algorithm: str):
+    exp = int(time.time()) + 3600
+    return [
+        jwt.encode(
+            {
+                "token_type": "access",
+                "user_id": number,
+                "groups": ["DRIVER"],
+                "exp": exp,
+            },
+            key,
+            algorithm=algorithm,
+        )
+        for number in range(TOKENS)
+    ]
+
+
+async def run(name: str, verifier: JWTVerifier, tokens) -> None:
+    start = time.perf_counter()
+    for number in range(VERIFICATIONS):
+        await verifier.verify(tokens[number % TOKENS], "access")
+    elapsed = time.perf_counter() - start
+    print(
+        "%-22s %10.0f tokens/s  %8.2f us/token"
+        % (name, VERIFICATIONS / elapsed, elapsed / VERIFICATIONS * 1e6)
+    )
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    public_pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    cases = [
+        ("HS256", JWTKeyProvider("HS256", secret_key=SECRET_KEY), SECRET_KEY),
+        ("RS256", JWTKeyProvider("RS256", public_key=public_pem.decode()), private_key),
+    ]
+    for algorithm, keys, signing_key in cases:
+        tokens = make_tokens(signing_key, algorithm)
+        await run("%s, no cache" % algorithm, JWTVerifier(keys, cache_size=0), tokens)
+        await run("%s, cache" % algorithm, JWTVerifier(keys, cache_size=10000), tokens)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
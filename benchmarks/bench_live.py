@@ -0,0 +1,259 @@
+"""
+benchmarks/bench_live.py
+
+The load test of '/live': CLIENTS simulated local clients (the ASGI websocket of the app in
+this process, through 'CustomHeaderMiddleware' + 'CustomJWTMiddleware' with the token in the
+query) subscribe to the city viewports around the hubs - 70% of them keep the default view of
+the city, the rest are panned; 10% of clients subscribe to 20 drivers. TRUCKS trucks, MOVED
+of them move every tick. SLOW share of the clients reads one frame per second.
+- the tick ('PositionHub.publish'): the match + the frames, p50/p99;
+- the frames built per tick against the frames delivered (the shared bytes);
+- the delay of delivery after the tick (the fast clients), p50/p99;
+- the frames dropped for the slow clients (the snapshot instead);
+- the serialization per socket (json.dumps of the matched trucks) for comparison.
+The real sockets need uvicorn - it isn't installed here, the network is not measured.
+Run: `python -m benchmarks.bench_live [CLIENTS]`
+"""
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+import jwt
+import numpy as np
+from fastapi import FastAPI
+from starlette.middleware import Middleware
+
+from project.db.spatial import SpatialGridIndex
+from project.jwt_auth import JWTKeyProvider, JWTVerifier
+from project.live import PositionHub
+from project.middlewares import CustomHeaderMiddleware, CustomJWTMiddleware
+from project.routers.internal.live import router as live_router
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+TRUCKS = 50_000
+MOVED = 2_000
+TICKS = 40
+INTERVAL = 0.25
+SLOW = 0.05
+HUBS = 40
+SECRET_KEY = "bench-signing-key-of-the-person-backend-0123456789"
+ORIGIN = b"http://127.0.0.1:8000"
+
+
+def percentiles(values):
+    if not values:
+        return 0.0, 0.0
+    values = np.array(values) * 1000
+    return float(np.percentile(values, 50)), float(np.percentile(values, 99))
+
+
+class Client:
+    """The browser of the dispatcher: the handshake, the subscription, then reads the frames."""
+
+    def __init__(
+        self, app, token: str, subscription: dict, slow: bool, ticks: dict
+    ) -> None:
+        self.app = app
+        self.token = token
+        self.subscription = subscription
+        self.slow = slow
+        self.ticks = ticks
+        self.inbox: asyncio.Queue = asyncio.Queue()
+        self.frames = 0
+        self.bytes = 0
+        self.snapshots = 0
+        self.delays = []
+        self.closed = None
+
+    async def receive(self):
+        return await self.inbox.get()
+
+    async def send(self, message) -> None:
+        kind = message["type"]
+        if kind == "websocket.accept":
+            self.inbox.put_nowait(
+                {"type": "websocket.receive", "text": json.dumps(self.subscription)}
+            )
+        elif kind == "websocket.send":
+            frame = message["bytes"]
+            self.frames += 1
+            self.bytes += len(frame)
+            if frame.startswith(b'{"type":"snapshot"'):
+                self.snapshots += 1
+            elif not self.slow:
+                start = frame.index(b'"tick":') + 7
+                tick = int(frame[start : frame.index(b",", start)])
+                self.delays.append(time.perf_counter() - self.ticks[tick])
+            if self.slow:
+                await asyncio.sleep(1.0)
+        elif kind == "websocket.close":
+            self.closed = message.get("code")
+
+    async def run(self) -> None:
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/live",
+            "raw_path": b"/live",
+            "query_string": b"token_access=" + self.token.encode(),
+            "headers": [(b"host", b"127.0.0.1:8000"), (b"origin", ORIGIN)],
+            "client": ("127.0.0.1", 1),
+            "server": ("127.0.0.1", 8000),
+            "subprotocols": [],
+            "state": {},
+        }
+        self.inbox.put_nowait({"type": "websocket.connect"})
+        await self.app(scope, self.receive, self.send)
+
+    def disconnect(self) -> None:
+        self.inbox.put_nowait({"type": "websocket.disconnect", "code": 1000})
+
+
+async def main() -> None:
+    generator = random.Random(1)
+    hubs = [
+        (generator.uniform(44.0, 66.0), generator.uniform(30.0, 170.0))
+        for _ in range(HUBS)
+    ]
+    spatial = SpatialGridIndex(cell_size=0.5)
+
+    def random_position():
+        lat, lon = generator.choice(hubs)
+        return lat + generator.gauss(0, 0.3), lon + generator.gauss(0, 0.5)
+
+    for driver_id in range(1, TRUCKS + 1):
+        spatial.upsert(driver_id, *random_position(), recorded_at=0.0)
+
+    verifier = JWTVerifier(JWTKeyProvider("HS256", secret_key=SECRET_KEY))
+    app = FastAPI(
+        middleware=[
+            Middleware(
+                CustomHeaderMiddleware,
+                secret_keys=["k"],
+                allowed_origins=[ORIGIN.decode()],
+            ),
+            Middleware(CustomJWTMiddleware, verifier=verifier),
+        ]
+    )
+    app.include_router(live_router)
+    hub = app.state.position_hub = PositionHub(spatial, interval=INTERVAL)
+    ticks = {}
+    clients = []
+    for number in range(CLIENTS):
+        token = jwt.encode(
+            {
+                "token_type": "access",
+                "user_id": number + 1,
+                "exp": int(time.time()) + 3600,
+            },
+            SECRET_KEY,
+            algorithm="HS256",
+        )
+        if number % 10 == 9:
+            subscription = {"drivers": generator.sample(range(1, TRUCKS + 1), 20)}
+        else:
+            lat, lon = generator.choice(hubs)
+            if generator.random() < 0.3:
+                lat += generator.uniform(-0.3, 0.3)
+                lon += generator.uniform(-0.5, 0.5)
+            subscription = {"bbox": [lat - 0.25, lon - 0.5, lat + 0.25, lon + 0.5]}
+        clients.append(
+            Client(app, token, subscription, generator.random() < SLOW, ticks)
+        )
+
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(client.run()) for client in clients]
+    while hub.info()["subscribers"] < CLIENTS:
+        await asyncio.sleep(0.01)
+    print(
+        "%d clients connected and subscribed in %.2f s: %d groups"
+        % (CLIENTS, time.perf_counter() - start, hub.info()["groups"])
+    )
+    await asyncio.sleep(0.5)
+
+    publish_times = []
+    frames_built = 0
+    naive_times = []
+    loop_start = time.perf_counter()
+    busy = 0.0
+    for _ in range(TICKS):
+        for driver_id in generator.sample(range(1, TRUCKS + 1), MOVED):
+            spatial.upsert(driver_id, *random_position(), recorded_at=time.time())
+        tick_start = time.perf_counter()
+        ticks[hub.tick + 1] = tick_start
+        frames_before = hub.frames
+        hub.publish()
+        publish_times.append(time.perf_counter() - tick_start)
+        busy += publish_times[-1]
+        frames_built += hub.frames - frames_before
+        await asyncio.sleep(INTERVAL)
+    elapsed = time.perf_counter() - loop_start
+
+    # The serialization per socket: json.dumps of the trucks of every subscriber
+    sample = [client for client in clients if "bbox" in client.subscription][:200]
+    start = time.perf_counter()
+    for client in sample:
+        bbox = client.subscription["bbox"]
+        trucks = [
+            {"driver_id": driver_id, "lat": lat, "lon": lon, "recorded_at": recorded_at}
+            for driver_id in spatial.bbox(*bbox)[: MOVED * 40 // TRUCKS + 1]
+            for lat, lon, recorded_at in (spatial.position(driver_id),)
+        ]
+        json.dumps({"type": "update", "trucks": trucks}).encode()
+    naive_times.append((time.perf_counter() - start) / len(sample))
+
+    for client in clients:
+        client.disconnect()
+    await asyncio.gather(*tasks)
+
+    fast = [client for client in clients if not client.slow]
+    slow = [client for client in clients if client.slow]
+    delivered = sum(client.frames for client in clients)
+    delays = [delay for client in fast for delay in client.delays]
+    p50, p99 = percentiles(publish_times)
+    print("%d ticks of %d moved trucks (of %d):" % (TICKS, MOVED, TRUCKS))
+    print("  %-40s %8.2f ms p50 %8.2f ms p99" % ("publish (match + frames)", p50, p99))
+    print(
+        "  %-40s %8d built %8d delivered (%.1fx shared)"
+        % ("frames", frames_built, delivered, delivered / max(1, frames_built))
+    )
+    p50, p99 = percentiles(delays)
+    print(
+        "  %-40s %8.2f ms p50 %8.2f ms p99"
+        % ("delivery after the tick (fast)", p50, p99)
+    )
+    print(
+        "  %-40s %8.1f frames/s, %.1f MB/s"
+        % (
+            "delivered",
+            delivered / elapsed,
+            sum(client.bytes for client in clients) / elapsed / 1e6,
+        )
+    )
+    print(
+        "  %-40s %8d clients, %d frames, %d snapshots (resync)"
+        % (
+            "slow clients (1 frame/s)",
+            len(slow),
+            sum(client.frames for client in slow),
+            sum(client.snapshots for client in slow) - len(slow),
+        )
+    )
+    print("  %-40s %8.1f%%" % ("loop busy by publish", busy / elapsed * 100))
+    print(
+        "  %-40s %8.3f ms/socket/tick (x%d sockets = %.0f ms)"
+        % (
+            "json.dumps per socket instead",
+            naive_times[0] * 1000,
+            CLIENTS,
+            naive_times[0] * 1000 * CLIENTS,
+        )
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+"""
+benchmarks/bench_logging.py
+
+Latency of the request which writes two INFO records: the old handlers (the 'FileHandler'
+and the console handler are called on the event loop) against the 'QueueHandler' pipeline
+of 'logs.configure_logging'. The requests come every ~1 ms (the loop is idle between them as
+in the server). The console is '/dev/null' or the "slow disk" - the stream which stalls
+for 5 ms on every 200th write (a busy disk, a network volume). The log file is in a temp dir.
+Run: `python -m benchmarks.bench_logging`
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from fastapi import FastAPI
+
+from logs import LOG_DATE_FORMAT, LOG_FORMAT, configure_logging, shutdown_logging
+
+REQUESTS = 3000
+PAUSE = 0.001  # of seconds between the requests
+log = logging.getLogger("benchmarks.bench_logging")
+
+app = FastAPI()
+
+
+@app.get("/position")
+async def position():
+    log.info("%s: position of driver %d" % (position.__name__, 7))
+    log.info("%s: done" % position.__name__)
+    return {"data": "ok"}
+
+
+SCOPE = {
+    "type": "http",
+    "asgi": {"version": "3.0"},
+    "http_version": "1.1",
+    "method": "GET",
+    "scheme": "http",
+    "path": "/position",
+    "raw_path": b"/position",
+    "root_path": "",
+    "query_string": b"",
+    "headers": [],
+    "client": ("127.0.0.1", 5000),
+    "server": ("testserver", 80),
+}
+
+
+async def receive() -> dict:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message) -> None:
+    pass
+
+
+class SlowStream:
+    """'/dev/null' which stalls for 5 ms on every 200th write."""
+
+    def __init__(self) -> None:
+        self.writes = 0
+
+    def write(self, text: str) -> int:
+        self.writes += 1
+        if self.writes % 200 == 0:
+            time.sleep(0.005)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def legacy_logging(log_file: str, stream) -> None:
+    """'configure_logging' before the rewrite (without the maintenance thread)."""
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler(stream)
+    console_handler.setFormatter(formatter)
+    logging.basicConfig(
+        level=logging.INFO, handlers=[file_handler, console_handler], force=True
+    )
+
+
+async def run(name: str) -> None:
+    for _ in range(200):
+        await app(dict(SCOPE), receive, send)
+    latencies = []
+    for _ in range(REQUESTS):
+        start = time.perf_counter()
+        await app(dict(SCOPE), receive, send)
+        latencies.append((time.perf_counter() - start) * 1e6)
+        await asyncio.sleep(PAUSE)
+    latencies.sort()
+    print(
+        "%-30s mean %7.1f us  p50 %7.1f us  p99 %7.1f us  max %8.1f us"
+        % (
+            name,
+            statistics.fmean(latencies),
+            latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99)],
+            latencies[-1],
+        )
+    )
+
+
+async def main() -> None:
+    shutdown_logging()
+    root = logging.getLogger()
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as devnull:
+        for disk, stream in (("", devnull), (", slow disk", SlowStream())):
+            legacy_logging(os.path.join(directory, "legacy.log"), stream)
+            await run("FileHandler (old)%s" % disk)
+            for handler in root.handlers[:]:
+                root.removeHandler(handler)
+                handler.close()
+
+            configure_logging(
+                logging.INFO, os.path.join(directory, "queue.log"), stream=stream
+            )
+            await run("QueueHandler%s" % disk)
+            shutdown_logging()
+
+            configure_logging(
+                logging.INFO,
+                os.path.join(directory, "json.log"),
+                json_format=True,
+                stream=stream,
+            )
+            await run("QueueHandler, JSON%s" % disk)
+            shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
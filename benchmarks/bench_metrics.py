@@ -0,0 +1,94 @@
+"""
+benchmarks/bench_metrics.py
+
+Cost of 'project.metrics.MetricsMiddleware' per request (the ASGI app is called directly):
+over the bare ASGI endpoint (the exact overhead) and over the FastAPI endpoint (the share of
+the real request, it is inside of the noise), and the time of one scrape ('REGISTRY.render()').
+Run: `python -m benchmarks.bench_metrics`
+"""
+
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from project.metrics import REGISTRY, MetricsMiddleware, observe_upstream
+
+REQUESTS = 20000
+
+app = FastAPI()
+
+
+@app.get("/drivers/{driver_id}")
+async def driver(driver_id: int):
+    return {"data": driver_id}
+
+
+def make_scope(path: str) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+        "client": ("127.0.0.1", 5000),
+        "server": ("testserver", 80),
+    }
+
+
+async def bare_endpoint(scope, receive, send) -> None:
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def receive() -> dict:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def send(message) -> None:
+    pass
+
+
+async def run(name: str, asgi_app) -> float:
+    scopes = [make_scope("/drivers/%d" % number) for number in range(100)]
+    for scope in scopes:
+        await asgi_app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for number in range(REQUESTS):
+        await asgi_app(dict(scopes[number % 100]), receive, send)
+    elapsed = (time.perf_counter() - start) / REQUESTS * 1e6
+    print("%-32s %8.2f us/request" % (name, elapsed))
+    return elapsed
+
+
+async def main() -> None:
+    for name, endpoint in (("bare ASGI", bare_endpoint), ("FastAPI", app)):
+        plain = await run("%s" % name, endpoint)
+        measured = await run(
+            "%s + MetricsMiddleware" % name, MetricsMiddleware(endpoint)
+        )
+        print("%-32s %8.2f us/request" % ("  overhead", measured - plain))
+
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        observe_upstream("GET", "person", 200, 0.012)
+    print(
+        "%-32s %8.2f us/call"
+        % ("observe_upstream", (time.perf_counter() - start) / REQUESTS * 1e6)
+    )
+
+    start = time.perf_counter()
+    text = REGISTRY.render()
+    print(
+        "%-32s %8.2f ms (%d lines)"
+        % ("scrape", (time.perf_counter() - start) * 1e3, text.count("\n"))
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,59 @@
+"""
+benchmarks/bench_permissions.py
+
+The check 'IsAll() | IsManipulate()' of one request: the old expressions
+('request.user.groups.filter(name__in=...).exists()' - here over the groups from the token,
+with the Django backend it is the query per call) against the bit test of the compiled mask.
+Run: `python -m benchmarks.bench_permissions`
+"""
+
+import time
+
+from project.jwt_auth import GroupSet, JWTUser
+from project.permissions import IsAll, IsManipulate, user_mask
+
+CHECKS = 500000
+
+
+def legacy_is_active(user) -> bool:
+    return user and user.is_authenticated and user.is_active
+
+
+def legacy_check(user) -> bool:
+    is_all = (
+        legacy_is_active(user)
+        and user.is_staff
+        and (
+            user.is_superuser
+            or user.groups.filter(name__in=["ADMIN", "Supervisor"]).exists()
+        )
+    )
+    return is_all or (
+        legacy_is_active(user)
+        and user.groups.filter(name__in=["MANAGER", "Manager"]).exists()
+    )
+
+
+def run(name: str, function, argument) -> None:
+    start = time.perf_counter()
+    for _ in range(CHECKS):
+        function(argument)
+    elapsed = time.perf_counter() - start
+    print(
+        "%-28s %10.0f checks/s  %6.3f us/check"
+        % (name, CHECKS / elapsed, elapsed / CHECKS * 1e6)
+    )
+
+
+def main() -> None:
+    user = JWTUser(id=1, groups=GroupSet(["Employee", "Manager"]))
+    permission = IsAll() | IsManipulate()
+    assert legacy_check(user) and permission.check(user_mask(user))
+    run("legacy filter().exists()", legacy_check, user)
+    run("mask per check", lambda user: permission.check(user_mask(user)), user)
+    mask = user_mask(user)
+    run("bit test (mask per request)", permission.check, mask)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+benchmarks/bench_query_profiler.py
+
+Cost of the SQL instrumentation on the lookup of session by id (aiosqlite, one connection):
+no instrumentation, 'QueryProfiler' (with N+1 counting of request) and the old 'echo=True'.
+Run: `python -m benchmarks.bench_query_profiler 2>/dev/null` (stderr has the SQL echo)
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import select
+from uuid_extensions import uuid7
+
+from logs import shutdown_logging
+from project.db.models import Database, SessionUserModel
+from project.db.profiler import QueryProfiler
+from project.db.profiles import EngineProfile
+
+SESSIONS = 2000
+QUERIES = 5000
+
+
+async def run(name: str, profile: EngineProfile, profiler=None) -> str:
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(
+            "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3"),
+            profile=profile,
+            profiler=profiler,
+        )
+        db.init_engine()
+        await db.table_exists_create()
+        session_ids = [str(uuid7()) for _ in range(SESSIONS)]
+        await db.bulk_create_sessions(session_ids)
+        token = profiler.start_request() if profiler is not None else None
+        async with db.session_factory() as session:
+            start = time.perf_counter()
+            for _ in range(QUERIES):
+                await session.execute(
+                    select(SessionUserModel).where(
+                        SessionUserModel.session_id == random.choice(session_ids)
+                    )
+                )
+            elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.finish_request(token, "bench")
+        await db.engine.dispose()
+        return "%-10s %8.0f queries/s  %6.1f us/query" % (
+            name,
+            QUERIES / elapsed,
+            elapsed / QUERIES * 1e6,
+        )
+
+
+async def main() -> None:
+    print(await run("none", EngineProfile()))
+    print(await run("profiler", EngineProfile(), QueryProfiler(sample_rate=0.01)))
+    print(await run("echo", EngineProfile(echo=True)))
+    # The queue of log records is written before the exit
+    shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
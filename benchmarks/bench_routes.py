@@ -0,0 +1,190 @@
+"""
+benchmarks/bench_routes.py
+
+The trace of the full day: POINTS reports (one per 2 s) of the truck which drives and
+stops.
+- points/s of Douglas-Peucker: the level-vectorized 'douglas_peucker_importance' (all zoom
+  levels by one run) against the recursive Douglas-Peucker of Python (one tolerance);
+- the sizes of the response: the JSON of all points against the encoded polylines per zoom;
+- the lag of the event loop while TRIPS trips are simplified: in the loop against in the
+  process pool ('RouteTiles' of the app).
+Run: `python -m benchmarks.bench_routes`
+"""
+
+import asyncio
+import gzip
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from project.routes import (
+    douglas_peucker_importance,
+    encode_polyline,
+    mercator_pixels,
+    simplify_route,
+    zoom_tolerance,
+)
+
+POINTS = 43_200
+TRIPS = 8
+ZOOMS = tuple(range(19))
+
+
+def make_trace(seed: int = 1):
+    random = np.random.default_rng(seed)
+    # Stops (speed 0) and the driving with the slow turns, GPS noise ~3 m
+    speed = np.where(random.random(POINTS // 600 + 1) < 0.2, 0.0, 1.0).repeat(600)[
+        :POINTS
+    ]
+    speed = speed * random.uniform(0.4, 1.0, POINTS) * 0.0003
+    heading = np.cumsum(random.normal(0, 0.05, POINTS))
+    lat = 55.75 + np.cumsum(np.cos(heading) * speed) + random.normal(0, 0.00003, POINTS)
+    lon = (
+        37.61
+        + np.cumsum(np.sin(heading) * speed * 1.7)
+        + random.normal(0, 0.00005, POINTS)
+    )
+    return lat, lon
+
+
+def python_douglas_peucker(x, y, tolerance):
+    """The classic algorithm by the stack (one tolerance) - the loops of Python."""
+    keep = [False] * len(x)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(x) - 1)]
+    while stack:
+        start, end = stack.pop()
+        ax, ay, dx, dy = x[start], y[start], x[end] - x[start], y[end] - y[start]
+        length2 = dx * dx + dy * dy
+        farthest, index = 0.0, -1
+        for i in range(start + 1, end):
+            t = 0.0 if length2 == 0 else ((x[i] - ax) * dx + (y[i] - ay) * dy) / length2
+            t = min(max(t, 0.0), 1.0)
+            distance = ((x[i] - ax - t * dx) ** 2 + (y[i] - ay - t * dy) ** 2) ** 0.5
+            if distance > farthest:
+                farthest, index = distance, i
+        if farthest > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+    return keep
+
+
+def speed(lat, lon) -> None:
+    x, y = mercator_pixels(lat, lon)
+    start = time.perf_counter()
+    python_douglas_peucker(x.tolist(), y.tolist(), zoom_tolerance(14))
+    python = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(5):
+        douglas_peucker_importance(x, y, min_tolerance=zoom_tolerance(ZOOMS[-1]))
+    vector = (time.perf_counter() - start) / 5
+    start = time.perf_counter()
+    for _ in range(5):
+        simplify_route(lat, lon, ZOOMS)
+    full = (time.perf_counter() - start) / 5
+    print("Douglas-Peucker of %d points:" % POINTS)
+    print("  %-44s %10.0f points/s" % ("recursive (Python, one zoom)", POINTS / python))
+    print(
+        "  %-44s %10.0f points/s"
+        % ("vectorized importance (all zooms)", POINTS / vector)
+    )
+    print(
+        "  %-44s %10.0f points/s" % ("simplify_route (+ 19 polylines)", POINTS / full)
+    )
+
+
+def sizes(lat, lon) -> None:
+    tiles = simplify_route(lat, lon, ZOOMS)
+    raw = json.dumps(
+        [[round(a, 6), round(b, 6)] for a, b in zip(lat.tolist(), lon.tolist())]
+    )
+    encoded = encode_polyline(lat, lon)
+    print("response sizes (bytes, gzip):")
+    print(
+        "  %-22s %7d points %9d %9d"
+        % ("JSON of all points", POINTS, len(raw), len(gzip.compress(raw.encode())))
+    )
+    print(
+        "  %-22s %7d points %9d %9d"
+        % (
+            "polyline of all",
+            POINTS,
+            len(encoded),
+            len(gzip.compress(encoded.encode())),
+        )
+    )
+    for zoom in (6, 10, 12, 14, 16, 18):
+        tile = tiles[zoom]
+        print(
+            "  %-22s %7d points %9d %9d"
+            % (
+                "polyline zoom %d" % zoom,
+                tile.points,
+                len(tile.polyline),
+                len(gzip.compress(tile.polyline.encode())),
+            )
+        )
+
+
+async def loop_lag(traces, executor):
+    """The max delay of the ticker of 1 ms while the trips are simplified."""
+    lag = 0.0
+    done = False
+
+    async def ticker() -> None:
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    if executor is None:
+        for lat, lon in traces:
+            simplify_route(lat, lon, ZOOMS)
+            await asyncio.sleep(0)
+    else:
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, simplify_route, lat, lon, ZOOMS)
+                for lat, lon in traces
+            )
+        )
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    return lag, elapsed
+
+
+async def lag() -> None:
+    traces = [make_trace(seed) for seed in range(TRIPS)]
+    print("event loop while %d trips are simplified:" % TRIPS)
+    worst, elapsed = await loop_lag(traces, None)
+    print("  %-22s max lag %7.1f ms, %6.2f s" % ("in the loop", worst * 1000, elapsed))
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        # The workers are started (and numpy is imported) before the measure
+        await asyncio.get_running_loop().run_in_executor(
+            pool, simplify_route, *traces[0], ZOOMS
+        )
+        worst, elapsed = await loop_lag(traces, pool)
+    print(
+        "  %-22s max lag %7.1f ms, %6.2f s"
+        % ("process pool (2)", worst * 1000, elapsed)
+    )
+
+
+def main() -> None:
+    lat, lon = make_trace()
+    speed(lat, lon)
+    sizes(lat, lon)
+    asyncio.run(lag())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+benchmarks/bench_schema_bootstrap.py
+
+Cold start of the schema check: the old 'check_tables' ('is_table_exists_async' probe +
+'create_all' when the table 'session' is empty) against 'Database.bootstrap_schema'.
+Every start is a new engine (the new worker).
+Run: `python -m benchmarks.bench_schema_bootstrap`
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from project.db.models import Database
+from project.db.profiles import EngineProfile
+
+STARTS = 30
+
+
+async def old_check_tables(url: str) -> None:
+    db = Database(url, profile=EngineProfile(echo=False))
+    db.init_engine()
+    if not await db.is_table_exists_async(db.engine):
+        await db.table_exists_create()
+    await db.engine.dispose()
+
+
+async def new_bootstrap(url: str) -> None:
+    db = Database(url, profile=EngineProfile(echo=False))
+    db.init_engine()
+    await db.bootstrap_schema()
+    await db.engine.dispose()
+
+
+async def measure(name: str, start_worker, url: str) -> None:
+    timings = []
+    for _ in range(STARTS):
+        start = time.perf_counter()
+        await start_worker(url)
+        timings.append((time.perf_counter() - start) * 1000)
+    print(
+        "%-30s median %6.2f ms  max %6.2f ms"
+        % (name, statistics.median(timings), max(timings))
+    )
+
+
+async def main() -> None:
+    logging.disable(logging.ERROR)
+    with tempfile.TemporaryDirectory() as directory:
+        url = "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3")
+        start = time.perf_counter()
+        await new_bootstrap(url)
+        print(
+            "%-30s %6.2f ms"
+            % ("first bootstrap (empty file)", (time.perf_counter() - start) * 1000)
+        )
+        # The table 'session' is empty - the old probe runs 'create_all' every start
+        await measure("old check_tables", old_check_tables, url)
+        await measure("bootstrap_schema (current)", new_bootstrap, url)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
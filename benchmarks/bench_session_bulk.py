@@ -0,0 +1,71 @@
+"""
+benchmarks/bench_session_bulk.py
+
+Throughput of the bulk session operations of 'Database' on aiosqlite for 10k and 100k rows,
+against the one-ORM-object-at-a-time path ('Database.create_session').
+Run: `python -m benchmarks.bench_session_bulk`
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from datetime import timedelta
+
+from uuid_extensions import uuid7
+
+from project.db.models import Database
+
+SIZES = (10_000, 100_000)
+# The ORM path is slow - it is measured on the part of rows
+ORM_ROWS = 2_000
+
+
+async def timed(name: str, rows: int, coroutine) -> None:
+    start = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - start
+    print(
+        "%-26s %7d rows %8.2f s %10.0f rows/s" % (name, rows, elapsed, rows / elapsed)
+    )
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    for size in SIZES:
+        with tempfile.TemporaryDirectory() as directory:
+            db = Database(
+                "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3")
+            )
+            db.init_engine()
+            db.engine.echo = False
+            await db.table_exists_create()
+            session_ids = [str(uuid7()) for _ in range(size)]
+
+            async def orm_one_by_one():
+                for session_id in session_ids[:ORM_ROWS]:
+                    await db.create_session(session_id)
+
+            await timed("ORM create_session", ORM_ROWS, orm_one_by_one())
+            await timed(
+                "bulk_create_sessions",
+                size - ORM_ROWS,
+                db.bulk_create_sessions(session_ids[ORM_ROWS:]),
+            )
+            await timed(
+                "bulk_touch", size, db.bulk_touch(session_ids, timedelta(hours=2))
+            )
+            await timed(
+                "bulk_upsert",
+                size,
+                db.bulk_upsert(
+                    {"session_id": session_id} for session_id in session_ids
+                ),
+            )
+            await db.engine.dispose()
+        print()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
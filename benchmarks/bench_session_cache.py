@@ -0,0 +1,68 @@
+"""
+benchmarks/bench_session_cache.py
+
+Session validation of the hot drivers: the plain aiosqlite path ('SELECT' on every check)
+against 'Database.is_session_valid' with the read-through 'SessionCache'.
+Run: `python -m benchmarks.bench_session_cache`
+"""
+
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from sqlalchemy import select
+from uuid_extensions import uuid7
+
+from project.db.models import Database, SessionUserModel
+
+SESSIONS = 1000
+CHECKS = 20000
+
+
+async def plain_is_valid(db: Database, session_id: str) -> bool:
+    async with db.session_factory() as session:
+        result = await session.execute(
+            select(SessionUserModel).where(SessionUserModel.session_id == session_id)
+        )
+        row = result.scalar_one_or_none()
+        return row is not None and not row.is_expired
+
+
+async def run(name: str, check, session_ids) -> None:
+    start = time.perf_counter()
+    for number in range(CHECKS):
+        assert await check(session_ids[number % len(session_ids)])
+    elapsed = time.perf_counter() - start
+    print(
+        "%-16s %9.0f checks/s  %8.1f us/check"
+        % (name, CHECKS / elapsed, elapsed / CHECKS * 1e6)
+    )
+
+
+async def main() -> None:
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(
+            "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3")
+        )
+        db.init_engine()
+        db.engine.echo = False
+        await db.table_exists_create()
+        session_ids = [str(uuid7()) for _ in range(SESSIONS)]
+        for session_id in session_ids:
+            await db.create_session(session_id)
+        db.sessions.clear()
+
+        await run("plain aiosqlite", lambda sid: plain_is_valid(db, sid), session_ids)
+        # The hot drivers: every session was checked once already
+        for session_id in session_ids:
+            await db.is_session_valid(session_id)
+        await run("session cache", db.is_session_valid, session_ids)
+        print("cache stats:", db.sessions.info())
+        await db.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,204 @@
+"""
+benchmarks/bench_spatial_index.py
+
+TRUCKS latest positions (lat 41..70, lon 20..180). The queries of dispatchers:
+- 'nearest' - 10 nearest trucks to the random point;
+- 'bbox city' (0.5 x 1 degree) and 'bbox region' (5 x 10 degrees) - the trucks in the viewport.
+In memory: 'SpatialGridIndex' against the scan of all trucks (the loop of Python and NumPy).
+Database (SQLite, temp file): the R*Tree of 'latest_positions' against the scan of the table.
+Run: `python -m benchmarks.bench_spatial_index`
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from project.db.models import Database
+from project.db.profiles import sqlite_performance_profile
+from project.db.spatial import EARTH_RADIUS_KM, SpatialGridIndex, haversine_km
+
+TRUCKS = 100_000
+QUERIES = 200
+VIEWPORTS = {"bbox city": (0.5, 1.0), "bbox region": (5.0, 10.0)}
+
+
+def make_rows():
+    generator = np.random.default_rng(1)
+    now = time.time()
+    lat = 41 + generator.random(TRUCKS) * 29
+    lon = 20 + generator.random(TRUCKS) * 160
+    return [
+        (driver_id + 1, now, float(lat[driver_id]), float(lon[driver_id]), 60.0, 90.0)
+        for driver_id in range(TRUCKS)
+    ]
+
+
+def make_points(count: int):
+    generator = random.Random(2)
+    return [
+        (generator.uniform(41, 70), generator.uniform(20, 180)) for _ in range(count)
+    ]
+
+
+def measure(name: str, function, arguments) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(*argument)
+    elapsed = (time.perf_counter() - start) / len(arguments)
+    print("  %-34s %10.1f us/query" % (name, elapsed * 1e6))
+    return elapsed
+
+
+def memory(rows) -> None:
+    points = make_points(QUERIES)
+    ids = np.array([row[0] for row in rows])
+    lats = np.array([row[2] for row in rows])
+    lons = np.array([row[3] for row in rows])
+    plain = [(row[0], row[2], row[3]) for row in rows]
+
+    start = time.perf_counter()
+    index = SpatialGridIndex(cell_size=0.5)
+    index.update_many(rows)
+    print(
+        "memory: %d trucks, index built in %.0f ms, %d cells"
+        % (len(index), (time.perf_counter() - start) * 1000, len(index.cells))
+    )
+    moved = [
+        (row[0], row[1] + 1, row[2] + 0.01, row[3] + 0.01) + row[4:]
+        for row in rows[:10000]
+    ]
+    start = time.perf_counter()
+    index.update_many(moved)
+    elapsed = (time.perf_counter() - start) / len(moved)
+    print("  %-34s %10.2f us/truck" % ("update (10k moved)", elapsed * 1e6))
+
+    def naive_nearest(lat, lon):
+        return sorted(
+            (haversine_km(lat, lon, p_lat, p_lon), i) for i, p_lat, p_lon in plain
+        )[:10]
+
+    def numpy_nearest(lat, lon):
+        phi, lambda_ = np.radians(lat), np.radians(lon)
+        phis, lambdas = np.radians(lats), np.radians(lons)
+        a = (
+            np.sin((phis - phi) / 2) ** 2
+            + np.cos(phi) * np.cos(phis) * np.sin((lambdas - lambda_) / 2) ** 2
+        )
+        distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+        nearest = np.argpartition(distances, 10)[:10]
+        return ids[nearest[np.argsort(distances[nearest])]]
+
+    print("nearest (k=10):")
+    naive = measure("naive scan (Python)", naive_nearest, points[:10])
+    vector = measure("scan (NumPy)", numpy_nearest, points)
+    grid = measure("SpatialGridIndex.nearest", index.nearest, points)
+    print("  speedup: %.0fx vs Python, %.0fx vs NumPy" % (naive / grid, vector / grid))
+
+    for name, (height, width) in VIEWPORTS.items():
+        boxes = [(lat, lon, lat + height, lon + width) for lat, lon in points]
+
+        def naive_bbox(min_lat, min_lon, max_lat, max_lon):
+            return [
+                i
+                for i, lat, lon in plain
+                if min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+            ]
+
+        def numpy_bbox(min_lat, min_lon, max_lat, max_lon):
+            inside = (
+                (lats >= min_lat)
+                & (lats <= max_lat)
+                & (lons >= min_lon)
+                & (lons <= max_lon)
+            )
+            return ids[inside]
+
+        found = sum(len(index.bbox(*box)) for box in boxes) / len(boxes)
+        print("%s (%.0f trucks on average):" % (name, found))
+        naive = measure("naive scan (Python)", naive_bbox, boxes[:20])
+        vector = measure("scan (NumPy)", numpy_bbox, boxes)
+        grid = measure("SpatialGridIndex.bbox", index.bbox, boxes)
+        print(
+            "  speedup: %.0fx vs Python, %.1fx vs NumPy" % (naive / grid, vector / grid)
+        )
+
+
+async def measure_async(name: str, function, arguments) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        await function(*argument)
+    elapsed = (time.perf_counter() - start) / len(arguments)
+    print("  %-34s %10.1f us/query" % (name, elapsed * 1e6))
+    return elapsed
+
+
+async def database(rows) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(
+            "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3"),
+            profile=sqlite_performance_profile(),
+        )
+        await db.bootstrap_schema()
+        start = time.perf_counter()
+        for position in range(0, len(rows), 10000):
+            await db.bulk_insert_positions(rows[position : position + 10000])
+        print(
+            "sqlite: %d positions + latest written in %.2f s"
+            % (len(rows), time.perf_counter() - start)
+        )
+        points = make_points(QUERIES // 4)
+        scan_sql = text(
+            "SELECT driver_id, recorded_at, lat, lon, speed, heading FROM latest_positions "
+            "WHERE lat BETWEEN :min_lat AND :max_lat AND lon BETWEEN :min_lon AND :max_lon"
+        )
+        async with db.engine.connect() as conn:
+
+            async def scan_bbox(min_lat, min_lon, max_lat, max_lon):
+                result = await conn.execute(
+                    scan_sql,
+                    {
+                        "min_lat": min_lat,
+                        "max_lat": max_lat,
+                        "min_lon": min_lon,
+                        "max_lon": max_lon,
+                    },
+                )
+                return result.all()
+
+            async def scan_nearest(lat, lon):
+                result = await conn.execute(
+                    text("SELECT driver_id, lat, lon FROM latest_positions")
+                )
+                return sorted(
+                    (haversine_km(lat, lon, p_lat, p_lon), i)
+                    for i, p_lat, p_lon in result
+                )[:10]
+
+            for name, (height, width) in VIEWPORTS.items():
+                boxes = [(lat, lon, lat + height, lon + width) for lat, lon in points]
+                print("%s:" % name)
+                scan = await measure_async("table scan", scan_bbox, boxes)
+                rtree = await measure_async("R*Tree", db.select_trucks_in_bbox, boxes)
+                print("  speedup: %.1fx" % (scan / rtree))
+            print("nearest (k=10):")
+            scan = await measure_async("table scan + sort", scan_nearest, points[:5])
+            rtree = await measure_async(
+                "R*Tree windows", db.select_nearest_trucks, points
+            )
+            print("  speedup: %.0fx" % (scan / rtree))
+        await db.engine.dispose()
+
+
+def main() -> None:
+    rows = make_rows()
+    memory(rows)
+    asyncio.run(database(rows))
+
+
+if __name__ == "__main__":
+    main()
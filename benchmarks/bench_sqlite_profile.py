@@ -0,0 +1,85 @@
+"""
+benchmarks/bench_sqlite_profile.py
+
+Concurrent mixed workload (80% reads, 20% writes) on aiosqlite:
+the "default" engine profile against the "performance" profile (WAL, PRAGMAs).
+Run: `python -m benchmarks.bench_sqlite_profile 2>/dev/null` (stderr has the SQL echo)
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+from uuid_extensions import uuid7
+
+from project.db.models import Database, SessionUserModel
+from project.db.profiles import EngineProfile, sqlite_performance_profile
+
+SESSIONS = 5000
+WORKERS = 32
+OPERATIONS = 200  # per worker
+WRITE_SHARE = 0.2
+
+
+async def worker(db: Database, session_ids, errors: list) -> None:
+    for _ in range(OPERATIONS):
+        try:
+            if random.random() < WRITE_SHARE:
+                await db.bulk_touch(
+                    random.sample(session_ids, 10), lifetime=timedelta(hours=2)
+                )
+            else:
+                async with db.session_factory() as session:
+                    await session.execute(
+                        select(SessionUserModel).where(
+                            SessionUserModel.session_id == random.choice(session_ids)
+                        )
+                    )
+        except OperationalError as error:
+            errors.append(error)
+
+
+async def run(name: str, profile: EngineProfile) -> str:
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(
+            "sqlite+aiosqlite:///%s" % os.path.join(directory, "bench.sqlite3"),
+            profile=profile,
+        )
+        db.init_engine()
+        await db.table_exists_create()
+        session_ids = [str(uuid7()) for _ in range(SESSIONS)]
+        await db.bulk_create_sessions(session_ids)
+        errors: list = []
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(db, session_ids, errors) for _ in range(WORKERS)))
+        elapsed = time.perf_counter() - start
+        total = WORKERS * OPERATIONS
+        await db.engine.dispose()
+        return "%-16s %8.0f ops/s  %6.2f s  errors: %d" % (
+            name,
+            total / elapsed,
+            elapsed,
+            len(errors),
+        )
+
+
+async def main() -> None:
+    logging.getLogger("project").setLevel(logging.WARNING)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The echo of SQL is written to stdout - it is dropped, but still formatted
+        result = await run("default/echo", EngineProfile(echo=True))
+    print(result)
+    # Without echo - the difference is the SQLite settings and the pool only
+    print(await run("default", EngineProfile()))
+    print(await run("performance", sqlite_performance_profile()))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
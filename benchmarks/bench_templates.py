@@ -0,0 +1,128 @@
+"""
+benchmarks/bench_templates.py
+
+Requests/s of 'GET /' ('templates/index.html'), the FastAPI app is called directly:
+'Jinja2Templates.TemplateResponse' on every request (before) against 'CachedTemplates'
+(the cached page, and '304' by 'If-None-Match'). And the first render of the template in
+the new process with/without the bytecode cache.
+Run: `python -m benchmarks.bench_templates`
+"""
+
+import asyncio
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from fastapi import FastAPI
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.requests import Request
+
+from project.routers.internal.views import static_assets
+from project.templating import CachedTemplates
+
+REQUESTS = 5000
+
+templates = Jinja2Templates(directory="templates")
+cached = CachedTemplates(directory="templates")
+cached.env.globals["static_url"] = static_assets.url
+app = FastAPI()
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+
+@app.get("/before")
+async def before(request: Request):
+    return templates.TemplateResponse(
+        request, name="index.html", context={"title": "First page"}
+    )
+
+
+@app.get("/after")
+async def after(request: Request):
+    return cached.cached_response(request, "index.html", {"title": "First page"})
+
+
+def make_scope(path: str, headers=()) -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": list(headers),
+        "client": ("127.0.0.1", 5000),
+        "server": ("testserver", 80),
+    }
+
+
+async def receive() -> dict:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def run(name: str, scope: dict) -> dict:
+    messages = {}
+
+    async def send(message) -> None:
+        messages[message["type"]] = message
+
+    await app(dict(scope), receive, send)
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - start
+    print(
+        "%-26s %8.0f req/s  %7.1f us/request  status %d"
+        % (
+            name,
+            REQUESTS / elapsed,
+            elapsed / REQUESTS * 1e6,
+            messages["http.response.start"]["status"],
+        )
+    )
+    return dict(messages["http.response.start"]["headers"])
+
+
+FIRST_RENDER = """
+import time
+from project.templating import CachedTemplates
+templates = CachedTemplates(directory="templates", bytecode_cache_dir=%r)
+start = time.perf_counter()
+templates.get_template("index.html")
+print("%%.2f" %% ((time.perf_counter() - start) * 1000))
+"""
+
+
+def first_render(bytecode_cache_dir: str) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", FIRST_RENDER % bytecode_cache_dir],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+async def main() -> None:
+    await run("before (TemplateResponse)", make_scope("/before"))
+    headers = await run("after (cached)", make_scope("/after"))
+    await run(
+        "after (304)", make_scope("/after", [(b"if-none-match", headers[b"etag"])])
+    )
+
+    directory = tempfile.mkdtemp()
+    try:
+        print("%-26s %8.2f ms" % ("first render, no bytecode", first_render("")))
+        first_render(directory)
+        print("%-26s %8.2f ms" % ("first render, bytecode", first_render(directory)))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,88 +2,249 @@
 """
 This module provides logging configuration.
 Logs are output to both console and a log file (default: 'log_putout.log').
+
+The records are put to the queue by 'QueueHandler' and written by the 'QueueListener'
+thread - the event loop never waits for the disk. The log file is rotated by its size
+(or by time) and the old files are kept compressed ('log_putout.log.1.gz', ...).
+
+Environment:
+    LOG_JSON: "true" - one JSON object per line (default: "false").
+    LOG_MAX_BYTES: Size of the log file before rotation (default: 10 MiB).
+    LOG_BACKUP_COUNT: Number of the kept archives (default: 5).
+    LOG_ROTATE_WHEN: Rotation by time instead of size, e.g. "midnight" (default: "").
 """
 
+import atexit
+import gzip
+import json
 import logging
+import os
+import queue
+import shutil
 import threading
-import time
+from datetime import datetime
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+    TimedRotatingFileHandler,
+)
 from typing import Optional
 
+LOG_FORMAT = (
+    "[%(asctime)s.%(msecs)03d] %(levelname)s - %(name)s:%(lineno)d - %(message)s"
+)
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%u"
+
+_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        context = {
+            "time": datetime.fromtimestamp(record.created)
+            .astimezone()
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "line": record.lineno,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            context["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            context["exc_info"] = record.exc_text
+        return json.dumps(context, ensure_ascii=False)
+
+
+class _BatchFlushMixin:
+    """
+    The stream is flushed once per batch of records by 'BatchQueueListener' - not per \
+    record (every flush is the system call and the switch of GIL with the event loop).
+    """
+
+    def flush(self) -> None:
+        pass
+
+    def flush_batch(self) -> None:
+        try:
+            super().flush()
+        except (OSError, ValueError):
+            # The stream was closed (e.g. the captured stderr at exit)
+            pass
+
+    def close(self) -> None:
+        self.flush_batch()
+        super().close()
+
+
+class CompressedRotatingFileHandler(_BatchFlushMixin, RotatingFileHandler):
+    pass
+
+
+class CompressedTimedRotatingFileHandler(_BatchFlushMixin, TimedRotatingFileHandler):
+    pass
+
+
+class ConsoleHandler(_BatchFlushMixin, logging.StreamHandler):
+    pass
+
+
+class BatchQueueListener(QueueListener):
+    """It takes all queued records at once and flushes the handlers after them."""
+
+    def _monitor(self) -> None:
+        get_nowait = self.queue.get_nowait
+        while True:
+            batch = [self.dequeue(True)]
+            while len(batch) < 1000:
+                try:
+                    batch.append(get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is self._sentinel:
+                    stop = True
+                    continue
+                self.handle(record)
+            for handler in self.handlers:
+                flush = getattr(handler, "flush_batch", handler.flush)
+                flush()
+            if stop:
+                break
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, "rb") as file_in, gzip.open(dest, "wb") as file_out:
+        shutil.copyfileobj(file_in, file_out)
+    os.remove(source)
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def make_file_handler(
+    log_file: str,
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    when: str = "",
+) -> logging.Handler:
+    """
+    The file handler with rotation. The rotated files are compressed by gzip.
+
+    Args:
+        log_file: Path to log file
+        max_bytes: Size of the file before rotation (default: 10 MiB). It is checked by \
+            the position of the stream - the file is not read.
+        backup_count: Number of the kept archives (default: 5)
+        when: Rotation by time ("midnight", "H", ...) instead of size (default: "" - size)
+    """
+    if when:
+        handler: logging.Handler = CompressedTimedRotatingFileHandler(
+            log_file, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        handler = CompressedRotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    handler.namer = _gzip_namer
+    handler.rotator = _gzip_rotator
+    return handler
+
 
 def configure_logging(
-    level: int = logging.INFO, log_file: str = "log_putout.log"
-) -> None:
+    level: int = logging.INFO,
+    log_file: str = "log_putout.log",
+    json_format: Optional[bool] = None,
+    stream=None,
+) -> QueueListener:
     """
-    Initialize logging configuration.
+    Initialize logging configuration. Only the first call builds the pipeline; the next \
+    calls (every module calls it at import) only lower the level if it is needed.
 
     Args:
         level: Logging level (default: logging.INFO)
         log_file: Name of the log file (default: 'log_putout.log')
+        json_format: JSON lines instead of text (default: env 'LOG_JSON')
+        stream: Stream of the console handler (default: sys.stderr)
 
     Example:
         import logging
-        from rabbit.logs import configure_logging
+        from logs import configure_logging
         log = logging.getLogger(__name__)
         configure_logging(logging.INFO)
         log.info("Application started")
     """
-    # Clear any existing handlers
-    logging.getLogger().handlers.clear()
-
-    # Create formatter
-    formatter = logging.Formatter(
-        "[%(asctime)s.%(msecs)03d] %(levelname)s - %(name)s:%(lineno)d - %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S.%u",
-    )
-
-    # File handler
-    file_handler = logging.FileHandler(log_file, encoding="utf-8")
-    file_handler.setLevel(level)
-    file_handler.setFormatter(formatter)
-
-    # Console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(level)
-    console_handler.setFormatter(formatter)
-
-    # Configure root logger
-    logging.basicConfig(
-        level=level, handlers=[file_handler, console_handler], force=True
-    )
-
-    # Start log file maintenance thread
-    threading.Thread(
-        target=check_log_file, args=(log_file,), daemon=True, name="LogFileMaintenance"
-    ).start()
-
-
-def check_log_file(
-    log_file: str, max_lines: int = 3000, check_interval: int = 1800
-) -> None:
-    """
-    Check log file size and rotate if needed.
+    global _listener, _queue_handler
+    with _lock:
+        root = logging.getLogger()
+        if _listener is not None:
+            if level < root.level:
+                root.setLevel(level)
+            if _queue_handler not in root.handlers:
+                root.addHandler(_queue_handler)
+            return _listener
 
-    Args:
-        log_file: Path to log file
-        max_lines: Maximum lines before rotation (default: 3000)
-        check_interval: Check interval in seconds (default: 1800 = 30 min)
-    """
-    while True:
-        time.sleep(check_interval)
-        try:
-            with open(log_file, "r+", encoding="utf-8") as f:
-                lines = f.readlines()
-                if len(lines) >= max_lines:
-                    f.seek(0)
-                    f.truncate()
-                    logging.warning(
-                        "Log file %s was cleared (%d lines exceeded limit of %d)",
-                        log_file,
-                        len(lines),
-                        max_lines,
-                    )
-        except Exception as e:
-            logging.error("Error checking log file: %s", str(e), exc_info=True)
+        if json_format is None:
+            json_format = os.getenv("LOG_JSON", "false").lower() == "true"
+        # Create formatter
+        if json_format:
+            formatter: logging.Formatter = JsonFormatter()
+        else:
+            formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+        # File handler
+        file_handler = make_file_handler(
+            log_file,
+            max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+            backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+            when=os.getenv("LOG_ROTATE_WHEN", ""),
+        )
+        file_handler.setFormatter(formatter)
+
+        # Console handler
+        console_handler = ConsoleHandler(stream)
+        console_handler.setFormatter(formatter)
+
+        # The event loop only puts the record to the queue
+        _queue_handler = QueueHandler(queue.SimpleQueue())
+        _listener = BatchQueueListener(
+            _queue_handler.queue,
+            file_handler,
+            console_handler,
+            respect_handler_level=True,
+        )
+        _listener.start()
+
+        # Configure root logger
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+        return _listener
+
+
+def shutdown_logging() -> None:
+    """Write the queued records, close the files. 'configure_logging' can be called again."""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
+
+
+atexit.register(shutdown_logging)
 
 
 class Logger:
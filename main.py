@@ -1,15 +1,42 @@
 import asyncio
+import logging
+import multiprocessing
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+
 from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 
 
 from starlette.middleware import Middleware
 from starlette.middleware.cors import CORSMiddleware
 
+from project.asynchttp_client import AsyncHttpClient
+from project.clusters import ClusterIndex
+from project.http_cache import ResponseCache
+from project.live import PositionHub
+from project.http_resilience import RetryPolicy
 from project.db.models import Database, SessionUserModel
-from project.routers.internal.views import router as interal_router
+from project.db.profiler import QueryProfiler, QueryProfilerMiddleware
+from project.db.profiles import profile_from_settings
+from project.db.reaper import SessionReaper
+from project.db.spatial import SpatialIndexSync
+from project.metrics import MetricsMiddleware, observe_upstream, register_engine_pool
+from project.positions import PositionBuffer
+from project.routes import RouteTiles
+from project.routers.internal.admin import router as admin_router
+from project.routers.internal.live import router as live_router
+from project.routers.internal.clusters import router as clusters_router
+from project.routers.internal.metrics import router as metrics_router
+from project.routers.internal.positions import router as positions_router
+from project.routers.internal.routes import router as routes_router
+from project.routers.internal.views import (
+    render,
+    router as interal_router,
+    static_assets,
+)
+from project.static_assets import PrecompressedStaticFiles
 
 from dotenv_ import (
     BASE_DIR,
@@ -17,12 +44,28 @@ from dotenv_ import (
     APP_PORT,
 )
 from project.db.corn import Settings
-from project.middlewares import CustomHeaderMiddleware
+from project.middlewares import CustomHeaderMiddleware, CustomJWTMiddleware
+from logs import configure_logging
 
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
 settings = Settings()
 # JINJA
 
+# The SQL statements of 'db' are measured instead of 'echo=True'
+query_profiler = (
+    QueryProfiler(
+        slow_threshold=settings.QUERY_SLOW_THRESHOLD,
+        sample_rate=settings.QUERY_SAMPLE_RATE,
+        n_plus_one_threshold=settings.QUERY_N_PLUS_ONE,
+    )
+    if settings.QUERY_PROFILER
+    else None
+)
+
 middleware_list = [
+    # The first - it measures the time of all other middlewares too
+    Middleware(MetricsMiddleware),
     Middleware(
         CORSMiddleware,
         allow_origins=settings.ALLOWED_ORIGINS,
@@ -31,41 +74,185 @@ middleware_list = [
         allow_headers=settings.ALLOWED_HEADERS,
         expose_headers=["X-CSRF-Token", "http"],
     ),
-    Middleware(CustomHeaderMiddleware, secret_key=settings.SECRET_KEY),
+    Middleware(
+        CustomHeaderMiddleware,
+        secret_keys=settings.CSRF_KEYS,
+        max_age=settings.CSRF_TOKEN_MAX_AGE,
+        allowed_origins=settings.ALLOWED_ORIGINS,
+    ),
+    Middleware(CustomJWTMiddleware),
 ]
+if query_profiler is not None:
+    # The queries of one request - for N+1
+    middleware_list.append(Middleware(QueryProfilerMiddleware, profiler=query_profiler))
 
 static_dir = "static"
 if not os.path.exists(static_dir):
     os.makedirs(static_dir)
     print(f"Created directory: {static_dir}")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if not settings.CSRF_KEYS_SHARED:
+        log.warning(
+            "%s: neither CSRF_SECRET_KEYS nor SECRET_KEY is set in env - the CSRF-tokens "
+            "of this worker fail with '403' on the other workers" % (lifespan.__name__,)
+        )
+    # Every started resource is registered in the stack - it is stopped (in the reverse order)
+    # at the shutdown and when the next step of the startup fails
+    async with AsyncExitStack() as stack:
+        # One pooled HTTP client per worker. It is shared by all requests.
+        app.state.http_client = AsyncHttpClient(
+            timeout=settings.HTTP_CLIENT_TIMEOUT,
+            limit=settings.HTTP_CLIENT_LIMIT,
+            limit_per_host=settings.HTTP_CLIENT_LIMIT_PER_HOST,
+            keepalive_timeout=settings.HTTP_CLIENT_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=settings.HTTP_CLIENT_DNS_CACHE_TTL,
+            retry_policy=RetryPolicy(
+                attempts=settings.HTTP_CLIENT_RETRIES + 1,
+                backoff_base=settings.HTTP_CLIENT_BACKOFF_BASE,
+                backoff_max=settings.HTTP_CLIENT_BACKOFF_MAX,
+                attempt_timeout=settings.HTTP_CLIENT_ATTEMPT_TIMEOUT or None,
+            ),
+            breaker_threshold=settings.HTTP_CLIENT_BREAKER_THRESHOLD,
+            breaker_reset_timeout=settings.HTTP_CLIENT_BREAKER_RESET,
+            hedge_after=settings.HTTP_CLIENT_HEDGE_AFTER or None,
+            cache=(
+                ResponseCache(
+                    maxsize=settings.HTTP_CLIENT_CACHE_MAXSIZE,
+                    max_bytes=settings.HTTP_CLIENT_CACHE_MAX_BYTES,
+                    default_ttl=settings.HTTP_CLIENT_CACHE_TTL,
+                )
+                if settings.HTTP_CLIENT_CACHE
+                else None
+            ),
+            observer=observe_upstream,
+        )
+        stack.push_async_callback(app.state.http_client.close)
+        # The hashed and compressed files - only the new/changed files are written
+        static_assets.build()
+        # The bytecode of templates is written once - the next workers load it
+        render.precompile()
+        await check_tables()
+        register_engine_pool(db.engine)
+        # Expired sessions are deleted in background
+        reaper = SessionReaper(
+            db,
+            interval=settings.SESSION_REAPER_INTERVAL,
+            batch_size=settings.SESSION_REAPER_BATCH_SIZE,
+            vacuum_every=settings.SESSION_REAPER_VACUUM_EVERY,
+            vacuum_pages=settings.SESSION_REAPER_VACUUM_PAGES,
+        )
+        reaper.start()
+        stack.push_async_callback(reaper.stop)
+        # The reports of positions are written by batches
+        app.state.position_buffer = PositionBuffer(
+            db,
+            max_rows=settings.POSITIONS_BUFFER_ROWS,
+            batch_size=settings.POSITIONS_BATCH_SIZE,
+            flush_interval=settings.POSITIONS_FLUSH_INTERVAL,
+            put_timeout=settings.POSITIONS_PUT_TIMEOUT,
+        )
+        app.state.position_buffer.start()
+        stack.push_async_callback(app.state.position_buffer.stop)
+        # The latest positions in memory ('db.spatial' and 'db.fleet'): all rows now, then the rows
+        # of the other workers
+        spatial_sync = SpatialIndexSync(db, interval=settings.SPATIAL_SYNC_INTERVAL)
+        await spatial_sync.start()
+        stack.push_async_callback(spatial_sync.stop)
+        # The clusters of the map: the levels are made from the loaded positions, then the moved
+        # trucks are applied by the timer
+        app.state.clusters = ClusterIndex(
+            db.spatial,
+            cell_px=settings.CLUSTERS_CELL_PX,
+            max_zoom=settings.CLUSTERS_MAX_ZOOM,
+            interval=settings.CLUSTERS_INTERVAL,
+            max_tiles=settings.CLUSTERS_MAX_TILES,
+            maxsize=settings.CLUSTERS_CACHE_SIZE,
+        )
+        app.state.clusters.start()
+        stack.push_async_callback(app.state.clusters.stop)
+        # The changed positions are pushed to the subscribed sockets per tick
+        app.state.position_hub = PositionHub(
+            db.spatial,
+            interval=settings.LIVE_TICK_INTERVAL,
+            max_pending=settings.LIVE_MAX_PENDING,
+            bbox_step=settings.LIVE_BBOX_STEP,
+            max_drivers=settings.LIVE_MAX_DRIVERS,
+            snapshot_limit=settings.LIVE_SNAPSHOT_LIMIT,
+        )
+        app.state.position_hub.start()
+        stack.push_async_callback(app.state.position_hub.stop)
+        # Douglas-Peucker of the routes out of the event loop. 'spawn' - the forked child would
+        # get the threads of the running app (aiosqlite, the loop) in an undefined state
+        route_pool = (
+            ProcessPoolExecutor(
+                max_workers=settings.ROUTES_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            if settings.ROUTES_POOL_WORKERS
+            else None
+        )
+        if route_pool is not None:
+            stack.callback(route_pool.shutdown, wait=False, cancel_futures=True)
+        app.state.route_tiles = RouteTiles(
+            db,
+            executor=route_pool,
+            max_zoom=settings.ROUTES_MAX_ZOOM,
+            tolerance_px=settings.ROUTES_TOLERANCE_PX,
+            maxsize=settings.ROUTES_CACHE_SIZE,
+            max_bytes=settings.ROUTES_CACHE_MAX_BYTES,
+            live_ttl=settings.ROUTES_LIVE_TTL,
+            ttl=settings.ROUTES_CACHE_MAX_AGE,
+        )
+        yield
+
+
 app = FastAPI(
     title="Truck Driver",
     version="0.1.0",
     description="App where truck-driver is working with a map.",
     middleware=middleware_list,
+    lifespan=lifespan,
 )
 app.include_router(interal_router)
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+app.include_router(metrics_router)
+app.include_router(admin_router)
+app.include_router(positions_router)
+app.include_router(routes_router)
+app.include_router(clusters_router)
+app.include_router(live_router)
+app.state.query_profiler = query_profiler
+app.mount(
+    "/static",
+    PrecompressedStaticFiles(static_assets, max_age=settings.STATIC_MAX_AGE),
+    name="static",
+)
 
-db = Database(settings.DATABASE_URL_SQLITE)
+db = Database(
+    settings.DATABASE_URL,
+    session_cache_size=settings.SESSION_CACHE_SIZE,
+    profile=profile_from_settings(settings),
+    profiler=query_profiler,
+    spatial_cell_size=settings.SPATIAL_CELL_SIZE,
+    fleet_capacity=settings.FLEET_CAPACITY,
+)
+app.state.db = db
 
 
 async def check_tables():
     # Get engine
-    db.init_engine()
-    # Check the table 'session'.
-    result = await db.is_table_exists_async(db.engine)
-    # If false, means what we will be creating the tables from models.
-    if not result:
-        await db.table_exists_create()
+    if not db.engine:
+        db.init_engine()
+    # The one query when the schema is current, else the missing migrations.
+    await db.bootstrap_schema(vacuum_max_bytes=settings.SQLITE_VACUUM_MAX_BYTES)
 
 
 if __name__ == "__main__":
     import uvicorn
 
-    asyncio.run(check_tables())
-    # RUN APP
+    # RUN APP. The tables are checked in the 'lifespan' of every worker.
     uvicorn.run(
         "main:app",
         host=APP_HOST,
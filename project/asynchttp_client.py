@@ -1,9 +1,33 @@
 import logging
 import aiohttp
 import asyncio
-from typing import Dict, Any, Optional, Union
+import time
+from dataclasses import asdict, dataclass, replace
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Union,
+)
 from enum import Enum
+from starlette.requests import Request
+from yarl import URL
+
 from logs import configure_logging
+from project.http_cache import ResponseCache
+from project.http_resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ResilienceStats,
+    RetryPolicy,
+)
 
 log = logging.getLogger(__name__)
 configure_logging(logging.INFO)
@@ -28,10 +52,65 @@ class ContentType(Enum):
     FORMDATA = "multipart/form-data"
 
 
+# Errors of the one HTTP call: a network error, a timeout, a not JSON body.
+HTTP_CALL_ERRORS = (asyncio.TimeoutError, aiohttp.ClientError, ValueError)
+# Only the safe methods are hedged.
+HEDGED_METHODS = frozenset({"GET", "HEAD"})
+
+
+@dataclass
+class HttpCall:
+    """
+    One call of the batch for 'AsyncHttpClient.request_many' / 'AsyncHttpClient.stream_many'.
+    'timeout' (seconds) overrides the batch's timeout for this call.
+    """
+
+    method: str
+    url: str
+    params: Optional[Dict[str, Any]] = None
+    data: Optional[Union[Dict[str, Any], str]] = None
+    jsom_data: Optional[Union[Dict[str, Any], Any]] = None
+    headers: Optional[Dict[str, str]] = None
+    auth: Optional[aiohttp.BasicAuth] = None
+    timeout: Optional[float] = None
+
+
+class HttpResponse(NamedTuple):
+    """The answer of the backend: status, decoded JSON body, headers and size of body (bytes)."""
+
+    status: int
+    data: Any
+    headers: Optional[Mapping[str, str]]
+    size: int
+
+
+@dataclass
+class HttpResult:
+    """
+    Result of the one call of the batch.
+    'index' - position of the call in the batch;
+    'status', 'data' - HTTP status and decoded JSON body, when the call is done;
+    'error' - exception of the call, when it failed.
+    """
+
+    index: int
+    call: HttpCall
+    status: Optional[int] = None
+    data: Any = None
+    error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and self.status < 400
+
+
 class AsyncHttpClient:
     """
     This client is built on the library aiohttp.
     "User-Agent": "AsyncHttpClient/1.0",
+    One client (and one 'aiohttp.ClientSession') is shared per worker. The session
+    is opened lazily on the first request and lives until '.close()'. So, the TCP
+    connections, the TLS sessions and the DNS answers are reused between the calls.
     Example:
     ```
         client = AsyncHttpClient()
@@ -39,19 +118,309 @@ class AsyncHttpClient:
         responses = await client.request(
             method, url=url, jsom_data={"string": ["Hallo word"]}
         )
+        # ...
+        await client.close()
+    ```
+    Or as the context manager:
+    ```
+        async with AsyncHttpClient() as client:
+            responses = await client.request("GET", url=url)
     ```
     """
 
     message = "AsyncHttpClient"
 
-    def __init__(self, timeout: int = 30, verify_ssl: bool = True) -> None:
+    def __init__(
+        self,
+        timeout: int = 30,
+        verify_ssl: bool = True,
+        limit: int = 100,
+        limit_per_host: int = 0,
+        keepalive_timeout: float = 15.0,
+        ttl_dns_cache: Optional[int] = 300,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker_threshold: int = 0,
+        breaker_reset_timeout: float = 30.0,
+        hedge_after: Optional[float] = None,
+        cache: Optional[ResponseCache] = None,
+        observer: Optional[Callable[[str, str, int, float], None]] = None,
+    ) -> None:
+        """
+        :param int timeout: Total timeout (seconds) for the one request.
+        :param bool verify_ssl: Check the SSL certificate.
+        :param int limit: Total number of the simultaneous connections in the pool.
+        :param int limit_per_host: Number of the simultaneous connections to the one host. \
+            '0' is no limit.
+        :param float keepalive_timeout: How long (seconds) the idle connection lives in the pool.
+        :param int ttl_dns_cache: How long (seconds) the resolved DNS answer is cached. \
+            'None' caches forever.
+        :param RetryPolicy retry_policy: Retries of the idempotent methods. 'None' - without retries.
+        :param int breaker_threshold: Failures in a row which open the host's circuit. \
+            '0' - without circuit breaker.
+        :param float breaker_reset_timeout: How long (seconds) the open circuit fails fast.
+        :param float hedge_after: For GET/HEAD - when the response is not received after \
+            'hedge_after' seconds, the second (hedged) request is sent and the first answer wins. \
+            'None' - without hedging.
+        :param ResponseCache cache: Cache of the GET responses. 'None' - without cache.
+        :param observer: It gets '(method, host, status, seconds)' of every upstream call \
+            (status '0' - the call failed), e.g. 'project.metrics.observe_upstream'.
+        """
         self.timeout = aiohttp.ClientTimeout(total=timeout)
         self.verify_ssl = verify_ssl
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
         self.headers = {
             "User-Agent": "AsyncHttpClient/1.0",
             "Accept": ContentType.DEFAULT.value,
             "Content-Type": ContentType.DEFAULT.value,
         }
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.retry_policy = retry_policy or RetryPolicy(attempts=1)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        self.hedge_after = hedge_after
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.resilience = ResilienceStats()
+        self.cache = cache
+        self.observer = observer
+
+    @property
+    def closed(self) -> bool:
+        return self._session is None or self._session.closed
+
+    def _create_session(self) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+            use_dns_cache=True,
+            ssl=None if self.verify_ssl else False,
+        )
+        return aiohttp.ClientSession(
+            connector=connector, timeout=self.timeout, headers=self.headers
+        )
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """
+        The shared session. It is created on the first access (must be inside \
+        a running event loop).
+        """
+        if self.closed:
+            self._session = self._create_session()
+        return self._session
+
+    async def close(self) -> None:
+        """Close the shared session and all pooled connections."""
+        if not self.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self) -> "AsyncHttpClient":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def _send(self, call: "HttpCall") -> "HttpResponse":
+        """
+        One HTTP call on the shared session.
+        :return: status, decoded JSON body, headers and size of the body.
+        :raise asyncio.TimeoutError, aiohttp.ClientError, ValueError: the errors are not caught here.
+        """
+        if self.observer is None:
+            return await self._send_call(call)
+        status = 0
+        start = time.perf_counter()
+        try:
+            response = await self._send_call(call)
+            status = response.status
+            return response
+        finally:
+            self.observer(
+                call.method.upper(),
+                URL(call.url).host or "",
+                status,
+                time.perf_counter() - start,
+            )
+
+    async def _send_call(self, call: "HttpCall") -> "HttpResponse":
+        async with self.session.request(
+            call.method,
+            call.url,
+            params=call.params,
+            data=call.data,
+            json=call.jsom_data,
+            headers=call.headers,
+            auth=call.auth,
+        ) as response:
+            if response.status == 304:
+                return HttpResponse(response.status, None, response.headers, 0)
+            context = await response.json()
+            log.info(context)
+            body = await response.read()
+            return HttpResponse(response.status, context, response.headers, len(body))
+
+    def _breaker(self, url: str) -> Optional[CircuitBreaker]:
+        if self.breaker_threshold <= 0:
+            return None
+        host = URL(url).host or ""
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(
+                host,
+                failure_threshold=self.breaker_threshold,
+                reset_timeout=self.breaker_reset_timeout,
+            )
+        return breaker
+
+    async def _attempt(self, call: "HttpCall") -> "HttpResponse":
+        """
+        One attempt of the call. For GET/HEAD with 'hedge_after' the hedged request \
+        is sent when the first is slow, and the first successful answer is returned.
+        """
+        timeout = self.retry_policy.attempt_timeout
+        if self.hedge_after is None or call.method.upper() not in HEDGED_METHODS:
+            return await asyncio.wait_for(self._send(call), timeout)
+
+        first = asyncio.ensure_future(asyncio.wait_for(self._send(call), timeout))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if not done:
+                self.resilience.hedges_started += 1
+                pending.add(
+                    asyncio.ensure_future(asyncio.wait_for(self._send(call), timeout))
+                )
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.resilience.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _execute(self, call: "HttpCall") -> "HttpResponse":
+        """
+        The call with the circuit breaker of the host and the retries of the idempotent methods.
+        :raise CircuitOpenError: the host's circuit is open, nothing was sent.
+        """
+        policy = self.retry_policy
+        attempts = policy.attempts if policy.is_retryable(call.method) else 1
+        breaker = self._breaker(call.url)
+        self.resilience.calls += 1
+        for attempt in range(attempts):
+            if breaker is not None:
+                try:
+                    breaker.before_call()
+                except CircuitOpenError:
+                    self.resilience.short_circuited += 1
+                    raise
+            try:
+                response = await self._attempt(call)
+            except asyncio.CancelledError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            except ValueError:
+                # Not JSON body: the backend answered
+                if breaker is not None:
+                    breaker.record_success()
+                raise
+            except (asyncio.TimeoutError, aiohttp.ClientError) as error:
+                status = getattr(error, "status", None)
+                # 4xx/decode errors: the backend is healthy, retry will not help
+                if isinstance(error, aiohttp.ClientResponseError) and (
+                    status not in policy.retry_statuses
+                ):
+                    if breaker is not None:
+                        breaker.record_success()
+                    raise
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    if attempts > 1:
+                        self.resilience.retries_exhausted += 1
+                    raise
+            else:
+                if response.status not in policy.retry_statuses:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return response
+                if breaker is not None:
+                    breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    if attempts > 1:
+                        self.resilience.retries_exhausted += 1
+                    return response
+            self.resilience.retries += 1
+            delay = policy.delay(attempt)
+            log.warning(
+                "%s: retry %d of %s %s in %.3f s"
+                % (self._execute.__name__, attempt + 1, call.method, call.url, delay)
+            )
+            await asyncio.sleep(delay)
+
+    async def _fetch(self, call: "HttpCall") -> "HttpResponse":
+        """
+        '._execute()' through the response cache. Only GET is cached; the concurrent misses \
+        of the same key share the one upstream request.
+        """
+        if self.cache is None or call.method.upper() != HttpRequest.GET.value:
+            return await self._execute(call)
+        key = self.cache.key(call.url, call.params, call.headers)
+        cached, etag = self.cache.lookup(key)
+        if cached is not None:
+            return HttpResponse(cached.status, cached.data, None, 0)
+        return await self.cache.single_flight(
+            key, lambda: self._revalidate(key, call, etag)
+        )
+
+    async def _revalidate(
+        self, key: Hashable, call: "HttpCall", etag: Optional[str]
+    ) -> "HttpResponse":
+        """Miss of the cache: the conditional request (when 'etag' is known) and store."""
+        if etag:
+            headers = dict(call.headers or {})
+            headers["If-None-Match"] = etag
+            response = await self._execute(replace(call, headers=headers))
+            if response.status == 304:
+                cached = self.cache.refresh(key, response.headers)
+                if cached is not None:
+                    return HttpResponse(cached.status, cached.data, response.headers, 0)
+                # Evicted while we waited - fetch the body
+                return await self._revalidate(key, call, None)
+        else:
+            response = await self._execute(call)
+        self.cache.store(
+            key, response.status, response.data, response.headers, response.size
+        )
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters of the retries/hedging and the state of every host's circuit breaker.
+        Example: `{"calls": 10, "retries": 2, ..., "breakers": {"127.0.0.1": {"state": "closed", ...}}}`
+        """
+        context: Dict[str, Any] = asdict(self.resilience)
+        context["breakers"] = {
+            host: breaker.snapshot() for host, breaker in self.breakers.items()
+        }
+        if self.cache is not None:
+            context["cache"] = self.cache.info()
+        return context
 
     async def request(
         self,
@@ -64,32 +433,107 @@ class AsyncHttpClient:
         auth: Optional[aiohttp.BasicAuth] = None,
     ) -> dict:
         """
-        Async HTTP request for
+        Async HTTP request for the shared session.
         """
-        request_headers = self.headers.copy()
-        if headers:
-            request_headers.update(headers)
-        async with aiohttp.ClientSession(
-            timeout=self.timeout, headers=self.headers
-        ) as session:
-            message = ""
+        message = ""
+        try:
+            response = await self._fetch(
+                HttpCall(method, url, params, data, jsom_data, headers, auth)
+            )
+            return response.data
+
+        except HTTP_CALL_ERRORS as error:
+            message += "".join([".", self.request.__name__, "ERROR => ", str(error)])
+            log.error(message)
+            return {"data": message}
+
+    async def _call_one(
+        self,
+        index: int,
+        call: "HttpCall",
+        semaphore: asyncio.Semaphore,
+        timeout: Optional[float],
+    ) -> "HttpResult":
+        """
+        One item of the batch. The error of this item is kept in the result and \
+        does not cancel the other items.
+        """
+        timeout = call.timeout if call.timeout is not None else timeout
+        async with semaphore:
             try:
-                async with session.request(
-                    method,
-                    url,
-                    params=params,
-                    data=data,
-                    json=jsom_data,
-                    auth=auth,
-                ) as response:
-                    context = await response.json()
-                    log.info(context)
-
-                    return context
-
-            except (asyncio.TimeoutError, aiohttp.ClientError, Exception) as error:
-                message += "".join(
-                    [".", self.request.__name__, "ERROR => ", str(error)]
+                response = await asyncio.wait_for(self._fetch(call), timeout)
+                return HttpResult(
+                    index=index, call=call, status=response.status, data=response.data
                 )
-                log.error(message)
-                return {"data": message}
+            except HTTP_CALL_ERRORS as error:
+                log.error(
+                    "%s: item %d %s %s ERROR => %r"
+                    % (self.stream_many.__name__, index, call.method, call.url, error)
+                )
+                return HttpResult(index=index, call=call, error=error)
+
+    async def stream_many(
+        self,
+        calls: Iterable["HttpCall"],
+        concurrency: int = 10,
+        timeout: Optional[float] = None,
+    ) -> AsyncIterator["HttpResult"]:
+        """
+        Run the calls concurrently (not more than 'concurrency' at once) and yield \
+        the results as they complete. 'HttpResult.index' is the position of the call in 'calls'.
+        :param calls: iterable of 'HttpCall'.
+        :param int concurrency: Max number of the calls in flight.
+        :param float timeout: Per-call timeout (seconds). 'HttpCall.timeout' overrides it. \
+            The timed out call is reported as 'asyncio.TimeoutError' in its result.
+        Example:
+        ```
+            calls = [HttpCall(HttpRequest.GET.value, url) for url in urls]
+            async for result in client.stream_many(calls, concurrency=20, timeout=5):
+                if result.ok:
+                    ...
+        ```
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [
+            asyncio.ensure_future(self._call_one(index, call, semaphore, timeout))
+            for index, call in enumerate(calls)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # The consumer stopped early - don't leave the calls running. The cancelled tasks \
+            # are awaited: no 'Task was destroyed but it is pending' and no not retrieved errors.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def request_many(
+        self,
+        calls: Iterable["HttpCall"],
+        concurrency: int = 10,
+        timeout: Optional[float] = None,
+    ) -> List["HttpResult"]:
+        """
+        The same as '.stream_many()', but waits for all calls and returns the results \
+        in the order of 'calls'.
+        """
+        calls = list(calls)
+        results: List[Optional[HttpResult]] = [None] * len(calls)
+        async for result in self.stream_many(calls, concurrency, timeout):
+            results[result.index] = result
+        return results
+
+
+def get_http_client(request: Request) -> AsyncHttpClient:
+    """
+    FastAPI dependency. Returns the worker's shared client created in the 'lifespan' of 'main.py'.
+    Example:
+    ```
+        @router.get("/")
+        async def view(client: AsyncHttpClient = Depends(get_http_client)): ...
+    ```
+    """
+    return request.app.state.http_client
@@ -0,0 +1,163 @@
+"""
+project/cache.py
+
+In-process LRU cache with per-entry expiry and an optional weight (memory) bound.
+It is not thread-safe - one cache is used inside one event loop.
+"""
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires_at: Optional[float] = None  # of 'clock()' seconds, 'None' - never
+    weight: int = 1
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+class LRUCache:
+    """
+    Example:
+    ```
+        cache = LRUCache(maxsize=1000, ttl=60)
+        cache.set("key", {"data": 1})
+        cache.get("key") # {"data": 1}
+        cache.set("key", value, expires_at=time.time() + 5, weight=len(body))
+    ```
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        max_weight: Optional[int] = None,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        :param int maxsize: Max number of the entries.
+        :param float ttl: Default time to live (seconds) of the entry. 'None' - until eviction.
+        :param int max_weight: Max sum of the entries' weights (e.g. bytes). 'None' - no bound.
+        :param clock: Source of the time for 'expires_at'. Default is 'time.time'.
+        """
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.clock = clock
+        self.weight = 0
+        self.stats = CacheStats()
+        self._data: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and not self._is_expired(entry)
+
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        return entry.expires_at is not None and self.clock() >= entry.expires_at
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """The not expired value or 'default'. The hit moves the entry to the end of LRU."""
+        entry = self._data.get(key)
+        if entry is None:
+            self.stats.misses += 1
+            return default
+        if self._is_expired(entry):
+            self._remove(key)
+            self.stats.expirations += 1
+            self.stats.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.stats.hits += 1
+        return entry.value
+
+    def get_entry(self, key: Hashable) -> Optional[CacheEntry]:
+        """The entry even if it is expired (e.g. for revalidation). Doesn't touch stats and LRU."""
+        return self._data.get(key)
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        expires_at: Optional[float] = None,
+        weight: int = 1,
+    ) -> None:
+        """
+        :param expires_at: 'clock()' time when the entry expires. Default is 'now + ttl'.
+        :param int weight: Weight of the entry for 'max_weight'.
+        """
+        if expires_at is None and self.ttl is not None:
+            expires_at = self.clock() + self.ttl
+        if self.max_weight is not None and weight > self.max_weight:
+            # It never fits
+            self.pop(key)
+            return
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = CacheEntry(value, expires_at, weight)
+        self.weight += weight
+        while len(self._data) > self.maxsize or (
+            self.max_weight is not None and self.weight > self.max_weight
+        ):
+            _, old_entry = self._data.popitem(last=False)
+            self.weight -= old_entry.weight
+            self.stats.evictions += 1
+
+    def touch(self, key: Hashable, expires_at: Optional[float]) -> None:
+        """Set the new expiry time of the entry."""
+        entry = self._data.get(key)
+        if entry is not None:
+            entry.expires_at = expires_at
+            self._data.move_to_end(key)
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._data.pop(key)
+        self.weight -= entry.weight
+
+    def pop(self, key: Hashable) -> Any:
+        """Explicit invalidation. Returns the removed value or 'None'."""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        self._remove(key)
+        self.stats.invalidations += 1
+        return entry.value
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """The not expired entries from the least recently used. Doesn't touch stats and LRU."""
+        return [
+            (key, entry.value)
+            for key, entry in self._data.items()
+            if not self._is_expired(entry)
+        ]
+
+    def clear(self) -> None:
+        self._data.clear()
+        self.weight = 0
+
+    def info(self) -> Dict[str, Any]:
+        """Stats and the size of cache."""
+        return {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "evictions": self.stats.evictions,
+            "expirations": self.stats.expirations,
+            "invalidations": self.stats.invalidations,
+            "size": len(self._data),
+            "weight": self.weight,
+        }
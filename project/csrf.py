@@ -0,0 +1,92 @@
+"""
+project/csrf.py
+
+Stateless CSRF-tokens signed by HMAC-SHA256. Nothing is stored on the server - the token is
+valid on every worker which has the same key ring.
+Token: '<key id>.<nonce>.<timestamp>.<signature>'
+"""
+
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from typing import Callable, Dict, Optional, Sequence
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def key_id(secret: str) -> str:
+    """Short public id of the key. The secret is not restored from it."""
+    return _b64(hashlib.sha256(b"csrf-key-id:" + secret.encode("utf-8")).digest()[:6])
+
+
+class CsrfTokenSigner:
+    """
+    Key ring: the first key signs the new tokens, all keys verify. Rotation - put the new key \
+    at the start of 'CSRF_SECRET_KEYS', remove the old key after 'max_age' seconds.
+    Example:
+    ```
+        signer = CsrfTokenSigner(["new-key", "old-key"], max_age=3600)
+        token = signer.new_token()
+        signer.verify(token) # True
+    ```
+    """
+
+    def __init__(
+        self,
+        secret_keys: Sequence[str],
+        max_age: int = 60 * 60,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """
+        :param secret_keys: Key ring. The first key signs.
+        :param int max_age: Seconds while the token is valid.
+        :param clock: Source of the time. Default is 'time.time'.
+        """
+        secret_keys = [key for key in secret_keys if key]
+        if not secret_keys:
+            raise ValueError("secret_keys can't be empty")
+        self.max_age = max_age
+        self.clock = clock
+        # The 'hmac' objects are copied per token - the key is not prepared every time
+        self._keys: Dict[str, hmac.HMAC] = {}
+        for secret in secret_keys:
+            self._keys.setdefault(
+                key_id(secret),
+                hmac.new(secret.encode("utf-8"), digestmod=hashlib.sha256),
+            )
+        self._signing_key_id = key_id(secret_keys[0])
+
+    def _sign(self, kid: str, payload: str) -> Optional[str]:
+        key = self._keys.get(kid)
+        if key is None:
+            return None
+        mac = key.copy()
+        mac.update(payload.encode("ascii"))
+        return _b64(mac.digest())
+
+    def new_token(self) -> str:
+        payload = "%s.%s.%d" % (
+            self._signing_key_id,
+            secrets.token_urlsafe(16),
+            int(self.clock()),
+        )
+        return "%s.%s" % (payload, self._sign(self._signing_key_id, payload))
+
+    def verify(self, token: str) -> bool:
+        """Signature (constant-time comparison), the known key and the age of token."""
+        if not token.isascii():
+            return False
+        payload, _, signature = token.rpartition(".")
+        parts = payload.split(".")
+        if len(parts) != 3 or not parts[2].isdigit():
+            return False
+        age = self.clock() - int(parts[2])
+        # 60 seconds of the clock skew between the workers
+        if age > self.max_age or age < -60:
+            return False
+        expected = self._sign(parts[0], payload)
+        return expected is not None and hmac.compare_digest(expected, signature)
@@ -5,6 +5,7 @@ project/db/corn.py
 import os
 from typing import List
 from pydantic.v1 import BaseSettings
+from sqlalchemy.engine import URL
 from uuid_extensions import uuid7
 from dotenv_ import (
     POSTGRES_PORT,
@@ -24,18 +25,44 @@ from dotenv_ import (
 
 # SETTING
 class Settings(BaseSettings):
+    # Set 'SECRET_KEY' in env - the default is new in every process
     SECRET_KEY = str(uuid7())
     SESSIONS_LIVE_TIME: int = 60 * 60  # of seconds
+    SESSION_CACHE_SIZE: int = 10000  # of sessions in 'Database.sessions'
+    SESSION_REAPER_INTERVAL: float = 300.0  # of seconds between the passes
+    SESSION_REAPER_BATCH_SIZE: int = 500  # of rows in the one transaction
+    SESSION_REAPER_VACUUM_EVERY: int = 288  # of passes, '0' - never
+    SESSION_REAPER_VACUUM_PAGES: int = 1000  # of free pages returned by the one trim
     # SQLITE
     SQLITE_DB_PATH: str = (
         os.path.join(BASE_DIR, "%s_db.sqlite3" % POSTGRES_DB)
     ).replace("\\", "/")
+    # DATABASE: "sqlite" or "postgres"
+    DATABASE_BACKEND: str = "sqlite"
+    # ENGINE PROFILE of SQLite: "default" or "performance" (WAL, PRAGMAs)
+    DATABASE_PROFILE: str = "default"
+    # 'echo=True' of the "default" profile - every statement is logged, only for debugging.
+    # The statements are measured by 'QUERY_PROFILER' (project.db.profiler)
+    DATABASE_ECHO: bool = False
+    SQLITE_MMAP_SIZE: int = 256 * 1024 * 1024  # of bytes
+    SQLITE_CACHE_SIZE: int = -64000  # of pages, of KiB when negative
+    SQLITE_BUSY_TIMEOUT: int = 5000  # of milliseconds
+    SQLITE_POOL_SIZE: int = 5
+    # The bigger file is not VACUUMed at startup to set 'auto_vacuum', '0' - never
+    SQLITE_VACUUM_MAX_BYTES: int = 64 * 1024 * 1024  # of bytes
     # POSTGRES
     POSTGRES_PORT: str = POSTGRES_PORT
     POSTGRES_DB: str = POSTGRES_DB
     POSTGRES_PASSWORD: str = POSTGRES_PASSWORD
     POSTGRES_USER: str = POSTGRES_USER
     POSTGRES_HOST: str = POSTGRES_HOST
+    POSTGRES_POOL_SIZE: int = 10
+    POSTGRES_MAX_OVERFLOW: int = 10
+    POSTGRES_POOL_PRE_PING: bool = True
+    POSTGRES_POOL_RECYCLE: int = 1800  # of seconds, '-1' - never
+    POSTGRES_STATEMENT_CACHE_SIZE: int = 256  # of prepared statements per connection
+    # PgBouncer/pooler in transaction mode: the prepared statements are not cached
+    POSTGRES_BEHIND_POOLER: bool = False
     # CORS
     ALLOWED_ORIGINS: List[str] = [
         f"http://{APP_HOST}:{int(APP_PORT)}",
@@ -79,17 +106,127 @@ class Settings(BaseSettings):
     CSRF_COOKIE_SAMESITE: str = "lax"
     CSRF_COOKIE_SECURE: bool = not DEBUG
     CSRF_COOKIE_MAX_AGE: int = 40
+    # Key ring of the CSRF-tokens (JSON list in env). The first key signs, all keys verify.
+    # Empty - '[SECRET_KEY]'.
+    CSRF_SECRET_KEYS: List[str] = []
+    CSRF_TOKEN_MAX_AGE: int = 60 * 60  # of seconds
+    # JWT of the Django backend Person (project.jwt_auth)
+    JWT_ALGORITHM: str = "HS256"
+    JWT_SECRET_KEY: str = ""  # HS*: 'SIMPLE_JWT["SIGNING_KEY"]' of the backend
+    JWT_PUBLIC_KEY: str = ""  # RS*/ES*: PEM text, or
+    JWT_PUBLIC_KEY_PATH: str = ""  # the PEM file, or
+    JWT_PUBLIC_KEY_URL: str = ""  # the URL - it is loaded once
+    JWT_KEY_RETRY_AFTER: float = 5.0  # of seconds after the failed load of the key
+    JWT_AUDIENCE: str = ""
+    JWT_ISSUER: str = ""
+    JWT_LEEWAY: int = 0  # of seconds
+    JWT_USER_ID_CLAIM: str = "user_id"
+    JWT_CACHE_SIZE: int = 10000  # of verified tokens, '0' - off
+    # QUERY PROFILER (project.db.profiler): the slow statements are logged, the others -
+    # the sample; N+1 - the same statement so many times in one request ('0' - off)
+    QUERY_PROFILER: bool = True
+    QUERY_SLOW_THRESHOLD: float = 0.1  # of seconds
+    QUERY_SAMPLE_RATE: float = 0.0  # 0..1
+    QUERY_N_PLUS_ONE: int = 10
+    # TEMPLATES (project.templating.CachedTemplates)
+    TEMPLATES_BYTECODE_CACHE: str = (
+        ".jinja_cache"  # directory of compiled templates, "" - off
+    )
+    TEMPLATES_CACHE_SIZE: int = 256  # of rendered pages
+    TEMPLATES_CHECK_INTERVAL: float = 1.0  # of seconds between checks of template files
+    # STATIC (project.static_assets): the hashed and compressed files
+    STATIC_BUILD_DIR: str = ".static_build"
+    STATIC_MAX_AGE: int = 31536000  # of seconds of 'Cache-Control: immutable'
+    # POSITIONS (project.positions): the buffer of the reports of trucks
+    POSITIONS_BUFFER_ROWS: int = 200000  # above it the requests wait (backpressure)
+    POSITIONS_BATCH_SIZE: int = 10000  # rows of the one flush
+    POSITIONS_FLUSH_INTERVAL: float = 0.25  # of seconds
+    POSITIONS_PUT_TIMEOUT: float = 5.0  # of seconds, then 503
+    POSITIONS_MAX_AGE: float = 604800.0  # of seconds, the older reports are rejected
+    POSITIONS_MAX_SKEW: float = 300.0  # of seconds, the reports from the future
+    # SPATIAL (project.db.spatial): the index of the latest positions in memory
+    SPATIAL_CELL_SIZE: float = 0.5  # of degrees of the cell of grid
+    SPATIAL_SYNC_INTERVAL: float = 2.0  # of seconds, the positions of other workers
+    # FLEET (project.db.models.FleetState): the latest state of trucks in the arrays
+    FLEET_CAPACITY: int = 1024  # of trucks, the first size of the arrays (then doubled)
+    FLEET_PAGE_SIZE: int = (
+        5000  # of trucks of the page of '/positions/fleet' by default
+    )
+    FLEET_MAX_PAGE_SIZE: int = 20000  # of trucks of the page, the max of 'limit'
+    # CLUSTERS (project.clusters): the markers of the fleet map grouped per zoom level
+    CLUSTERS_CELL_PX: int = 64  # of pixels of the zoom, the power of 2
+    CLUSTERS_MAX_ZOOM: int = 16  # the larger zoom - the trucks one by one
+    CLUSTERS_INTERVAL: float = 1.0  # of seconds, the moved trucks are applied
+    CLUSTERS_MAX_TILES: int = 256  # of tiles of one viewport
+    CLUSTERS_CACHE_SIZE: int = 4096  # of tiles
+    # LIVE (project.live): the positions pushed by WebSocket
+    LIVE_TICK_INTERVAL: float = 0.25  # of seconds, the changes are sent per tick
+    LIVE_MAX_PENDING: int = 4  # of frames per socket, then the snapshot
+    LIVE_BBOX_STEP: float = 0.05  # of degrees, the near viewports are one frame
+    LIVE_MAX_DRIVERS: int = 1000  # of drivers of one subscription
+    LIVE_SNAPSHOT_LIMIT: int = 5000  # of trucks of the snapshot of bbox
+    # ROUTES (project.routes): the traces of drivers simplified per zoom level
+    ROUTES_POOL_WORKERS: int = 2  # of processes of Douglas-Peucker, '0' - the threads
+    ROUTES_MAX_ZOOM: int = 18
+    ROUTES_TOLERANCE_PX: float = 0.5  # of pixels of the zoom
+    ROUTES_CACHE_SIZE: int = 1024  # of trips
+    ROUTES_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # of polylines
+    ROUTES_LIVE_TTL: float = 30.0  # of seconds, the trip of today
+    ROUTES_CACHE_MAX_AGE: int = 3600  # of seconds, the trips of the past days
+    # HTTP CLIENT (project.asynchttp_client.AsyncHttpClient)
+    HTTP_CLIENT_TIMEOUT: int = 30  # of seconds
+    HTTP_CLIENT_LIMIT: int = 100
+    HTTP_CLIENT_LIMIT_PER_HOST: int = 20
+    HTTP_CLIENT_KEEPALIVE_TIMEOUT: float = 15.0  # of seconds
+    HTTP_CLIENT_DNS_CACHE_TTL: int = 300  # of seconds
+    HTTP_CLIENT_RETRIES: int = 0  # retries of GET/HEAD/PUT/DELETE, '0' - off
+    HTTP_CLIENT_BACKOFF_BASE: float = 0.1  # of seconds
+    HTTP_CLIENT_BACKOFF_MAX: float = 2.0  # of seconds
+    HTTP_CLIENT_ATTEMPT_TIMEOUT: float = 0.0  # of seconds, '0' - the total timeout only
+    HTTP_CLIENT_BREAKER_THRESHOLD: int = 0  # failures in a row, '0' - off
+    HTTP_CLIENT_BREAKER_RESET: float = 30.0  # of seconds
+    HTTP_CLIENT_HEDGE_AFTER: float = 0.0  # of seconds, '0' - off
+    HTTP_CLIENT_CACHE: bool = False  # cache of the GET responses
+    HTTP_CLIENT_CACHE_MAXSIZE: int = 1024  # of responses
+    HTTP_CLIENT_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    HTTP_CLIENT_CACHE_TTL: float = 60.0  # of seconds, when response has not 'max-age'
+
+    @property
+    def CSRF_KEYS(self) -> List[str]:
+        return self.CSRF_SECRET_KEYS or [self.SECRET_KEY]
+
+    @property
+    def CSRF_KEYS_SHARED(self) -> bool:
+        # The default 'SECRET_KEY' is new in every process - the CSRF-token of one worker
+        # fails on the others
+        return bool(self.CSRF_SECRET_KEYS) or "SECRET_KEY" in self.__fields_set__
 
     @property
     def DATABASE_URL_PS(self) -> str:
-        # POSTGRES
-        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_HOST}{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+        # POSTGRES. The user and the password are escaped.
+        return URL.create(
+            "postgresql+asyncpg",
+            username=self.POSTGRES_USER or None,
+            password=self.POSTGRES_PASSWORD or None,
+            host=self.POSTGRES_HOST or None,
+            port=int(self.POSTGRES_PORT) if self.POSTGRES_PORT else None,
+            database=self.POSTGRES_DB or None,
+        ).render_as_string(hide_password=False)
 
     @property
     def DATABASE_URL_SQLITE(self) -> str:
         # SQLIte sqlite+aiosqlite
         return f"sqlite+aiosqlite:///{self.SQLITE_DB_PATH}"
 
+    @property
+    def DATABASE_URL(self) -> str:
+        # URL of the selected 'DATABASE_BACKEND'
+        if self.DATABASE_BACKEND == "postgres":
+            return self.DATABASE_URL_PS
+        if self.DATABASE_BACKEND == "sqlite":
+            return self.DATABASE_URL_SQLITE
+        raise ValueError("Unknown DATABASE_BACKEND '%s'" % self.DATABASE_BACKEND)
+
 
 # УДАЛИТЬ
 async def create_db(settings: Settings()):
@@ -0,0 +1,397 @@
+"""
+project/db/migrations.py
+
+Versioned schema of the database. The table 'schema_version' keeps the one row with
+the number of the last applied migration. At startup 'bootstrap_schema' reads it by
+the one query and skips DDL when the schema is current.
+"""
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, List
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    text,
+)
+from sqlalchemy.engine import Connection
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+SCHEMA_VERSION_TABLE = "schema_version"
+# 'PRAGMA auto_vacuum' of SQLite
+SQLITE_AUTO_VACUUM_INCREMENTAL = 2
+# The bigger file of SQLite is not VACUUMed at startup (the copy of the whole file)
+SQLITE_VACUUM_MAX_BYTES = 64 * 1024 * 1024
+# Key of 'pg_advisory_xact_lock' - the migrations of PostgreSQL are serialized by it
+ADVISORY_LOCK_KEY = 7_305_101
+
+
+@dataclass(frozen=True)
+class Migration:
+    """
+    'upgrade' gets the sync connection (it is run by 'AsyncConnection.run_sync') inside \
+    the transaction of bootstrap. It must be idempotent - the databases created before \
+    the versioning have some of the objects already.
+    """
+
+    version: int
+    name: str
+    upgrade: Callable[[Connection], None]
+
+
+# The frozen schema of every migration: the tables and indexes as they were at the version,
+# not the current models - the change of a model is the new migration. The objects are
+# created with 'checkfirst' - the databases made by 'create_all' before the versioning have
+# some of them
+_V1 = MetaData()
+_V1_SESSION = Table(
+    "session",
+    _V1,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column(
+        "session",
+        String(40),
+        unique=True,
+        nullable=False,
+        comment="Session ID for anyone of user/ Min length 30 and max length 40 symbols",
+    ),
+    Column("created_at", DateTime),
+    Column("expires_at", DateTime),
+)
+
+# The index of the own copy of table - it is not created with the table of version 1
+_V2 = MetaData()
+_V2_SESSION_EXPIRES_AT = Index(
+    "ix_session_expires_at", _V1_SESSION.to_metadata(_V2).c.expires_at
+)
+
+_V3 = MetaData()
+_V3_POSITIONS = Table(
+    "positions",
+    _V3,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("driver_id", Integer, nullable=False),
+    Column(
+        "recorded_at", Float, nullable=False, comment="Unix time of the report, seconds"
+    ),
+    Column("lat", Float, nullable=False),
+    Column("lon", Float, nullable=False),
+    Column("speed", Float, nullable=False, comment="km/h"),
+    Column("heading", Float, nullable=False, comment="Degrees from the north, 0..360"),
+    Index("ix_positions_driver_id_recorded_at", "driver_id", "recorded_at"),
+)
+
+_V4 = MetaData()
+_V4_LATEST_POSITIONS = Table(
+    "latest_positions",
+    _V4,
+    Column("driver_id", Integer, primary_key=True, autoincrement=False),
+    Column(
+        "recorded_at", Float, nullable=False, comment="Unix time of the report, seconds"
+    ),
+    Column("lat", Float, nullable=False),
+    Column("lon", Float, nullable=False),
+    Column("speed", Float, nullable=False, comment="km/h"),
+    Column("heading", Float, nullable=False, comment="Degrees from the north, 0..360"),
+    Column(
+        "updated_at",
+        Float,
+        nullable=False,
+        comment="Unix time of the write, for the sync of workers",
+    ),
+    Index("ix_latest_positions_updated_at", "updated_at"),
+)
+
+
+def _create_session(connection: Connection) -> None:
+    _V1_SESSION.create(connection, checkfirst=True)
+
+
+def _index_session_expires_at(connection: Connection) -> None:
+    _V2_SESSION_EXPIRES_AT.create(connection, checkfirst=True)
+
+
+def _create_positions(connection: Connection) -> None:
+    _V3_POSITIONS.create(connection, checkfirst=True)
+    # The table made by 'create_all' before the index was in the model
+    for index in _V3_POSITIONS.indexes:
+        index.create(connection, checkfirst=True)
+
+
+def _rtree_box(row: str) -> List[str]:
+    """
+    The box of the point in the R*Tree - the cell of grid of 1 / 'LATEST_POSITIONS_RTREE_SCALE' \
+    degree (0.1 degree, ~11 km of latitude). The truck moves inside of its cell without the \
+    writes to the R*Tree.
+    :param str row: 'new' or the alias of table.
+    :return: the expressions of (min_lat, max_lat, min_lon, max_lon).
+    """
+    from project.db.models import LATEST_POSITIONS_RTREE_SCALE as scale
+
+    box = []
+    for column, shift in (("lat", 90), ("lon", 180)):
+        low = "CAST(({row}.{column} + {shift}) * {scale} AS INTEGER) / {scale}.0 - {shift}".format(
+            row=row, column=column, shift=shift, scale=scale
+        )
+        box.extend((low, "%s + 1.0 / %d" % (low, scale)))
+    return box
+
+
+def _create_spatial_index(connection: Connection) -> None:
+    """
+    The table 'latest_positions' from 'positions' and its spatial index:
+    SQLite - the R*Tree of the cells of points ('_rtree_box') which is kept by the triggers; \
+    PostgreSQL - GiST of 'point(lon, lat)' (without PostGIS).
+    """
+    from project.db.models import LATEST_POSITIONS_RTREE, LATEST_POSITIONS_RTREE_SCALE
+
+    _V4_LATEST_POSITIONS.create(connection, checkfirst=True)
+    for index in _V4_LATEST_POSITIONS.indexes:
+        index.create(connection, checkfirst=True)
+    table = _V4_LATEST_POSITIONS.name
+    if connection.dialect.name == "sqlite":
+        box = _rtree_box("new")
+        changed = " OR ".join(
+            "CAST((new.{column} + {shift}) * {scale} AS INTEGER) "
+            "!= CAST((old.{column} + {shift}) * {scale} AS INTEGER)".format(
+                column=column, shift=shift, scale=LATEST_POSITIONS_RTREE_SCALE
+            )
+            for column, shift in (("lat", 90), ("lon", 180))
+        )
+        for statement in (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} "
+            "USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+            "CREATE TRIGGER IF NOT EXISTS {table}_ai AFTER INSERT ON {table} BEGIN "
+            "INSERT INTO {rtree} VALUES (new.driver_id, {box}); END",
+            # Only the truck which left its cell. 'OR REPLACE' of the statements of trigger is
+            # not applied to the virtual table - 'UPDATE'
+            "CREATE TRIGGER IF NOT EXISTS {table}_au AFTER UPDATE OF lat, lon ON {table} "
+            "WHEN {changed} BEGIN "
+            "UPDATE {rtree} SET {set_box} WHERE id = new.driver_id; END",
+            "CREATE TRIGGER IF NOT EXISTS {table}_ad AFTER DELETE ON {table} BEGIN "
+            "DELETE FROM {rtree} WHERE id = old.driver_id; END",
+        ):
+            connection.execute(
+                text(
+                    statement.format(
+                        table=table,
+                        rtree=LATEST_POSITIONS_RTREE,
+                        box=", ".join(box),
+                        set_box=", ".join(
+                            "%s = %s" % (column, expression)
+                            for column, expression in zip(
+                                ("min_lat", "max_lat", "min_lon", "max_lon"), box
+                            )
+                        ),
+                        changed=changed,
+                    )
+                )
+            )
+    elif connection.dialect.name == "postgresql":
+        connection.execute(
+            text(
+                "CREATE INDEX IF NOT EXISTS ix_%s_point ON %s USING gist (point(lon, lat))"
+                % (table, table)
+            )
+        )
+    # The last report of every truck. 'WHERE 1 = 1' - the parser of SQLite needs it before
+    # 'ON CONFLICT' of 'INSERT ... SELECT'
+    connection.execute(
+        text(
+            "INSERT INTO {latest} (driver_id, recorded_at, lat, lon, speed, heading, updated_at) "
+            "SELECT p.driver_id, p.recorded_at, p.lat, p.lon, p.speed, p.heading, p.recorded_at "
+            "FROM {positions} p JOIN (SELECT driver_id, MAX(recorded_at) AS recorded_at "
+            "FROM {positions} GROUP BY driver_id) m "
+            "ON m.driver_id = p.driver_id AND m.recorded_at = p.recorded_at WHERE 1 = 1 "
+            "ON CONFLICT (driver_id) DO NOTHING".format(
+                latest=table, positions=_V3_POSITIONS.name
+            )
+        )
+    )
+    if connection.dialect.name == "sqlite":
+        # The rows which were in the table before the triggers
+        connection.execute(
+            text(
+                "INSERT OR REPLACE INTO %s SELECT l.driver_id, %s FROM %s l"
+                % (LATEST_POSITIONS_RTREE, ", ".join(_rtree_box("l")), table)
+            )
+        )
+
+
+def _nothing(connection: Connection) -> None:
+    pass
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "create table session", _create_session),
+    Migration(2, "index session.expires_at", _index_session_expires_at),
+    Migration(3, "create table positions", _create_positions),
+    Migration(4, "spatial index of latest positions", _create_spatial_index),
+    # The mode is set by 'incremental_auto_vacuum' at every bootstrap - VACUUM can't be
+    # in the transaction of migration, the failed one is tried again at the next start
+    Migration(5, "incremental auto_vacuum of SQLite", _nothing),
+]
+
+
+def latest_version() -> int:
+    return MIGRATIONS[-1].version
+
+
+async def current_version(conn: AsyncConnection) -> int:
+    """The version of schema. '0' - the table 'schema_version' doesn't exist."""
+    try:
+        result = await conn.execute(
+            text("SELECT version FROM %s WHERE id = 1" % SCHEMA_VERSION_TABLE)
+        )
+    except DBAPIError:
+        return 0
+    return result.scalar() or 0
+
+
+async def _lock(conn: AsyncConnection) -> None:
+    """
+    Only one worker migrates. PostgreSQL - the advisory lock of transaction.
+    SQLite - the first write of transaction takes the RESERVED lock, the other workers \
+    wait for it ('busy_timeout').
+    """
+    if conn.dialect.name == "postgresql":
+        await conn.execute(
+            text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY}
+        )
+    await conn.execute(
+        text(
+            "CREATE TABLE IF NOT EXISTS %s "
+            "(id INTEGER PRIMARY KEY, version INTEGER NOT NULL)" % SCHEMA_VERSION_TABLE
+        )
+    )
+    await conn.execute(
+        text(
+            "INSERT INTO {table} (id, version) SELECT 1, 0 "
+            "WHERE NOT EXISTS (SELECT 1 FROM {table} WHERE id = 1)".format(
+                table=SCHEMA_VERSION_TABLE
+            )
+        )
+    )
+    await conn.execute(
+        text("UPDATE %s SET version = version WHERE id = 1" % SCHEMA_VERSION_TABLE)
+    )
+
+
+async def incremental_auto_vacuum(
+    engine: AsyncEngine, max_bytes: int = SQLITE_VACUUM_MAX_BYTES
+) -> bool:
+    """
+    SQLite: the free pages are trimmed by 'PRAGMA incremental_vacuum(N)' (N pages, \
+    the short lock) instead of VACUUM (the copy of the whole file under the exclusive \
+    lock) - 'project.db.reaper.SessionReaper.vacuum'. The mode of the existing file is \
+    changed only by VACUUM. It is run here when the mode is not INCREMENTAL yet and \
+    the file is not above 'max_bytes'; the bigger file is left for the maintenance \
+    window (`PRAGMA auto_vacuum = INCREMENTAL; VACUUM;`). The failed VACUUM (the lock \
+    of the other worker, the full disk) does not stop the startup - the next start \
+    tries again.
+    :param int max_bytes: Bytes of the file. '0' - never VACUUM at startup.
+    :return: 'True' - the mode is INCREMENTAL.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        auto_vacuum = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+        if auto_vacuum == SQLITE_AUTO_VACUUM_INCREMENTAL:
+            return True
+        page_count = (await conn.execute(text("PRAGMA page_count"))).scalar()
+        page_size = (await conn.execute(text("PRAGMA page_size"))).scalar()
+        size = page_count * page_size
+        if size > max_bytes:
+            log.warning(
+                "%s: auto_vacuum is not INCREMENTAL, the file of %d bytes is above "
+                "%d - run 'PRAGMA auto_vacuum = INCREMENTAL; VACUUM;' in the "
+                "maintenance window"
+                % (incremental_auto_vacuum.__name__, size, max_bytes)
+            )
+            return False
+        start = time.perf_counter()
+        try:
+            await conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            await conn.execute(text("VACUUM"))
+        except DBAPIError as error:
+            log.warning(
+                "%s: VACUUM failed, the next start tries again => %s"
+                % (incremental_auto_vacuum.__name__, error.args[0])
+            )
+            return False
+    log.info(
+        "%s: auto_vacuum is INCREMENTAL, VACUUM of %d bytes in %.3f s"
+        % (incremental_auto_vacuum.__name__, size, time.perf_counter() - start)
+    )
+    return True
+
+
+async def bootstrap_schema(
+    engine: AsyncEngine, vacuum_max_bytes: int = SQLITE_VACUUM_MAX_BYTES
+) -> int:
+    """
+    Brings the schema to the 'latest_version()'. It is safe when several workers start at once.
+    SQLite: 'incremental_auto_vacuum' is checked at every call (the one PRAGMA when \
+    it is set).
+    Example:
+    ```
+        db.init_engine()
+        await bootstrap_schema(db.engine)
+    ```
+    :param int vacuum_max_bytes: 'max_bytes' of 'incremental_auto_vacuum'.
+    :return: number of the applied migrations ('0' - the schema is current, no DDL was run).
+    """
+    start = time.perf_counter()
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    if version >= latest_version():
+        await incremental_auto_vacuum(engine, vacuum_max_bytes)
+        return 0
+
+    applied = 0
+    async with engine.begin() as conn:
+        await _lock(conn)
+        # The other worker could migrate while we waited for the lock
+        version = await current_version(conn)
+        for migration in MIGRATIONS:
+            if migration.version <= version:
+                continue
+            await conn.run_sync(migration.upgrade)
+            await conn.execute(
+                text(
+                    "UPDATE %s SET version = :version WHERE id = 1"
+                    % SCHEMA_VERSION_TABLE
+                ),
+                {"version": migration.version},
+            )
+            log.info(
+                "%s: applied migration %d '%s'"
+                % (bootstrap_schema.__name__, migration.version, migration.name)
+            )
+            applied += 1
+    await incremental_auto_vacuum(engine, vacuum_max_bytes)
+    log.info(
+        "%s: schema version %d, %d migration(s) in %.3f s"
+        % (
+            bootstrap_schema.__name__,
+            latest_version(),
+            applied,
+            time.perf_counter() - start,
+        )
+    )
+    return applied
@@ -3,8 +3,16 @@ project/db/models.py
 """
 
 import asyncio
+import json
 import logging
+import math
 import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
 from sqlalchemy.orm import validates, Session
 
 from pydantic import BaseModel, ConfigDict
@@ -12,31 +20,112 @@ from pydantic import BaseModel, ConfigDict
 from sqlalchemy import (
     Column,
     DateTime,
+    Float,
+    Index,
     Integer,
     String,
-    ColumnElement,
     create_engine,
+    delete,
+    select,
+    text,
+    update,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timedelta
 
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import declarative_base
 
 from logs import configure_logging
+from project.cache import LRUCache
+from project.db.profiler import QueryProfiler
+from project.db.profiles import EngineProfile
+from project.db.spatial import (
+    KM_PER_DEGREE,
+    SpatialGridIndex,
+    haversine_km,
+    lon_ranges,
+    min_distance_km,
+)
 
 log = logging.getLogger(__name__)
 configure_logging(logging.INFO)
 
 Base = declarative_base()
 
+SESSION_ID_REGEX = re.compile(r"([a-zA-A0-9][a-zA-A0-9-]*[a-zA-A0-9]$)")
+SESSION_ID_MIN_LENGTH = 30
+SESSION_ID_MAX_LENGTH = 40
+# Max of bound parameters of the one 'IN (...)' statement
+BULK_CHUNK_SIZE = 500
+# Rows of the one multi-row 'INSERT' of positions: 6 columns * 1000 - under the limits of
+# bound parameters of SQLite (32766) and PostgreSQL (32767)
+POSITIONS_INSERT_ROWS = 1000
+POSITION_COLUMNS = ("driver_id", "recorded_at", "lat", "lon", "speed", "heading")
+LATEST_POSITION_COLUMNS = POSITION_COLUMNS + ("updated_at",)
+# The R*Tree of SQLite (project.db.migrations). The box of every truck is its cell of
+# 1 / 'LATEST_POSITIONS_RTREE_SCALE' degree - the R*Tree is written only when the truck
+# leaves the cell; the points are checked by the columns of 'latest_positions'
+LATEST_POSITIONS_RTREE = "latest_positions_rtree"
+LATEST_POSITIONS_RTREE_SCALE = 10
+# Seconds. The rows of the other workers are read again with this overlap - their transactions
+# could be committed later than 'updated_at' was taken
+SPATIAL_SYNC_OVERLAP = 5.0
+# 'FleetState': the columns of arrays, the codes of 'status' (0 - the free slot)
+FLEET_COLUMNS = ("driver_id", "recorded_at", "lat", "lon", "speed", "heading", "status")
+FLEET_STATUS_FREE = 0
+FLEET_STATUS_MOVING = 1
+FLEET_STATUS_STOPPED = 2
+FLEET_STATUS_NAMES = np.array(["", "moving", "stopped"])
+FLEET_STOPPED_SPEED = 3.0  # km/h, the slower truck is 'stopped'
+# The records of the fleet snapshot ('application/octet-stream') - 41 bytes, little-endian
+FLEET_WIRE_DTYPE = np.dtype(
+    [
+        ("driver_id", "<i8"),
+        ("recorded_at", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("speed", "<f4"),
+        ("heading", "<f4"),
+        ("status", "u1"),
+    ]
+)
+
+
+def validate_session_ids(session_ids: Iterable[str]) -> List[str]:
+    """
+    Batched equivalent of 'SessionUserModel.validate_session_id_regex' for the bulk operations.
+    It doesn't log every row.
+    :return: list of the session ids.
+    :raise ValueError: when any session id is invalid. The message has the first invalid ids.
+    """
+    session_ids = list(session_ids)
+    invalid = [
+        session_id
+        for session_id in session_ids
+        if not SESSION_ID_MIN_LENGTH <= len(session_id) <= SESSION_ID_MAX_LENGTH
+        or not SESSION_ID_REGEX.fullmatch(session_id)
+    ]
+    if invalid:
+        raise ValueError(
+            "%s: %d session id(s) don't match regex or length, e.g. %s"
+            % (validate_session_ids.__name__, len(invalid), invalid[:5])
+        )
+    return session_ids
+
 
 class BaseSession(BaseModel):
-    session_id: int = None
-    created_at: ColumnElement[DateTime] = None
-    expires_at: ColumnElement[DateTime] = None
+    session_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True, from_attributes=True)
 
+    @property
+    def is_expired(self) -> bool:
+        """The same as 'SessionUserModel.is_expired'."""
+        return self.expires_at is not None and datetime.now() >= self.expires_at
+
 
 class SessionUserModel(Base):
     """
@@ -53,13 +142,14 @@ class SessionUserModel(Base):
         nullable=False,
         comment="Session ID for anyone of user/ Min length 30 and max length 40 symbols",
     )
-    created_at = Column(DateTime, default=datetime.now())
-    expires_at = Column(DateTime, default=lambda: datetime.now() + timedelta(hours=1))
+    created_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(
+        DateTime, default=lambda: datetime.now() + timedelta(hours=1), index=True
+    )
 
     @validates("session_id")
     def validate_session_id_regex(self, key, session_id: str) -> str:
-        regex = r"([a-zA-A0-9][a-zA-A0-9-]*[a-zA-A0-9]$)"
-        if not re.fullmatch(regex, session_id):
+        if not SESSION_ID_REGEX.fullmatch(session_id):
             raise ValueError(
                 "%s: Session_id don't match regex"
                 % (self.validate_session_id_regex.__name__,)
@@ -70,12 +160,12 @@ class SessionUserModel(Base):
         )
 
         # Valid the length of session_id
-        if len(session_id) < 30:
+        if len(session_id) < SESSION_ID_MIN_LENGTH:
             raise ValueError(
                 "%s: Session ID must be at least 30 characters long"
                 % (self.validate_session_id_regex.__name__,)
             )
-        if len(session_id) > 40:
+        if len(session_id) > SESSION_ID_MAX_LENGTH:
             raise ValueError(
                 "%s: Session ID must be at exceed 40 characters"
                 % (self.validate_session_id_regex.__name__,)
@@ -96,7 +186,7 @@ class SessionUserModel(Base):
         :param BaseSession new_session: This is object where is fields the 'created_at' and 'exires_at' it's DateTime
         :return: None
         """
-        if new_session is not None:
+        if new_session is None:
             raise ValueError("new_session cannot be None")
 
         if not isinstance(new_session, BaseSession):
@@ -113,12 +203,442 @@ class SessionUserModel(Base):
             )
             self.session_id = new_session.__getattribute__("session_id")
             self.created_at = new_session.__getattribute__("created_at")
+            if new_session.expires_at is not None:
+                self.expires_at = new_session.expires_at
+
+
+class PositionModel(Base):
+    """
+    The reports of positions of the trucks. It is written only by the batches \
+    ('Database.bulk_insert_positions'), the time is Unix seconds - no conversion per row.
+    """
+
+    __tablename__ = "positions"
+    __table_args__ = (
+        Index("ix_positions_driver_id_recorded_at", "driver_id", "recorded_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    driver_id = Column(Integer, nullable=False)
+    recorded_at = Column(
+        Float, nullable=False, comment="Unix time of the report, seconds"
+    )
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+    speed = Column(Float, nullable=False, comment="km/h")
+    heading = Column(Float, nullable=False, comment="Degrees from the north, 0..360")
+
+
+class LatestPositionModel(Base):
+    """
+    The last position of every truck - the rows of the spatial queries of dispatchers. \
+    It is upserted with every batch of 'positions'; the older report doesn't replace the newer.
+    SQLite - the R*Tree 'latest_positions_rtree' is kept by the triggers, PostgreSQL - \
+    the GiST index of 'point(lon, lat)' (project.db.migrations).
+    """
+
+    __tablename__ = "latest_positions"
+
+    driver_id = Column(Integer, primary_key=True, autoincrement=False)
+    recorded_at = Column(
+        Float, nullable=False, comment="Unix time of the report, seconds"
+    )
+    lat = Column(Float, nullable=False)
+    lon = Column(Float, nullable=False)
+    speed = Column(Float, nullable=False, comment="km/h")
+    heading = Column(Float, nullable=False, comment="Degrees from the north, 0..360")
+    updated_at = Column(
+        Float,
+        nullable=False,
+        index=True,
+        comment="Unix time of the write, for the sync of workers",
+    )
+
+
+@lru_cache(maxsize=64)
+def _values_sql(paramstyle: str, rows: int, columns: int) -> str:
+    """'(...), (...)' of 'rows' rows with the placeholders of the driver."""
+    if paramstyle == "qmark":
+        values = ["(%s)" % ", ".join("?" * columns)] * rows
+    elif paramstyle in ("format", "pyformat"):
+        values = ["(%s)" % ", ".join(["%s"] * columns)] * rows
+    elif paramstyle in ("numeric", "numeric_dollar"):
+        mark = "$%d" if paramstyle == "numeric_dollar" else ":%d"
+        values = [
+            "(%s)"
+            % ", ".join(
+                mark % (row * columns + column + 1) for column in range(columns)
+            )
+            for row in range(rows)
+        ]
+    else:
+        raise NotImplementedError(
+            "%s: paramstyle '%s' is not supported" % (_values_sql.__name__, paramstyle)
+        )
+    return ", ".join(values)
+
+
+@lru_cache(maxsize=64)
+def _positions_insert_sql(paramstyle: str, rows: int) -> str:
+    """'INSERT ... VALUES (...), (...)' of 'rows' rows with the placeholders of the driver."""
+    return "INSERT INTO %s (%s) VALUES %s" % (
+        PositionModel.__tablename__,
+        ", ".join(POSITION_COLUMNS),
+        _values_sql(paramstyle, rows, len(POSITION_COLUMNS)),
+    )
+
+
+@lru_cache(maxsize=64)
+def _latest_positions_upsert_sql(paramstyle: str, rows: int) -> str:
+    """
+    'INSERT ... ON CONFLICT (driver_id) DO UPDATE ... WHERE' the new report is newer. \
+    The same for SQLite and PostgreSQL. The driver ids of rows must be unique.
+    """
+    table = LatestPositionModel.__tablename__
+    return (
+        "INSERT INTO %s (%s) VALUES %s ON CONFLICT (driver_id) DO UPDATE SET %s "
+        "WHERE excluded.recorded_at > %s.recorded_at"
+        % (
+            table,
+            ", ".join(LATEST_POSITION_COLUMNS),
+            _values_sql(paramstyle, rows, len(LATEST_POSITION_COLUMNS)),
+            ", ".join(
+                "%s = excluded.%s" % (column, column)
+                for column in LATEST_POSITION_COLUMNS[1:]
+            ),
+            table,
+        )
+    )
+
+
+def latest_per_driver(rows: Sequence[Tuple]) -> List[Tuple]:
+    """
+    The newest row of every driver id.
+    :param rows: Tuples in the order of 'POSITION_COLUMNS'.
+    """
+    latest: Dict[int, Tuple] = {}
+    for row in rows:
+        current = latest.get(row[0])
+        if current is None or row[1] >= current[1]:
+            latest[row[0]] = row
+    return list(latest.values())
+
+
+class SessionCache:
+    """
+    Read-through cache of the sessions for the 'Database'. Key is 'session_id'.
+    The entry expires at the session's 'expires_at', the least recently used \
+    entries are evicted when 'maxsize' is reached.
+    Example:
+    ```
+        cache = SessionCache(maxsize=10000)
+        cache.put(BaseSession.model_validate(session_user_model))
+        cache.get(session_id) # BaseSession or None
+        cache.invalidate(session_id)
+    ```
+    """
+
+    def __init__(self, maxsize: int = 10000) -> None:
+        self.entries = LRUCache(maxsize=maxsize, clock=time.time)
+
+    def get(self, session_id: str) -> Optional[BaseSession]:
+        return self.entries.get(session_id)
+
+    def put(self, session: BaseSession) -> None:
+        if session.expires_at is None or session.is_expired:
+            self.entries.pop(session.session_id)
+            return
+        self.entries.set(
+            session.session_id, session, expires_at=session.expires_at.timestamp()
+        )
+
+    def invalidate(self, session_id: str) -> None:
+        self.entries.pop(session_id)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def info(self) -> Dict[str, Any]:
+        """'hits', 'misses', 'evictions', 'expirations', 'invalidations' and 'size'."""
+        return self.entries.info()
+
+
+def fleet_json(
+    columns: Dict[str, np.ndarray], next_after: Optional[int] = None
+) -> bytes:
+    """
+    The columns of 'FleetState.columns' as the JSON arrays: `{"count": 1, "next_after": null, \
+    "driver_id": [...], ..., "status": ["moving", ...]}` - the lists are made from the arrays \
+    by 'tolist', no dict per truck.
+    :param int next_after: The cursor of the next page ('after'), None - the last page.
+    """
+    return json.dumps(
+        {
+            "count": len(columns["driver_id"]),
+            "next_after": next_after,
+            "driver_id": columns["driver_id"].tolist(),
+            "recorded_at": columns["recorded_at"].tolist(),
+            "lat": columns["lat"].tolist(),
+            "lon": columns["lon"].tolist(),
+            # float32 -> the digits of float64 are noise
+            "speed": np.round(columns["speed"].astype(np.float64), 1).tolist(),
+            "heading": np.round(columns["heading"].astype(np.float64), 1).tolist(),
+            "status": FLEET_STATUS_NAMES[columns["status"]].tolist(),
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def fleet_records(columns: Dict[str, np.ndarray]) -> bytes:
+    """The columns of 'FleetState.columns' as the records of 'FLEET_WIRE_DTYPE', no header."""
+    records = np.empty(len(columns["driver_id"]), dtype=FLEET_WIRE_DTYPE)
+    for name in FLEET_COLUMNS:
+        records[name] = columns[name]
+    return records.tobytes()
+
+
+class FleetState:
+    """
+    The latest state of every truck in memory - the struct of NumPy arrays (a column per \
+    field, a row - 'slot' - per truck) instead of the object per truck: ~50 bytes of the \
+    truck instead of some hundreds of the object with its floats.
+    The map driver id -> slot is the two sorted arrays ('searchsorted'), the slots of the \
+    removed trucks are reused. The queries are the masks of slots, they are combined by '&':
+    ```
+        fleet = FleetState()
+        fleet.update_many([(7, 1760000000.0, 55.75, 37.61, 62.5, 180.0)])
+        mask = fleet.stale(300.0) & fleet.in_region(55.0, 37.0, 56.0, 38.0)
+        fleet.ids(mask) # array([7])
+        fleet_json(fleet.columns(mask, limit=1000)) # b'{"count":1,...,"driver_id":[7],...}'
+    ```
+    """
+
+    def __init__(
+        self, capacity: int = 1024, stopped_speed: float = FLEET_STOPPED_SPEED
+    ) -> None:
+        """
+        :param int capacity: The first size of the arrays, they are doubled when it is full.
+        :param float stopped_speed: km/h. The slower truck is 'stopped', else 'moving'.
+        """
+        self.stopped_speed = stopped_speed
+        self.capacity = 0
+        # The slots [0, size) were used, the free ones are in '_free'
+        self.size = 0
+        self.driver_id = np.empty(0, dtype=np.int64)
+        self.recorded_at = np.empty(0, dtype=np.float64)
+        self.lat = np.empty(0, dtype=np.float64)
+        self.lon = np.empty(0, dtype=np.float64)
+        self.speed = np.empty(0, dtype=np.float32)
+        self.heading = np.empty(0, dtype=np.float32)
+        self.status = np.empty(0, dtype=np.uint8)
+        self._ids = np.empty(0, dtype=np.int64)
+        self._id_slots = np.empty(0, dtype=np.int32)
+        self._free = np.empty(0, dtype=np.int32)
+        self._grow(capacity)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _grow(self, needed: int) -> None:
+        capacity = max(needed, 2 * self.capacity)
+        for name in FLEET_COLUMNS:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[: self.capacity] = old
+            setattr(self, name, new)
+        self._clear_slots(np.arange(self.capacity, capacity))
+        self.capacity = capacity
+
+    def _clear_slots(self, slots: np.ndarray) -> None:
+        self.driver_id[slots] = 0
+        # Any report is newer than the free slot
+        self.recorded_at[slots] = -np.inf
+        self.lat[slots] = self.lon[slots] = np.nan
+        self.speed[slots] = self.heading[slots] = 0.0
+        self.status[slots] = FLEET_STATUS_FREE
+
+    def slots_of(self, driver_ids: np.ndarray) -> np.ndarray:
+        """:return: the slots of ids, '-1' - the truck is not in the fleet."""
+        driver_ids = np.asarray(driver_ids, dtype=np.int64)
+        if not len(self._ids):
+            return np.full(len(driver_ids), -1, dtype=np.int32)
+        positions = np.minimum(
+            np.searchsorted(self._ids, driver_ids), len(self._ids) - 1
+        )
+        found = self._ids[positions] == driver_ids
+        return np.where(found, self._id_slots[positions], -1).astype(np.int32)
+
+    def _allocate(self, driver_ids: np.ndarray) -> np.ndarray:
+        """The slots of the new (sorted, unique) ids: the free ones first, then the new."""
+        reused = self._free[len(self._free) - min(len(driver_ids), len(self._free)) :]
+        self._free = self._free[: len(self._free) - len(reused)]
+        added = len(driver_ids) - len(reused)
+        if self.size + added > self.capacity:
+            self._grow(self.size + added)
+        slots = np.concatenate(
+            (reused, np.arange(self.size, self.size + added, dtype=np.int32))
+        )
+        self.size += added
+        positions = np.searchsorted(self._ids, driver_ids)
+        self._ids = np.insert(self._ids, positions, driver_ids)
+        self._id_slots = np.insert(self._id_slots, positions, slots)
+        return slots
+
+    def update_many(self, rows: Sequence[Sequence]) -> int:
+        """
+        The older report doesn't replace the newer; of the same truck in 'rows' - the newest.
+        :param rows: Tuples in the order of 'POSITION_COLUMNS' (the next columns, \
+            e.g. 'updated_at', are ignored) or the array of them.
+        :return: number of the changed trucks.
+        """
+        if not len(rows):
+            return 0
+        data = np.asarray(rows, dtype=np.float64)[:, : len(POSITION_COLUMNS)]
+        driver_ids = data[:, 0].astype(np.int64)
+        # The newest row of every id: sorted by (id, time) - the last row of the id
+        order = np.lexsort((data[:, 1], driver_ids))
+        driver_ids = driver_ids[order]
+        last = np.append(driver_ids[1:] != driver_ids[:-1], True)
+        data, driver_ids = data[order[last]], driver_ids[last]
+        slots = self.slots_of(driver_ids)
+        new = slots < 0
+        if new.any():
+            slots[new] = self._allocate(driver_ids[new])
+        newer = data[:, 1] >= self.recorded_at[slots]
+        slots, data = slots[newer], data[newer]
+        self.driver_id[slots] = driver_ids[newer]
+        self.recorded_at[slots] = data[:, 1]
+        self.lat[slots] = data[:, 2]
+        self.lon[slots] = data[:, 3]
+        self.speed[slots] = data[:, 4]
+        self.heading[slots] = data[:, 5]
+        self.status[slots] = np.where(
+            data[:, 4] < self.stopped_speed, FLEET_STATUS_STOPPED, FLEET_STATUS_MOVING
+        )
+        return len(slots)
+
+    def remove_many(self, driver_ids: Iterable[int]) -> int:
+        """:return: number of the removed trucks. Their slots are reused by the new trucks."""
+        driver_ids = np.unique(np.fromiter(driver_ids, dtype=np.int64))
+        slots = self.slots_of(driver_ids)
+        found = slots >= 0
+        slots = slots[found]
+        if not len(slots):
+            return 0
+        self._clear_slots(slots)
+        self._free = np.concatenate((self._free, slots))
+        keep = ~np.isin(self._ids, driver_ids[found], assume_unique=True)
+        self._ids, self._id_slots = self._ids[keep], self._id_slots[keep]
+        return len(slots)
+
+    def get(self, driver_id: int) -> Optional[Tuple]:
+        """:return: the tuple in the order of 'POSITION_COLUMNS' or None."""
+        slot = int(self.slots_of([driver_id])[0])
+        if slot < 0:
+            return None
+        return (
+            int(self.driver_id[slot]),
+            float(self.recorded_at[slot]),
+            float(self.lat[slot]),
+            float(self.lon[slot]),
+            float(self.speed[slot]),
+            float(self.heading[slot]),
+        )
+
+    def used(self) -> np.ndarray:
+        """The mask of the slots of trucks. All masks are of the slots [0, size)."""
+        return self.status[: self.size] != FLEET_STATUS_FREE
+
+    def stale(self, max_age: float, now: Optional[float] = None) -> np.ndarray:
+        """The mask of the trucks without reports for more than 'max_age' seconds."""
+        if now is None:
+            now = time.time()
+        return self.used() & (self.recorded_at[: self.size] < now - max_age)
+
+    def in_region(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """The mask of the trucks in the box. 'min_lon' > 'max_lon' - over the antimeridian."""
+        lat = self.lat[: self.size]
+        lon = self.lon[: self.size]
+        if min_lon <= max_lon:
+            inside_lon = (lon >= min_lon) & (lon <= max_lon)
+        else:
+            inside_lon = (lon >= min_lon) | (lon <= max_lon)
+        return self.used() & (lat >= min_lat) & (lat <= max_lat) & inside_lon
+
+    def with_status(self, status: int) -> np.ndarray:
+        return self.status[: self.size] == status
+
+    def _slots(self, mask: Optional[np.ndarray]) -> np.ndarray:
+        return np.flatnonzero(self.used() if mask is None else mask)
+
+    def ids(self, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """The driver ids of the mask (None - all trucks) in the order of slots."""
+        return self.driver_id[self._slots(mask)]
+
+    def columns(
+        self,
+        mask: Optional[np.ndarray] = None,
+        limit: Optional[int] = None,
+        after: Optional[int] = None,
+    ) -> Dict[str, np.ndarray]:
+        """
+        The copies of the columns ('FLEET_COLUMNS') of the trucks of the mask in the order of \
+        driver ids - they are not changed by the next 'update_many', so they can be \
+        serialized out of the event loop ('fleet_json', 'fleet_records').
+        :param int limit: The trucks of the smallest ids.
+        :param int after: Only the ids greater than it - the cursor of the pages.
+        """
+        slots = self._slots(mask)
+        if after is not None:
+            slots = slots[self.driver_id[slots] > after]
+        if limit is not None and len(slots) > limit:
+            slots = slots[np.argpartition(self.driver_id[slots], limit - 1)[:limit]]
+        slots = slots[np.argsort(self.driver_id[slots])]
+        return {name: getattr(self, name)[slots] for name in FLEET_COLUMNS}
+
+    def to_json(
+        self, mask: Optional[np.ndarray] = None, limit: Optional[int] = None
+    ) -> bytes:
+        return fleet_json(self.columns(mask, limit))
+
+    def to_records(
+        self, mask: Optional[np.ndarray] = None, limit: Optional[int] = None
+    ) -> bytes:
+        return fleet_records(self.columns(mask, limit))
+
+    def info(self) -> Dict[str, Any]:
+        """'trucks', 'capacity', 'free' and 'bytes' of the arrays."""
+        return {
+            "trucks": len(self),
+            "capacity": self.capacity,
+            "free": len(self._free) + self.capacity - self.size,
+            "bytes": sum(getattr(self, name).nbytes for name in FLEET_COLUMNS)
+            + self._ids.nbytes
+            + self._id_slots.nbytes
+            + self._free.nbytes,
+        }
 
 
 class Database:
-    def __init__(self, path_in_db: str) -> None:
+    def __init__(
+        self,
+        path_in_db: str,
+        session_cache_size: int = 10000,
+        profile: Optional[EngineProfile] = None,
+        profiler: Optional[QueryProfiler] = None,
+        spatial_cell_size: float = 0.5,
+        fleet_capacity: int = 1024,
+    ) -> None:
         """
         :param db_url: str This is url/path to the database
+        :param int session_cache_size: Max number of the sessions in the 'SessionCache'.
+        :param EngineProfile profile: Options of the engine. Default is 'EngineProfile()' - \
+            the pool 5 + 10 without SQL echo.
+        :param QueryProfiler profiler: The statements of engine are measured by it.
+        :param float spatial_cell_size: Degrees of the cell of 'SpatialGridIndex' ('spatial').
+        :param int fleet_capacity: The first number of the slots of 'FleetState' ('fleet').
         :param is_async: bool
         engine = None
         session_factory = None or sessionmaker(engine)
@@ -145,6 +665,14 @@ class Database:
         self.is_async = self._check_async_url(path_in_db)
         self.engine = None
         self.session_factory: Session = None
+        self.sessions = SessionCache(maxsize=session_cache_size)
+        self.profile = profile or EngineProfile()
+        self.profiler = profiler
+        # The latest positions of trucks in memory - 'nearest_trucks', 'trucks_in_bbox'
+        self.spatial = SpatialGridIndex(cell_size=spatial_cell_size)
+        # The latest state of trucks in memory - the bulk queries and the fleet snapshot
+        self.fleet = FleetState(capacity=fleet_capacity)
+        self._spatial_synced_at = 0.0
 
     def init_engine(self) -> None:
         """
@@ -161,8 +689,11 @@ class Database:
         """
         if self.is_async:
             self.engine = create_async_engine(
-                self.path_in_db, echo=True, pool_size=5, max_overflow=10
+                self.path_in_db, **self.profile.engine_kwargs()
             )
+            self.profile.attach(self.engine.sync_engine)
+            if self.profiler is not None:
+                self.profiler.attach(self.engine.sync_engine)
             self.session_factory = async_sessionmaker(
                 bind=self.engine,
                 # class_=AsyncSession,
@@ -170,9 +701,10 @@ class Database:
                 autoflush=False,
             )
         else:
-            self.engine = create_engine(
-                self.path_in_db, echo=True, pool_size=5, max_overflow=10
-            )
+            self.engine = create_engine(self.path_in_db, **self.profile.engine_kwargs())
+            self.profile.attach(self.engine)
+            if self.profiler is not None:
+                self.profiler.attach(self.engine)
             # self.session_factory = sessionmaker(
             #     bind=self.engine,
             #     autocommit=False,
@@ -256,6 +788,46 @@ class Database:
                 return False
         return False
 
+    async def bootstrap_schema(self, vacuum_max_bytes: Optional[int] = None) -> int:
+        """
+        Versioned schema: the one query when the schema is current, else the missing \
+        migrations of 'project.db.migrations.MIGRATIONS'. Async engine only.
+        Example: ```python
+            db.init_engine()
+            await db.bootstrap_schema()
+        ```
+        :param int vacuum_max_bytes: SQLite, the bigger file is not VACUUMed at \
+            startup. 'None' - 'project.db.migrations.SQLITE_VACUUM_MAX_BYTES'.
+        :return: number of the applied migrations.
+        """
+        from project.db.migrations import SQLITE_VACUUM_MAX_BYTES, bootstrap_schema
+
+        if not self.engine:
+            self.init_engine()
+        if vacuum_max_bytes is None:
+            vacuum_max_bytes = SQLITE_VACUUM_MAX_BYTES
+        return await bootstrap_schema(self.engine, vacuum_max_bytes)
+
+    async def ensure_indexes(self) -> None:
+        """
+        Creates the indexes of models which are missing (e.g. 'ix_session_expires_at' \
+        in the database created before it). The tables must exist.
+        """
+        if not self.engine:
+            self.init_engine()
+
+        def create_indexes(connection) -> None:
+            for table in Base.metadata.sorted_tables:
+                for index in table.indexes:
+                    index.create(connection, checkfirst=True)
+
+        if self.is_async:
+            async with self.engine.begin() as conn:
+                await conn.run_sync(create_indexes)
+        else:
+            with self.engine.begin() as conn:
+                create_indexes(conn)
+
     async def drop_tables(self) -> None:
         if not self.engine:
             self.init_engine()
@@ -265,3 +837,413 @@ class Database:
                 await conn.run_sync(Base.metadata.drop_all)
         else:
             Base.metadata.drop_all(bind=self.engine)
+
+    async def get_session(self, session_id: str) -> Optional[BaseSession]:
+        """
+        Read-through: the session from the 'SessionCache' or, on a miss, from the table 'session'.
+        The expired session is not cached. Async engine only.
+        :return: BaseSession or None
+        """
+        cached = self.sessions.get(session_id)
+        if cached is not None:
+            return cached
+        if not self.engine:
+            self.init_engine()
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(SessionUserModel).where(
+                    SessionUserModel.session_id == session_id
+                )
+            )
+            row = result.scalar_one_or_none()
+            if row is None:
+                return None
+            base_session = BaseSession.model_validate(row)
+        self.sessions.put(base_session)
+        return base_session
+
+    async def is_session_valid(self, session_id: str) -> bool:
+        """The session exists and is not expired. For a cached session it costs no DB round-trip."""
+        base_session = await self.get_session(session_id)
+        return base_session is not None and not base_session.is_expired
+
+    async def create_session(
+        self, session_id: str, expires_at: Optional[datetime] = None
+    ) -> BaseSession:
+        """
+        Write-through: creates the row and puts the session in the cache.
+        :param session_id: str. It is validated by 'SessionUserModel.validate_session_id_regex'.
+        :param expires_at: datetime. Default is 'now + 1 hour'.
+        """
+        if not self.engine:
+            self.init_engine()
+        async with self.session_factory() as session:
+            row = SessionUserModel(session_id=session_id)
+            if expires_at is not None:
+                row.expires_at = expires_at
+            session.add(row)
+            await session.flush()
+            base_session = BaseSession.model_validate(row)
+            await session.commit()
+        self.sessions.put(base_session)
+        return base_session
+
+    async def replace_session(
+        self, session_id: str, new_session: BaseSession
+    ) -> Optional[BaseSession]:
+        """
+        Write-through of 'SessionUserModel.replace'. The old 'session_id' is invalidated.
+        :return: the new BaseSession or None, if the session was not found.
+        """
+        if not self.engine:
+            self.init_engine()
+        async with self.session_factory() as session:
+            result = await session.execute(
+                select(SessionUserModel).where(
+                    SessionUserModel.session_id == session_id
+                )
+            )
+            row = result.scalar_one_or_none()
+            if row is None:
+                self.sessions.invalidate(session_id)
+                return None
+            row.replace(new_session)
+            await session.flush()
+            base_session = BaseSession.model_validate(row)
+            await session.commit()
+        self.sessions.invalidate(session_id)
+        self.sessions.put(base_session)
+        return base_session
+
+    async def delete_session(self, session_id: str) -> None:
+        """Deletes the row and invalidates the cache."""
+        if not self.engine:
+            self.init_engine()
+        self.sessions.invalidate(session_id)
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(SessionUserModel).where(
+                    SessionUserModel.session_id == session_id
+                )
+            )
+            await session.commit()
+
+    def _refresh_cached(self, session_id: str, expires_at: datetime) -> None:
+        """Only the sessions which are in the cache already get the new expiry."""
+        entry = self.sessions.entries.get_entry(session_id)
+        if entry is not None:
+            self.sessions.put(entry.value.model_copy(update={"expires_at": expires_at}))
+
+    def _insert(self):
+        """'INSERT' of the dialect of engine - with '.on_conflict_do_update()'."""
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(SessionUserModel.__table__)
+        if self.engine.dialect.name == "sqlite":
+            return sqlite.insert(SessionUserModel.__table__)
+        raise NotImplementedError(
+            "%s: dialect '%s' is not supported"
+            % (self._insert.__name__, self.engine.dialect.name)
+        )
+
+    async def bulk_create_sessions(
+        self, session_ids: Iterable[str], lifetime: Optional[timedelta] = None
+    ) -> int:
+        """
+        Inserts many sessions by the one 'executemany' in the one transaction.
+        The cache is not filled - the new sessions are read through on the first check.
+        :param session_ids: Session ids, they are validated by 'validate_session_ids'.
+        :param lifetime: timedelta. Default is 1 hour.
+        :return: number of the inserted rows.
+        """
+        session_ids = validate_session_ids(session_ids)
+        if not session_ids:
+            return 0
+        if not self.engine:
+            self.init_engine()
+        now = datetime.now()
+        expires_at = now + (lifetime or timedelta(hours=1))
+        rows = [
+            {"session": session_id, "created_at": now, "expires_at": expires_at}
+            for session_id in session_ids
+        ]
+        async with self.engine.begin() as conn:
+            await conn.execute(SessionUserModel.__table__.insert(), rows)
+        return len(rows)
+
+    async def bulk_touch(
+        self, session_ids: Iterable[str], lifetime: Optional[timedelta] = None
+    ) -> int:
+        """
+        Extends the sessions: 'expires_at = now + lifetime'. The cached sessions get the new expiry.
+        :param lifetime: timedelta. Default is 1 hour.
+        :return: number of the updated rows.
+        """
+        session_ids = list(session_ids)
+        if not session_ids:
+            return 0
+        if not self.engine:
+            self.init_engine()
+        expires_at = datetime.now() + (lifetime or timedelta(hours=1))
+        column = SessionUserModel.__table__.c.session
+        updated = 0
+        async with self.engine.begin() as conn:
+            for start in range(0, len(session_ids), BULK_CHUNK_SIZE):
+                chunk = session_ids[start : start + BULK_CHUNK_SIZE]
+                result = await conn.execute(
+                    update(SessionUserModel.__table__)
+                    .where(column.in_(chunk))
+                    .values(expires_at=expires_at)
+                )
+                updated += result.rowcount
+        for session_id in session_ids:
+            self._refresh_cached(session_id, expires_at)
+        return updated
+
+    async def bulk_upsert(
+        self, sessions: Iterable[Union[BaseSession, Dict[str, Any]]]
+    ) -> int:
+        """
+        'INSERT ... ON CONFLICT (session) DO UPDATE' of many sessions (SQLite and PostgreSQL).
+        The missing 'created_at' is 'now', the missing 'expires_at' is 'now + 1 hour'.
+        :param sessions: BaseSession or dict with the keys 'session_id', 'created_at', 'expires_at'.
+        :return: number of the rows sent.
+        """
+        now = datetime.now()
+        default_expires_at = now + timedelta(hours=1)
+        rows = []
+        for item in sessions:
+            if isinstance(item, BaseSession):
+                item = item.model_dump()
+            rows.append(
+                {
+                    "session": item["session_id"],
+                    "created_at": item.get("created_at") or now,
+                    "expires_at": item.get("expires_at") or default_expires_at,
+                }
+            )
+        validate_session_ids(row["session"] for row in rows)
+        if not rows:
+            return 0
+        if not self.engine:
+            self.init_engine()
+        statement = self._insert()
+        statement = statement.on_conflict_do_update(
+            index_elements=[SessionUserModel.__table__.c.session],
+            set_={
+                "created_at": statement.excluded.created_at,
+                "expires_at": statement.excluded.expires_at,
+            },
+        )
+        async with self.engine.begin() as conn:
+            await conn.execute(statement, rows)
+        for row in rows:
+            self._refresh_cached(row["session"], row["expires_at"])
+        return len(rows)
+
+    async def bulk_insert_positions(self, rows: Sequence[Tuple]) -> int:
+        """
+        Inserts the positions by the multi-row 'INSERT' statements of 'POSITIONS_INSERT_ROWS' \
+        rows in the one transaction. The rows are validated by the caller \
+        ('project.positions.validate_positions').
+        The newest row of every truck is upserted to 'latest_positions' in the same \
+        transaction and, after the commit, to the index 'spatial' and to 'fleet'.
+        :param rows: Tuples in the order of 'POSITION_COLUMNS'.
+        :return: number of the inserted rows.
+        """
+        if not rows:
+            return 0
+        if not self.engine:
+            self.init_engine()
+        paramstyle = self.engine.dialect.paramstyle
+        latest = latest_per_driver(rows)
+        updated_at = time.time()
+        async with self.engine.begin() as conn:
+            for start in range(0, len(rows), POSITIONS_INSERT_ROWS):
+                chunk = rows[start : start + POSITIONS_INSERT_ROWS]
+                parameters = tuple(value for row in chunk for value in row)
+                await conn.exec_driver_sql(
+                    _positions_insert_sql(paramstyle, len(chunk)), parameters
+                )
+            for start in range(0, len(latest), POSITIONS_INSERT_ROWS):
+                chunk = latest[start : start + POSITIONS_INSERT_ROWS]
+                parameters = tuple(
+                    value for row in chunk for value in (*row, updated_at)
+                )
+                await conn.exec_driver_sql(
+                    _latest_positions_upsert_sql(paramstyle, len(chunk)), parameters
+                )
+        self.spatial.update_many(latest)
+        self.fleet.update_many(latest)
+        return len(rows)
+
+    async def sync_spatial_index(self) -> int:
+        """
+        Reads to the index 'spatial' and to 'fleet' the latest positions changed since the \
+        previous call (the first call - all rows: the state of the startup). The positions \
+        of this worker are in them already, this is for the positions written by the other \
+        workers.
+        :return: number of the read rows.
+        """
+        if not self.engine:
+            self.init_engine()
+        since = (
+            self._spatial_synced_at - SPATIAL_SYNC_OVERLAP
+            if self._spatial_synced_at
+            else None
+        )
+        table = LatestPositionModel.__table__
+        statement = select(*(table.c[column] for column in LATEST_POSITION_COLUMNS))
+        if since is not None:
+            statement = statement.where(table.c.updated_at >= since)
+        synced_at = time.time()
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(statement)).all()
+        self.spatial.update_many(rows)
+        self.fleet.update_many(rows)
+        self._spatial_synced_at = synced_at
+        return len(rows)
+
+    async def select_route_positions(
+        self, driver_id: int, start: float, end: float
+    ) -> List[Tuple[float, float, float]]:
+        """
+        The trace of the driver by the index 'ix_positions_driver_id_recorded_at'.
+        :param float start: Unix seconds, included.
+        :param float end: Unix seconds, excluded.
+        :return: [(recorded_at, lat, lon)] in the order of time.
+        """
+        if not self.engine:
+            self.init_engine()
+        table = PositionModel.__table__
+        statement = (
+            select(table.c.recorded_at, table.c.lat, table.c.lon)
+            .where(
+                table.c.driver_id == driver_id,
+                table.c.recorded_at >= start,
+                table.c.recorded_at < end,
+            )
+            .order_by(table.c.recorded_at)
+        )
+        async with self.engine.connect() as conn:
+            return [tuple(row) for row in (await conn.execute(statement)).all()]
+
+    def nearest_trucks(
+        self, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        The nearest trucks by the index in memory ('spatial'), no DB round-trip.
+        :return: [(driver id, km)] - the nearest first.
+        """
+        return self.spatial.nearest(lat, lon, k=k, max_km=max_km)
+
+    def trucks_in_bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        """The driver ids inside of the viewport by the index in memory ('spatial')."""
+        return self.spatial.bbox(min_lat, min_lon, max_lat, max_lon, limit=limit)
+
+    async def select_trucks_in_bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        limit: Optional[int] = None,
+    ) -> List[Tuple]:
+        """
+        The latest positions inside of the viewport from the database: SQLite - by the \
+        R*Tree, PostgreSQL - by the GiST index of 'point(lon, lat)'. \
+        'min_lon' > 'max_lon' - the viewport over the antimeridian.
+        :return: tuples in the order of 'POSITION_COLUMNS'.
+        """
+        if not self.engine:
+            self.init_engine()
+        columns = ", ".join("l.%s" % column for column in POSITION_COLUMNS)
+        table = LatestPositionModel.__tablename__
+        if self.engine.dialect.name == "sqlite":
+            # The boxes of R*Tree are the cells of points - the exact check is by 'l'
+            sql = (
+                "SELECT %s FROM %s r JOIN %s l ON l.driver_id = r.id "
+                "WHERE r.max_lat >= :min_lat AND r.min_lat <= :max_lat "
+                "AND r.max_lon >= :min_lon AND r.min_lon <= :max_lon "
+                "AND l.lat BETWEEN :min_lat AND :max_lat "
+                "AND l.lon BETWEEN :min_lon AND :max_lon"
+                % (columns, LATEST_POSITIONS_RTREE, table)
+            )
+        elif self.engine.dialect.name == "postgresql":
+            sql = (
+                "SELECT %s FROM %s l WHERE point(l.lon, l.lat) "
+                "<@ box(point(:min_lon, :min_lat), point(:max_lon, :max_lat))"
+                % (columns, table)
+            )
+        else:
+            raise NotImplementedError(
+                "%s: dialect '%s' is not supported"
+                % (self.select_trucks_in_bbox.__name__, self.engine.dialect.name)
+            )
+        if limit is not None:
+            sql += " LIMIT :limit"
+        found: List[Tuple] = []
+        async with self.engine.connect() as conn:
+            for west, east in lon_ranges(min_lon, max_lon):
+                result = await conn.execute(
+                    text(sql),
+                    {
+                        "min_lat": min_lat,
+                        "max_lat": max_lat,
+                        "min_lon": west,
+                        "max_lon": east,
+                        "limit": None if limit is None else limit - len(found),
+                    },
+                )
+                found.extend(tuple(row) for row in result)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    async def select_nearest_trucks(
+        self, lat: float, lon: float, k: int = 10, radius_km: float = 10.0
+    ) -> List[Tuple[Tuple, float]]:
+        """
+        The nearest latest positions from the database: the window of the spatial index \
+        around the point is doubled until the k-th truck is nearer than any truck outside \
+        of the window can be.
+        :param float radius_km: The first window.
+        :return: [(row in the order of 'POSITION_COLUMNS', km)] - the nearest first.
+        """
+        if k <= 0:
+            return []
+        dlat = radius_km / KM_PER_DEGREE
+        while True:
+            max_abs_lat = min(90.0, abs(lat) + dlat)
+            cos_lat = math.cos(math.radians(max_abs_lat))
+            dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+            if dlon >= 180.0:
+                west, east = -180.0, 180.0
+            else:
+                # Over the antimeridian - 'west' > 'east'
+                west = lon - dlon + 360.0 if lon - dlon < -180.0 else lon - dlon
+                east = lon + dlon - 360.0 if lon + dlon > 180.0 else lon + dlon
+            rows = await self.select_trucks_in_bbox(
+                max(-90.0, lat - dlat), west, min(90.0, lat + dlat), east
+            )
+            found = sorted(
+                ((row, haversine_km(lat, lon, row[2], row[3])) for row in rows),
+                key=lambda item: item[1],
+            )[:k]
+            covers_all = dlat >= 180.0 and dlon >= 180.0
+            if covers_all or (
+                len(found) == k
+                and found[-1][1] <= min_distance_km(dlat, dlon, max_abs_lat)
+            ):
+                return found
+            dlat *= 2
+
+    def invalidate_session(self, session_id: str) -> None:
+        """Explicit invalidation of the cache only (e.g. the row was changed by other worker)."""
+        self.sessions.invalidate(session_id)
@@ -0,0 +1,241 @@
+"""
+project/db/profiler.py
+
+Profiler of the SQL queries by the events 'before_cursor_execute'/'after_cursor_execute'
+of the engine (instead of 'echo=True', which formats and logs every statement).
+The statements are aggregated by the fingerprint (SQL without literals), only the slow
+statements are logged (and the sample of the rest), the repeated statement inside of one
+request is flagged as N+1.
+"""
+
+import logging
+import random
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from logs import configure_logging
+from project.cache import LRUCache
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"(?<![\w.$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_PLACEHOLDERS = re.compile(
+    r"\(\s*(?:\?|%s|:\w+|\$\d+)(?:\s*,\s*(?:\?|%s|:\w+|\$\d+))+\s*\)"
+)
+_SPACES = re.compile(r"\s+")
+_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+
+# Counts of fingerprints of the current request - for N+1
+_request_queries: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    "request_queries", default=None
+)
+
+
+def fingerprint(statement: str) -> str:
+    """
+    SQL without literals and the lengths of 'IN' lists.
+    Example: `"SELECT * FROM session WHERE id IN (?, ?, ?) AND name = 'x'"` => \
+        `"SELECT * FROM session WHERE id IN (?+) AND name = ?"`
+    """
+    statement = _STRING.sub("?", statement)
+    statement = _NUMBER.sub("?", statement)
+    statement = _POSTCOMPILE.sub("(?+)", statement)
+    statement = _PLACEHOLDERS.sub("(?+)", statement)
+    return _SPACES.sub(" ", statement).strip()
+
+
+@dataclass
+class QueryStats:
+    """The durations (seconds) of the last 'reservoir' executions give p50/p95."""
+
+    fingerprint: str
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+    slow: int = 0
+    n_plus_one: int = 0
+    durations: List[float] = field(default_factory=list)
+    _position: int = 0
+
+    def add(self, elapsed: float, reservoir: int) -> None:
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+        if len(self.durations) < reservoir:
+            self.durations.append(elapsed)
+        else:
+            self.durations[self._position] = elapsed
+            self._position = (self._position + 1) % reservoir
+
+    def percentile(self, percent: float) -> float:
+        if not self.durations:
+            return 0.0
+        ordered = sorted(self.durations)
+        return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total * 1000, 3),
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p95_ms": round(self.percentile(95) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "slow": self.slow,
+            "n_plus_one": self.n_plus_one,
+        }
+
+
+class QueryProfiler:
+    """
+    Example:
+    ```
+        profiler = QueryProfiler(slow_threshold=0.1, sample_rate=0.01)
+        db = Database(settings.DATABASE_URL, profiler=profiler)
+        db.init_engine() # the events are attached to 'db.engine'
+        ...
+        profiler.report() # the aggregates, the slowest first
+    ```
+    """
+
+    def __init__(
+        self,
+        slow_threshold: float = 0.1,
+        sample_rate: float = 0.0,
+        n_plus_one_threshold: int = 10,
+        max_fingerprints: int = 1000,
+        reservoir: int = 256,
+    ) -> None:
+        """
+        :param float slow_threshold: Seconds. The slower statements are logged (WARNING).
+        :param float sample_rate: Share (0..1) of the other statements which are logged (INFO).
+        :param int n_plus_one_threshold: The same fingerprint so many times in one request \
+            is N+1. '0' - off.
+        :param int max_fingerprints: Max number of the aggregated fingerprints (LRU).
+        :param int reservoir: Number of the last durations for percentiles.
+        """
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.reservoir = reservoir
+        self.stats = LRUCache(maxsize=max_fingerprints)
+        # The statements of SQLAlchemy are the same strings - the fingerprint is made once
+        self._fingerprints = LRUCache(maxsize=max_fingerprints * 4)
+
+    def attach(self, engine: Engine) -> None:
+        """
+        :param engine: sync engine (for async engine - 'async_engine.sync_engine').
+        """
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+        event.listen(engine, "handle_error", self._error)
+
+    def _before(
+        self, conn, cursor, statement, parameters, context, executemany
+    ) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        self.record(statement, elapsed)
+
+    def _error(self, context) -> None:
+        # The failed statement has not 'after_cursor_execute'
+        connection = context.connection
+        if connection is not None and connection.info.get("query_start"):
+            connection.info["query_start"].pop()
+
+    def _fingerprint(self, statement: str) -> str:
+        key = self._fingerprints.get(statement)
+        if key is None:
+            key = fingerprint(statement)
+            self._fingerprints.set(statement, key)
+        return key
+
+    def record(self, statement: str, elapsed: float) -> None:
+        key = self._fingerprint(statement)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = QueryStats(key)
+            self.stats.set(key, stats)
+        stats.add(elapsed, self.reservoir)
+        if elapsed >= self.slow_threshold:
+            stats.slow += 1
+            log.warning(
+                "%s: slow query %.1f ms: %s"
+                % (self.record.__name__, elapsed * 1000, key)
+            )
+        elif self.sample_rate and random.random() < self.sample_rate:
+            log.info(
+                "%s: query %.1f ms: %s" % (self.record.__name__, elapsed * 1000, key)
+            )
+        queries = _request_queries.get()
+        if queries is not None:
+            queries[key] = queries.get(key, 0) + 1
+
+    def start_request(self):
+        """:return: the token for 'finish_request'."""
+        return _request_queries.set({})
+
+    def finish_request(self, token, name: str = "") -> Dict[str, int]:
+        """
+        Flags N+1 of the request.
+        :param str name: Name of request for the log, e.g. "GET /drivers/{id}".
+        :return: fingerprint => count of the repeated statements.
+        """
+        queries = _request_queries.get() or {}
+        _request_queries.reset(token)
+        flagged = {}
+        if self.n_plus_one_threshold:
+            for key, count in queries.items():
+                if count >= self.n_plus_one_threshold:
+                    flagged[key] = count
+                    stats = self.stats.get(key)
+                    if stats is not None:
+                        stats.n_plus_one += 1
+                    log.warning(
+                        "%s: N+1 in '%s' - %d times: %s"
+                        % (self.finish_request.__name__, name, count, key)
+                    )
+        return flagged
+
+    def report(
+        self, limit: int = 50, order_by: str = "total_ms"
+    ) -> List[Dict[str, Any]]:
+        """The aggregates of fingerprints, sorted by 'order_by' (descending)."""
+        rows = [stats.as_dict() for _, stats in self.stats.items()]
+        rows.sort(key=lambda row: row.get(order_by, 0), reverse=True)
+        return rows[:limit]
+
+    def reset(self) -> None:
+        self.stats.clear()
+
+
+class QueryProfilerMiddleware:
+    """Pure ASGI middleware: the queries of every HTTP request are counted for N+1."""
+
+    def __init__(self, app: ASGIApp, profiler: QueryProfiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.profiler.n_plus_one_threshold:
+            await self.app(scope, receive, send)
+            return
+        token = self.profiler.start_request()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            self.profiler.finish_request(token, "%s %s" % (scope["method"], route))
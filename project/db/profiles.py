@@ -0,0 +1,176 @@
+"""
+project/db/profiles.py
+
+Named profiles of the SQLAlchemy engine for 'project.db.models.Database'.
+The profile is selected by 'Settings.DATABASE_BACKEND' and 'Settings.DATABASE_PROFILE'.
+"""
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Dict
+from uuid import uuid4
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class ProfileName(Enum):
+    DEFAULT = "default"
+    PERFORMANCE = "performance"
+    POSTGRES = "postgres"
+
+
+@dataclass
+class EngineProfile:
+    """
+    Options of 'create_async_engine'/'create_engine' and the PRAGMAs which are applied \
+    to every new SQLite connection (the event 'connect').
+    """
+
+    name: str = ProfileName.DEFAULT.value
+    echo: bool = False
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0
+    pool_pre_ping: bool = False
+    pool_recycle: int = -1
+    connect_args: Dict[str, Any] = field(default_factory=dict)
+    sqlite_pragmas: Dict[str, Any] = field(default_factory=dict)
+
+    def engine_kwargs(self) -> Dict[str, Any]:
+        kwargs: Dict[str, Any] = {
+            "echo": self.echo,
+            "pool_size": self.pool_size,
+            "max_overflow": self.max_overflow,
+            "pool_timeout": self.pool_timeout,
+        }
+        if self.pool_pre_ping:
+            kwargs["pool_pre_ping"] = True
+        if self.pool_recycle >= 0:
+            kwargs["pool_recycle"] = self.pool_recycle
+        if self.connect_args:
+            kwargs["connect_args"] = self.connect_args
+        return kwargs
+
+    def attach(self, engine: Engine) -> None:
+        """
+        :param engine: sync engine (for async engine - 'async_engine.sync_engine').
+        """
+        if not self.sqlite_pragmas or engine.dialect.name != "sqlite":
+            return
+        pragmas = [
+            "PRAGMA %s = %s" % (name, value)
+            for name, value in self.sqlite_pragmas.items()
+        ]
+
+        @event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+            cursor = dbapi_connection.cursor()
+            try:
+                for pragma in pragmas:
+                    cursor.execute(pragma)
+            finally:
+                cursor.close()
+
+
+def sqlite_performance_profile(
+    mmap_size: int = 256 * 1024 * 1024,
+    cache_size: int = -64000,
+    busy_timeout: int = 5000,
+    pool_size: int = 5,
+) -> EngineProfile:
+    """
+    SQLite in production: WAL (readers don't block the writer), 'synchronous=NORMAL' \
+    (safe with WAL), memory-mapped I/O, the bigger page cache, temp tables in memory and \
+    waiting 'busy_timeout' ms for the lock instead of "database is locked".
+    SQLite has the one writer, so the pool is fixed-size without overflow - the extra \
+    connections only wait for the same lock.
+    :param int mmap_size: bytes.
+    :param int cache_size: pages, or KiB when negative.
+    :param int busy_timeout: milliseconds.
+    """
+    return EngineProfile(
+        name=ProfileName.PERFORMANCE.value,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=busy_timeout / 1000 + 30.0,
+        sqlite_pragmas={
+            "journal_mode": "WAL",
+            "synchronous": "NORMAL",
+            "mmap_size": mmap_size,
+            "cache_size": cache_size,
+            "temp_store": "MEMORY",
+            "busy_timeout": busy_timeout,
+        },
+    )
+
+
+def _unique_statement_name() -> str:
+    return "__asyncpg_%s__" % uuid4().hex
+
+
+def postgres_profile(
+    pool_size: int = 10,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    pool_recycle: int = 1800,
+    statement_cache_size: int = 256,
+    behind_pooler: bool = False,
+) -> EngineProfile:
+    """
+    PostgreSQL on asyncpg. The connections are checked before use ('pool_pre_ping') and \
+    replaced after 'pool_recycle' seconds. Every connection keeps the LRU of \
+    'statement_cache_size' prepared statements.
+    Behind PgBouncer/pooler in the transaction mode the prepared statement can be executed \
+    on the other server connection - so the caches are off and the names of statements are unique.
+    """
+    if behind_pooler:
+        connect_args: Dict[str, Any] = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": _unique_statement_name,
+        }
+    else:
+        connect_args = {
+            "statement_cache_size": statement_cache_size,
+            "prepared_statement_cache_size": statement_cache_size,
+        }
+    return EngineProfile(
+        name=ProfileName.POSTGRES.value,
+        echo=False,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=pool_pre_ping,
+        pool_recycle=pool_recycle,
+        connect_args=connect_args,
+    )
+
+
+def profile_from_settings(settings) -> EngineProfile:
+    """
+    :param settings: 'project.db.corn.Settings'. For 'DATABASE_BACKEND="postgres"' it is \
+        the 'postgres_profile', else the 'DATABASE_PROFILE' of SQLite.
+    """
+    if settings.DATABASE_BACKEND == "postgres":
+        return postgres_profile(
+            pool_size=settings.POSTGRES_POOL_SIZE,
+            max_overflow=settings.POSTGRES_MAX_OVERFLOW,
+            pool_pre_ping=settings.POSTGRES_POOL_PRE_PING,
+            pool_recycle=settings.POSTGRES_POOL_RECYCLE,
+            statement_cache_size=settings.POSTGRES_STATEMENT_CACHE_SIZE,
+            behind_pooler=settings.POSTGRES_BEHIND_POOLER,
+        )
+    if settings.DATABASE_PROFILE == ProfileName.PERFORMANCE.value:
+        return sqlite_performance_profile(
+            mmap_size=settings.SQLITE_MMAP_SIZE,
+            cache_size=settings.SQLITE_CACHE_SIZE,
+            busy_timeout=settings.SQLITE_BUSY_TIMEOUT,
+            pool_size=settings.SQLITE_POOL_SIZE,
+        )
+    if settings.DATABASE_PROFILE == ProfileName.DEFAULT.value:
+        return EngineProfile(echo=settings.DATABASE_ECHO)
+    raise ValueError(
+        "%s: unknown DATABASE_PROFILE '%s'"
+        % (profile_from_settings.__name__, settings.DATABASE_PROFILE)
+    )
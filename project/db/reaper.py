@@ -0,0 +1,149 @@
+"""
+project/db/reaper.py
+
+Background task which deletes the expired sessions from the table 'session'.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import delete, select, text
+
+from logs import configure_logging
+from project.db.migrations import SQLITE_AUTO_VACUUM_INCREMENTAL
+from project.db.models import Database, SessionUserModel
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+class SessionReaper:
+    """
+    Every 'interval' seconds deletes the expired sessions by batches of 'batch_size' rows.
+    Every batch is the own short transaction, so the write lock is never held for long.
+    Every 'vacuum_every' passes the database file is trimmed by 'vacuum_pages' pages.
+    Example:
+    ```
+        reaper = SessionReaper(db, interval=300, batch_size=500)
+        reaper.start() # in the lifespan of app
+        ...
+        await reaper.stop()
+    ```
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        interval: float = 300.0,
+        batch_size: int = 500,
+        vacuum_every: int = 0,
+        vacuum_pages: int = 1000,
+    ) -> None:
+        """
+        :param Database db: Database with the initialized async engine.
+        :param float interval: Pause (seconds) between the passes.
+        :param int batch_size: Max rows deleted by the one transaction.
+        :param int vacuum_every: Trim the database after every N passes. '0' - never.
+        :param int vacuum_pages: SQLite. Max free pages returned to the OS by the one trim.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self.vacuum_every = vacuum_every
+        self.vacuum_pages = vacuum_pages
+        self.passes = 0
+        self.removed_total = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _delete_batch(self, now: datetime) -> int:
+        expired_ids = (
+            select(SessionUserModel.id)
+            .where(SessionUserModel.expires_at < now)
+            .limit(self.batch_size)
+        )
+        async with self.db.engine.begin() as conn:
+            result = await conn.execute(
+                delete(SessionUserModel).where(SessionUserModel.id.in_(expired_ids))
+            )
+        return result.rowcount
+
+    async def vacuum(self) -> None:
+        """
+        SQLite: 'PRAGMA incremental_vacuum(vacuum_pages)' - 'auto_vacuum' is INCREMENTAL \
+        after 'project.db.migrations.incremental_auto_vacuum'; never the full VACUUM, \
+        it rewrites the whole file (the positions too) under the exclusive lock. Then \
+        the passive checkpoint of WAL - the writers are not blocked.
+        PostgreSQL: VACUUM ANALYZE of the table 'session'.
+        """
+        engine = self.db.engine
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            if engine.dialect.name == "sqlite":
+                auto_vacuum = (await conn.execute(text("PRAGMA auto_vacuum"))).scalar()
+                if auto_vacuum == SQLITE_AUTO_VACUUM_INCREMENTAL:
+                    # 'execute' steps the pragma once - one page; the script runs it to the end
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.executescript(
+                        "PRAGMA incremental_vacuum(%d)" % self.vacuum_pages
+                    )
+                else:
+                    log.warning(
+                        "%s: auto_vacuum is not INCREMENTAL, the free pages are kept"
+                        % (self.vacuum.__name__,)
+                    )
+                await conn.execute(text("PRAGMA wal_checkpoint(PASSIVE)"))
+            elif engine.dialect.name == "postgresql":
+                await conn.execute(
+                    text("VACUUM (ANALYZE) %s" % SessionUserModel.__tablename__)
+                )
+
+    async def run_once(self) -> int:
+        """
+        The one pass: deletes all expired sessions batch by batch.
+        :return: number of deleted rows.
+        """
+        start = time.perf_counter()
+        now = datetime.now()
+        removed = 0
+        while True:
+            deleted = await self._delete_batch(now)
+            removed += deleted
+            if deleted < self.batch_size:
+                break
+            # Let the other writers take the lock between the batches
+            await asyncio.sleep(0)
+        self.passes += 1
+        self.removed_total += removed
+        if self.vacuum_every and self.passes % self.vacuum_every == 0:
+            await self.vacuum()
+        log.info(
+            "%s: removed %d expired sessions in %.3f s"
+            % (self.run_once.__name__, removed, time.perf_counter() - start)
+        )
+        return removed
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as error:
+                log.error("%s ERROR => %s" % (self._run.__name__, error))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="SessionReaper")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
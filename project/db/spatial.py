@@ -0,0 +1,343 @@
+"""
+project/db/spatial.py
+
+The in-memory index of the latest positions of trucks for the queries of dispatchers:
+"the trucks in this viewport" ('bbox') and "the nearest 10 trucks to this point" ('nearest').
+The positions are kept in the cells of the uniform grid (degrees), so the query reads only
+the cells around the point/viewport instead of all trucks. The index is updated by every
+written batch of positions ('Database.bulk_insert_positions') and by the rows of the other
+workers ('Database.sync_spatial_index').
+"""
+
+import asyncio
+import heapq
+import logging
+import math
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+Cell = Tuple[int, int]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Distance of the great circle, km."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(lon2 - lon1) / 2
+    a = (
+        math.sin(half_dphi) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def min_distance_km(dlat: float, dlon: float, max_abs_lat: float) -> float:
+    """
+    The lower bound of distance to any point which is at least 'dlat' degrees away by \
+    latitude or at least 'dlon' degrees away by longitude.
+    :param float max_abs_lat: Degrees. The points which are nearer by latitude are not \
+        farther from the equator than it.
+    """
+    by_lat = math.radians(dlat) * EARTH_RADIUS_KM
+    if dlon >= 180:
+        return by_lat
+    # hav(d) >= cos(phi1) * cos(phi2) * hav(dlon) >= cos(phi_max) ** 2 * hav(dlon)
+    cos_max = math.cos(math.radians(min(90.0, max_abs_lat)))
+    by_lon = (
+        2
+        * EARTH_RADIUS_KM
+        * math.asin(min(1.0, cos_max * math.sin(math.radians(dlon) / 2)))
+    )
+    return min(by_lat, by_lon)
+
+
+def lon_ranges(min_lon: float, max_lon: float) -> List[Tuple[float, float]]:
+    """The viewport over the antimeridian ('min_lon' > 'max_lon') is split in two."""
+    if min_lon <= max_lon:
+        return [(min_lon, max_lon)]
+    return [(min_lon, 180.0), (-180.0, max_lon)]
+
+
+class SpatialGridIndex:
+    """
+    Example:
+    ```
+        index = SpatialGridIndex(cell_size=0.5)
+        index.upsert(7, 55.75, 37.61, recorded_at=1760000000.0)
+        index.bbox(55.0, 37.0, 56.0, 38.0) # [7]
+        index.nearest(55.7, 37.6, k=10) # [(7, 6.1...)] - (driver id, km)
+    ```
+    """
+
+    def __init__(self, cell_size: float = 0.5) -> None:
+        """
+        :param float cell_size: Degrees. It is corrected so that 360 is divided by it. \
+            The smaller cells - the less points per query, but more cells per viewport.
+        """
+        self.columns = max(1, round(360.0 / cell_size))
+        self.cell_size = 360.0 / self.columns
+        self.rows = math.ceil(180.0 / self.cell_size)
+        # cell => {driver id: (lat, lon)}
+        self.cells: Dict[Cell, Dict[int, Tuple[float, float]]] = {}
+        # driver id => (lat, lon, recorded_at, cell)
+        self.points: Dict[int, Tuple[float, float, float, Cell]] = {}
+        # The sets of the changed driver ids of the consumers ('track_changes')
+        self._change_sets: List[Set[int]] = []
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def _row(self, lat: float) -> int:
+        return min(max(int((lat + 90.0) // self.cell_size), 0), self.rows - 1)
+
+    def _column(self, lon: float) -> int:
+        return min(max(int((lon + 180.0) // self.cell_size), 0), self.columns - 1)
+
+    def track_changes(self) -> Set[int]:
+        """
+        :return: the set which gets the driver id of every moved/removed truck. The consumer \
+            reads and clears it (e.g. by the timer) - many reports of the truck are one id.
+        """
+        changes: Set[int] = set()
+        self._change_sets.append(changes)
+        return changes
+
+    def position(self, driver_id: int) -> Optional[Tuple[float, float, float]]:
+        """:return: (lat, lon, recorded_at) or None."""
+        point = self.points.get(driver_id)
+        return None if point is None else point[:3]
+
+    def upsert(
+        self, driver_id: int, lat: float, lon: float, recorded_at: float = 0.0
+    ) -> bool:
+        """
+        :return: False - the index has the newer position of the truck, nothing is changed.
+        """
+        old = self.points.get(driver_id)
+        if old is not None and old[2] > recorded_at:
+            return False
+        cell = (self._row(lat), self._column(lon))
+        if old is not None and old[3] != cell:
+            self._discard(driver_id, old[3])
+        bucket = self.cells.get(cell)
+        if bucket is None:
+            bucket = self.cells[cell] = {}
+        bucket[driver_id] = (lat, lon)
+        self.points[driver_id] = (lat, lon, recorded_at, cell)
+        for changes in self._change_sets:
+            changes.add(driver_id)
+        return True
+
+    def update_many(self, rows: Iterable[Sequence]) -> int:
+        """
+        :param rows: Tuples in the order of 'project.db.models.POSITION_COLUMNS' - \
+            (driver_id, recorded_at, lat, lon, ...).
+        :return: number of the changed positions.
+        """
+        upsert = self.upsert
+        return sum(upsert(int(row[0]), row[2], row[3], row[1]) for row in rows)
+
+    def _discard(self, driver_id: int, cell: Cell) -> None:
+        bucket = self.cells[cell]
+        del bucket[driver_id]
+        if not bucket:
+            del self.cells[cell]
+
+    def remove(self, driver_id: int) -> None:
+        point = self.points.pop(driver_id, None)
+        if point is not None:
+            self._discard(driver_id, point[3])
+            for changes in self._change_sets:
+                changes.add(driver_id)
+
+    def clear(self) -> None:
+        for changes in self._change_sets:
+            changes.update(self.points)
+        self.cells.clear()
+        self.points.clear()
+
+    def bbox(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        limit: Optional[int] = None,
+    ) -> List[int]:
+        """
+        The trucks inside of the viewport (the borders are included). \
+        'min_lon' > 'max_lon' - the viewport over the antimeridian.
+        :return: the driver ids (not sorted).
+        """
+        found: List[int] = []
+        if min_lat > max_lat:
+            return found
+        first_row, last_row = self._row(min_lat), self._row(max_lat)
+        for west, east in lon_ranges(min_lon, max_lon):
+            first_column, last_column = self._column(west), self._column(east)
+
+            def take(
+                row: int, column: int, bucket: Dict[int, Tuple[float, float]]
+            ) -> None:
+                if first_row < row < last_row and first_column < column < last_column:
+                    # The inner cell is inside of the viewport entirely
+                    found.extend(bucket)
+                else:
+                    found.extend(
+                        driver_id
+                        for driver_id, (lat, lon) in bucket.items()
+                        if min_lat <= lat <= max_lat and west <= lon <= east
+                    )
+
+            count = (last_row - first_row + 1) * (last_column - first_column + 1)
+            if count <= len(self.cells):
+                get = self.cells.get
+                columns = range(first_column, last_column + 1)
+                for row in range(first_row, last_row + 1):
+                    for column in columns:
+                        bucket = get((row, column))
+                        if bucket:
+                            take(row, column, bucket)
+                    if limit is not None and len(found) >= limit:
+                        return found[:limit]
+            else:
+                # The viewport is larger than the occupied area - only the occupied cells
+                for (row, column), bucket in list(self.cells.items()):
+                    if (
+                        first_row <= row <= last_row
+                        and first_column <= column <= last_column
+                    ):
+                        take(row, column, bucket)
+                        if limit is not None and len(found) >= limit:
+                            return found[:limit]
+        return found
+
+    def _ring(self, row: int, column: int, radius: int) -> Iterator[Cell]:
+        """The cells on the border of the square (2 * radius + 1) around the cell."""
+        if radius == 0:
+            yield row, column
+            return
+        for d_row in range(-radius, radius + 1):
+            current = row + d_row
+            if not 0 <= current < self.rows:
+                continue
+            if abs(d_row) == radius:
+                d_columns: Iterable[int] = range(-radius, radius + 1)
+            else:
+                d_columns = (-radius, radius)
+            for d_column in d_columns:
+                yield current, (column + d_column) % self.columns
+
+    def _scan(self, lat: float, lon: float, k: int, max_km: Optional[float]):
+        distances = [
+            (haversine_km(lat, lon, point[0], point[1]), driver_id)
+            for driver_id, point in self.points.items()
+        ]
+        distances.sort()
+        return [
+            (driver_id, distance)
+            for distance, driver_id in distances[:k]
+            if max_km is None or distance <= max_km
+        ]
+
+    def nearest(
+        self, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """
+        The rings of cells around the point are read until the k-th found truck is nearer \
+        than any truck of the next ring can be.
+        :param float max_km: The farther trucks are not returned.
+        :return: [(driver id, km)] - the nearest first.
+        """
+        if k <= 0 or not self.points:
+            return []
+        row, column = self._row(lat), self._column(lon)
+        # The max-heap of the best k by the negative distance
+        best: List[Tuple[float, int]] = []
+        radius = 0
+        while True:
+            ring_size = 8 * radius or 1
+            if ring_size > len(self.cells) or 2 * radius + 1 >= self.columns:
+                # The rings are larger than the occupied area - all trucks are compared
+                return self._scan(lat, lon, k, max_km)
+            for cell in self._ring(row, column, radius):
+                bucket = self.cells.get(cell)
+                if not bucket:
+                    continue
+                for driver_id, (point_lat, point_lon) in bucket.items():
+                    distance = haversine_km(lat, lon, point_lat, point_lon)
+                    if len(best) < k:
+                        heapq.heappush(best, (-distance, driver_id))
+                    elif distance < -best[0][0]:
+                        heapq.heapreplace(best, (-distance, driver_id))
+            # Any truck outside of the read rings is at least so far
+            bound = min_distance_km(
+                radius * self.cell_size,
+                radius * self.cell_size,
+                abs(lat) + (radius + 1) * self.cell_size,
+            )
+            if len(best) == k and -best[0][0] <= bound:
+                break
+            if max_km is not None and bound > max_km:
+                break
+            radius += 1
+        found = sorted((-distance, driver_id) for distance, driver_id in best)
+        return [
+            (driver_id, distance)
+            for distance, driver_id in found
+            if max_km is None or distance <= max_km
+        ]
+
+
+class SpatialIndexSync:
+    """
+    Every 'interval' seconds reads the latest positions written by the other workers \
+    ('Database.sync_spatial_index'). The first pass (at start) fills the index from the database.
+    Example:
+    ```
+        sync = SpatialIndexSync(db, interval=2.0)
+        await sync.start() # in the lifespan of app, after the schema
+        ...
+        await sync.stop()
+    ```
+    """
+
+    def __init__(self, db, interval: float = 2.0) -> None:
+        """
+        :param db: 'project.db.models.Database' with the async engine.
+        :param float interval: Seconds between the passes. '0' - only the first pass.
+        """
+        self.db = db
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.db.sync_spatial_index()
+            except Exception as error:
+                log.error("%s ERROR => %s" % (self._run.__name__, error))
+
+    async def start(self) -> None:
+        loaded = await self.db.sync_spatial_index()
+        log.info("%s: %d latest positions are loaded" % (self.start.__name__, loaded))
+        if self.interval and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run(), name="SpatialIndexSync")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
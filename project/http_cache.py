@@ -0,0 +1,184 @@
+"""
+project/http_cache.py
+
+Opt-in in-memory cache of the GET responses for 'project.asynchttp_client.AsyncHttpClient'.
+It respects 'Cache-Control', revalidates the stale entries by 'ETag'/'If-None-Match' and
+coalesces the concurrent misses of the same URL into one upstream request (single-flight).
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional, Tuple
+
+from yarl import URL
+
+from project.cache import LRUCache
+
+
+@dataclass
+class CachedResponse:
+    status: int
+    data: Any
+    etag: Optional[str] = None
+
+
+def parse_cache_control(header: Optional[str]) -> Dict[str, Optional[str]]:
+    """
+    'Cache-Control' to the dict.
+    Example: `"public, max-age=60"` => `{"public": None, "max-age": "60"}`
+    """
+    directives: Dict[str, Optional[str]] = {}
+    if not header:
+        return directives
+    for part in header.split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip('"') if value else None
+    return directives
+
+
+class ResponseCache:
+    """
+    The data of the cached response is shared between the callers - don't mutate it.
+    Example:
+    ```
+        client = AsyncHttpClient(cache=ResponseCache(maxsize=1000, max_bytes=8 * 1024 * 1024))
+    ```
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        max_bytes: int = 16 * 1024 * 1024,
+        default_ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param int maxsize: Max number of the cached responses.
+        :param int max_bytes: Max sum of the cached bodies (bytes).
+        :param float default_ttl: Time to live (seconds) when the response has not 'max-age'.
+        """
+        self.default_ttl = default_ttl
+        self.entries = LRUCache(maxsize=maxsize, max_weight=max_bytes, clock=clock)
+        self.revalidated = 0
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    @staticmethod
+    def key(
+        url: str,
+        params: Optional[Mapping[str, Any]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ) -> Hashable:
+        """The per-call headers (e.g. a token) are the part of key - responses of users are not mixed."""
+        if params:
+            url = str(URL(url).update_query(params))
+        return url, tuple(sorted((headers or {}).items()))
+
+    def lookup(self, key: Hashable) -> Tuple[Optional[CachedResponse], Optional[str]]:
+        """
+        :return: (fresh response, None) - hit; (None, etag) - stale entry can be revalidated; \
+            (None, None) - miss.
+        """
+        entry = self.entries.get_entry(key)
+        if entry is not None and entry.value.etag and key not in self.entries:
+            # Stale, but it can be revalidated - keep it.
+            self.entries.stats.misses += 1
+            return None, entry.value.etag
+        return self.entries.get(key), None
+
+    def _ttl(self, cache_control: Dict[str, Optional[str]]) -> Optional[float]:
+        """'None' - don't store the response."""
+        if "no-store" in cache_control:
+            return None
+        if "no-cache" in cache_control:
+            return 0.0
+        for name in ("s-maxage", "max-age"):
+            value = cache_control.get(name)
+            if value is not None:
+                try:
+                    return max(float(value), 0.0)
+                except ValueError:
+                    return None
+        return self.default_ttl
+
+    def store(
+        self,
+        key: Hashable,
+        status: int,
+        data: Any,
+        headers: Mapping[str, str],
+        size: int,
+    ) -> None:
+        """Store the 200 response according to its 'Cache-Control'."""
+        if status != 200:
+            return
+        ttl = self._ttl(parse_cache_control(headers.get("Cache-Control")))
+        etag = headers.get("ETag")
+        # 'no-cache' without 'ETag' can't be revalidated - nothing to keep.
+        if ttl is None or (ttl == 0 and not etag):
+            self.entries.pop(key)
+            return
+        self.entries.set(
+            key,
+            CachedResponse(status, data, etag),
+            expires_at=self.entries.clock() + ttl,
+            weight=max(size, 1),
+        )
+
+    def refresh(
+        self, key: Hashable, headers: Mapping[str, str]
+    ) -> Optional[CachedResponse]:
+        """'304 Not Modified': the stale entry is fresh again."""
+        entry = self.entries.get_entry(key)
+        if entry is None:
+            return None
+        ttl = self._ttl(parse_cache_control(headers.get("Cache-Control")))
+        if ttl is None:
+            self.entries.pop(key)
+        else:
+            self.entries.touch(key, self.entries.clock() + ttl)
+        self.revalidated += 1
+        return entry.value
+
+    async def single_flight(
+        self, key: Hashable, fetch: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """
+        The first caller runs 'fetch()', the concurrent callers of the same key wait \
+        for its result (or its error).
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    # The leader was cancelled, not this caller - fetch by itself.
+                    return await self.single_flight(key, fetch)
+                raise
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # Mark as retrieved - it may have no waiters
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    def info(self) -> Dict[str, Any]:
+        context = self.entries.info()
+        context["revalidated"] = self.revalidated
+        context["coalesced"] = self.coalesced
+        return context
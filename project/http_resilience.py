@@ -0,0 +1,130 @@
+"""
+project/http_resilience.py
+
+Retry policy (jittered exponential backoff) and per-host circuit breaker for
+the 'project.asynchttp_client.AsyncHttpClient'.
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Dict, FrozenSet, Optional
+
+import aiohttp
+
+
+class BreakerState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """The host's circuit is open - the call was not sent."""
+
+    def __init__(self, host: str, retry_in: float) -> None:
+        super().__init__(
+            "Circuit for '%s' is open, retry in %.1f s" % (host, max(retry_in, 0.0))
+        )
+        self.host = host
+        self.retry_in = retry_in
+
+
+@dataclass
+class RetryPolicy:
+    """
+    :param int attempts: Total attempts of the one call (1 - without retries).
+    :param float backoff_base: Delay (seconds) before the first retry, it doubles on every next retry.
+    :param float backoff_max: Max delay (seconds) between attempts.
+    :param float attempt_timeout: Timeout (seconds) of the one attempt. 'None' - the \
+        client's total timeout only.
+    :param retry_statuses: Response statuses which are retried.
+    :param methods: Only the idempotent methods are retried.
+    """
+
+    attempts: int = 3
+    backoff_base: float = 0.1
+    backoff_max: float = 2.0
+    attempt_timeout: Optional[float] = None
+    retry_statuses: FrozenSet[int] = frozenset({502, 503, 504})
+    methods: FrozenSet[str] = frozenset({"GET", "HEAD", "PUT", "DELETE"})
+
+    def is_retryable(self, method: str) -> bool:
+        return method.upper() in self.methods
+
+    def delay(self, retry: int) -> float:
+        """'Full jitter' backoff: random value in [0, min(max, base * 2 ** retry)]."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**retry))
+
+
+@dataclass
+class CircuitBreaker:
+    """
+    Circuit breaker of the one host.
+    CLOSED - calls pass; 'failure_threshold' failures in a row open the circuit.
+    OPEN - calls fail fast with 'CircuitOpenError' during 'reset_timeout' seconds.
+    HALF_OPEN - one probe call passes; its success closes the circuit, its failure opens it again.
+    """
+
+    host: str
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    state: BreakerState = BreakerState.CLOSED
+    failures: int = 0
+    opened_at: float = 0.0
+    times_opened: int = 0
+    _probe_in_flight: bool = field(default=False, repr=False)
+
+    def before_call(self) -> None:
+        """:raise CircuitOpenError: when the call must not be sent."""
+        if self.state is BreakerState.OPEN:
+            retry_in = self.opened_at + self.reset_timeout - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError(self.host, retry_in)
+            self.state = BreakerState.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state is BreakerState.HALF_OPEN:
+            if self._probe_in_flight:
+                raise CircuitOpenError(self.host, self.reset_timeout)
+            self._probe_in_flight = True
+
+    def release(self) -> None:
+        """The call was cancelled - no result, but the probe slot is free again."""
+        self._probe_in_flight = False
+
+    def record_success(self) -> None:
+        self.state = BreakerState.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if (
+            self.state is BreakerState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            if self.state is not BreakerState.OPEN:
+                self.times_opened += 1
+            self.state = BreakerState.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "state": self.state.value,
+            "failures": self.failures,
+            "times_opened": self.times_opened,
+        }
+
+
+@dataclass
+class ResilienceStats:
+    """Counters of the client. They only grow."""
+
+    calls: int = 0
+    retries: int = 0
+    retries_exhausted: int = 0
+    short_circuited: int = 0
+    hedges_started: int = 0
+    hedges_won: int = 0
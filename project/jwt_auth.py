@@ -0,0 +1,324 @@
+"""
+project/jwt_auth.py
+
+Verification of the JWT-tokens issued by the Django backend Person (simplejwt) and the user
+of request ('request.user') built from the claims.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Optional, Sequence
+
+import aiohttp
+import jwt
+
+from logs import configure_logging
+from project.cache import LRUCache
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+class GroupSet:
+    """
+    Groups of the user from the token. It has the 'filter(name__in=...).exists()' of the \
+    Django queryset - but without the query.
+    """
+
+    __slots__ = ("names",)
+
+    def __init__(self, names: Iterable[str] = ()) -> None:
+        self.names: FrozenSet[str] = frozenset(names)
+
+    def filter(self, name__in: Iterable[str]) -> "GroupSet":
+        return GroupSet(self.names.intersection(name__in))
+
+    def exists(self) -> bool:
+        return bool(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+@dataclass(frozen=True)
+class JWTUser:
+    """'request.user' of the verified token. It is shared between the requests - don't mutate it."""
+
+    id: Any
+    username: str = ""
+    is_active: bool = True
+    is_staff: bool = False
+    is_superuser: bool = False
+    groups: GroupSet = field(default_factory=GroupSet)
+    claims: Dict[str, Any] = field(default_factory=dict, repr=False)
+
+    @property
+    def is_authenticated(self) -> bool:
+        return True
+
+    @property
+    def display_name(self) -> str:
+        return self.username
+
+    @property
+    def identity(self) -> str:
+        return str(self.id)
+
+    @classmethod
+    def from_claims(
+        cls, claims: Dict[str, Any], user_id_claim: str = "user_id"
+    ) -> "JWTUser":
+        groups = claims.get("groups") or ()
+        if isinstance(groups, str):
+            groups = (groups,)
+        return cls(
+            id=claims.get(user_id_claim, claims.get("sub")),
+            username=claims.get("username", ""),
+            is_active=bool(claims.get("is_active", True)),
+            is_staff=bool(claims.get("is_staff", False)),
+            is_superuser=bool(claims.get("is_superuser", False)),
+            groups=GroupSet(groups),
+            claims=claims,
+        )
+
+
+class AnonymousUser:
+    """'request.user' of the request without token."""
+
+    id = None
+    username = ""
+    is_active = False
+    is_staff = False
+    is_superuser = False
+    groups = GroupSet()
+    is_authenticated = False
+    display_name = ""
+    identity = ""
+
+
+ANONYMOUS_USER = AnonymousUser()
+
+
+class JWTKeyProvider:
+    """
+    The key of verification is loaded once and cached: HS* - the secret key ('SIGNING_KEY' \
+    of the Django backend), RS*/ES* - the public key (PEM text, file or URL).
+    The failed load is cached too: during 'retry_after' seconds 'get_key' raises \
+    the same error without the new request to the backend Person.
+    Example:
+    ```
+        keys = JWTKeyProvider("RS256", public_key_url="http://person/api/jwt/public-key/")
+        key = await keys.get_key(http_client)
+    ```
+    """
+
+    def __init__(
+        self,
+        algorithm: str = "HS256",
+        secret_key: str = "",
+        public_key: str = "",
+        public_key_path: str = "",
+        public_key_url: str = "",
+        retry_after: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """
+        :param float retry_after: Seconds after the failed load without new attempts.
+        :param clock: Source of the time. Default is 'time.monotonic'.
+        """
+        self.algorithm = algorithm
+        self.secret_key = secret_key
+        self.public_key = public_key
+        self.public_key_path = public_key_path
+        self.public_key_url = public_key_url
+        self.retry_after = retry_after
+        self.clock = clock
+        self._key: Optional[Any] = None
+        self._error: Optional[Exception] = None
+        self._failed_at = 0.0
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_symmetric(self) -> bool:
+        return self.algorithm.startswith("HS")
+
+    @property
+    def configured(self) -> bool:
+        if self.is_symmetric:
+            return bool(self.secret_key)
+        return bool(self.public_key or self.public_key_path or self.public_key_url)
+
+    async def _load_pem(self, http_client=None) -> str:
+        if self.public_key:
+            return self.public_key
+        if self.public_key_path:
+            with open(self.public_key_path, encoding="utf-8") as file:
+                return file.read()
+        if http_client is None:
+            raise ValueError("HTTP client is needed for '%s'" % self.public_key_url)
+        # The PEM text or '{"public_key": "<PEM>"}'. The body is read as the text by the shared
+        # session - 'AsyncHttpClient.request' decodes JSON only
+        try:
+            async with http_client.session.get(self.public_key_url) as response:
+                response.raise_for_status()
+                body = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise ValueError(
+                "The public key was not loaded from '%s': %r"
+                % (self.public_key_url, error)
+            ) from error
+        if body.lstrip().startswith("{"):
+            try:
+                body = json.loads(body).get("public_key")
+            except ValueError:
+                body = None
+        if not body or not isinstance(body, str):
+            raise ValueError(
+                "The public key was not loaded from '%s'" % self.public_key_url
+            )
+        return body
+
+    async def get_key(self, http_client=None) -> Any:
+        """
+        :param http_client: 'project.asynchttp_client.AsyncHttpClient' for 'public_key_url'.
+        :raise ValueError: The public key was not loaded (now or in 'retry_after').
+        :raise jwt.InvalidKeyError: The public key is malformed.
+        """
+        if self._key is not None:
+            return self._key
+        self._raise_recent_error()
+        async with self._lock:
+            if self._key is None:
+                # The requests which waited for the lock don't repeat the failed load
+                self._raise_recent_error()
+                if self.is_symmetric:
+                    self._key = self.secret_key
+                else:
+                    try:
+                        pem = await self._load_pem(http_client)
+                        # Parsed once - not on every verification
+                        self._key = jwt.get_algorithm_by_name(
+                            self.algorithm
+                        ).prepare_key(pem)
+                    except (jwt.InvalidKeyError, ValueError, OSError) as error:
+                        self._error = error
+                        self._failed_at = self.clock()
+                        raise
+                    self._error = None
+                log.info(
+                    "%s: the key of '%s' is loaded"
+                    % (self.get_key.__name__, self.algorithm)
+                )
+        return self._key
+
+    def _raise_recent_error(self) -> None:
+        if (
+            self._error is not None
+            and self.clock() - self._failed_at < self.retry_after
+        ):
+            # The traceback is not grown by every request
+            raise self._error.with_traceback(None)
+
+
+class JWTVerifier:
+    """
+    Verifies the token and keeps the user of the verified token in LRU by the hash of token \
+    until its 'exp' - the repeated requests with the same token skip the signature check.
+    Example:
+    ```
+        verifier = JWTVerifier(JWTKeyProvider("HS256", secret_key="..."))
+        user = await verifier.verify(token) # JWTUser or 'jwt.InvalidTokenError'
+    ```
+    """
+
+    def __init__(
+        self,
+        keys: JWTKeyProvider,
+        audience: Optional[str] = None,
+        issuer: Optional[str] = None,
+        leeway: int = 0,
+        user_id_claim: str = "user_id",
+        cache_size: int = 10000,
+        http_client=None,
+    ) -> None:
+        """
+        :param JWTKeyProvider keys:
+        :param int leeway: Seconds of the clock skew for 'exp'/'nbf'.
+        :param int cache_size: Max number of the cached tokens. '0' - no cache.
+        :param http_client: 'AsyncHttpClient' for the public key URL.
+        """
+        self.keys = keys
+        self.algorithms: Sequence[str] = [keys.algorithm]
+        self.audience = audience or None
+        self.issuer = issuer or None
+        self.leeway = leeway
+        self.user_id_claim = user_id_claim
+        self.http_client = http_client
+        self.cache: Optional[LRUCache] = (
+            LRUCache(maxsize=cache_size, clock=time.time) if cache_size else None
+        )
+
+    @staticmethod
+    def token_key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("latin-1")).digest()
+
+    async def verify(
+        self, token: str, token_type: Optional[str] = None, http_client=None
+    ) -> JWTUser:
+        """
+        :param str token_type: The expected claim 'token_type' ("access"/"refresh") if the \
+            token has it.
+        :param http_client: 'AsyncHttpClient' for the public key URL. Default is 'self.http_client'.
+        :raise jwt.InvalidTokenError: The token is not valid.
+        :raise ValueError: The public key was not loaded.
+        :raise jwt.InvalidKeyError: The public key is malformed.
+        """
+        cache_key = None
+        if self.cache is not None:
+            cache_key = (self.token_key(token), token_type)
+            user = self.cache.get(cache_key)
+            if user is not None:
+                return user
+        claims = jwt.decode(
+            token,
+            await self.keys.get_key(http_client or self.http_client),
+            algorithms=self.algorithms,
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={"require": ["exp"], "verify_aud": self.audience is not None},
+        )
+        if token_type and claims.get("token_type", token_type) != token_type:
+            raise jwt.InvalidTokenError("Token has wrong type")
+        user = JWTUser.from_claims(claims, self.user_id_claim)
+        if cache_key is not None:
+            self.cache.set(cache_key, user, expires_at=claims["exp"] + self.leeway)
+        return user
+
+
+def verifier_from_settings(settings) -> JWTVerifier:
+    """
+    :param settings: 'project.db.corn.Settings'.
+    """
+    return JWTVerifier(
+        JWTKeyProvider(
+            algorithm=settings.JWT_ALGORITHM,
+            secret_key=settings.JWT_SECRET_KEY,
+            public_key=settings.JWT_PUBLIC_KEY,
+            public_key_path=settings.JWT_PUBLIC_KEY_PATH,
+            public_key_url=settings.JWT_PUBLIC_KEY_URL,
+            retry_after=settings.JWT_KEY_RETRY_AFTER,
+        ),
+        audience=settings.JWT_AUDIENCE,
+        issuer=settings.JWT_ISSUER,
+        leeway=settings.JWT_LEEWAY,
+        user_id_claim=settings.JWT_USER_ID_CLAIM,
+        cache_size=settings.JWT_CACHE_SIZE,
+    )
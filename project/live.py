@@ -0,0 +1,422 @@
+"""
+project/live.py
+
+The live positions of trucks by WebSocket: the map client subscribes to the viewport (bbox)
+or to the drivers, the hub pushes only the changed positions which match.
+The changes are taken from 'SpatialGridIndex.track_changes' once per tick - many reports of
+the truck in one tick are one update. Every truck is serialized once per tick, the frame is
+made once per group of the same subscriptions (the bbox is snapped to the grid - the near
+viewports are one group) and the same bytes are sent to all sockets of the group.
+The socket which doesn't read keeps at most 'max_pending' frames: then the frames are dropped
+and the client gets the snapshot of its subscription instead - the latest positions, so
+nothing is lost but the intermediate moves.
+"""
+
+import asyncio
+import json
+import logging
+import math
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Hashable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+import numpy as np
+
+from logs import configure_logging
+from project.db.spatial import SpatialGridIndex
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+BBox = Tuple[float, float, float, float]
+
+
+def truck_fragment(driver_id: int, lat: float, lon: float, recorded_at: float) -> bytes:
+    return b'{"driver_id":%d,"lat":%.6f,"lon":%.6f,"recorded_at":%.3f}' % (
+        driver_id,
+        lat,
+        lon,
+        recorded_at,
+    )
+
+
+def make_frame(kind: bytes, tick: int, fragments: List[bytes]) -> bytes:
+    return b'{"type":"%s","tick":%d,"trucks":[%s]}' % (kind, tick, b",".join(fragments))
+
+
+def match_boxes(
+    boxes: np.ndarray, lat: np.ndarray, lon: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The points inside of the boxes: the points are sorted by latitude, every box takes the \
+    band of its latitudes by 'searchsorted' and the band is filtered by longitude - the work \
+    is of the band, not of all (boxes x points).
+    :param boxes: (min_lat, min_lon, max_lat, max_lon) per row, 'min_lon' > 'max_lon' - \
+        over the antimeridian.
+    :return: (rows of boxes, indexes of points) - sorted by the row. NaN is not inside.
+    """
+    order = np.argsort(lat, kind="stable")
+    sorted_lat = lat[order]
+    starts = np.searchsorted(sorted_lat, boxes[:, 0], side="left")
+    lengths = np.maximum(
+        np.searchsorted(sorted_lat, boxes[:, 2], side="right") - starts, 0
+    )
+    rows = np.repeat(np.arange(len(boxes)), lengths)
+    offsets = np.cumsum(lengths) - lengths
+    points = order[starts[rows] + np.arange(len(rows)) - offsets[rows]]
+    point_lon = lon[points]
+    min_lon, max_lon = boxes[rows, 1], boxes[rows, 3]
+    east = point_lon >= min_lon
+    west = point_lon <= max_lon
+    inside = np.where(min_lon > max_lon, east | west, east & west)
+    return rows[inside], points[inside]
+
+
+@dataclass(eq=False)
+class LiveGroup:
+    """The subscribers of the same subscription - they get the same frames."""
+
+    key: Hashable
+    bbox: Optional[BBox] = None
+    drivers: FrozenSet[int] = frozenset()
+    subscribers: Set["LiveSubscriber"] = field(default_factory=set)
+    # (tick, frame) - the subscribers of the group which resync in one tick share it
+    snapshot: Optional[Tuple[int, bytes]] = None
+
+
+class LiveSubscriber:
+    """The socket of one client: the frames which are not sent yet."""
+
+    def __init__(self, max_pending: int = 4) -> None:
+        """:param int max_pending: Max number of the frames - the older are dropped."""
+        self.max_pending = max_pending
+        self.queue: Deque[bytes] = deque()
+        self.event = asyncio.Event()
+        self.group: Optional[LiveGroup] = None
+        # The snapshot is sent before the next frames
+        self.resync = False
+        self.sent = 0
+        self.dropped = 0
+
+    def push(self, frame: bytes) -> None:
+        if len(self.queue) >= self.max_pending:
+            # The client doesn't read - the updates are replaced by the snapshot
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.resync = True
+        else:
+            self.queue.append(frame)
+        self.event.set()
+
+
+class PositionHub:
+    """
+    Example:
+    ```
+        hub = PositionHub(db.spatial, interval=0.25)
+        hub.start()
+        subscriber = LiveSubscriber()
+        hub.subscribe(subscriber, bbox=(55.0, 37.0, 56.0, 38.0))
+        await hub.sender(subscriber, websocket.send_bytes) # until the socket is closed
+        hub.unsubscribe(subscriber)
+        await hub.stop()
+    ```
+    The frames: `{"type": "snapshot" | "update", "tick": 12, "trucks": [{"driver_id": 7, \
+    "lat": 55.75, "lon": 37.61, "recorded_at": 1760000000.5}]}`. The update of bbox has the \
+    trucks which moved in or out of it; the removed truck is `{"driver_id": 7, "removed": true}`.
+    """
+
+    def __init__(
+        self,
+        spatial: SpatialGridIndex,
+        interval: float = 0.25,
+        max_pending: int = 4,
+        bbox_step: float = 0.05,
+        max_drivers: int = 1000,
+        snapshot_limit: int = 5000,
+    ) -> None:
+        """
+        :param spatial: The latest positions ('Database.spatial').
+        :param float interval: Seconds of the tick.
+        :param int max_pending: The frames per socket, then the snapshot.
+        :param float bbox_step: Degrees. The bbox is extended to it - the near viewports are \
+            one group (one frame).
+        :param int max_drivers: Max number of the drivers of one subscription.
+        :param int snapshot_limit: Max number of the trucks of the snapshot of bbox.
+        """
+        self.spatial = spatial
+        self.interval = interval
+        self.max_pending = max_pending
+        self.bbox_step = bbox_step
+        self.max_drivers = max_drivers
+        self.snapshot_limit = snapshot_limit
+        self.changes: Set[int] = spatial.track_changes()
+        # driver id => (lat, lon) of the last tick - the truck which left the bbox is sent too
+        self.positions: Dict[int, Tuple[float, float]] = {
+            driver_id: (point[0], point[1])
+            for driver_id, point in spatial.points.items()
+        }
+        self.groups: Dict[Hashable, LiveGroup] = {}
+        self.by_driver: Dict[int, Set[LiveGroup]] = {}
+        self._boxes: Optional[Tuple[List[LiveGroup], np.ndarray]] = None
+        self.tick = 0
+        self.frames = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def snap(self, bbox: BBox) -> BBox:
+        """The bbox is extended to the grid of 'bbox_step'."""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        step = self.bbox_step
+
+        def down(value: float, low: float) -> float:
+            return max(low, round(math.floor(value / step) * step, 6))
+
+        def up(value: float, high: float) -> float:
+            return min(high, round(math.ceil(value / step) * step, 6))
+
+        return (
+            down(min_lat, -90.0),
+            down(min_lon, -180.0),
+            up(max_lat, 90.0),
+            up(max_lon, 180.0),
+        )
+
+    def subscribe(
+        self,
+        subscriber: LiveSubscriber,
+        bbox: Optional[BBox] = None,
+        drivers: Optional[Set[int]] = None,
+    ) -> LiveGroup:
+        """
+        The new subscription of the subscriber (the old one is replaced). The snapshot of it \
+        is the next frame.
+        :raise ValueError: no bbox and no drivers, too many drivers.
+        """
+        if bbox is not None:
+            bbox = self.snap(bbox)
+            key: Hashable = ("bbox", bbox)
+            drivers = frozenset()
+        elif drivers:
+            drivers = frozenset(drivers)
+            if len(drivers) > self.max_drivers:
+                raise ValueError("Max %d drivers" % self.max_drivers)
+            key = ("drivers", drivers)
+        else:
+            raise ValueError("The subscription must have 'bbox' or 'drivers'")
+        self.unsubscribe(subscriber)
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = LiveGroup(key, bbox, drivers)
+            if bbox is not None:
+                self._boxes = None
+            for driver_id in drivers:
+                self.by_driver.setdefault(driver_id, set()).add(group)
+        group.subscribers.add(subscriber)
+        subscriber.group = group
+        subscriber.queue.clear()
+        subscriber.resync = True
+        subscriber.event.set()
+        return group
+
+    def subscribe_message(self, subscriber: LiveSubscriber, message: str) -> LiveGroup:
+        """
+        The subscription of the client: `{"bbox": [min_lat, min_lon, max_lat, max_lon]}` or \
+        `{"drivers": [7, 12]}`.
+        :raise ValueError: the invalid message.
+        """
+        try:
+            data = json.loads(message)
+        except ValueError:
+            raise ValueError("The message must be JSON") from None
+        if not isinstance(data, dict):
+            raise ValueError("The message must be the JSON object")
+        if data.get("bbox") is not None:
+            bbox = data["bbox"]
+            if (
+                not isinstance(bbox, list)
+                or len(bbox) != 4
+                or not all(isinstance(value, (int, float)) for value in bbox)
+                or not -90 <= bbox[0] <= bbox[2] <= 90
+                or not all(-180 <= value <= 180 for value in bbox[1::2])
+            ):
+                raise ValueError("'bbox' must be [min_lat, min_lon, max_lat, max_lon]")
+            return self.subscribe(
+                subscriber, bbox=tuple(float(value) for value in bbox)
+            )
+        drivers = data.get("drivers")
+        if not isinstance(drivers, list) or not all(
+            isinstance(driver_id, int) and not isinstance(driver_id, bool)
+            for driver_id in drivers
+        ):
+            raise ValueError("'drivers' must be the list of ids")
+        return self.subscribe(subscriber, drivers=set(drivers))
+
+    def unsubscribe(self, subscriber: LiveSubscriber) -> None:
+        group = subscriber.group
+        if group is None:
+            return
+        subscriber.group = None
+        group.subscribers.discard(subscriber)
+        if group.subscribers:
+            return
+        del self.groups[group.key]
+        if group.bbox is not None:
+            self._boxes = None
+        for driver_id in group.drivers:
+            groups = self.by_driver[driver_id]
+            groups.discard(group)
+            if not groups:
+                del self.by_driver[driver_id]
+
+    def snapshot(self, group: LiveGroup) -> bytes:
+        """The latest positions of the subscription - once per tick for the group."""
+        if group.snapshot is not None and group.snapshot[0] == self.tick:
+            return group.snapshot[1]
+        spatial = self.spatial
+        if group.bbox is not None:
+            drivers = spatial.bbox(*group.bbox, limit=self.snapshot_limit)
+        else:
+            drivers = group.drivers
+        fragments = []
+        for driver_id in drivers:
+            point = spatial.position(driver_id)
+            if point is not None:
+                fragments.append(truck_fragment(driver_id, *point))
+        frame = make_frame(b"snapshot", self.tick, fragments)
+        group.snapshot = (self.tick, frame)
+        return frame
+
+    def _bbox_groups(self) -> Tuple[List[LiveGroup], np.ndarray]:
+        if self._boxes is None:
+            groups = [group for group in self.groups.values() if group.bbox is not None]
+            boxes = np.array(
+                [group.bbox for group in groups], dtype=np.float64
+            ).reshape(-1, 4)
+            self._boxes = (groups, boxes)
+        return self._boxes
+
+    def publish(self) -> int:
+        """
+        One tick: the trucks changed since the last tick are serialized once, the frame of \
+        every group with the matched trucks is pushed to its subscribers.
+        :return: number of the changed trucks.
+        """
+        self.tick += 1
+        if not self.changes:
+            return 0
+        changed = list(self.changes)
+        self.changes.clear()
+        position = self.spatial.position
+        positions = self.positions
+        ids: List[int] = []
+        fragments: List[bytes] = []
+        coordinates: List[Tuple[float, float, float, float]] = []
+        nan = math.nan
+        for driver_id in changed:
+            point = position(driver_id)
+            old = positions.get(driver_id, (nan, nan))
+            if point is None:
+                if driver_id not in positions:
+                    continue
+                del positions[driver_id]
+                fragments.append(b'{"driver_id":%d,"removed":true}' % driver_id)
+                coordinates.append((nan, nan) + old)
+            else:
+                positions[driver_id] = (point[0], point[1])
+                fragments.append(truck_fragment(driver_id, *point))
+                coordinates.append((point[0], point[1]) + old)
+            ids.append(driver_id)
+        if not self.groups or not ids:
+            return len(ids)
+        matched: Dict[LiveGroup, List[int]] = {}
+        groups, boxes = self._bbox_groups()
+        if groups:
+            count = len(ids)
+            lat, lon, old_lat, old_lon = np.array(coordinates, dtype=np.float64).T
+            # The new and the old positions - the truck which left the bbox is matched too
+            rows, points = match_boxes(
+                boxes, np.concatenate((lat, old_lat)), np.concatenate((lon, old_lon))
+            )
+            pairs = rows.astype(np.int64) * count + points % count
+            pairs.sort()
+            if len(pairs):
+                pairs = pairs[np.r_[True, pairs[1:] != pairs[:-1]]]
+                rows, points = pairs // count, pairs % count
+                bounds = (np.flatnonzero(np.diff(rows)) + 1).tolist()
+                points_list = points.tolist()
+                for row, start, end in zip(
+                    rows[[0] + bounds].tolist(),
+                    [0] + bounds,
+                    bounds + [len(points_list)],
+                ):
+                    matched[groups[row]] = points_list[start:end]
+        if self.by_driver:
+            by_driver = self.by_driver
+            for index, driver_id in enumerate(ids):
+                for group in by_driver.get(driver_id, ()):
+                    matched.setdefault(group, []).append(index)
+        for group, indexes in matched.items():
+            frame = make_frame(
+                b"update", self.tick, [fragments[index] for index in indexes]
+            )
+            self.frames += 1
+            for subscriber in group.subscribers:
+                subscriber.push(frame)
+        return len(ids)
+
+    async def sender(
+        self, subscriber: LiveSubscriber, send: Callable[[bytes], Awaitable[None]]
+    ) -> None:
+        """Sends the frames of the subscriber until the error of 'send' (the closed socket)."""
+        while True:
+            await subscriber.event.wait()
+            subscriber.event.clear()
+            if subscriber.resync and subscriber.group is not None:
+                subscriber.resync = False
+                await send(self.snapshot(subscriber.group))
+                subscriber.sent += 1
+            while subscriber.queue:
+                await send(subscriber.queue.popleft())
+                subscriber.sent += 1
+
+    def info(self) -> Dict[str, int]:
+        return {
+            "groups": len(self.groups),
+            "subscribers": sum(
+                len(group.subscribers) for group in self.groups.values()
+            ),
+            "ticks": self.tick,
+            "frames": self.frames,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as error:
+                log.error("%s ERROR => %s" % (self._run.__name__, error))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name="PositionHub")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,302 @@
+"""
+project/metrics.py
+
+Metrics of the app in the Prometheus text format ('GET /metrics'):
+- 'http_requests_total', 'http_request_duration_seconds', 'http_requests_in_flight' -
+  by 'MetricsMiddleware' per route template (not per URL - the number of series is bounded);
+- 'upstream_requests_total', 'upstream_request_duration_seconds' - the calls of
+  'AsyncHttpClient' (its 'observer');
+- 'db_pool_*' - the pool of 'Database.engine', read at the scrape.
+The counters are plain numbers in dicts without locks: they are changed only in the thread of
+the event loop, so the update is a dict lookup and an addition (microseconds).
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# (name, type, help, [(labels, value)])
+Sample = Tuple[Dict[str, str], float]
+Family = Tuple[str, str, str, List[Sample]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        '%s="%s"' % (name, _escape(str(value))) for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        """
+        :param str name: Name of metric.
+        :param str documentation: Text of '# HELP'.
+        :param labelnames: Names of labels. The values are passed as the tuple in this order.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.kind),
+        ]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """
+    Example:
+    ```
+        requests = Counter("requests_total", "Requests.", ("method",))
+        requests.inc(("GET",))
+    ```
+    """
+
+    kind = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in self.values.items():
+            lines.append(
+                "%s%s %s"
+                % (self.name, _labels(self.labelnames, labels), _number(value))
+            )
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1) -> None:
+        values = self.values
+        values[labels] = values.get(labels, 0) - amount
+
+    def set(self, labels: Tuple[str, ...] = (), value: float = 0) -> None:
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """
+    The counts of buckets are kept not cumulative (one increment per observation) and \
+    summed at the render.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels => [count of bucket 0, ..., count of +Inf, sum]
+        self.series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        bounds = [_number(bound) for bound in self.buckets] + ["+Inf"]
+        for labels, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                label_text = _labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append("%s_bucket%s %d" % (self.name, label_text, cumulative))
+            label_text = _labels(self.labelnames, labels)
+            lines.append("%s_sum%s %s" % (self.name, label_text, _number(series[-1])))
+            lines.append("%s_count%s %d" % (self.name, label_text, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.collectors: Dict[str, Callable[[], Iterable[Family]]] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def add_collector(
+        self, name: str, collector: Callable[[], Iterable[Family]]
+    ) -> None:
+        """
+        :param str name: The collector of the same name is replaced (e.g. the app was restarted).
+        :param collector: It is called at the scrape and returns the families of samples.
+        """
+        self.collectors[name] = collector
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        for collector in self.collectors.values():
+            for name, kind, documentation, samples in collector():
+                lines.append("# HELP %s %s" % (name, documentation))
+                lines.append("# TYPE %s %s" % (name, kind))
+                for labels, value in samples:
+                    lines.append(
+                        "%s%s %s"
+                        % (
+                            name,
+                            _labels(list(labels), list(labels.values())),
+                            _number(value),
+                        )
+                    )
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = MetricsRegistry()
+HTTP_REQUESTS = REGISTRY.register(
+    Counter("http_requests_total", "HTTP requests.", ("method", "route", "status"))
+)
+HTTP_DURATION = REGISTRY.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Latency of HTTP requests.",
+        ("method", "route"),
+    )
+)
+HTTP_IN_FLIGHT = REGISTRY.register(
+    Gauge("http_requests_in_flight", "HTTP requests in progress.", ("method",))
+)
+UPSTREAM_REQUESTS = REGISTRY.register(
+    Counter(
+        "upstream_requests_total",
+        "Calls of AsyncHttpClient, status '0' - failed.",
+        ("method", "host", "status"),
+    )
+)
+UPSTREAM_DURATION = REGISTRY.register(
+    Histogram(
+        "upstream_request_duration_seconds",
+        "Latency of AsyncHttpClient calls.",
+        ("method", "host"),
+    )
+)
+
+
+def observe_upstream(method: str, host: str, status: int, seconds: float) -> None:
+    """'observer' of 'project.asynchttp_client.AsyncHttpClient'."""
+    UPSTREAM_REQUESTS.inc((method, host, str(status)))
+    UPSTREAM_DURATION.observe((method, host), seconds)
+
+
+def register_engine_pool(engine, registry: MetricsRegistry = REGISTRY) -> None:
+    """
+    The gauges of the pool of SQLAlchemy engine are read at the scrape.
+    :param engine: 'AsyncEngine' ('Database.engine') or 'Engine'.
+    """
+    pool = getattr(engine, "sync_engine", engine).pool
+
+    def collect() -> Iterable[Family]:
+        families: List[Family] = []
+        for name, method, documentation in (
+            ("db_pool_size", "size", "Size of the connection pool."),
+            ("db_pool_checked_out", "checkedout", "Connections in use."),
+            ("db_pool_checked_in", "checkedin", "Idle connections in the pool."),
+            ("db_pool_overflow", "overflow", "Connections over the size of pool."),
+        ):
+            function = getattr(pool, method, None)
+            if function is not None:
+                # 'QueuePool.overflow()' starts from '-pool_size'
+                value = max(function(), 0)
+                families.append((name, "gauge", documentation, [({}, value)]))
+        return families
+
+    registry.add_collector("db_pool", collect)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware. The route is the template ('/drivers/{id}') of the matched route; \
+    the not matched requests are '<unmatched>'.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        in_flight = (method,)
+        HTTP_IN_FLIGHT.inc(in_flight)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec(in_flight)
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            HTTP_REQUESTS.inc((method, route, str(status_code)))
+            HTTP_DURATION.observe((method, route), elapsed)
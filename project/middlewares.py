@@ -2,82 +2,145 @@
 project/middlewares.py
 """
 
-import secrets
+import logging
+import math
 from enum import Enum
+from urllib.parse import parse_qsl
 
-from fastapi import Request, Response, HTTPException, status, FastAPI
-from typing import Callable, Awaitable, Union
-from starlette.middleware.base import BaseHTTPMiddleware
-
-
-from dotenv_ import DEBUG
+import jwt
+from fastapi import status
+from typing import Optional, Sequence, Tuple
+from starlette.authentication import AuthCredentials
+from starlette.requests import cookie_parser
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from logs import configure_logging
+from project.csrf import CsrfTokenSigner
 from project.db.corn import Settings
+from project.jwt_auth import ANONYMOUS_USER, JWTVerifier, verifier_from_settings
 
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
 settings = Settings()
 
 
-class CustomHeaderMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, secret_key: str, cookie_name: str = "csrf_token") -> None:
+class CustomHeaderMiddleware:
+    """
+    CSRF of the pure ASGI (without 'BaseHTTPMiddleware' - no extra task and the streaming \
+    responses are not buffered).
+    The safe methods ('HEAD', 'OPTIONS', 'TRACE', 'GET'): if the request has not the valid \
+    token in the cookie 'cookie_name' (no cookie, expired, signed by the removed key), \
+    the response gets the new CSRF-token in this cookie.
+    The unsafe methods ('PUT', 'DELETE', 'PATCH', 'POST'): the header 'X-CSRF-Token' \
+    must be the valid token - else the response is '403 {"detail": "Invalid CSRF Token"}'.
+    The token is signed by 'project.csrf.CsrfTokenSigner' - it is checked without the storage \
+    on any worker with the same 'secret_keys'.
+    The websocket: the handshake with the header 'Origin' which is not in 'allowed_origins' \
+    is refused (the close 1008 - '403'). The browser opens the socket from any page and sends \
+    the cookies of our site - the cross-site WebSocket hijacking.
+    The other methods and the other scopes (lifespan) are passed as is.
+    https://www.starlette.io/middleware/#pure-asgi-middleware
+    """
+
+    header_name = b"x-csrf-token"
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        secret_keys: Sequence[str],
+        cookie_name: str = "csrf_token",
+        max_age: int = 60 * 60,
+        allowed_origins: Optional[Sequence[str]] = None,
+    ) -> None:
         """
-        https://www.starlette.io/middleware/#BaseHTTPMiddleware
         :param app:
-        :param secret_key:
-        :param cookie_name:
+        :param secret_keys: Key ring ('Settings.CSRF_KEYS'). The first key signs.
+        :param str cookie_name: Name of cookie with the CSRF-token.
+        :param int max_age: Seconds while the token is valid.
+        :param allowed_origins: The origins of websocket ('Settings.ALLOWED_ORIGINS'). \
+            'None' - any. The handshake without 'Origin' (not a browser) is passed.
         """
-        super().__init__(app)
-        self.secret_key: str = secret_key
+        self.app = app
+        self.signer = CsrfTokenSigner(secret_keys, max_age=max_age)
         self.cookie_name: str = cookie_name
-        self.csrf_token: str | None = None
-
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
-        # For don't danger the http methods - Here, install the CSRF-token in cookie
-        if request.method in settings.ALLOWED_METHODS[:4]:
-            # Check - Do we have a CSRF-token in cookie
-            if not request.cookies.get(self.cookie_name):
-                response = await call_next(request)
-                # Create the CSRF-token & install in cookie
-                csrf_token = "".join(
-                    [
-                        self.secret_key.replace("-", ""),
-                        "Bearer",
-                        secrets.token_urlsafe(32),
-                    ]
-                )
-                response.set_cookie(
-                    key=self.cookie_name,
-                    value=csrf_token,
-                    httponly=False,
-                    samesite=settings.CSRF_COOKIE_SAMESITE,
-                    secure=not DEBUG,
-                    max_age=settings.CSRF_COOKIE_MAX_AGE,
-                )
-                return response
-            else:
-                # If we installed earlier - the CSRF-token
-                return await call_next(request)
-
-        # For danger the http methods -  Here, install the CSRF-token in cookie
-        elif request.method in settings.ALLOWED_METHODS[4:]:
-
-            # Checkin equality between an app'n secret_key and X-CSRF-Token from request's header
-            csrf_header = request.headers.get("X-CSRF-Token").split("Bearer")[0]
-            if (
-                not csrf_header
-                or not self.secret_key
-                or csrf_header != self.secret_key.replace("-", "")
-            ):
-
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN, detail="Invalid CSRF Token"
-                )
-            return await call_next(request)
+        # All is calculated once - not per request
+        self.safe_methods = frozenset(settings.ALLOWED_METHODS[:4])
+        self.unsafe_methods = frozenset(settings.ALLOWED_METHODS[4:])
+        self._cookie_name = cookie_name.encode("latin-1")
+        self._origins = (
+            None
+            if allowed_origins is None
+            else frozenset(origin.encode("latin-1") for origin in allowed_origins)
+        )
+        self._cookie_attrs = "; Max-Age=%d; Path=/; SameSite=%s%s" % (
+            settings.CSRF_COOKIE_MAX_AGE,
+            settings.CSRF_COOKIE_SAMESITE,
+            "; Secure" if settings.CSRF_COOKIE_SECURE else "",
+        )
+
+    def new_token(self) -> str:
+        return self.signer.new_token()
+
+    def is_valid(self, token: bytes) -> bool:
+        return self.signer.verify(token.decode("latin-1"))
+
+    def _has_valid_cookie(self, cookie_header: bytes) -> bool:
+        if self._cookie_name not in cookie_header:
+            return False
+        token = cookie_parser(cookie_header.decode("latin-1")).get(self.cookie_name)
+        return bool(token) and self.signer.verify(token)
 
-        # For some html methods.
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            if scope["type"] == "websocket" and self._origins is not None:
+                for name, value in scope["headers"]:
+                    if name == b"origin" and value not in self._origins:
+                        await send({"type": "websocket.close", "code": 1008})
+                        return
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"]
+        if method in self.safe_methods:
+            for name, value in scope["headers"]:
+                if name == b"cookie" and self._has_valid_cookie(value):
+                    # We installed the CSRF-token earlier, and it is still valid
+                    await self.app(scope, receive, send)
+                    return
+            await self.app(scope, receive, self._set_cookie(send))
+        elif method in self.unsafe_methods:
+            for name, value in scope["headers"]:
+                if name == self.header_name:
+                    if self.is_valid(value):
+                        await self.app(scope, receive, send)
+                        return
+                    break
+            await self.forbidden(send)
         else:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+
+    def _set_cookie(self, send: Send) -> Send:
+        cookie = b"".join(
+            [
+                self._cookie_name,
+                b"=",
+                self.new_token().encode("latin-1"),
+                self._cookie_attrs.encode("latin-1"),
+            ]
+        )
+
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"set-cookie", cookie),
+                ]
+            await send(message)
+
+        return send_with_cookie
+
+    @staticmethod
+    async def forbidden(send: Send) -> None:
+        await send_json(send, status.HTTP_403_FORBIDDEN, _FORBIDDEN_CONTENT)
 
 
 class JWTTokenName(Enum):
@@ -86,26 +149,133 @@ class JWTTokenName(Enum):
 
 
 # JWT-token
-class CustomJWTMiddleware(BaseHTTPMiddleware):
-    def __init__(
-        self, app: FastAPI, header_name: JWTTokenName = JWTTokenName.ACCESS.value
-    ) -> None:
-        super().__init__(app)
-        self.header_name = header_name
-
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
-        jwt_token = ""
-        if list(request.headers.keys()):
-            # ACCESS token
-            if JWTTokenName.ACCESS.value in list(request.headers.keys()):
-                jwt_token += "".join([request.headers[JWTTokenName.ACCESS.value]])
-            # REFRESH token
-            elif JWTTokenName.REFRESH.name in list(request.headers.keys()):
-                jwt_token += "".join([request.headers[JWTTokenName.REFRESH.name]])
-            if len(jwt_token) == 0:
-                return await call_next(request)
-            #
-
-        return await call_next(request)
+class CustomJWTMiddleware:
+    """
+    The pure ASGI middleware of authentication. The token is taken from the header \
+    'token_access' (else 'token_refresh'), 'Bearer ' prefix is allowed. The websocket of \
+    browser can't have the headers - its token is taken from the query too \
+    ('/live?token_access=...').
+    No token - 'request.user' is 'AnonymousUser'. The valid token - 'request.user' is \
+    'JWTUser' of its claims. The invalid or expired token - '401 {"detail": "Invalid token"}' \
+    (websocket - it is closed by the code 1008).
+    The verified tokens are cached by 'JWTVerifier' until their 'exp'.
+    """
+
+    def __init__(self, app: ASGIApp, verifier: Optional[JWTVerifier] = None) -> None:
+        """
+        :param app:
+        :param JWTVerifier verifier: Default is 'verifier_from_settings(settings)'.
+        """
+        self.app = app
+        self.verifier = (
+            verifier if verifier is not None else verifier_from_settings(settings)
+        )
+        self.enabled = self.verifier.keys.configured
+        if not self.enabled:
+            log.warning(
+                "%s: the key of JWT is not set - all requests are anonymous"
+                % self.__class__.__name__
+            )
+        self._headers = {
+            JWTTokenName.ACCESS.value.encode("latin-1"): "access",
+            JWTTokenName.REFRESH.value.encode("latin-1"): "refresh",
+        }
+        # The failed load of the key is not repeated during 'JWTKeyProvider.retry_after'
+        self._unavailable_headers = [
+            (b"retry-after", b"%d" % max(1, math.ceil(self.verifier.keys.retry_after)))
+        ]
+
+    def _find_token(self, headers) -> Tuple[Optional[str], Optional[str]]:
+        """:return: (token, token type). The access token wins."""
+        token = token_type = None
+        for name, value in headers:
+            kind = self._headers.get(name)
+            if kind is None or not value:
+                continue
+            token, token_type = value.decode("latin-1"), kind
+            if kind == "access":
+                break
+        if token is not None and token[:7].lower() == "bearer ":
+            token = token[7:].strip()
+        return token, token_type
+
+    def _find_query_token(
+        self, query_string: bytes
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """:return: (token, token type) of the query of websocket."""
+        token = token_type = None
+        for name, value in parse_qsl(query_string.decode("latin-1")):
+            kind = self._headers.get(name.encode("latin-1"))
+            if kind is None or not value:
+                continue
+            token, token_type = value, kind
+            if kind == "access":
+                break
+        return token, token_type
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        scope["user"] = ANONYMOUS_USER
+        scope["auth"] = AuthCredentials()
+        token, token_type = (
+            self._find_token(scope["headers"]) if self.enabled else (None, None)
+        )
+        if token is None and self.enabled and scope["type"] == "websocket":
+            token, token_type = self._find_query_token(scope.get("query_string", b""))
+        if token:
+            app = scope.get("app")
+            http_client = getattr(app.state, "http_client", None) if app else None
+            try:
+                user = await self.verifier.verify(token, token_type, http_client)
+            except jwt.InvalidTokenError:
+                await self.unauthorized(scope, send)
+                return
+            except (jwt.InvalidKeyError, ValueError, OSError) as error:
+                # The public key was not loaded or is malformed - it isn't the error of client
+                log.error("%s ERROR => %s" % (self.__class__.__name__, error))
+                await send_json(
+                    send,
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    _UNAVAILABLE_CONTENT,
+                    self._unavailable_headers,
+                )
+                return
+            scope["user"] = user
+            scope["auth"] = AuthCredentials(["authenticated"])
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def unauthorized(scope: Scope, send: Send) -> None:
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008})
+            return
+        await send_json(
+            send,
+            status.HTTP_401_UNAUTHORIZED,
+            _UNAUTHORIZED_CONTENT,
+            [(b"www-authenticate", b"Bearer")],
+        )
+
+
+async def send_json(send: Send, status_code: int, content: bytes, headers=()) -> None:
+    """The JSON response of middleware. The messages are new every time - the outer \
+    middlewares (CORS) add their headers to them."""
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(content)).encode("latin-1")),
+                *headers,
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": content})
+
+
+_FORBIDDEN_CONTENT = b'{"detail":"Invalid CSRF Token"}'
+_UNAUTHORIZED_CONTENT = b'{"detail":"Invalid token"}'
+_UNAVAILABLE_CONTENT = b'{"detail":"Authentication is unavailable"}'
@@ -1,78 +1,306 @@
 """
 project/permissions.py
+
+Permissions are the bit tests. The flags and the groups of user (from the token) are compiled
+to the mask once per request ('request.scope'). The check of permission is 'mask & bits' - no
+queries.
+Example:
+```
+    @router.get("/reports", dependencies=[Depends(require(IsOwnerRaport() | IsManipulate()))])
+    async def reports(): ...
+```
 """
 
+from enum import IntFlag
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional
+
 from fastapi import HTTPException, status, Request
 
 
+class Flag(IntFlag):
+    ACTIVE = 1 << 0  # authenticated and active
+    STAFF = 1 << 1
+    SUPERUSER = 1 << 2
+    ADMIN = 1 << 3
+    SUPERVISOR = 1 << 4
+    BASE = 1 << 5
+    EMPLOYEE = 1 << 6
+    DRIVER = 1 << 7
+    MANAGER = 1 << 8
+
+
+# Groups of the Django backend Person => bit. The masks are plain 'int' - the operators of
+# 'IntFlag' are much slower.
+GROUP_FLAGS: Dict[str, int] = {
+    "ADMIN": Flag.ADMIN.value,
+    "Supervisor": Flag.SUPERVISOR.value,
+    "BASE": Flag.BASE.value,
+    "Employee": Flag.EMPLOYEE.value,
+    "DRIVER": Flag.DRIVER.value,
+    "Truck driver": Flag.DRIVER.value,
+    "MANAGER": Flag.MANAGER.value,
+    "Manager": Flag.MANAGER.value,
+}
+_ACTIVE = Flag.ACTIVE.value
+_STAFF = Flag.STAFF.value
+_SUPERUSER = Flag.SUPERUSER.value
+
+
+def groups_mask(names: Iterable[str]) -> int:
+    mask = 0
+    for name in names:
+        mask |= GROUP_FLAGS.get(name, 0)
+    return mask
+
+
+def user_mask(user: Any, groups: Optional[Iterable[str]] = None) -> int:
+    """
+    :param user: 'request.user' ('project.jwt_auth.JWTUser', 'AnonymousUser').
+    :param groups: Names of groups. Default is 'user.groups'.
+    """
+    if user is None or not getattr(user, "is_authenticated", False):
+        return 0
+    mask = 0
+    if getattr(user, "is_active", False):
+        mask |= _ACTIVE
+    if getattr(user, "is_staff", False):
+        mask |= _STAFF
+    if getattr(user, "is_superuser", False):
+        mask |= _SUPERUSER
+    return mask | groups_mask(getattr(user, "groups", ()) if groups is None else groups)
+
+
+class Rule:
+    """
+    The compiled permission: all bits of 'all_of', one of bits of 'any_of' (if it is set) \
+    and none of bits of 'none_of'. Rules are composed by '&', '|' and '~'.
+    """
+
+    __slots__ = ("all_of", "any_of", "none_of")
+
+    def __init__(self, all_of: int = 0, any_of: int = 0, none_of: int = 0) -> None:
+        self.all_of = int(all_of)
+        self.any_of = int(any_of)
+        self.none_of = int(none_of)
+
+    def check(self, mask: int) -> bool:
+        return (
+            mask & self.all_of == self.all_of
+            and (not self.any_of or bool(mask & self.any_of))
+            and not mask & self.none_of
+        )
+
+    def __and__(self, other: "Rule") -> "Rule":
+        plain = type(self) is Rule and type(other) is Rule
+        if not plain or (self.any_of and other.any_of):
+            return AllRule(self, other)
+        return Rule(
+            self.all_of | other.all_of,
+            self.any_of | other.any_of,
+            self.none_of | other.none_of,
+        )
+
+    def __or__(self, other: "Rule") -> "Rule":
+        return AnyRule(self, other)
+
+    def __invert__(self) -> "Rule":
+        return NotRule(self)
+
+
+class AllRule(Rule):
+    __slots__ = ("rules",)
+
+    def __init__(self, *rules: Rule) -> None:
+        super().__init__()
+        self.rules = rules
+
+    def check(self, mask: int) -> bool:
+        for rule in self.rules:
+            if not rule.check(mask):
+                return False
+        return True
+
+
+class AnyRule(Rule):
+    __slots__ = ("rules",)
+
+    def __init__(self, *rules: Rule) -> None:
+        super().__init__()
+        self.rules = rules
+
+    def check(self, mask: int) -> bool:
+        for rule in self.rules:
+            if rule.check(mask):
+                return True
+        return False
+
+
+class NotRule(Rule):
+    __slots__ = ("rule",)
+
+    def __init__(self, rule: Rule) -> None:
+        super().__init__()
+        self.rule = rule
+
+    def check(self, mask: int) -> bool:
+        return not self.rule.check(mask)
+
+
+class PermissionEngine:
+    """
+    The mask of user: 'request.scope' (once per request) => the groups from the token.
+    With 'load_groups' (the groups are not in the token) the loader is called once per \
+    request by 'mask_for'.
+    """
+
+    # The full mask (with the loaded groups) and the mask of the token only - the sync check
+    # must not cache the mask without the loaded groups for 'mask_for'
+    scope_key = "permissions_mask"
+    token_scope_key = "permissions_token_mask"
+
+    def __init__(
+        self,
+        load_groups: Optional[Callable[[Any], Awaitable[Iterable[str]]]] = None,
+    ) -> None:
+        """
+        :param load_groups: Async loader of the names of groups of user \
+            (e.g. from the backend Person).
+        """
+        self.load_groups = load_groups
+
+    def request_mask(self, request: Request) -> int:
+        """
+        The mask of 'request.user' by his flags and the groups from token. The full mask \
+        when 'mask_for' has made it for the request already.
+        """
+        mask = request.scope.get(self.scope_key)
+        if mask is None:
+            mask = request.scope.get(self.token_scope_key)
+        if mask is None:
+            mask = user_mask(request.scope.get("user"))
+            request.scope[self.token_scope_key] = mask
+        return mask
+
+    async def mask_for(self, request: Request) -> int:
+        mask = request.scope.get(self.scope_key)
+        if mask is not None:
+            return mask
+        user = request.scope.get("user")
+        if self.load_groups is None or getattr(user, "id", None) is None:
+            mask = user_mask(user)
+        else:
+            mask = user_mask(user, await self.load_groups(user))
+        request.scope[self.scope_key] = mask
+        return mask
+
+
+# The groups of the token only - the app has no loader of groups
+permission_engine = PermissionEngine()
+
+
 class BasePermission:
-    """This is base class for permission"""
+    """This is base class for permission. The subclass sets the 'rule'."""
+
+    rule: Optional[Rule] = None
+
+    def __init__(self, rule: Optional[Rule] = None) -> None:
+        if rule is not None:
+            self.rule = rule
+        if self.rule is None:
+            raise HTTPException(
+                status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+                detail="Subclass must implement this method",
+            )
+
+    def check(self, mask: int) -> bool:
+        return self.rule.check(mask)
 
     def has_permission(self, request: Request) -> bool:
-        raise HTTPException(
-            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
-            detail="Subclass must implement this method",
-        )
+        """Sync check by the groups from token. The loaded groups - 'require()'."""
+        return self.rule.check(permission_engine.request_mask(request))
+
+    def __and__(self, other: "BasePermission") -> "BasePermission":
+        return BasePermission(self.rule & other.rule)
+
+    def __or__(self, other: "BasePermission") -> "BasePermission":
+        return BasePermission(self.rule | other.rule)
+
+    def __invert__(self) -> "BasePermission":
+        return BasePermission(~self.rule)
+
+
+def in_groups(*names: str) -> Rule:
+    """One of the groups."""
+    return Rule(any_of=groups_mask(names))
 
 
 class IsActive(BasePermission):
     """allows access only activated"""
 
-    def has_permission(self, request: Request):
-        return request.user and request.user.is_authenticated and request.user.is_active
+    rule = Rule(all_of=Flag.ACTIVE)
 
 
 class IsAll(BasePermission):
     """Allows access only for admin and owner"""
 
-    def has_permission(self, request: Request) -> bool:
-        return (
-            IsActive().has_permission(request)
-            and request.user.is_staff
-            and (
-                request.user.is_superuser
-                or request.user.groups.filter(name__in=["ADMIN", "Supervisor"]).exists()
-            )
-        )
+    rule = Rule(
+        all_of=Flag.ACTIVE | Flag.STAFF,
+        any_of=Flag.SUPERUSER | Flag.ADMIN | Flag.SUPERVISOR,
+    )
 
 
 class IsReader(BasePermission):
     """allows access only for read"""
 
-    def has_permissionps(self, request: Request) -> bool:
-        return (
-            IsActive().has_permission(request)
-            and not request.user.is_superuser
-            and (
-                request.user.is_staff
-                or request.user.groups.filter(name__in=["BASE", "Employee"]).exists()
-            )
-        )
+    rule = Rule(
+        all_of=Flag.ACTIVE,
+        any_of=Flag.STAFF | Flag.BASE | Flag.EMPLOYEE,
+        none_of=Flag.SUPERUSER,
+    )
 
 
 class IsOwnerRaport(BasePermission):
-    """ "Allows access only for the pruck-drivers"""
+    """Allows access only for the truck-drivers"""
 
-    def has_permission(self, request: Request) -> bool:
-        return (
-            IsActive().has_permission(request)
-            and request.user.geroups.filter(
-                name__in=["DRIVER", "Truck driver"]
-            ).axists()
-        )
+    rule = IsActive.rule & in_groups("DRIVER", "Truck driver")
 
 
 class IsManipulate(BasePermission):
     """Allows access only for managers"""
 
-    def has_permission(self, request: Request) -> bool:
-        return (
-            IsActive().has_permission(request)
-            and request.user.groups.filter(name__in=["MANAGER", "Manager"]).exists()
+    rule = IsActive.rule & in_groups("MANAGER", "Manager")
+
+
+def require(
+    permission: BasePermission, engine: Optional[PermissionEngine] = None
+) -> Callable[[Request], Awaitable[None]]:
+    """
+    FastAPI dependency of the permission. Anonymous - 401, no permission - 403.
+    :param BasePermission permission: e.g. 'IsAll() | IsManipulate()'.
+    :param PermissionEngine engine: Default is 'permission_engine'.
+    """
+    engine = engine or permission_engine
+    rule = permission.rule
+
+    async def check_permission(request: Request) -> None:
+        mask = await engine.mask_for(request)
+        if rule.check(mask):
+            return
+        if not getattr(request.scope.get("user"), "is_authenticated", False):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Authentication credentials were not provided",
+            )
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action",
         )
 
+    return check_permission
+
 
-is_active = IsActive.has_permission
-is_aLL = IsAll.has_permission
-is_reader = IsReader.has_permission
-is_ownerraport = IsOwnerRaport.has_permission
+is_active = IsActive().has_permission
+is_aLL = IsAll().has_permission
+is_reader = IsReader().has_permission
+is_ownerraport = IsOwnerRaport().has_permission
+is_manipulate = IsManipulate().has_permission
@@ -0,0 +1,503 @@
+"""
+project/positions.py
+
+Ingestion of the positions of trucks: driver id, time, lat/lon, speed and heading.
+The body of request is parsed by chunks (NDJSON or the binary records), the rows of chunk
+are validated by NumPy at once and put to 'PositionBuffer'. The buffer writes them by the
+multi-row inserts of 'Database.bulk_insert_positions'. When the buffer is full, 'put()' waits -
+the body is not read further, so the client is slowed down by TCP (backpressure).
+"""
+
+import asyncio
+import json
+import logging
+import time
+from typing import Callable, List, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy.exc import DataError, IntegrityError
+
+from logs import configure_logging
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+# The rows in memory (the order of 'project.db.models.POSITION_COLUMNS')
+POSITION_DTYPE = np.dtype(
+    [
+        ("driver_id", "<i8"),
+        ("recorded_at", "<f8"),
+        ("lat", "<f8"),
+        ("lon", "<f8"),
+        ("speed", "<f8"),
+        ("heading", "<f8"),
+    ]
+)
+# The binary record of 'application/octet-stream' - 28 bytes, little-endian, without header.
+# float32 of lat/lon is ~1 m - under the accuracy of GPS.
+POSITION_WIRE_DTYPE = np.dtype(
+    [
+        ("driver_id", "<u4"),
+        ("recorded_at", "<f8"),
+        ("lat", "<f4"),
+        ("lon", "<f4"),
+        ("speed", "<f4"),
+        ("heading", "<f4"),
+    ]
+)
+# NDJSON: one object per line with these keys
+NDJSON_KEYS = ("driver_id", "timestamp", "lat", "lon", "speed", "heading")
+MAX_LINE_SIZE = 4096
+# 'PositionModel.driver_id' is 'Integer' - int4 of PostgreSQL
+MAX_DRIVER_ID = 2**31 - 1
+
+
+class BufferFullError(Exception):
+    """
+    The buffer stayed full longer than 'put_timeout'. 'ingest' sets what was done \
+    before it: the rows of body before the byte 'resume_at' are accepted or rejected, \
+    the rest is not.
+    """
+
+    accepted = 0
+    rejected = 0
+    resume_at = 0
+
+
+def is_data_error(error: BaseException) -> bool:
+    """
+    The rows are bad, not the database - the retry of the same rows will not help: \
+    the value out of range of the column, the broken constraint.
+    """
+    if isinstance(error, (DataError, IntegrityError)):
+        return True
+    orig = getattr(error, "orig", None) or error
+    # The driver could not convert the value (e.g. 'OverflowError' of sqlite3,
+    # 'DataError' of asyncpg is 'ValueError')
+    if isinstance(orig, (OverflowError, ValueError, TypeError)):
+        return True
+    # PostgreSQL: the class '22' - data exception, '23' - integrity constraint violation
+    return str(getattr(orig, "sqlstate", None) or "")[:2] in ("22", "23")
+
+
+def empty_positions() -> np.ndarray:
+    return np.empty(0, dtype=POSITION_DTYPE)
+
+
+def validate_positions(
+    rows: np.ndarray,
+    now: Optional[float] = None,
+    max_age: float = 7 * 24 * 3600,
+    max_skew: float = 300.0,
+    max_speed: float = 300.0,
+) -> Tuple[np.ndarray, int]:
+    """
+    The checks of all rows at once (no loop of Python).
+    :param rows: The array of 'POSITION_DTYPE'.
+    :param float max_age: Seconds. The older reports are rejected (the device was offline).
+    :param float max_skew: Seconds. The reports from the future are rejected.
+    :param float max_speed: km/h.
+    :return: (the valid rows, number of the rejected rows).
+    """
+    if now is None:
+        now = time.time()
+    lat = rows["lat"]
+    lon = rows["lon"]
+    speed = rows["speed"]
+    heading = rows["heading"]
+    recorded_at = rows["recorded_at"]
+    with np.errstate(invalid="ignore"):
+        # NaN fails all comparisons - the separate 'isfinite' is not needed
+        valid = (
+            (rows["driver_id"] > 0)
+            & (rows["driver_id"] <= MAX_DRIVER_ID)
+            & (lat >= -90.0)
+            & (lat <= 90.0)
+            & (lon >= -180.0)
+            & (lon <= 180.0)
+            & (speed >= 0.0)
+            & (speed <= max_speed)
+            & (heading >= 0.0)
+            & (heading <= 360.0)
+            & (recorded_at >= now - max_age)
+            & (recorded_at <= now + max_skew)
+        )
+    if valid.all():
+        return rows, 0
+    return rows[valid], int(len(rows) - valid.sum())
+
+
+def positions_to_rows(rows: np.ndarray) -> List[Tuple]:
+    """The tuples of Python scalars for the driver of database (not NumPy scalars)."""
+    return rows.tolist()
+
+
+class BinaryPositionParser:
+    """The records of 'POSITION_WIRE_DTYPE'. The record split between chunks is kept."""
+
+    def __init__(self) -> None:
+        self._tail = b""
+        self.rejected = 0
+
+    @property
+    def pending(self) -> int:
+        """Bytes of the incomplete record at the end of the fed data."""
+        return len(self._tail)
+
+    def feed(self, chunk: bytes) -> np.ndarray:
+        data = self._tail + chunk if self._tail else chunk
+        size = len(data) - len(data) % POSITION_WIRE_DTYPE.itemsize
+        self._tail = data[size:]
+        wire = np.frombuffer(data[:size], dtype=POSITION_WIRE_DTYPE)
+        rows = np.empty(len(wire), dtype=POSITION_DTYPE)
+        rows["driver_id"] = wire["driver_id"]
+        rows["recorded_at"] = wire["recorded_at"]
+        # float32 => float64 without the noise of float32 ('55.7' instead of '55.70000076'):
+        # 5 digits are ~1 m, float32 keeps ~6-7 significant digits
+        rows["lat"] = wire["lat"].astype(np.float64).round(5)
+        rows["lon"] = wire["lon"].astype(np.float64).round(5)
+        rows["speed"] = wire["speed"].astype(np.float64).round(2)
+        rows["heading"] = wire["heading"].astype(np.float64).round(2)
+        return rows
+
+    def close(self) -> np.ndarray:
+        if self._tail:
+            # The incomplete record at the end of body
+            self.rejected += 1
+            self._tail = b""
+        return empty_positions()
+
+
+class NdjsonPositionParser:
+    """
+    The lines of chunk are parsed by the one 'json.loads' (as the JSON array) and the columns \
+    are made by 'np.fromiter'. The chunk with the broken line falls back to the line-by-line \
+    parsing - only the broken lines are rejected. 'driver_id' must be the JSON integer \
+    (7.9 is not truncated to 7). The line longer than 'MAX_LINE_SIZE' is rejected once, \
+    its rest is skipped up to the end of line.
+    """
+
+    def __init__(self) -> None:
+        self._tail = b""
+        self.rejected = 0
+        # Bytes of the too long line which are skipped; 'None' - the line is not skipped
+        self._skipped: Optional[int] = None
+
+    @property
+    def pending(self) -> int:
+        """Bytes of the incomplete line at the end of the fed data."""
+        return len(self._tail) + (self._skipped or 0)
+
+    def feed(self, chunk: bytes) -> np.ndarray:
+        data = self._tail + chunk if self._tail else chunk
+        if self._skipped is not None:
+            end = data.find(b"\n")
+            if end < 0:
+                self._skipped += len(data)
+                return empty_positions()
+            self._skipped = None
+            data = data[end + 1 :]
+        end = data.rfind(b"\n")
+        self._tail = data[end + 1 :]
+        if len(self._tail) > MAX_LINE_SIZE:
+            self.rejected += 1
+            self._skipped = len(self._tail)
+            self._tail = b""
+        return self._parse(data[:end]) if end > 0 else empty_positions()
+
+    def close(self) -> np.ndarray:
+        data, self._tail = self._tail, b""
+        self._skipped = None
+        return self._parse(data) if data.strip() else empty_positions()
+
+    def _parse(self, data: bytes) -> np.ndarray:
+        lines = [line for line in data.split(b"\n") if line.strip()]
+        if not lines:
+            return empty_positions()
+        try:
+            objects = json.loads(b"[%s]" % b",".join(lines))
+            return self._columns(objects)
+        except (ValueError, TypeError, KeyError):
+            pass
+        driver_ids = []
+        tuples = []
+        for line in lines:
+            try:
+                item = json.loads(line)
+                driver_id = _driver_id(item["driver_id"])
+                tuples.append(tuple(float(item[key]) for key in NDJSON_KEYS[1:]))
+                driver_ids.append(driver_id)
+            except (ValueError, TypeError, KeyError):
+                self.rejected += 1
+        rows = np.empty(len(tuples), dtype=POSITION_DTYPE)
+        if tuples:
+            rows["driver_id"] = driver_ids
+            values = np.array(tuples, dtype=np.float64)
+            for index, name in enumerate(POSITION_DTYPE.names[1:]):
+                rows[name] = values[:, index]
+        return rows
+
+    @staticmethod
+    def _columns(objects: list) -> np.ndarray:
+        count = len(objects)
+        rows = np.empty(count, dtype=POSITION_DTYPE)
+        rows["driver_id"] = np.fromiter(
+            (_driver_id(item["driver_id"]) for item in objects), np.int64, count
+        )
+        for name, key in zip(POSITION_DTYPE.names[1:], NDJSON_KEYS[1:]):
+            # 'float()' raises on 'None' and the not numeric strings (TypeError/ValueError)
+            rows[name] = np.fromiter(
+                (float(item[key]) for item in objects), np.float64, count
+            )
+        return rows
+
+
+def _driver_id(value) -> int:
+    """The JSON integer only: not 7.9 (no truncation to 7), not "7", not 'true'."""
+    if type(value) is not int:
+        raise TypeError("driver_id must be an integer")
+    # The id out of the column is the rejected line - not 'OverflowError' of int64
+    if not 0 < value <= MAX_DRIVER_ID:
+        raise ValueError("driver_id is out of range")
+    return value
+
+
+class PositionBuffer:
+    """
+    Example:
+    ```
+        buffer = PositionBuffer(db, max_rows=200000, batch_size=10000)
+        buffer.start() # in the lifespan of app
+        await buffer.put(rows) # waits while the buffer is full
+        ...
+        await buffer.stop() # the rest is written
+    ```
+    """
+
+    def __init__(
+        self,
+        db,
+        max_rows: int = 200_000,
+        batch_size: int = 10_000,
+        flush_interval: float = 0.25,
+        put_timeout: float = 5.0,
+        retry_delay: float = 1.0,
+    ) -> None:
+        """
+        :param db: 'project.db.models.Database' with the async engine.
+        :param int max_rows: Rows in memory (including the rows being written). Above it \
+            'put()' waits.
+        :param int batch_size: The flush starts when so many rows are buffered.
+        :param float flush_interval: Seconds. The smaller buffer is written at least so often.
+        :param float put_timeout: Seconds of waiting in 'put()', then 'BufferFullError'.
+        :param float retry_delay: Seconds before the next attempt after the error of database.
+        """
+        self.db = db
+        self.max_rows = max_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.retry_delay = retry_delay
+        self.pending: List[np.ndarray] = []
+        # Buffered + being written
+        self.size = 0
+        self.written = 0
+        # The rows which the database refused (the data error) - they are not retried
+        self.dropped = 0
+        self.flushes = 0
+        # They get every written batch (e.g. the live indexes of positions)
+        self.listeners: List[Callable[[np.ndarray], None]] = []
+        self._space = asyncio.Condition()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def put(self, rows: np.ndarray) -> None:
+        """
+        :param rows: The validated rows of 'POSITION_DTYPE'.
+        :raise BufferFullError:
+        """
+        count = len(rows)
+        if not count:
+            return
+        if count > self.max_rows:
+            raise ValueError(
+                "%d rows are more than the buffer (%d)" % (count, self.max_rows)
+            )
+        if self.size + count > self.max_rows:
+            self._wakeup.set()
+            async with self._space:
+                try:
+                    await asyncio.wait_for(
+                        self._space.wait_for(
+                            lambda: self.size + count <= self.max_rows
+                        ),
+                        self.put_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    raise BufferFullError(
+                        "The buffer of positions is full (%d rows)" % self.size
+                    ) from None
+                self.pending.append(rows)
+                self.size += count
+        else:
+            self.pending.append(rows)
+            self.size += count
+        if self.size >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """
+        Writes the buffered rows. The batch refused by the data error \
+        ('is_data_error') is bisected - the good rows are written, the bad rows are \
+        dropped (logged), so the one bad row does not stop the buffer.
+        :return: number of the written rows.
+        """
+        if not self.pending:
+            return 0
+        batches, self.pending = self.pending, []
+        rows = batches[0] if len(batches) == 1 else np.concatenate(batches)
+        written: List[np.ndarray] = []
+        dropped = 0
+        # The parts to write, the next is the last
+        parts = [rows]
+        try:
+            while parts:
+                part = parts.pop()
+                try:
+                    await self.db.bulk_insert_positions(positions_to_rows(part))
+                except Exception as error:
+                    if not is_data_error(error):
+                        raise
+                    if len(part) == 1:
+                        dropped += 1
+                        log.error(
+                            "%s: the row %s is dropped => %s"
+                            % (self.flush.__name__, part.tolist()[0], error)
+                        )
+                    else:
+                        half = len(part) // 2
+                        parts += [part[half:], part[:half]]
+                    continue
+                written.append(part)
+        except BaseException as error:
+            # The rest is kept (and counted in 'size') - 'put()' waits while the
+            # database fails. The cancelled flush (the transaction is rolled back) keeps
+            # it too.
+            kept = [part, *reversed(parts)]
+            self.pending[:0] = kept
+            if isinstance(error, Exception):
+                log.error(
+                    "%s: %d rows were not written => %s"
+                    % (self.flush.__name__, sum(len(rest) for rest in kept), error)
+                )
+            raise
+        finally:
+            count = sum(len(done) for done in written)
+            self.size -= count + dropped
+            self.written += count
+            self.dropped += dropped
+            for done in written:
+                for listener in self.listeners:
+                    listener(done)
+        self.flushes += 1
+        async with self._space:
+            self._space.notify_all()
+        return count
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                if not self._closing:
+                    await asyncio.sleep(self.retry_delay)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stops the background flush (the current flush is finished) and writes the rest."""
+        if self._task is not None:
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        try:
+            await self.flush()
+        except Exception:
+            log.error("%s: %d rows are lost" % (self.stop.__name__, self.size))
+
+
+Parser = Union[NdjsonPositionParser, BinaryPositionParser]
+
+
+async def ingest(
+    chunks,
+    parser: Parser,
+    buffer: PositionBuffer,
+    validate: Callable[[np.ndarray], Tuple[np.ndarray, int]] = validate_positions,
+) -> Tuple[int, int]:
+    """
+    The body is fed to the parser by the pieces of not more than 'batch_size' \
+    records; the valid rows of the piece are put to the buffer at once - the piece is \
+    accepted all or nothing, so the accepted rows are the beginning of body.
+    :param chunks: Async iterator of bytes ('request.stream()').
+    :param parser: 'NdjsonPositionParser' or 'BinaryPositionParser'.
+    :param validate: e.g. 'validate_positions'.
+    :return: (accepted, rejected).
+    :raise BufferFullError: With 'accepted', 'rejected' and 'resume_at' - the client \
+        re-sends the body from the byte 'resume_at', not the whole body.
+    """
+    accepted = 0
+    rejected = 0
+    fed = 0
+    piece_size = buffer.batch_size * POSITION_WIRE_DTYPE.itemsize
+
+    async def put(piece: Optional[bytes]) -> None:
+        nonlocal accepted, rejected, fed
+        # The bytes before the incomplete record (line) are handled
+        resume_at = fed - parser.pending
+        parser_rejected = parser.rejected
+        rows = parser.close() if piece is None else parser.feed(piece)
+        invalid = 0
+        if len(rows):
+            rows, invalid = validate(rows)
+        try:
+            await buffer.put(rows)
+        except BufferFullError as error:
+            error.accepted = accepted
+            error.rejected = rejected + parser_rejected
+            error.resume_at = resume_at
+            raise
+        accepted += len(rows)
+        rejected += invalid
+        if piece is not None:
+            fed += len(piece)
+
+    async for chunk in chunks:
+        for start in range(0, len(chunk), piece_size):
+            await put(chunk[start : start + piece_size])
+    await put(None)
+    return accepted, rejected + parser.rejected
+
+
+def parser_for(content_type: str) -> Optional[Parser]:
+    """The parser of 'Content-Type' or 'None'."""
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    if media_type in (
+        "application/x-ndjson",
+        "application/ndjson",
+        "application/jsonl",
+    ):
+        return NdjsonPositionParser()
+    if media_type == "application/octet-stream":
+        return BinaryPositionParser()
+    return None
@@ -0,0 +1,43 @@
+"""
+project/routers/internal/admin.py
+"""
+
+from typing import Literal
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+
+from project.db.profiler import QueryProfiler
+from project.permissions import IsAll, require
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require(IsAll()))])
+
+QueryOrder = Literal[
+    "total_ms", "count", "mean_ms", "p95_ms", "max_ms", "slow", "n_plus_one"
+]
+
+
+def get_query_profiler(request: Request) -> QueryProfiler:
+    profiler = getattr(request.app.state, "query_profiler", None)
+    if profiler is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The query profiler is off (QUERY_PROFILER)",
+        )
+    return profiler
+
+
+@router.get("/queries", include_in_schema=False)
+async def queries(
+    limit: int = Query(50, ge=1, le=1000),
+    order_by: QueryOrder = "total_ms",
+    profiler: QueryProfiler = Depends(get_query_profiler),
+):
+    """The aggregates of SQL statements by fingerprint of this worker."""
+    return {"queries": profiler.report(limit=limit, order_by=order_by)}
+
+
+@router.delete(
+    "/queries", include_in_schema=False, status_code=status.HTTP_204_NO_CONTENT
+)
+async def reset_queries(profiler: QueryProfiler = Depends(get_query_profiler)) -> None:
+    profiler.reset()
@@ -0,0 +1,91 @@
+"""
+project/routers/internal/clusters.py
+"""
+
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from starlette.responses import Response
+
+from project.clusters import ClusterIndex, ClusterTile
+from project.permissions import IsActive, require
+from project.templating import etag_matches, make_etag
+
+router = APIRouter(prefix="/clusters", dependencies=[Depends(require(IsActive()))])
+
+
+def get_clusters(request: Request) -> ClusterIndex:
+    clusters = getattr(request.app.state, "clusters", None)
+    if clusters is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The clusters are not started",
+        )
+    return clusters
+
+
+def clusters_response(
+    request: Request, clusters: ClusterIndex, head: str, tiles: List[ClusterTile]
+) -> Response:
+    """
+    The body is joined from the serialized tiles. 'ETag' - of the tiles' etags; the clusters \
+    are changed not earlier than the next pass of the moved trucks ('max-age').
+    """
+    etag = (
+        tiles[0].etag
+        if len(tiles) == 1
+        else make_etag("".join(t.etag for t in tiles).encode())
+    )
+    headers = {
+        "etag": etag,
+        "cache-control": "private, max-age=%d" % max(1, clusters.interval),
+    }
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = '{%s,"clusters":[%s]}' % (
+        head,
+        ",".join(t.clusters for t in tiles if t.clusters),
+    )
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@router.get("")
+async def viewport_clusters(
+    request: Request,
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+    clusters: ClusterIndex = Depends(get_clusters),
+) -> Response:
+    """
+    The clusters of the viewport: `{"zoom": 4, "clusters": [{"lat": 55.7, "lon": 37.6, \
+    "count": 120}, {"lat": 59.9, "lon": 30.3, "count": 1, "driver_id": 7}]}`. The clusters \
+    are of the whole tiles which cover the viewport. 'min_lon' > 'max_lon' - the viewport \
+    over the antimeridian.
+    """
+    try:
+        tiles = clusters.viewport(min_lat, min_lon, max_lat, max_lon, zoom)
+    except ValueError as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    return clusters_response(request, clusters, '"zoom":%d' % zoom, tiles)
+
+
+@router.get("/{zoom}/{x}/{y}")
+async def tile_clusters(
+    request: Request,
+    zoom: int = Path(..., ge=0, le=22),
+    x: int = Path(..., ge=0),
+    y: int = Path(..., ge=0),
+    clusters: ClusterIndex = Depends(get_clusters),
+) -> Response:
+    """The clusters of the tile (XYZ, 256 px) - the URL is the cache key of the map client."""
+    if x >= 2**zoom or y >= 2**zoom:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="No such tile"
+        )
+    tile = clusters.tile(zoom, x, y)
+    return clusters_response(
+        request, clusters, '"zoom":%d,"x":%d,"y":%d' % (zoom, x, y), [tile]
+    )
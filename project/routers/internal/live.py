@@ -0,0 +1,55 @@
+"""
+project/routers/internal/live.py
+"""
+
+import asyncio
+import json
+from contextlib import suppress
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
+
+from project.live import LiveSubscriber, PositionHub
+from project.permissions import IsActive, permission_engine
+
+router = APIRouter(prefix="/live")
+
+_ERROR_FRAME = b'{"type":"error","detail":%s}'
+
+
+@router.websocket("")
+async def live_positions(websocket: WebSocket) -> None:
+    """
+    The live positions: the client sends the subscription (`{"bbox": [55.0, 37.0, 56.0, \
+    38.0]}` or `{"drivers": [7, 12]}`, again - to change it) and gets the snapshot of it, \
+    then the updates per tick ('project.live.PositionHub'). The frames are binary (UTF-8 \
+    JSON) - the same bytes for all sockets of the subscription.
+    The user is of 'CustomJWTMiddleware' (the token in the query of browser: \
+    '/live?token_access=...'). Not active - the close 1008.
+    """
+    hub: PositionHub = getattr(websocket.app.state, "position_hub", None)
+    if hub is None:
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
+    mask = await permission_engine.mask_for(websocket)
+    if not IsActive.rule.check(mask):
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscriber = LiveSubscriber(max_pending=hub.max_pending)
+    # One task sends - the errors of subscription are queued as the frames too
+    sender = asyncio.create_task(hub.sender(subscriber, websocket.send_bytes))
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                hub.subscribe_message(subscriber, message)
+            except ValueError as error:
+                subscriber.push(_ERROR_FRAME % json.dumps(str(error)).encode())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unsubscribe(subscriber)
+        sender.cancel()
+        # The sender stops by the closed socket too
+        with suppress(asyncio.CancelledError, Exception):
+            await sender
@@ -0,0 +1,16 @@
+"""
+project/routers/internal/metrics.py
+"""
+
+from fastapi import APIRouter
+from starlette.responses import Response
+
+from project.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Metrics of the worker in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,210 @@
+"""
+project/routers/internal/positions.py
+"""
+
+from functools import partial
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+
+from project.db.corn import Settings
+from project.db.models import (
+    FLEET_STATUS_MOVING,
+    FLEET_STATUS_STOPPED,
+    Database,
+    fleet_json,
+    fleet_records,
+)
+from project.permissions import IsActive, require
+from project.positions import (
+    BufferFullError,
+    PositionBuffer,
+    ingest,
+    parser_for,
+    validate_positions,
+)
+
+settings = Settings()
+router = APIRouter(prefix="/positions", dependencies=[Depends(require(IsActive()))])
+
+validate = partial(
+    validate_positions,
+    max_age=settings.POSITIONS_MAX_AGE,
+    max_skew=settings.POSITIONS_MAX_SKEW,
+)
+FLEET_STATUSES = {"moving": FLEET_STATUS_MOVING, "stopped": FLEET_STATUS_STOPPED}
+
+
+def get_position_buffer(request: Request) -> PositionBuffer:
+    buffer = getattr(request.app.state, "position_buffer", None)
+    if buffer is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The buffer of positions is not started",
+        )
+    return buffer
+
+
+def get_database(request: Request) -> Database:
+    db = getattr(request.app.state, "db", None)
+    if db is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The database is not configured",
+        )
+    return db
+
+
+@router.post("", status_code=status.HTTP_202_ACCEPTED)
+async def post_positions(
+    request: Request, buffer: PositionBuffer = Depends(get_position_buffer)
+) -> JSONResponse:
+    """
+    The reports of positions by the stream of body:
+    - 'application/x-ndjson': `{"driver_id": 7, "timestamp": 1760000000.5, "lat": 55.75, \
+    "lon": 37.61, "speed": 62.5, "heading": 180}` per line;
+    - 'application/octet-stream': the records of 'project.positions.POSITION_WIRE_DTYPE'.
+    The invalid rows are rejected (counted), the valid are written by batches.
+    The response is '202' - the rows are in the buffer, not in the database yet.
+    '503' (the buffer is full): the rows before the byte 'resume_at' of body are \
+    accepted or rejected ('accepted'/'rejected'), the rest is not - the client re-sends \
+    the body from 'resume_at'.
+    """
+    parser = parser_for(request.headers.get("content-type", ""))
+    if parser is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Content-Type must be 'application/x-ndjson' or 'application/octet-stream'",
+        )
+    try:
+        accepted, rejected = await ingest(request.stream(), parser, buffer, validate)
+    except BufferFullError as error:
+        return JSONResponse(
+            {
+                "detail": str(error),
+                "accepted": error.accepted,
+                "rejected": error.rejected,
+                "resume_at": error.resume_at,
+            },
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": "1"},
+        )
+    return JSONResponse(
+        {"accepted": accepted, "rejected": rejected},
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+@router.get("/nearest")
+async def nearest_trucks(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    k: int = Query(10, ge=1, le=1000),
+    max_km: Optional[float] = Query(None, gt=0),
+    db: Database = Depends(get_database),
+):
+    """The nearest trucks by their latest positions (the index in memory), the nearest first."""
+    trucks = []
+    for driver_id, distance in db.nearest_trucks(lat, lon, k=k, max_km=max_km):
+        truck_lat, truck_lon, recorded_at = db.spatial.position(driver_id)
+        trucks.append(
+            {
+                "driver_id": driver_id,
+                "lat": truck_lat,
+                "lon": truck_lon,
+                "recorded_at": recorded_at,
+                "distance_km": round(distance, 3),
+            }
+        )
+    return {"trucks": trucks}
+
+
+@router.get("/bbox")
+async def trucks_in_bbox(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    limit: int = Query(10000, ge=1, le=100000),
+    db: Database = Depends(get_database),
+):
+    """
+    The trucks inside of the viewport by their latest positions (the index in memory). \
+    'min_lon' > 'max_lon' - the viewport over the antimeridian.
+    """
+    trucks = []
+    for driver_id in db.trucks_in_bbox(min_lat, min_lon, max_lat, max_lon, limit=limit):
+        truck_lat, truck_lon, recorded_at = db.spatial.position(driver_id)
+        trucks.append(
+            {
+                "driver_id": driver_id,
+                "lat": truck_lat,
+                "lon": truck_lon,
+                "recorded_at": recorded_at,
+            }
+        )
+    return {"trucks": trucks}
+
+
+@router.get("/fleet")
+async def fleet_snapshot(
+    request: Request,
+    stale_after: Optional[float] = Query(None, gt=0),
+    truck_status: Optional[str] = Query(
+        None, alias="status", pattern="^(moving|stopped)$"
+    ),
+    min_lat: Optional[float] = Query(None, ge=-90, le=90),
+    min_lon: Optional[float] = Query(None, ge=-180, le=180),
+    max_lat: Optional[float] = Query(None, ge=-90, le=90),
+    max_lon: Optional[float] = Query(None, ge=-180, le=180),
+    limit: int = Query(settings.FLEET_PAGE_SIZE, ge=1, le=settings.FLEET_MAX_PAGE_SIZE),
+    after: Optional[int] = Query(None, ge=0),
+    db: Database = Depends(get_database),
+) -> Response:
+    """
+    The latest state of the fleet from the arrays of 'db.fleet' - no query of database, \
+    no dict per truck. The filters are combined:
+    - 'stale_after': seconds, only the trucks without reports for longer;
+    - 'status': 'moving' or 'stopped';
+    - 'min_lat', 'min_lon', 'max_lat', 'max_lon': all four, the box of trucks.
+    The pages of 'limit' trucks in the order of driver ids: the next page is `after=<the \
+    'next_after' of JSON or the header 'X-Next-After'>`.
+    The response is the columns as the JSON arrays or, by `Accept: application/octet-stream`, \
+    the records of 'project.db.models.FLEET_WIRE_DTYPE'.
+    """
+    fleet = db.fleet
+    mask = fleet.used()
+    if stale_after is not None:
+        mask &= fleet.stale(stale_after)
+    if truck_status is not None:
+        mask &= fleet.with_status(FLEET_STATUSES[truck_status])
+    box = (min_lat, min_lon, max_lat, max_lon)
+    if any(value is not None for value in box):
+        if any(value is None for value in box):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="The box needs 'min_lat', 'min_lon', 'max_lat' and 'max_lon'",
+            )
+        mask &= fleet.in_region(min_lat, min_lon, max_lat, max_lon)
+    # The copies of the page are taken in the loop, the serialization (tens of ms of the page
+    # of thousands of trucks) is in the threads - the loop is not blocked
+    columns = fleet.columns(mask, limit=limit, after=after)
+    next_after = (
+        int(columns["driver_id"][-1]) if len(columns["driver_id"]) == limit else None
+    )
+    headers = {"Cache-Control": "no-store"}
+    if next_after is not None:
+        headers["X-Next-After"] = str(next_after)
+    if "application/octet-stream" in request.headers.get("accept", ""):
+        return Response(
+            await run_in_threadpool(fleet_records, columns),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+    return Response(
+        await run_in_threadpool(fleet_json, columns, next_after),
+        media_type="application/json",
+        headers=headers,
+    )
@@ -0,0 +1,63 @@
+"""
+project/routers/internal/routes.py
+"""
+
+from datetime import date
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from starlette.responses import JSONResponse, Response
+
+from project.db.corn import Settings
+from project.permissions import IsActive, require
+from project.routes import RouteTiles
+from project.templating import etag_matches
+
+settings = Settings()
+router = APIRouter(prefix="/routes", dependencies=[Depends(require(IsActive()))])
+
+
+def get_route_tiles(request: Request) -> RouteTiles:
+    routes = getattr(request.app.state, "route_tiles", None)
+    if routes is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The routes are not started",
+        )
+    return routes
+
+
+@router.get("/{driver_id}/{day}")
+async def route(
+    request: Request,
+    driver_id: int = Path(..., ge=1),
+    day: date = Path(..., description="UTC day, e.g. 2026-10-18"),
+    zoom: int = Query(12, ge=0, le=22),
+    routes: RouteTiles = Depends(get_route_tiles),
+) -> Response:
+    """
+    The trace of the driver for the day, simplified for the zoom of map - the encoded \
+    polyline (precision 5). The zoom above 'ROUTES_MAX_ZOOM' gets the route of it.
+    """
+    trip = await routes.trip(driver_id, day)
+    if trip is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="The driver has no positions for this day",
+        )
+    zoom = min(zoom, routes.zooms[-1])
+    tile = trip.tiles[zoom]
+    max_age = routes.live_ttl if routes.is_live(day) else settings.ROUTES_CACHE_MAX_AGE
+    headers = {"etag": tile.etag, "cache-control": "private, max-age=%d" % max_age}
+    if etag_matches(request.headers.get("if-none-match", ""), tile.etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(
+        {
+            "driver_id": driver_id,
+            "day": day.isoformat(),
+            "zoom": zoom,
+            "points": tile.points,
+            "total_points": trip.total,
+            "polyline": tile.polyline,
+        },
+        headers=headers,
+    )
@@ -4,22 +4,33 @@ project/routers/internal/views.py
 
 from fastapi import status, HTTPException, APIRouter
 from starlette.requests import Request
-from starlette.responses import JSONResponse
+from starlette.responses import Response
 
-from fastapi.templating import Jinja2Templates
+from project.db.corn import Settings
+from project.static_assets import StaticAssets
+from project.templating import CachedTemplates
 
-render = Jinja2Templates(directory="templates")
+settings = Settings()
+# It is built in the 'lifespan' of app ('static_assets.build()')
+static_assets = StaticAssets("static", settings.STATIC_BUILD_DIR)
+render = CachedTemplates(
+    directory="templates",
+    bytecode_cache_dir=settings.TEMPLATES_BYTECODE_CACHE,
+    maxsize=settings.TEMPLATES_CACHE_SIZE,
+    check_interval=settings.TEMPLATES_CHECK_INTERVAL,
+)
+# '{{ static_url("styles/style.css") }}' - the URL with the content hash
+render.env.globals["static_url"] = static_assets.url
 router = APIRouter()
 
 
 @router.get("/")
-def main_page(request: Request) -> JSONResponse:
+async def main_page(request: Request) -> Response:
     if not request:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error => 'request' not was found",
         )
+    # The constant context - the page is rendered once, the next requests get it from cache
     context = {"title": "First page"}
-    return render.TemplateResponse(
-        request, name="index.html", context=context, status=status.HTTP_200_OK
-    )
+    return render.cached_response(request, "index.html", context)
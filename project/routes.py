@@ -0,0 +1,325 @@
+"""
+project/routes.py
+
+The routes (the GPS traces) of the trucks for the map: the positions of the driver for one
+day (UTC) are simplified by Douglas-Peucker per zoom level and sent as the encoded polylines
+(the format of Google, precision 5) - a few hundred points of the zoom instead of the tens
+of thousands of the full day.
+Douglas-Peucker is run once per trip: every point gets its 'importance' - the max tolerance
+at which the point is still kept. The points of zoom 'z' are `importance > tolerance(z)`, so
+all zoom levels are made by one run. The run is in the process pool - the event loop is not
+blocked; the result (the polylines of all zoom levels) is cached per trip.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from functools import partial
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from logs import configure_logging
+from project.cache import LRUCache
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+# Web Mercator: the world is 'TILE_SIZE' pixels at zoom 0, 'TILE_SIZE * 2 ** z' at zoom 'z'
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878
+POLYLINE_PRECISION = 1e5
+DAY_SECONDS = 24 * 3600
+
+
+def mercator_pixels(lat: np.ndarray, lon: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The coordinates in pixels of zoom 0 - the tolerance of zoom 'z' is 'pixels / 2 ** z'."""
+    phi = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0 * TILE_SIZE
+    y = (1.0 - np.log(np.tan(phi) + 1.0 / np.cos(phi)) / math.pi) / 2.0 * TILE_SIZE
+    return x, y
+
+
+def zoom_tolerance(zoom: int, tolerance_px: float = 0.5) -> float:
+    """The tolerance of zoom in the pixels of zoom 0."""
+    return tolerance_px / 2**zoom
+
+
+def douglas_peucker_importance(
+    x: np.ndarray, y: np.ndarray, min_tolerance: float = 0.0
+) -> np.ndarray:
+    """
+    Douglas-Peucker of all segments of the level at once: the distances of the inner points \
+    to their segments are computed by the one NumPy expression, the farthest point of every \
+    segment splits it. The distance is to the segment (not to the line) - the trace can turn back.
+    :param float min_tolerance: The segments which are flat by it are not split further - \
+        their inner points get '0' (they are not kept by any tolerance >= 'min_tolerance').
+    :return: the importance of points: the point is kept by the tolerance 't' when \
+        'importance > t'. The first and the last points - 'inf'.
+    """
+    count = len(x)
+    importance = np.zeros(count)
+    if count < 3:
+        importance[:] = np.inf
+        return importance
+    importance[0] = importance[-1] = np.inf
+    starts = np.array([0])
+    ends = np.array([count - 1])
+    parents = np.array([np.inf])
+    while len(starts):
+        lengths = ends - starts - 1
+        offsets = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        inner = starts[segment] + 1 + (np.arange(lengths.sum()) - offsets[segment])
+        ax, ay = x[starts][segment], y[starts][segment]
+        dx, dy = x[ends][segment] - ax, y[ends][segment] - ay
+        px, py = x[inner] - ax, y[inner] - ay
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, (px * dx + py * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distance = np.hypot(px - t * dx, py - t * dy)
+        farthest = np.maximum.reduceat(distance, offsets)
+        # The first point of the max distance of every segment
+        candidates = np.flatnonzero(distance == farthest[segment])
+        _, first = np.unique(segment[candidates], return_index=True)
+        split = inner[candidates[first]]
+        # The point is not more important than its parent - the kept points of the larger
+        # tolerance are the subset of the kept points of the smaller
+        value = np.minimum(farthest, parents)
+        importance[split] = value
+        deeper = value > min_tolerance
+        starts, ends, parents = (
+            np.concatenate((starts[deeper], split[deeper])),
+            np.concatenate((split[deeper], ends[deeper])),
+            np.concatenate((value[deeper], value[deeper])),
+        )
+        has_inner = ends - starts > 1
+        starts, ends, parents = starts[has_inner], ends[has_inner], parents[has_inner]
+    return importance
+
+
+def encode_polyline(lat: np.ndarray, lon: np.ndarray) -> str:
+    """
+    The encoded polyline (precision 5) - vectorized: the zigzag deltas are cut to the chunks \
+    of 5 bits at once.
+    Example: `encode_polyline([38.5, 40.7, 43.252], [-120.2, -120.95, -126.453])` => \
+        `"_p~iF~ps|U_ulLnnqC_mqNvxq`@"`
+    """
+    if not len(lat):
+        return ""
+    values = np.empty((len(lat), 2), dtype=np.int64)
+    values[:, 0] = np.round(np.asarray(lat, dtype=np.float64) * POLYLINE_PRECISION)
+    values[:, 1] = np.round(np.asarray(lon, dtype=np.float64) * POLYLINE_PRECISION)
+    deltas = np.diff(values, axis=0, prepend=0).ravel()
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+    # 7 chunks of 5 bits cover 32 bits
+    shifts = 5 * np.arange(7)
+    chunks = (zigzag[:, None] >> shifts) & 0x1F
+    needed = 1 + (zigzag[:, None] >= (1 << shifts[1:])).sum(axis=1)
+    used = np.arange(7) < needed[:, None]
+    more = np.arange(7) < (needed - 1)[:, None]
+    chunks = (chunks | (more * 0x20)) + 63
+    return chunks[used].astype(np.uint8).tobytes().decode("ascii")
+
+
+def decode_polyline(polyline: str) -> List[Tuple[float, float]]:
+    """:return: [(lat, lon)]."""
+    points: List[Tuple[float, float]] = []
+    index = lat = lon = 0
+    while index < len(polyline):
+        deltas = []
+        for _ in range(2):
+            result = shift = 0
+            while True:
+                byte = ord(polyline[index]) - 63
+                index += 1
+                result |= (byte & 0x1F) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        points.append((lat / POLYLINE_PRECISION, lon / POLYLINE_PRECISION))
+    return points
+
+
+@dataclass(frozen=True)
+class RouteTile:
+    """The route of one zoom level."""
+
+    polyline: str
+    points: int
+    etag: str
+
+
+def simplify_route(
+    lat: np.ndarray, lon: np.ndarray, zooms: Sequence[int], tolerance_px: float = 0.5
+) -> Dict[int, RouteTile]:
+    """
+    The function of the process pool: the polylines of all zoom levels by the one run of \
+    Douglas-Peucker.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    x, y = mercator_pixels(lat, lon)
+    importance = douglas_peucker_importance(
+        x, y, min_tolerance=zoom_tolerance(max(zooms), tolerance_px)
+    )
+    tiles: Dict[int, RouteTile] = {}
+    for zoom in zooms:
+        kept = importance > zoom_tolerance(zoom, tolerance_px)
+        polyline = encode_polyline(lat[kept], lon[kept])
+        etag = (
+            '"%s"'
+            % hashlib.blake2b(polyline.encode("ascii"), digest_size=16).hexdigest()
+        )
+        tiles[zoom] = RouteTile(polyline, int(kept.sum()), etag)
+    return tiles
+
+
+@dataclass
+class Trip:
+    """The routes of all zoom levels of the driver for one day."""
+
+    driver_id: int
+    day: date
+    total: int
+    tiles: Dict[int, RouteTile]
+
+
+def day_bounds(day: date) -> Tuple[float, float]:
+    """Unix seconds of [start, end) of the day (UTC)."""
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp()
+    return start, start + DAY_SECONDS
+
+
+class RouteTiles:
+    """
+    Example:
+    ```
+        routes = RouteTiles(db, executor=ProcessPoolExecutor(2))
+        trip = await routes.trip(driver_id=7, day=date(2026, 10, 18)) # None - no positions
+        trip.tiles[12].polyline
+    ```
+    """
+
+    def __init__(
+        self,
+        db,
+        executor: Optional[Executor] = None,
+        max_zoom: int = 18,
+        tolerance_px: float = 0.5,
+        maxsize: int = 1024,
+        max_bytes: Optional[int] = 64 * 1024 * 1024,
+        live_ttl: float = 30.0,
+        ttl: Optional[float] = 3600.0,
+        clock=time.time,
+    ) -> None:
+        """
+        :param db: 'project.db.models.Database' with the async engine.
+        :param executor: The process pool of 'simplify_route'. 'None' - the default \
+            executor of the loop (the threads).
+        :param int max_zoom: The zoom levels are 0..max_zoom.
+        :param float tolerance_px: Pixels of the zoom. The points nearer to the simplified \
+            line are dropped - they are not seen on the map.
+        :param int maxsize: Max number of the cached trips.
+        :param int max_bytes: Max sum of the lengths of the cached polylines.
+        :param float live_ttl: Seconds. The trip of today gets the new positions - it is \
+            computed again after it.
+        :param float ttl: Seconds of the trips of the past days (the late reports of the \
+            offline devices are written too). 'None' - until eviction.
+        """
+        self.db = db
+        self.executor = executor
+        self.zooms = tuple(range(max_zoom + 1))
+        self.tolerance_px = tolerance_px
+        self.live_ttl = live_ttl
+        self.ttl = ttl
+        self.clock = clock
+        self.trips = LRUCache(maxsize=maxsize, max_weight=max_bytes, clock=clock)
+        # The trips being computed - the concurrent requests wait for the same task
+        self._pending: Dict[Tuple[int, date], asyncio.Task] = {}
+        self._waiters: Dict[Tuple[int, date], int] = {}
+
+    def is_live(self, day: date) -> bool:
+        return day_bounds(day)[1] > self.clock()
+
+    async def _compute(self, driver_id: int, day: date) -> Optional[Trip]:
+        start, end = day_bounds(day)
+        rows = await self.db.select_route_positions(driver_id, start, end)
+        if not rows:
+            return None
+        lat = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        lon = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        started = time.perf_counter()
+        tiles = await asyncio.get_running_loop().run_in_executor(
+            self.executor, simplify_route, lat, lon, self.zooms, self.tolerance_px
+        )
+        log.info(
+            "%s: driver %d, %s - %d points in %.3f s"
+            % (
+                self._compute.__name__,
+                driver_id,
+                day,
+                len(rows),
+                time.perf_counter() - started,
+            )
+        )
+        return Trip(driver_id, day, len(rows), tiles)
+
+    async def _load(self, key: Tuple[int, date]) -> Optional[Trip]:
+        trip = await self._compute(*key)
+        if trip is not None:
+            ttl = self.live_ttl if self.is_live(key[1]) else self.ttl
+            expires_at = None if ttl is None else self.clock() + ttl
+            weight = sum(len(tile.polyline) for tile in trip.tiles.values())
+            self.trips.set(key, trip, expires_at=expires_at, weight=weight)
+        return trip
+
+    def _loaded(self, key: Tuple[int, date], task: asyncio.Task) -> None:
+        if self._pending.get(key) is task:
+            del self._pending[key]
+            del self._waiters[key]
+        # The waiters get the error, nobody else - it is not "never retrieved"
+        if not task.cancelled():
+            task.exception()
+
+    async def trip(self, driver_id: int, day: date) -> Optional[Trip]:
+        """
+        The cached trip or the computed one. The computation is the own task - the cancelled \
+        request (the client has gone) doesn't cancel it for the other waiters; it is \
+        cancelled when nobody waits for it.
+        :return: None - the driver has no positions.
+        """
+        key = (driver_id, day)
+        trip = self.trips.get(key)
+        if trip is not None:
+            return trip
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self._pending[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(partial(self._loaded, key))
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if not task.done():
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    # Removed at once, not by '_loaded' - the next request must not await
+                    # the cancelling task, it starts the new one
+                    del self._pending[key]
+                    del self._waiters[key]
+                    task.cancel()
+
+    def invalidate(self, driver_id: int, day: date) -> None:
+        self.trips.pop((driver_id, day))
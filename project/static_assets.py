@@ -0,0 +1,300 @@
+"""
+project/static_assets.py
+
+The static files with the content hash in the name and the precompressed variants:
+- 'StaticAssets.build()' (at the start of worker or `python -m project.static_assets`)
+  copies 'static/styles/style.css' to '<build dir>/styles/style.<hash>.css' and writes
+  'style.<hash>.css.gz' (and '.br' if the package 'brotli' is installed) next to it.
+  The files which exist are not written again - the build of the same files is fast, the
+  workers can build at the same time (the files are replaced atomically);
+- 'static_url("styles/style.css")' of the templates gives '/static/styles/style.<hash>.css';
+- 'PrecompressedStaticFiles' sends the hashed file (by 'Accept-Encoding' - the compressed
+  variant) with 'Cache-Control: immutable' - the changed file has the other name.
+  The other paths are served from the source directory as 'StaticFiles' does.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Scope
+
+from logs import configure_logging
+
+try:
+    import brotli
+except ImportError:
+    # '.br' is optional
+    brotli = None
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+# The formats which are compressed already
+INCOMPRESSIBLE = frozenset(
+    (
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".webp",
+        ".avif",
+        ".ico",
+        ".woff",
+        ".woff2",
+        ".gz",
+        ".br",
+    )
+)
+MANIFEST_NAME = "manifest.json"
+
+
+@dataclass
+class Asset:
+    """The hashed file and its compressed variants: encoding => (path, stat)."""
+
+    path: str
+    stat_result: os.stat_result
+    media_type: str
+    variants: Dict[str, Tuple[str, os.stat_result]] = field(default_factory=dict)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            file.write(data)
+        # 'mkstemp' makes the file 0600 - the files are read by the proxy too
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def _parse_encodings(accept_encoding: str) -> Dict[str, float]:
+    """'gzip, br;q=0.9, *;q=0' => {'gzip': 1.0, 'br': 0.9, '*': 0.0}"""
+    encodings: Dict[str, float] = {}
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        encodings[name.strip()] = quality
+    return encodings
+
+
+class StaticAssets:
+    """
+    Example:
+    ```
+        assets = StaticAssets("static", ".static_build")
+        assets.build()
+        assets.url("styles/style.css") # '/static/styles/style.1a2b3c4d5e6f7a8b.css'
+    ```
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        build_dir: str,
+        url_prefix: str = "/static",
+        min_size: int = 256,
+        gzip_level: int = 9,
+        brotli_quality: int = 11,
+    ) -> None:
+        """
+        :param str directory: The source directory of the static files.
+        :param str build_dir: The directory of the hashed and compressed files.
+        :param str url_prefix: The path of mount of 'PrecompressedStaticFiles'.
+        :param int min_size: The smaller files are not compressed (bytes).
+        :param int gzip_level: 1..9. It is the build step - the max ratio is used.
+        :param int brotli_quality: 0..11.
+        """
+        self.directory = directory
+        self.build_dir = build_dir
+        self.url_prefix = url_prefix.rstrip("/")
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # The source path => the hashed path
+        self.manifest: Dict[str, str] = {}
+        # The hashed path => Asset
+        self.assets: Dict[str, Asset] = {}
+
+    @staticmethod
+    def hashed_name(path: str, data: bytes) -> str:
+        root, extension = os.path.splitext(path)
+        return "%s.%s%s" % (
+            root,
+            hashlib.blake2b(data, digest_size=8).hexdigest(),
+            extension,
+        )
+
+    def _compress(self, data: bytes) -> Dict[str, bytes]:
+        variants = {"gzip": gzip.compress(data, compresslevel=self.gzip_level, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(data, quality=self.brotli_quality)
+        return variants
+
+    def build(self) -> Dict[str, str]:
+        """
+        :return: The manifest - the source path => the hashed path.
+        """
+        manifest: Dict[str, str] = {}
+        assets: Dict[str, Asset] = {}
+        written = 0
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                source = os.path.join(root, name)
+                path = os.path.relpath(source, self.directory).replace(os.sep, "/")
+                with open(source, "rb") as file:
+                    data = file.read()
+                hashed = self.hashed_name(path, data)
+                target = os.path.join(self.build_dir, hashed)
+                if not os.path.exists(target):
+                    _write_atomic(target, data)
+                    written += 1
+                media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+                asset = Asset(target, os.stat(target), media_type)
+                extension = os.path.splitext(path)[1].lower()
+                if len(data) >= self.min_size and extension not in INCOMPRESSIBLE:
+                    suffixes = {"gzip": ".gz", "br": ".br"}
+                    missing = [
+                        encoding
+                        for encoding in (
+                            ("gzip", "br") if brotli is not None else ("gzip",)
+                        )
+                        if not os.path.exists(target + suffixes[encoding])
+                    ]
+                    if missing:
+                        for encoding, compressed in self._compress(data).items():
+                            # The variant is kept only if it is really smaller
+                            if (
+                                encoding in missing
+                                and len(compressed) < len(data) * 0.95
+                            ):
+                                _write_atomic(target + suffixes[encoding], compressed)
+                    for encoding, suffix in suffixes.items():
+                        if os.path.exists(target + suffix):
+                            asset.variants[encoding] = (
+                                target + suffix,
+                                os.stat(target + suffix),
+                            )
+                manifest[path] = hashed
+                assets[hashed] = asset
+        _write_atomic(
+            os.path.join(self.build_dir, MANIFEST_NAME),
+            json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"),
+        )
+        self.manifest = manifest
+        self.assets = assets
+        log.info(
+            "%s: %d assets, %d written to '%s'"
+            % (self.build.__name__, len(manifest), written, self.build_dir)
+        )
+        return manifest
+
+    def url(self, path: str) -> str:
+        """
+        Template helper 'static_url'. The path without hash (not built) - as it is.
+        :param str path: The path inside of the static directory, e.g. 'styles/style.css'.
+        """
+        path = path.lstrip("/")
+        return "%s/%s" % (self.url_prefix, self.manifest.get(path, path))
+
+    def choose(
+        self, asset: Asset, accept_encoding: str
+    ) -> Tuple[str, os.stat_result, str]:
+        """
+        :return: (path, stat, content-encoding) of the best variant for 'Accept-Encoding'. \
+            'identity' - the file without compression.
+        """
+        if asset.variants and accept_encoding:
+            encodings = _parse_encodings(accept_encoding)
+            best: Optional[str] = None
+            best_quality = 0.0
+            # 'br' is preferred at the same quality - it is smaller
+            for encoding in ("br", "gzip"):
+                if encoding not in asset.variants:
+                    continue
+                quality = encodings.get(encoding, encodings.get("*", 0.0))
+                if quality > best_quality:
+                    best, best_quality = encoding, quality
+            if best is not None:
+                path, stat_result = asset.variants[best]
+                return path, stat_result, best
+        return asset.path, asset.stat_result, "identity"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """
+    'StaticFiles' of the source directory + the hashed files of 'StaticAssets'.
+    'FileResponse' sends the file by 'http.response.pathsend' (sendfile of the server) \
+    if the server has this extension, else by chunks.
+    """
+
+    def __init__(self, assets: StaticAssets, max_age: int = 31536000, **kwargs) -> None:
+        """
+        :param StaticAssets assets:
+        :param int max_age: Seconds of 'Cache-Control' of the hashed files.
+        """
+        super().__init__(directory=assets.directory, **kwargs)
+        self.static_assets = assets
+        self.cache_control = "public, max-age=%d, immutable" % max_age
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        asset = self.static_assets.assets.get(path.replace(os.sep, "/"))
+        if asset is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        request_headers = Headers(scope=scope)
+        full_path, stat_result, encoding = self.static_assets.choose(
+            asset, request_headers.get("accept-encoding", "")
+        )
+        headers = {"cache-control": self.cache_control}
+        if asset.variants:
+            headers["vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+        response = FileResponse(
+            full_path,
+            stat_result=stat_result,
+            media_type=asset.media_type,
+            headers=headers,
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """The build step: `python -m project.static_assets [static] [.static_build]`"""
+    import sys
+
+    argv = sys.argv[1:] if argv is None else argv
+    directory = argv[0] if argv else "static"
+    build_dir = argv[1] if len(argv) > 1 else ".static_build"
+    manifest = StaticAssets(directory, build_dir).build()
+    for path, hashed in manifest.items():
+        print("%s => %s" % (path, hashed))
+
+
+if __name__ == "__main__":
+    main()
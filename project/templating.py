@@ -0,0 +1,196 @@
+"""
+project/templating.py
+
+Rendering of the Jinja2 templates with the caches:
+- the compiled templates are kept by 'FileSystemBytecodeCache' on the disk - the workers
+  after deploy (and restart) load the bytecode instead of parsing the templates;
+- the rendered HTML of the constant (or keyed) context is kept in LRU with its strong
+  'ETag'; the request with 'If-None-Match' of the same 'ETag' gets '304 Not Modified'.
+The cache of HTML is dropped when the file of the template (or of its parent templates -
+'extends'/'include'/'import') is changed: the mtimes are checked once per 'check_interval'.
+"""
+
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from fastapi.templating import Jinja2Templates
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, meta
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+from logs import configure_logging
+from project.cache import LRUCache
+
+log = logging.getLogger(__name__)
+configure_logging(logging.INFO)
+
+
+@dataclass
+class RenderedPage:
+    body: bytes
+    etag: str
+    # (path, mtime_ns) of the template and of its parents
+    files: Tuple[Tuple[str, int], ...]
+    checked_at: float
+
+
+def make_etag(body: bytes) -> str:
+    """Strong 'ETag' - the hash of the body."""
+    return '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    'If-None-Match' is compared weakly (RFC 9110): 'W/"x"' matches '"x"'.
+    :param str if_none_match: The header, e.g. '"a", W/"b"' or '*'.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _mtime_ns(path: str) -> int:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        # The file was removed - it is the change too
+        return -1
+
+
+class CachedTemplates(Jinja2Templates):
+    """
+    Example:
+    ```
+        templates = CachedTemplates(directory="templates", bytecode_cache_dir=".jinja_cache")
+
+        @router.get("/")
+        async def main_page(request: Request) -> Response:
+            return templates.cached_response(request, "index.html", {"title": "First page"})
+    ```
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        bytecode_cache_dir: str = "",
+        maxsize: int = 256,
+        check_interval: float = 1.0,
+        cache_control: str = "no-cache",
+    ) -> None:
+        """
+        :param str directory: The directory of templates.
+        :param str bytecode_cache_dir: The directory of the compiled templates. "" - off.
+        :param int maxsize: Max number of the cached pages.
+        :param float check_interval: Seconds between the checks of mtimes of the template files. \
+            '0' - every request.
+        :param str cache_control: 'Cache-Control' of the cached pages. "no-cache" - the browser \
+            revalidates the page by 'ETag' (and gets '304').
+        """
+        bytecode_cache = None
+        if bytecode_cache_dir:
+            os.makedirs(bytecode_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+        env = Environment(
+            loader=FileSystemLoader(directory),
+            bytecode_cache=bytecode_cache,
+            autoescape=True,
+            # The changed template is compiled again
+            auto_reload=True,
+        )
+        super().__init__(env=env)
+        self.pages = LRUCache(maxsize=maxsize)
+        self.check_interval = check_interval
+        self.cache_control = cache_control
+
+    def precompile(self) -> int:
+        """
+        Compiles all templates (and writes the bytecode cache) - at the start of worker.
+        :return: Number of the templates.
+        """
+        names = self.env.list_templates(extensions=["html", "txt", "xml", "jinja"])
+        for name in names:
+            self.env.get_template(name)
+        log.info("%s: %d templates" % (self.precompile.__name__, len(names)))
+        return len(names)
+
+    def template_files(self, name: str) -> Tuple[str, ...]:
+        """The paths of the template and of all templates which it uses by the literal name."""
+        paths: List[str] = []
+        seen = set()
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            source, path, _ = self.env.loader.get_source(self.env, current)
+            paths.append(path)
+            referenced: Iterable[Optional[str]] = meta.find_referenced_templates(
+                self.env.parse(source)
+            )
+            pending.extend(reference for reference in referenced if reference)
+        return tuple(paths)
+
+    def _is_fresh(self, page: RenderedPage) -> bool:
+        now = time.monotonic()
+        if now - page.checked_at < self.check_interval:
+            return True
+        for path, mtime in page.files:
+            if _mtime_ns(path) != mtime:
+                return False
+        page.checked_at = now
+        return True
+
+    def render_cached(
+        self,
+        request: Request,
+        name: str,
+        context: Optional[Dict[str, Any]] = None,
+        key: Hashable = None,
+    ) -> RenderedPage:
+        """
+        :param str name: Name of template.
+        :param context: The context must be the same for the same 'key'.
+        :param key: The key of context. 'None' - the context is constant.
+        """
+        # 'url_for' of the template makes the absolute URLs - they depend on the host
+        cache_key = (name, key, str(request.base_url))
+        page = self.pages.get(cache_key)
+        if page is not None:
+            if self._is_fresh(page):
+                return page
+            log.info("%s: '%s' was changed" % (self.render_cached.__name__, name))
+        files = tuple((path, _mtime_ns(path)) for path in self.template_files(name))
+        body = (
+            self.get_template(name)
+            .render({**(context or {}), "request": request})
+            .encode("utf-8")
+        )
+        page = RenderedPage(body, make_etag(body), files, time.monotonic())
+        self.pages.set(cache_key, page)
+        return page
+
+    def cached_response(
+        self,
+        request: Request,
+        name: str,
+        context: Optional[Dict[str, Any]] = None,
+        key: Hashable = None,
+    ) -> Response:
+        """The page from 'render_cached' or '304 Not Modified' by 'If-None-Match'."""
+        page = self.render_cached(request, name, context, key)
+        headers = {"etag": page.etag, "cache-control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match", ""), page.etag):
+            return Response(status_code=304, headers=headers)
+        return HTMLResponse(page.body, headers=headers)
+
+    def clear(self) -> None:
+        self.pages.clear()